@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+"""Benchmark Product.link_package_repos on a synthetic stack.
+
+Creates a synthetic manifest with many packages, each with a ``doc/``
+directory of a few entities and a ``doc/_static/<pkg>/`` directory, then
+times:
+
+- a cold link into a fresh doc repo directory,
+- a warm reconcile of the unchanged tree,
+- a reconcile after a few packages moved to a new install directory and one
+  package was dropped.
+
+Run from the repository root with ltd-mason installed (``pip install -e .``)::
+
+   python benchmarks/bench_link_package_repos.py --packages 1000
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import ruamel.yaml
+from ruamel.yaml.compat import StringIO
+
+from ltdmason.manifest import Manifest
+from ltdmason.product import Product
+
+
+def make_package(stack_dir, name, version, entities):
+    doc_dir = os.path.join(stack_dir, name, version, 'doc')
+    os.makedirs(os.path.join(doc_dir, '_static', name))
+    for i in range(entities):
+        with open(os.path.join(doc_dir, 'page{0:d}.rst'.format(i)), 'w') as f:
+            f.write('Page\n====\n')
+    with open(os.path.join(doc_dir, 'conf.py'), 'w') as f:
+        f.write('# excluded from links\n')
+    return os.path.dirname(doc_dir)
+
+
+def make_manifest(package_dirs):
+    data = {
+        'product_name': 'bench',
+        'build_id': 'b1',
+        'refs': ['master'],
+        'requester_github_handle': 'bench',
+        'doc_repo': {'url': 'https://github.com/lsst/bench_docs.git',
+                     'ref': 'master'},
+        'packages': {name: {'dir': path,
+                            'url': 'https://github.com/lsst/' + name,
+                            'ref': 'master'}
+                     for name, path in package_dirs.items()}
+    }
+    stream = StringIO()
+    ruamel.yaml.YAML().dump(data, stream)
+    return Manifest(stream.getvalue())
+
+
+def timed(label, func):
+    start = time.perf_counter()
+    stats = func()
+    elapsed = time.perf_counter() - start
+    print('{0:<36s} {1:8.3f} s  created={2[created]:<6d} '
+          'updated={2[updated]:<6d} removed={2[removed]:<6d} '
+          'unchanged={2[unchanged]:d}'.format(label, elapsed, stats))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--packages', type=int, default=1000)
+    parser.add_argument('--entities', type=int, default=5,
+                        help='Linked entities per package doc/ directory')
+    parser.add_argument('--changed', type=int, default=3,
+                        help='Packages moved to a new version directory')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        stack_dir = os.path.join(work_dir, 'stack')
+        names = ['pkg{0:04d}'.format(i) for i in range(args.packages)]
+        package_dirs = {name: make_package(stack_dir, name, 'v1',
+                                           args.entities)
+                        for name in names}
+
+        build_dir = os.path.join(work_dir, 'build')
+        product = Product(make_manifest(package_dirs), build_dir)
+        os.makedirs(product.doc_dir)
+
+        print('{0:d} packages, {1:d} entities each'.format(
+            args.packages, args.entities))
+        timed('cold link', product.link_package_repos)
+        timed('warm reconcile (no change)', product.link_package_repos)
+
+        for name in names[:args.changed]:
+            package_dirs[name] = make_package(stack_dir, name, 'v2',
+                                              args.entities)
+        del package_dirs[names[-1]]
+        product.manifest = make_manifest(package_dirs)
+        timed('reconcile ({0:d} changed, 1 dropped)'.format(args.changed),
+              product.link_package_repos)
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
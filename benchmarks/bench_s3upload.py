@@ -0,0 +1,341 @@
+#!/usr/bin/env python
+"""Benchmark s3upload.upload end to end against a local S3 stand-in.
+
+Generates a synthetic Sphinx-like HTML site (pages spread over a directory
+tree, plus ``_static/``, ``_images/`` and ``_sources/`` files with
+log-normally distributed sizes), serves an in-memory S3-compatible bucket
+with an injectable per-request latency (``s3stub.S3Stub``), and times these
+scenarios in order against the same bucket:
+
+- ``cold``: upload into an empty prefix;
+- ``warm``: upload the unchanged site again;
+- ``warm-skip``: the same, with ``skip_unchanged=True``;
+- ``changed``: rewrite some pages, drop a directory, and upload with
+  ``skip_unchanged=True``.
+
+For each scenario the wall time, the number of requests per phase (list,
+delete, upload, redirect) and per S3 operation, and the bytes sent and
+received are printed. After each scenario the bucket is checked against the
+site, so the benchmark also catches upload regressions. Results can be
+written to a JSON file to compare runs.
+
+With ``--backend memory`` the site is synced to an
+``ltdmason.storage.MemoryBackend`` instead, which measures the sync engine
+itself without any HTTP; backend calls are then counted as requests.
+
+Run from the repository root with ltd-mason installed (``pip install -e .``)::
+
+   python benchmarks/bench_s3upload.py --pages 2000 --latency 20
+"""
+
+import argparse
+import collections
+import contextlib
+import json
+import math
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from ltdmason import s3upload
+from ltdmason.storage import MemoryBackend
+from s3stub import S3Stub
+
+BUCKET = 'bench-bucket'
+PREFIX = 'bench/builds/1'
+
+PHASES = {
+    'ListObjects': 'list',
+    'ListObjectsV2': 'list',
+    'DeleteObject': 'delete',
+    'DeleteObjects': 'delete',
+    'PutObject': 'upload',
+    'CreateMultipartUpload': 'upload',
+    'UploadPart': 'upload',
+    'CompleteMultipartUpload': 'upload',
+    'AbortMultipartUpload': 'upload',
+    'PutObject (redirect)': 'redirect',
+}
+
+
+def sizes(rng, count, median, sigma, max_size):
+    """Log-normally distributed file sizes."""
+    mu = math.log(median)
+    return [min(max_size, max(1, int(rng.lognormvariate(mu, sigma))))
+            for _ in range(count)]
+
+
+def make_dirs(rng, count, depth, fanout):
+    """Relative paths of a random directory tree of at most ``depth``
+    levels, including the root (``''``).
+    """
+    dirs = ['']
+    while len(dirs) < count:
+        parent = rng.choice(dirs)
+        if parent.count('/') + (1 if parent else 0) >= depth:
+            continue
+        siblings = [d for d in dirs if os.path.dirname(d) == parent]
+        if len(siblings) >= fanout:
+            continue
+        dirs.append(os.path.join(parent, 'dir{0:d}'.format(len(dirs))))
+    return dirs
+
+
+def write_file(rng, path, size):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(rng.randbytes(size))
+
+
+def make_site(site_dir, args):
+    """Write a synthetic site and return its relative file paths."""
+    rng = random.Random(args.seed)
+    dirs = make_dirs(rng, args.dirs, args.depth, args.fanout)
+    paths = []
+    page_sizes = sizes(rng, args.pages, args.median_size, args.size_sigma,
+                       args.max_size)
+    for i, size in enumerate(page_sizes):
+        # Every directory gets an index page, like a Sphinx toctree
+        if i < len(dirs):
+            path = os.path.join(dirs[i], 'index.html')
+        else:
+            path = os.path.join(rng.choice(dirs), 'page{0:d}.html'.format(i))
+        paths.append(path)
+        write_file(rng, os.path.join(site_dir, path), size)
+        source = os.path.join('_sources', path[:-len('.html')] + '.rst.txt')
+        paths.append(source)
+        write_file(rng, os.path.join(site_dir, source), max(1, size // 4))
+    asset_sizes = sizes(rng, args.assets, args.median_size * 2,
+                        args.size_sigma, args.max_size)
+    for i, size in enumerate(asset_sizes):
+        subdir = '_images' if i % 2 else '_static'
+        path = os.path.join(subdir, 'asset{0:d}.bin'.format(i))
+        paths.append(path)
+        write_file(rng, os.path.join(site_dir, path), size)
+    return paths, dirs
+
+
+def change_site(site_dir, pages, dirs, args):
+    """Rewrite some pages and remove the deepest directory."""
+    rng = random.Random(args.seed + 1)
+    html = [p for p in pages if p.endswith('.html')]
+    for path in rng.sample(html, int(len(html) * args.changed)):
+        full_path = os.path.join(site_dir, path)
+        if os.path.exists(full_path):
+            write_file(rng, full_path, os.path.getsize(full_path))
+    deepest = max(dirs, key=lambda d: (d.count('/'), d))
+    if deepest:
+        shutil.rmtree(os.path.join(site_dir, deepest))
+
+
+def expected_keys(site_dir):
+    keys = set()
+    for rootdir, dirnames, filenames in os.walk(site_dir):
+        rel_dir = os.path.relpath(rootdir, site_dir)
+        rel_dir = '' if rel_dir == '.' else rel_dir
+        keys.add(os.path.join(PREFIX, rel_dir).rstrip('/'))
+        for filename in filenames:
+            keys.add(os.path.join(PREFIX, rel_dir, filename))
+    return keys
+
+
+class StubTarget(object):
+    """Uploads to the S3 stand-in over HTTP."""
+    def __init__(self, stub):
+        super().__init__()
+        self.stub = stub
+        self.upload_kwargs = {'endpoint_url': stub.url,
+                              'aws_access_key_id': 'bench',
+                              'aws_secret_access_key': 'bench'}
+
+    def reset_stats(self):
+        self.stub.reset_stats()
+
+    def stats(self):
+        return self.stub.stats()
+
+    def keys(self):
+        return self.stub.keys(BUCKET, PREFIX)
+
+    def body(self, key):
+        return self.stub.get(BUCKET, key).body
+
+
+class CountingMemoryBackend(MemoryBackend):
+    """Memory backend that counts its calls as the S3 requests they
+    stand for.
+    """
+    def __init__(self):
+        super().__init__()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.counts = collections.Counter()
+        self.bytes_in = 0
+
+    def list(self, prefix=''):
+        self.counts['ListObjects'] += 1
+        return super().list(prefix)
+
+    def put(self, key, path=None, body=None, extra_args=None):
+        metadata = (extra_args or {}).get('Metadata', {})
+        if metadata.get('dir-redirect') == 'true':
+            self.counts['PutObject (redirect)'] += 1
+        else:
+            self.counts['PutObject'] += 1
+        super().put(key, path=path, body=body, extra_args=extra_args)
+        self.bytes_in += self.head(key).size
+
+    def delete(self, keys):
+        self.counts['DeleteObjects'] += 1
+        super().delete(keys)
+
+
+class MemoryTarget(object):
+    """Syncs to a memory backend, without HTTP."""
+    def __init__(self):
+        super().__init__()
+        self.backend = CountingMemoryBackend()
+        self.upload_kwargs = {'backend': self.backend}
+
+    def reset_stats(self):
+        self.backend.reset_stats()
+
+    def stats(self):
+        return {'requests': sum(self.backend.counts.values()),
+                'counts': dict(self.backend.counts),
+                'bytes_in': self.backend.bytes_in,
+                'bytes_out': 0}
+
+    def keys(self):
+        return [o.key for o in self.backend.list(PREFIX)]
+
+    def body(self, key):
+        return self.backend.get(key)
+
+
+def verify(target, site_dir):
+    """Check that the bucket mirrors the site."""
+    keys = set(target.keys())
+    expected = expected_keys(site_dir)
+    if keys != expected:
+        raise RuntimeError(
+            'Bucket differs from the site: {0:d} missing, {1:d} stale'.format(
+                len(expected - keys), len(keys - expected)))
+    for key in keys:
+        path = os.path.join(site_dir, os.path.relpath(key, PREFIX))
+        if os.path.isfile(path):
+            with open(path, 'rb') as f:
+                if f.read() != target.body(key):
+                    raise RuntimeError('Content of {0} differs'.format(key))
+
+
+def run_scenario(name, target, site_dir, **kwargs):
+    target.reset_stats()
+    kwargs.update(target.upload_kwargs)
+    start = time.perf_counter()
+    s3upload.upload(BUCKET, PREFIX, site_dir, surrogate_key='bench',
+                    **kwargs)
+    elapsed = time.perf_counter() - start
+    stats = target.stats()
+    verify(target, site_dir)
+
+    phases = {}
+    for operation, count in stats['counts'].items():
+        phase = PHASES.get(operation, 'other')
+        phases[phase] = phases.get(phase, 0) + count
+    result = {'scenario': name, 'seconds': elapsed,
+              'requests': stats['requests'], 'phases': phases,
+              'operations': stats['counts'],
+              'bytes_sent': stats['bytes_in'],
+              'bytes_received': stats['bytes_out']}
+    print('{0:<10s} {1:8.3f} s  {2:6d} requests  {3}  sent={4:d} B '
+          'received={5:d} B'.format(
+              name, elapsed, stats['requests'],
+              ' '.join('{0}={1:d}'.format(p, phases[p])
+                       for p in sorted(phases)),
+              stats['bytes_in'], stats['bytes_out']))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--pages', type=int, default=500,
+                        help='Number of HTML pages')
+    parser.add_argument('--assets', type=int, default=100,
+                        help='Number of files in _static/ and _images/')
+    parser.add_argument('--dirs', type=int, default=50,
+                        help='Number of page directories')
+    parser.add_argument('--depth', type=int, default=4,
+                        help='Maximum depth of page directories')
+    parser.add_argument('--fanout', type=int, default=8,
+                        help='Maximum subdirectories per directory')
+    parser.add_argument('--median-size', dest='median_size', type=int,
+                        default=8000, help='Median page size, in bytes')
+    parser.add_argument('--size-sigma', dest='size_sigma', type=float,
+                        default=1.,
+                        help='Sigma of the log-normal size distribution')
+    parser.add_argument('--max-size', dest='max_size', type=int,
+                        default=16 * 1024 * 1024,
+                        help='Maximum file size, in bytes')
+    parser.add_argument('--changed', type=float, default=0.05,
+                        help='Fraction of pages rewritten before the '
+                             '"changed" scenario')
+    parser.add_argument('--backend', choices=['stub', 'memory'],
+                        default='stub',
+                        help='Upload to the S3 stand-in over HTTP, or sync '
+                             'to a memory backend')
+    parser.add_argument('--latency', type=float, default=10.,
+                        help='Latency of each request, in milliseconds')
+    parser.add_argument('--jitter', type=float, default=0.,
+                        help='Maximum extra random latency, in milliseconds')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--json', dest='json_path', default=None,
+                        help='Write the results to this JSON file')
+    args = parser.parse_args()
+
+    # The stand-in doesn't check credentials, but botocore needs a region
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        site_dir = os.path.join(work_dir, 'html')
+        paths, dirs = make_site(site_dir, args)
+        total = sum(os.path.getsize(os.path.join(site_dir, p))
+                    for p in paths)
+        if args.backend == 'memory':
+            backend = 'memory backend'
+        else:
+            backend = '{0:.0f} ms latency'.format(args.latency)
+        print('{0:d} files in {1:d} directories, {2:d} bytes; {3}'.format(
+            len(paths), len(dirs), total, backend))
+
+        results = []
+        with contextlib.ExitStack() as stack:
+            if args.backend == 'memory':
+                target = MemoryTarget()
+            else:
+                target = StubTarget(stack.enter_context(
+                    S3Stub(latency=args.latency / 1000.,
+                           jitter=args.jitter / 1000.)))
+            results.append(run_scenario('cold', target, site_dir))
+            results.append(run_scenario('warm', target, site_dir))
+            results.append(run_scenario('warm-skip', target, site_dir,
+                                        skip_unchanged=True))
+            change_site(site_dir, paths, dirs, args)
+            results.append(run_scenario('changed', target, site_dir,
+                                        skip_unchanged=True))
+    finally:
+        shutil.rmtree(work_dir)
+
+    if args.json_path is not None:
+        with open(args.json_path, 'w') as f:
+            json.dump({'args': vars(args), 'files': len(paths),
+                       'bytes': total, 'results': results},
+                      f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
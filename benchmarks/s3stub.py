@@ -0,0 +1,409 @@
+"""A local, in-memory stand-in for the subset of the S3 API that ltd-mason
+uses, for benchmarks.
+
+:class:`S3Stub` serves path-style requests (``http://host:port/bucket/key``)
+from a thread per connection and implements ListObjects (v1 and v2),
+PutObject, GetObject, HeadObject, DeleteObject, DeleteObjects and multipart
+uploads. Requests aren't authenticated. Each request is delayed by an
+injectable latency to model a remote service, and the stub counts requests
+per operation and the bytes received and sent.
+
+Use it as a context manager::
+
+   with S3Stub(latency=0.02) as stub:
+       s3upload.upload('bucket', 'prefix', 'html', endpoint_url=stub.url,
+                       aws_access_key_id='stub',
+                       aws_secret_access_key='stub')
+       print(stub.counts, stub.bytes_in)
+"""
+
+import collections
+import hashlib
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+__all__ = ['S3Stub', 'StoredObject']
+
+StoredObject = collections.namedtuple('StoredObject',
+                                      ['body', 'etag', 'headers'])
+"""An object in the stub: its content (`bytes`), ETag (without quotes) and
+stored headers (`dict` with lowercase keys).
+"""
+
+_STORED_HEADERS = ('content-type', 'cache-control', 'content-encoding',
+                   'content-disposition', 'x-amz-acl')
+
+_S3_NS = 'http://s3.amazonaws.com/doc/2006-03-01/'
+
+
+class S3Stub(object):
+    """In-memory S3-compatible HTTP server.
+
+    Parameters
+    ----------
+    latency : float, optional
+        Seconds each request is delayed before it is answered.
+    jitter : float, optional
+        Maximum extra delay, in seconds, drawn uniformly for each request.
+    host : str, optional
+        Interface to listen on.
+    port : int, optional
+        Port to listen on; by default a free port is chosen.
+    """
+    def __init__(self, latency=0., jitter=0., host='127.0.0.1', port=0):
+        super().__init__()
+        self.latency = latency
+        self.jitter = jitter
+        self.buckets = collections.defaultdict(dict)
+        self._uploads = {}
+        self._lock = threading.Lock()
+        self.reset_stats()
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.stub = self
+        self._thread = None
+
+    @property
+    def url(self):
+        """Endpoint URL of the running stub."""
+        host, port = self._server.server_address[:2]
+        return 'http://{0}:{1:d}'.format(host, port)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def reset_stats(self):
+        """Zero the request and byte counters."""
+        with self._lock:
+            self.counts = collections.Counter()
+            self.bytes_in = 0
+            self.bytes_out = 0
+
+    def stats(self):
+        """Copy of the counters, as ``{'requests', 'counts', 'bytes_in',
+        'bytes_out'}``.
+        """
+        with self._lock:
+            return {'requests': sum(self.counts.values()),
+                    'counts': dict(self.counts),
+                    'bytes_in': self.bytes_in,
+                    'bytes_out': self.bytes_out}
+
+    def keys(self, bucket, prefix=''):
+        """Sorted keys of a bucket's objects that start with ``prefix``."""
+        with self._lock:
+            return sorted(k for k in self.buckets[bucket]
+                          if k.startswith(prefix))
+
+    def get(self, bucket, key):
+        """The :class:`StoredObject` at a key, or `None`."""
+        with self._lock:
+            return self.buckets[bucket].get(key)
+
+    def _record(self, operation, bytes_in, bytes_out):
+        with self._lock:
+            self.counts[operation] += 1
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+
+    def _delay(self):
+        delay = self.latency
+        if self.jitter:
+            delay += random.uniform(0., self.jitter)
+        if delay > 0.:
+            time.sleep(delay)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are separate writes, which Nagle's algorithm would
+    # delay until the client acknowledges the headers
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def stub(self):
+        return self.server.stub
+
+    def _parse(self):
+        parts = urlsplit(self.path)
+        path = unquote(parts.path).lstrip('/')
+        bucket, _, key = path.partition('/')
+        query = parse_qs(parts.query, keep_blank_values=True)
+        query = {name: values[0] for name, values in query.items()}
+        return bucket, key, query
+
+    def _read_body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            body = self._read_chunks()
+        else:
+            body = self.rfile.read(int(self.headers.get('Content-Length',
+                                                        0)))
+        raw_length = len(body)
+        if 'aws-chunked' in self.headers.get('Content-Encoding', ''):
+            body = _decode_aws_chunked(body)
+        return body, raw_length
+
+    def _read_chunks(self):
+        body = b''
+        while True:
+            size = int(self.rfile.readline().split(b';')[0], 16)
+            if size == 0:
+                # Trailers end with an empty line
+                while self.rfile.readline() not in (b'\r\n', b'\n', b''):
+                    pass
+                return body
+            body += self.rfile.read(size)
+            self.rfile.readline()
+
+    def _respond(self, operation, status, body=b'', headers=None,
+                 bytes_in=0, head=False):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        self.stub._delay()
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+        self.stub._record(operation, bytes_in, 0 if head else len(body))
+
+    def _error(self, operation, status, code, bytes_in=0):
+        body = ('<?xml version="1.0" encoding="UTF-8"?>\n<Error><Code>{0}'
+                '</Code><Message>{0}</Message></Error>').format(code)
+        self._respond(operation, status, body,
+                      {'Content-Type': 'application/xml'}, bytes_in)
+
+    def do_GET(self):
+        bucket, key, query = self._parse()
+        if not key:
+            self._list(bucket, query)
+            return
+        obj = self.stub.get(bucket, key)
+        if obj is None:
+            self._error('GetObject', 404, 'NoSuchKey')
+            return
+        self._respond('GetObject', 200, obj.body, _object_headers(obj))
+
+    def do_HEAD(self):
+        bucket, key, query = self._parse()
+        obj = self.stub.get(bucket, key)
+        if obj is None:
+            self._respond('HeadObject', 404, head=True)
+            return
+        headers = _object_headers(obj)
+        self.stub._delay()
+        self.send_response(200)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(obj.body)))
+        self.end_headers()
+        self.stub._record('HeadObject', 0, 0)
+
+    def do_PUT(self):
+        bucket, key, query = self._parse()
+        body, raw_length = self._read_body()
+        etag = hashlib.md5(body).hexdigest()
+        if 'uploadId' in query:
+            with self.stub._lock:
+                upload = self.stub._uploads.get(query['uploadId'])
+                if upload is not None:
+                    upload['parts'][int(query['partNumber'])] = body
+            if upload is None:
+                self._error('UploadPart', 404, 'NoSuchUpload', raw_length)
+                return
+            self._respond('UploadPart', 200,
+                          headers={'ETag': '"{0}"'.format(etag)},
+                          bytes_in=raw_length)
+            return
+
+        headers = self._stored_headers()
+        operation = 'PutObject'
+        if headers.get('x-amz-meta-dir-redirect') == 'true':
+            operation = 'PutObject (redirect)'
+        with self.stub._lock:
+            self.stub.buckets[bucket][key] = StoredObject(body, etag, headers)
+        self._respond(operation, 200, headers={'ETag': '"{0}"'.format(etag)},
+                      bytes_in=raw_length)
+
+    def do_POST(self):
+        bucket, key, query = self._parse()
+        body, raw_length = self._read_body()
+        if 'delete' in query:
+            self._delete_objects(bucket, body, raw_length)
+        elif 'uploads' in query:
+            upload_id = uuid.uuid4().hex
+            with self.stub._lock:
+                self.stub._uploads[upload_id] = {
+                    'bucket': bucket, 'key': key, 'parts': {},
+                    'headers': self._stored_headers()}
+            self._respond(
+                'CreateMultipartUpload', 200,
+                '<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<InitiateMultipartUploadResult xmlns="{0}"><Bucket>{1}'
+                '</Bucket><Key>{2}</Key><UploadId>{3}</UploadId>'
+                '</InitiateMultipartUploadResult>'.format(
+                    _S3_NS, escape(bucket), escape(key), upload_id),
+                {'Content-Type': 'application/xml'}, raw_length)
+        elif 'uploadId' in query:
+            with self.stub._lock:
+                upload = self.stub._uploads.pop(query['uploadId'], None)
+            if upload is None:
+                self._error('CompleteMultipartUpload', 404, 'NoSuchUpload',
+                            raw_length)
+                return
+            parts = [upload['parts'][n] for n in sorted(upload['parts'])]
+            digest = hashlib.md5(b''.join(hashlib.md5(p).digest()
+                                          for p in parts))
+            etag = '{0}-{1:d}'.format(digest.hexdigest(), len(parts))
+            with self.stub._lock:
+                self.stub.buckets[bucket][key] = StoredObject(
+                    b''.join(parts), etag, upload['headers'])
+            self._respond(
+                'CompleteMultipartUpload', 200,
+                '<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<CompleteMultipartUploadResult xmlns="{0}"><Bucket>{1}'
+                '</Bucket><Key>{2}</Key><ETag>"{3}"</ETag>'
+                '</CompleteMultipartUploadResult>'.format(
+                    _S3_NS, escape(bucket), escape(key), etag),
+                {'Content-Type': 'application/xml'}, raw_length)
+        else:
+            self._error('POST', 400, 'NotImplemented', raw_length)
+
+    def do_DELETE(self):
+        bucket, key, query = self._parse()
+        if 'uploadId' in query:
+            with self.stub._lock:
+                self.stub._uploads.pop(query['uploadId'], None)
+            self._respond('AbortMultipartUpload', 204)
+            return
+        with self.stub._lock:
+            self.stub.buckets[bucket].pop(key, None)
+        self._respond('DeleteObject', 204)
+
+    def _stored_headers(self):
+        headers = {}
+        for name, value in self.headers.items():
+            name = name.lower()
+            if name in _STORED_HEADERS or name.startswith('x-amz-meta-'):
+                headers[name] = value
+        return headers
+
+    def _list(self, bucket, query):
+        v2 = query.get('list-type') == '2'
+        operation = 'ListObjectsV2' if v2 else 'ListObjects'
+        prefix = query.get('prefix', '')
+        max_keys = int(query.get('max-keys', 1000))
+        if v2:
+            marker = query.get('continuation-token',
+                               query.get('start-after', ''))
+        else:
+            marker = query.get('marker', '')
+        url_encode = query.get('encoding-type') == 'url'
+
+        with self.stub._lock:
+            keys = sorted(k for k in self.stub.buckets[bucket]
+                          if k.startswith(prefix) and k > marker)
+            truncated = len(keys) > max_keys
+            keys = keys[:max_keys]
+            objects = [(k, self.stub.buckets[bucket][k]) for k in keys]
+
+        def encode(value):
+            return quote(value, safe='/') if url_encode else escape(value)
+
+        root = 'ListBucketResult'
+        xml = ['<?xml version="1.0" encoding="UTF-8"?>\n',
+               '<{0} xmlns="{1}"><Name>{2}</Name><Prefix>{3}</Prefix>'
+               '<MaxKeys>{4:d}</MaxKeys><IsTruncated>{5}</IsTruncated>'.format(
+                   root, _S3_NS, escape(bucket), encode(prefix), max_keys,
+                   'true' if truncated else 'false')]
+        if url_encode:
+            xml.append('<EncodingType>url</EncodingType>')
+        if v2:
+            xml.append('<KeyCount>{0:d}</KeyCount>'.format(len(objects)))
+            if truncated:
+                xml.append('<NextContinuationToken>{0}'
+                           '</NextContinuationToken>'.format(
+                               escape(keys[-1])))
+        elif truncated:
+            xml.append('<NextMarker>{0}</NextMarker>'.format(
+                encode(keys[-1])))
+        for key, obj in objects:
+            xml.append('<Contents><Key>{0}</Key><LastModified>'
+                       '2017-01-01T00:00:00.000Z</LastModified><ETag>'
+                       '&quot;{1}&quot;</ETag><Size>{2:d}</Size>'
+                       '<StorageClass>STANDARD</StorageClass>'
+                       '</Contents>'.format(encode(key), obj.etag,
+                                            len(obj.body)))
+        xml.append('</{0}>'.format(root))
+        self._respond(operation, 200, ''.join(xml),
+                      {'Content-Type': 'application/xml'})
+
+    def _delete_objects(self, bucket, body, raw_length):
+        tree = ElementTree.fromstring(body)
+        keys = [element.text for element in tree.iter()
+                if element.tag.split('}')[-1] == 'Key']
+        with self.stub._lock:
+            for key in keys:
+                self.stub.buckets[bucket].pop(key, None)
+        xml = ['<?xml version="1.0" encoding="UTF-8"?>\n',
+               '<DeleteResult xmlns="{0}">'.format(_S3_NS)]
+        xml.extend('<Deleted><Key>{0}</Key></Deleted>'.format(escape(key))
+                   for key in keys)
+        xml.append('</DeleteResult>')
+        self._respond('DeleteObjects', 200, ''.join(xml),
+                      {'Content-Type': 'application/xml'}, raw_length)
+
+
+_CHUNK_HEADER_RE = re.compile(rb'^([0-9a-fA-F]+)(;[^\r\n]*)?\r\n')
+
+
+def _decode_aws_chunked(body):
+    """Decode a body sent with ``Content-Encoding: aws-chunked``, which
+    botocore uses to send checksums as trailers.
+    """
+    decoded = []
+    pos = 0
+    while True:
+        match = _CHUNK_HEADER_RE.match(body, pos)
+        if match is None:
+            raise ValueError('Malformed aws-chunked body')
+        size = int(match.group(1), 16)
+        pos = match.end()
+        if size == 0:
+            return b''.join(decoded)
+        decoded.append(body[pos:pos + size])
+        pos += size + 2
+
+
+def _object_headers(obj):
+    headers = {name: value for name, value in obj.headers.items()
+               if name != 'x-amz-acl'}
+    headers.setdefault('content-type', 'binary/octet-stream')
+    headers['ETag'] = '"{0}"'.format(obj.etag)
+    return headers
@@ -0,0 +1,280 @@
+"""Auto-tuning of the concurrency of uploads.
+
+The best number of concurrent file uploads depends on where ltd-mason runs:
+a CI runner far from the bucket needs many uploads in flight to fill its
+uplink, while a worker in the bucket's region saturates S3 request rates or
+its CPU with few. A :class:`ConcurrencyTuner` finds it during the upload by
+hill climbing on measured throughput:
+
+- uploads are measured over windows of ``window`` seconds (and of at least
+  as many uploads as are in flight);
+- while ramping up, the concurrency is doubled after each window whose
+  throughput beats the best so far by ``gain``; once throughput stops
+  increasing, or the mean upload latency grows by more than
+  ``latency_factor`` over that of the best window, the concurrency settles
+  on the best one measured;
+- once settled, the concurrency is halved whenever S3 throttles requests
+  (HTTP 429 or 503 responses), and reduced by a quarter whenever latency
+  rises while throughput drops below the best.
+
+With a ``state_path``, the best concurrency is saved per host in a JSON
+file, and the next run on the same host starts from it instead of ramping
+up from ``initial``.
+"""
+
+import datetime
+import json
+import logging
+import socket
+import threading
+import time
+
+from .botoevents import attach
+from .fileutils import write_atomic
+
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+_THROTTLE_STATUSES = (429, 503)
+
+
+class ConcurrencyTuner(object):
+    """Adjust the number of concurrent uploads to maximize throughput.
+
+    Uploads are submitted with :meth:`submit`, which keeps at most
+    :attr:`concurrency` of them in flight. Instances are thread-safe, so the
+    concurrent uploads of a batch build can share one tuner, which then
+    bounds their total concurrency.
+
+    Parameters
+    ----------
+    initial : int, optional
+        Concurrency to start from, unless one is saved in ``state_path``.
+    minimum, maximum : int, optional
+        Bounds of the concurrency.
+    window : float, optional
+        Minimum duration of a measurement window, in seconds.
+    gain : float, optional
+        Relative increase of throughput over the best window that keeps the
+        concurrency ramping up.
+    latency_factor : float, optional
+        Growth of the mean upload latency, relative to the best window, that
+        is taken as a sign of congestion.
+    state_path : str, optional
+        JSON file of the best concurrency of each host, read when the tuner
+        is created and written by :meth:`save`.
+    host : str, optional
+        Key of this host in ``state_path``. Defaults to the host name.
+    """
+    def __init__(self, initial=4, minimum=1, maximum=32, window=5.,
+                 gain=0.1, latency_factor=2., state_path=None, host=None):
+        super().__init__()
+        self.minimum = minimum
+        self.maximum = maximum
+        self.window = window
+        self.gain = gain
+        self.latency_factor = latency_factor
+        self.state_path = state_path
+        self.host = host or socket.gethostname()
+
+        saved = self._load_state().get(self.host, {}).get('concurrency')
+        if saved is not None:
+            log.info('Starting uploads at the saved concurrency of %d',
+                     saved)
+            initial = saved
+        self.concurrency = max(minimum, min(maximum, initial))
+        self.settled = False
+        self.best_concurrency = self.concurrency
+        self.best_throughput = 0.
+        self.best_latency = None
+
+        self._lock = threading.Lock()
+        self._slots = threading.Condition(self._lock)
+        self._in_flight = 0
+        self._reset_window(None)
+
+    def _reset_window(self, start_time):
+        self._window_start = start_time
+        self._window_bytes = 0
+        self._window_uploads = 0
+        self._window_seconds = 0.
+        self._window_throttled = 0
+
+    def attach(self, client):
+        """Count the throttled requests of a botocore client.
+
+        Attaching the same client more than once has no effect.
+        """
+        # First, since the retry handler answers the event
+        attach(client, self, [('needs-retry.s3', self._needs_retry)],
+               first=True)
+
+    def _needs_retry(self, response=None, **kwargs):
+        if response is None:
+            return None
+        status = getattr(response[0], 'status_code', None)
+        if status in _THROTTLE_STATUSES:
+            with self._lock:
+                self._window_throttled += 1
+        return None
+
+    def submit(self, executor, nbytes, fn, *args, **kwargs):
+        """Submit an upload to an executor once fewer than
+        :attr:`concurrency` uploads are in flight, and measure it.
+
+        Parameters
+        ----------
+        executor : :class:`concurrent.futures.Executor`
+            Executor with at least :attr:`maximum` workers.
+        nbytes : int
+            Size of the upload, in bytes.
+        fn : callable
+            Called with ``args`` and ``kwargs`` to upload.
+
+        Returns
+        -------
+        future : :class:`concurrent.futures.Future`
+            Future of ``fn``'s result.
+        """
+        with self._slots:
+            while self._in_flight >= self.concurrency:
+                self._slots.wait()
+            self._in_flight += 1
+            if self._window_start is None:
+                self._window_start = time.monotonic()
+        try:
+            return executor.submit(self._run, nbytes, fn, *args, **kwargs)
+        except BaseException:
+            self._release()
+            raise
+
+    def _run(self, nbytes, fn, *args, **kwargs):
+        start_time = time.monotonic()
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException:
+            self._release()
+            raise
+        self._release(nbytes, time.monotonic() - start_time)
+        return result
+
+    def _release(self, nbytes=0, seconds=None):
+        with self._slots:
+            self._in_flight -= 1
+            if seconds is not None:
+                self._window_bytes += nbytes
+                self._window_uploads += 1
+                self._window_seconds += seconds
+                self._end_window()
+            self._slots.notify_all()
+
+    def _end_window(self):
+        now = time.monotonic()
+        elapsed = now - self._window_start
+        if elapsed < self.window or \
+                self._window_uploads < self.concurrency:
+            return
+        throughput = self._window_bytes / elapsed
+        latency = self._window_seconds / self._window_uploads
+        throttled = self._window_throttled
+        self._reset_window(now)
+        self.adjust(throughput, latency, throttled=throttled)
+
+    def adjust(self, throughput, latency, throttled=0):
+        """Adjust the concurrency after a measurement window.
+
+        Parameters
+        ----------
+        throughput : float
+            Bytes uploaded per second during the window.
+        latency : float
+            Mean duration of the window's uploads, in seconds.
+        throttled : int, optional
+            Number of throttled requests during the window.
+        """
+        concurrency = self.concurrency
+        congested = self.best_latency is not None and \
+            latency > self.best_latency * self.latency_factor
+        if throttled:
+            self.settled = True
+            self._set(max(self.minimum, concurrency // 2),
+                      '{0:d} requests throttled'.format(throttled))
+            self.best_concurrency = self.concurrency
+        elif throughput > self.best_throughput * (1. + self.gain):
+            self.best_throughput = throughput
+            self.best_latency = latency
+            self.best_concurrency = concurrency
+            if not self.settled:
+                if congested or concurrency >= self.maximum:
+                    self.settled = True
+                else:
+                    self._set(min(self.maximum, concurrency * 2),
+                              'throughput increased')
+        elif not self.settled:
+            self.settled = True
+            self._set(self.best_concurrency,
+                      'throughput stopped increasing')
+        elif congested and throughput < self.best_throughput:
+            self._set(max(self.minimum, concurrency - max(1,
+                                                          concurrency // 4)),
+                      'latency increased')
+            self.best_concurrency = self.concurrency
+
+    def _set(self, concurrency, reason):
+        if concurrency != self.concurrency:
+            log.info('Upload concurrency %d -> %d (%s)',
+                     self.concurrency, concurrency, reason)
+        self.concurrency = concurrency
+
+    def _load_state(self):
+        if self.state_path is None:
+            return {}
+        try:
+            with open(self.state_path, encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError as e:
+            log.warning('Ignoring invalid tuning state %s: %s',
+                        self.state_path, e)
+            return {}
+
+    def save(self):
+        """Save the best concurrency of this host in ``state_path``, if
+        any was measured.
+        """
+        if self.state_path is None or self.best_throughput <= 0.:
+            return
+        state = self._load_state()
+        state[self.host] = {
+            'concurrency': self.best_concurrency,
+            'bytes_per_second': self.best_throughput,
+            'updated': datetime.datetime.now(
+                datetime.timezone.utc).isoformat()}
+        write_atomic(self.state_path,
+                     json.dumps(state, indent=2, sort_keys=True),
+                     prefix='.ltd-mason-tuning-')
+        log.info('Saved upload concurrency %d for %s to %s',
+                 self.best_concurrency, self.host, self.state_path)
+
+
+def parse_concurrency(value):
+    """Parse an upload concurrency option: a positive number of uploads
+    (`int`), or ``'auto'`` to tune it with a :class:`ConcurrencyTuner`.
+
+    Raises
+    ------
+    ValueError
+        Raised if ``value`` is neither.
+    """
+    value = str(value).strip().lower()
+    if value == 'auto':
+        return value
+    try:
+        concurrency = int(value)
+    except ValueError:
+        concurrency = 0
+    if concurrency < 1:
+        raise ValueError('expected a positive number of uploads or "auto", '
+                         'got {0!r}'.format(value))
+    return concurrency
@@ -0,0 +1,95 @@
+"""Bandwidth cap of uploads.
+
+A :class:`BandwidthLimiter` is a token bucket shared by the botocore
+clients it is attached to, so that it caps the total rate at which all of
+their threads send request bodies, such as the concurrent file uploads of
+:func:`ltdmason.s3upload.upload`, the parts of multipart uploads, and the
+uploads of the concurrent builds of a batch or a worker. Each request
+reserves its body's bytes just before it is sent, and waits until the
+bucket has refilled enough to cover them; retried requests are charged
+again.
+
+Requests whose bodies are no larger than ``bypass_size`` (small files,
+directory redirect objects) are sent right away. Their bytes are still
+charged, so the large uploads queued behind them slow down to keep the
+total at the cap, but the request rate of sites with many small pages
+isn't limited by the large files.
+"""
+
+import logging
+import threading
+import time
+
+from .botoevents import attach
+
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+
+class BandwidthLimiter(object):
+    """Cap the upload bandwidth of botocore clients with a token bucket.
+
+    Instances are thread-safe.
+
+    Parameters
+    ----------
+    rate : float
+        Maximum average bandwidth, in bytes per second.
+    burst : int, optional
+        Capacity of the bucket: the bytes that can be sent at once after
+        an idle period. Defaults to one second at ``rate``.
+    bypass_size : int, optional
+        Requests with bodies of at most this many bytes aren't delayed.
+    """
+    def __init__(self, rate, burst=None, bypass_size=0):
+        super().__init__()
+        if rate <= 0:
+            raise ValueError('Bandwidth must be positive, not {0!r}'.format(
+                rate))
+        self.rate = float(rate)
+        self.burst = self.rate if burst is None else float(burst)
+        self.bypass_size = bypass_size
+        self.seconds_waited = 0.
+        self._lock = threading.Lock()
+        self._tokens = self.burst
+        self._time = time.monotonic()
+
+    def attach(self, client):
+        """Cap the bandwidth of a botocore client's requests.
+
+        Attaching the same client more than once has no effect.
+        """
+        attach(client, self, [('before-send.s3', self._before_send)])
+
+    def _before_send(self, request=None, **kwargs):
+        try:
+            size = int(request.headers.get('Content-Length', 0))
+        except (AttributeError, TypeError, ValueError):
+            return None
+        if size > 0:
+            self.consume(size)
+        return None
+
+    def consume(self, nbytes):
+        """Charge ``nbytes`` bytes and wait until the bucket covers them,
+        unless ``nbytes`` is at most ``bypass_size``.
+
+        Returns
+        -------
+        seconds : float
+            Seconds waited.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens +
+                               (now - self._time) * self.rate)
+            self._time = now
+            self._tokens -= nbytes
+            if nbytes <= self.bypass_size or self._tokens >= 0.:
+                return 0.
+            # Concurrent requests queue up behind each other's reservations
+            delay = -self._tokens / self.rate
+            self.seconds_waited += delay
+        log.debug('Waiting %.3f s to send %d bytes', delay, nbytes)
+        time.sleep(delay)
+        return delay
@@ -0,0 +1,156 @@
+"""Build and upload many manifests in one shared pipeline.
+
+All phases of all builds are scheduled on a single
+:class:`ltdmason.pipeline.Pipeline`. Pipeline resources keep the machine
+busy without oversubscribing it: CPU-bound Sphinx builds are limited to the
+number of cores, ``pip install`` runs one at a time because builds share a
+Python environment, and the I/O-bound clones and uploads overlap freely
+with everything else. Manifests with identical inputs are built once and
+uploaded once per manifest.
+"""
+
+import logging
+import os
+
+from .buildcache import compute_fingerprint
+from .product import InstalledRequirements, Product, add_build_phases
+from .uploader import add_upload_phases, KeeperClient
+
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+
+def default_resources(sphinx_jobs=None):
+    """Default pipeline resource limits for batch builds.
+
+    Parameters
+    ----------
+    sphinx_jobs : int, optional
+        Maximum number of concurrent Sphinx builds. Defaults to the number
+        of CPUs.
+
+    Returns
+    -------
+    resources : dict
+        Resource limits for :class:`ltdmason.pipeline.Pipeline`.
+    """
+    if sphinx_jobs is None:
+        sphinx_jobs = os.cpu_count() or 1
+    # Streaming uploads hold a pipeline worker until their build finishes,
+    # so they must leave workers for the builds
+    return {'cpu': sphinx_jobs, 'pip': 1, 'network': 8, 'upload': 8,
+            'upload-stream': 4}
+
+
+def add_batch_phases(pipeline, manifests, build_root, upload=True,
+                     cache=None, sphinx_runner=None, git_mirrors=None,
+                     incremental=False, inventory_cache=None,
+                     stream_upload=False, postprocessors=None,
+                     skip_unchanged=False, cache_control_rules=None,
+                     header_policy=None, call_stats=None, report=None,
+                     tracer=None, progress=None, max_workers=1,
+                     tuner=None, bandwidth=None):
+    """Add the build and upload phases of many manifests to a pipeline.
+
+    Parameters
+    ----------
+    pipeline : :class:`ltdmason.pipeline.Pipeline`
+        Pipeline to add phases to, typically created with
+        :func:`default_resources` and ``keep_going=True``.
+    manifests : list of :class:`ltdmason.manifest.Manifest`
+        Manifests to build.
+    build_root : str
+        Directory in which each build gets its own sub-directory.
+    upload : bool, optional
+        Add the LTD Keeper and S3 upload phases for each manifest.
+    cache : :class:`ltdmason.buildcache.BuildCache`, optional
+        Build cache.
+    sphinx_runner : :class:`ltdmason.sphinxrunner.SphinxRunner`, optional
+        Runner for in-process Sphinx builds.
+    git_mirrors : :class:`ltdmason.gitmirror.GitMirrorCache`, optional
+        Git mirrors for doc repo clones.
+    incremental : bool, optional
+        Reuse the build trees from a previous batch build in ``build_root``
+        (see :class:`ltdmason.product.Product`).
+    inventory_cache : `ltdmason.intersphinxcache.InventoryCache`, optional
+        Intersphinx inventory cache shared by all builds.
+    stream_upload : bool, optional
+        Stream each build's HTML to S3 while Sphinx is writing it (see
+        :func:`ltdmason.uploader.add_upload_phases`). It can't be combined
+        with ``postprocessors``.
+    postprocessors : list, optional
+        Post-build stages run on each build's HTML (see
+        :func:`ltdmason.product.add_build_phases`).
+    skip_unchanged : bool, optional
+        Skip uploading files that are unchanged in the bucket.
+    cache_control_rules : list of tuple, optional
+        ``(glob, cache_control)`` rules for uploaded files.
+    header_policy : :class:`ltdmason.headerpolicy.HeaderPolicy`, optional
+        Per-path headers of uploaded files.
+    call_stats : :class:`ltdmason.s3stats.S3CallStats`, optional
+        Accounting that the S3 API calls of all uploads are added to.
+    report : :class:`ltdmason.runreport.RunReport`, optional
+        Report that the upload steps and file counts of all uploads are
+        added to.
+    tracer : :class:`ltdmason.tracing.Tracer`, optional
+        Tracer that records the directories and S3 API calls of all uploads
+        as spans.
+    progress : :class:`ltdmason.progress.UploadProgress`, optional
+        Reporter of the combined progress of all uploads.
+    max_workers : int, optional
+        Maximum number of concurrent file uploads of each upload.
+    tuner : :class:`ltdmason.autotune.ConcurrencyTuner`, optional
+        Tuner of the total number of concurrent file uploads of all
+        uploads, instead of ``max_workers``.
+    bandwidth : :class:`ltdmason.bandwidth.BandwidthLimiter`, optional
+        Cap of the total bandwidth of all uploads.
+
+    Returns
+    -------
+    products : list of :class:`ltdmason.product.Product`
+        The product built for each manifest. Manifests with identical
+        inputs share a product.
+    """
+    if upload and stream_upload and postprocessors:
+        raise ValueError('Streamed uploads can\'t be post-processed')
+    keeper = KeeperClient.from_env() if upload else None
+    installed_requirements = InstalledRequirements()
+    builds = {}
+    products = []
+    for i, manifest in enumerate(manifests):
+        prefix = '{0}[{1:d}]:'.format(manifest.product_name, i)
+        inputs = compute_fingerprint(manifest)
+        if inputs in builds:
+            product, build_phase = builds[inputs]
+            log.info('%s has the same inputs as an earlier manifest; '
+                     'reusing its build', prefix.rstrip(':'))
+        else:
+            build_dir = os.path.join(build_root, str(i))
+            os.makedirs(build_dir, exist_ok=incremental)
+            product = Product(manifest, build_dir,
+                              sphinx_runner=sphinx_runner,
+                              git_mirrors=git_mirrors,
+                              installed_requirements=installed_requirements,
+                              incremental=incremental,
+                              inventory_cache=inventory_cache)
+            build_phase = add_build_phases(pipeline, product, cache=cache,
+                                           prefix=prefix,
+                                           postprocessors=postprocessors)
+            builds[inputs] = (product, build_phase)
+        products.append(product)
+
+        if upload:
+            add_upload_phases(pipeline, manifest, product,
+                              requires=[build_phase], keeper=keeper,
+                              prefix=prefix, stream=stream_upload,
+                              skip_unchanged=skip_unchanged,
+                              cache_control_rules=cache_control_rules,
+                              header_policy=header_policy,
+                              call_stats=call_stats,
+                              report=report,
+                              tracer=tracer,
+                              progress=progress,
+                              max_workers=max_workers,
+                              tuner=tuner,
+                              bandwidth=bandwidth)
+    return products
@@ -0,0 +1,60 @@
+"""Instrumentation of botocore clients through their event system.
+
+S3 call accounting (:mod:`ltdmason.s3stats`), tracing
+(:mod:`ltdmason.tracing`), upload progress (:mod:`ltdmason.progress`),
+concurrency tuning (:mod:`ltdmason.autotune`) and bandwidth limiting
+(:mod:`ltdmason.bandwidth`) all register their event handlers on the
+clients that upload with :func:`attach`.
+"""
+
+import logging
+
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+
+def attach(client, owner, handlers, first=False):
+    """Register the event handlers of an object on a botocore client.
+
+    Attaching the same object to a client more than once has no effect.
+    Errors raised by the handlers are logged rather than failing the API
+    call (see :func:`guard`).
+
+    Parameters
+    ----------
+    client : :class:`botocore.client.BaseClient`
+        An S3 client, such as ``session.client('s3')`` or the
+        ``meta.client`` of an S3 resource.
+    owner : object
+        Object that the handlers belong to, such as a
+        :class:`ltdmason.s3stats.S3CallStats`.
+    handlers : list of tuple
+        ``(event_name, handler)`` pairs, such as
+        ``('before-send.s3', owner._before_send)``.
+    first : bool, optional
+        Register the handlers ahead of botocore's own, so that they see
+        events that those answer, such as ``needs-retry``.
+    """
+    events = client.meta.events
+    register = events.register_first if first else events.register
+    for event, handler in handlers:
+        register(event, guard(handler),
+                 unique_id='{0}-{1}-{2:x}'.format(
+                     event, type(owner).__name__, id(owner)))
+
+
+def guard(handler):
+    """Wrap an event handler so that its errors are logged instead of
+    replacing the outcome of the API call.
+
+    The wrapped handler always returns `None`, so it never answers an event
+    in place of botocore.
+    """
+    def guarded(**kwargs):
+        try:
+            handler(**kwargs)
+        except Exception:
+            log.exception('Error in the %s handler %r',
+                          kwargs.get('event_name'), handler)
+        return None
+    return guarded
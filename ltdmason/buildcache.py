@@ -0,0 +1,200 @@
+"""Content-addressed cache of built HTML sites.
+
+A manifest fully determines a documentation build: the doc repository's URL,
+ref and clone options, plus the URL and ref of every package.
+:func:`compute_fingerprint` hashes these inputs, along with the resolved Git
+commit SHAs where they are available, into a key. :class:`BuildCache`
+stores the rendered HTML tree under that key so that a later build with
+identical inputs can skip the Sphinx build and go straight to the upload.
+Builds whose commits can't be resolved aren't cached at all.
+
+Cached sites include the output of the post-build stages (see
+:func:`ltdmason.product.add_build_phases`), so the names and settings of
+these stages are part of the key too.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+from io import BytesIO
+
+import sh
+
+from . import __version__
+
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+
+def compute_fingerprint(manifest, doc_repo_sha=None, package_shas=None,
+                        postprocessors=None):
+    """Compute a fingerprint of the inputs of a documentation build.
+
+    Parameters
+    ----------
+    manifest : :class:`ltdmason.manifest.BaseManifest`
+        Manifest for the documentation build.
+    doc_repo_sha : str, optional
+        Resolved commit SHA of the documentation repository's ref.
+    package_shas : dict, optional
+        Resolved commit SHAs of packages, keyed by package name. Packages
+        without a resolved SHA are fingerprinted by their ref alone.
+    postprocessors : list, optional
+        Post-build stages of the build, in order. Each is fingerprinted by
+        its ``name`` and, if it has one, its ``settings`` attribute, which
+        must be JSON-serializable.
+
+    Returns
+    -------
+    fingerprint : str
+        Hex-encoded SHA-256 digest of the build inputs.
+    """
+    package_shas = package_shas or {}
+    inputs = {
+        'ltdmason_version': __version__,
+        'doc_repo': {'url': manifest.doc_repo_url,
+                     'ref': manifest.doc_repo_ref,
+                     'clone': manifest.doc_repo_clone_options,
+                     'sha': doc_repo_sha},
+        'packages': {
+            str(name): {'url': data['url'],
+                        'ref': data['ref'],
+                        'sha': package_shas.get(name)}
+            for name, data in manifest.packages.items()},
+        'postprocessors': [[p.name, getattr(p, 'settings', None)]
+                           for p in postprocessors or []]
+    }
+    encoded = json.dumps(inputs, sort_keys=True).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def resolve_git_sha(repo_dir):
+    """Resolve the commit SHA checked out in a Git working directory.
+
+    Parameters
+    ----------
+    repo_dir : str
+        Path of the Git working directory.
+
+    Returns
+    -------
+    sha : str
+        The ``HEAD`` commit SHA, or `None` if ``repo_dir`` is not a Git
+        working directory.
+    """
+    if not os.path.exists(os.path.join(repo_dir, '.git')):
+        return None
+    err_log = BytesIO()
+    try:
+        sha = sh.git('rev-parse', 'HEAD', _cwd=repo_dir, _err=err_log)
+    except sh.ErrorReturnCode:
+        log.debug(err_log.getvalue())
+        return None
+    return str(sha).strip()
+
+
+class BuildCache(object):
+    """A directory of built HTML sites, keyed by build fingerprint.
+
+    Each entry is stored as ``<cache_dir>/<fingerprint>/html/``. Entries are
+    written to a temporary directory and then renamed into place, so
+    concurrent builds never observe a partially-written entry.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Root directory of the cache. It is created if necessary.
+    """
+    def __init__(self, cache_dir):
+        super().__init__()
+        self.cache_dir = os.path.abspath(cache_dir)
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    def fingerprint(self, product, postprocessors=None):
+        """Fingerprint the inputs of a product whose doc repo is cloned.
+
+        Parameters
+        ----------
+        product : :class:`ltdmason.product.Product`
+            Product, after :meth:`~ltdmason.product.Product.clone_doc_repo`.
+        postprocessors : list, optional
+            Post-build stages whose output is cached with the site.
+
+        Returns
+        -------
+        fingerprint : str
+            See :func:`compute_fingerprint`, or `None` if the commit of the
+            doc repo or of a package can't be resolved. A ref alone doesn't
+            pin the build's inputs (a branch moves), so such builds must not
+            be cached.
+        """
+        manifest = product.manifest
+        doc_repo_sha = resolve_git_sha(product.doc_dir)
+        if doc_repo_sha is None:
+            log.info('Not caching the build: the commit of %s is unknown',
+                     product.doc_dir)
+            return None
+        package_shas = {}
+        for name, data in manifest.packages.items():
+            package_shas[name] = resolve_git_sha(data['dir'])
+            if package_shas[name] is None:
+                log.info('Not caching the build: the commit of package %s '
+                         'is unknown', name)
+                return None
+        return compute_fingerprint(
+            manifest,
+            doc_repo_sha=doc_repo_sha,
+            package_shas=package_shas,
+            postprocessors=postprocessors)
+
+    def _entry_dir(self, fingerprint):
+        return os.path.join(self.cache_dir, fingerprint, 'html')
+
+    def __contains__(self, fingerprint):
+        return os.path.isdir(self._entry_dir(fingerprint))
+
+    def restore(self, fingerprint, html_dir):
+        """Copy a cached HTML site into ``html_dir``.
+
+        Parameters
+        ----------
+        fingerprint : str
+            Fingerprint of the cached build.
+        html_dir : str
+            Destination directory; it must not exist yet.
+        """
+        log.info('Restoring cached build %s to %s', fingerprint, html_dir)
+        shutil.copytree(self._entry_dir(fingerprint), html_dir,
+                        symlinks=True)
+
+    def store(self, fingerprint, html_dir):
+        """Store a built HTML site in the cache.
+
+        Nothing is written if the cache already has an entry for
+        ``fingerprint``.
+
+        Parameters
+        ----------
+        fingerprint : str
+            Fingerprint of the build inputs.
+        html_dir : str
+            Directory of the built HTML site.
+        """
+        if fingerprint in self:
+            return
+        staging_dir = tempfile.mkdtemp(prefix='.staging-', dir=self.cache_dir)
+        try:
+            shutil.copytree(html_dir, os.path.join(staging_dir, 'html'),
+                            symlinks=True)
+            os.rename(staging_dir, os.path.join(self.cache_dir, fingerprint))
+        except OSError:
+            # Most likely a concurrent build stored the same entry first
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            if fingerprint not in self:
+                raise
+        else:
+            log.info('Stored build %s in cache', fingerprint)
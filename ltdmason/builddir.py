@@ -0,0 +1,260 @@
+"""Placement, cleanup and disk usage reporting of build directories.
+
+Large documentation builds spend a surprising amount of wall time creating
+and deleting files on slow disks. This module lets ltd-mason:
+
+- place build directories on a fast filesystem (such as a tmpfs mount),
+  falling back to the default temporary directory when it lacks free space
+  (:func:`choose_build_root`);
+- delete old build trees without blocking the build, by renaming them aside
+  and deleting them in the background (:class:`TreeRemover`);
+- report the disk usage of a build directory after each pipeline phase
+  (:class:`DiskUsageReporter`).
+"""
+
+import fnmatch
+import logging
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+BUILD_DIR_PREFIX = 'ltd-mason-'
+"""Prefix of the names of the temporary build directories that ltd-mason
+creates, and whose interrupted removals it sweeps (see
+:meth:`TreeRemover.sweep`).
+"""
+
+_TRASH_RE = re.compile(r'^\.(?P<name>.+)\.trash-[0-9a-f]{32}$')
+
+_SIZE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3,
+               'T': 1024 ** 4}
+
+
+def parse_size(size):
+    """Parse a size like ``'512M'`` or ``'2G'`` into bytes (`int`)."""
+    match = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*$',
+                     str(size), re.IGNORECASE)
+    if match is None:
+        raise ValueError('Cannot parse size {0!r}'.format(size))
+    return int(float(match.group(1)) * _SIZE_UNITS[match.group(2).upper()])
+
+
+def format_size(nbytes):
+    """Format a number of bytes for humans (`str`)."""
+    if abs(nbytes) < 1024:
+        return '{0:d} B'.format(int(nbytes))
+    for unit in ('KiB', 'MiB', 'GiB'):
+        nbytes /= 1024.
+        if abs(nbytes) < 1024:
+            return '{0:.1f} {1}'.format(nbytes, unit)
+    nbytes /= 1024.
+    return '{0:.1f} TiB'.format(nbytes)
+
+
+def free_space(path):
+    """Bytes available to unprivileged users on the filesystem of ``path``.
+    """
+    stats = os.statvfs(path)
+    return stats.f_bavail * stats.f_frsize
+
+
+def choose_build_root(preferred=None, min_free=0):
+    """Choose the directory in which to create build directories.
+
+    Parameters
+    ----------
+    preferred : str, optional
+        Preferred directory, typically on a fast filesystem such as a tmpfs
+        mount like :file:`/dev/shm`.
+    min_free : int, optional
+        Minimum free space, in bytes, that ``preferred`` must have.
+
+    Returns
+    -------
+    build_root : str
+        ``preferred`` if it exists and has enough free space, otherwise the
+        system's default temporary directory.
+    """
+    if preferred is not None:
+        if not os.path.isdir(preferred):
+            log.warning('Build root %s does not exist; using %s',
+                        preferred, tempfile.gettempdir())
+        elif free_space(preferred) < min_free:
+            log.warning('Build root %s has %s free, less than %s; using %s',
+                        preferred, format_size(free_space(preferred)),
+                        format_size(min_free), tempfile.gettempdir())
+        else:
+            return os.path.abspath(preferred)
+    return tempfile.gettempdir()
+
+
+def disk_usage(path):
+    """Disk space used by a directory tree, in bytes (`int`).
+
+    Symbolic links are not followed, so linked package docs aren't counted.
+    """
+    total = 0
+    stack = [path]
+    while stack:
+        try:
+            entries = os.scandir(stack.pop())
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                try:
+                    stat = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                total += stat.st_blocks * 512
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+    return total
+
+
+class TreeRemover(object):
+    """Delete directory trees without blocking the caller.
+
+    A tree is first renamed to a hidden ``.<name>.trash-<id>`` sibling, which
+    is instant, so its original path can be reused right away. The renamed
+    tree is then deleted in a background thread or, for trees removed just
+    before the process exits, in a detached ``rm`` process that outlives it.
+    Threads are daemonic, so call :meth:`wait` before exiting to let them
+    finish.
+    """
+    def __init__(self):
+        super().__init__()
+        self._threads = []
+
+    def remove(self, path, detach=False):
+        """Remove a directory tree in the background.
+
+        Parameters
+        ----------
+        path : str
+            Directory to remove.
+        detach : bool, optional
+            Delete in a detached process rather than a thread, so that the
+            deletion continues after this process exits.
+        """
+        path = os.path.abspath(path)
+        trash_path = os.path.join(
+            os.path.dirname(path),
+            '.{0}.trash-{1}'.format(os.path.basename(path), uuid.uuid4().hex))
+        try:
+            os.rename(path, trash_path)
+        except FileNotFoundError:
+            return
+        log.debug('Deleting %s (renamed from %s) in the background',
+                  trash_path, path)
+        self._delete(trash_path, detach)
+
+    def sweep(self, directory, pattern='*', detach=False):
+        """Remove trees left in ``directory`` by removals that were
+        interrupted, for example because the process was killed.
+
+        Parameters
+        ----------
+        directory : str
+            Directory to sweep.
+        pattern : str, optional
+            Glob pattern that the original names of the removed trees must
+            match. Only trees that ltd-mason created should match, since
+            ``directory`` may be shared with other programs.
+        detach : bool, optional
+            Delete in detached processes rather than threads (see
+            :meth:`remove`).
+        """
+        try:
+            entries = list(os.scandir(directory))
+        except FileNotFoundError:
+            return
+        for entry in entries:
+            match = _TRASH_RE.match(entry.name)
+            if match is not None \
+                    and fnmatch.fnmatchcase(match.group('name'), pattern) \
+                    and entry.is_dir(follow_symlinks=False):
+                self._delete(entry.path, detach)
+
+    def _delete(self, trash_path, detach):
+        if detach:
+            subprocess.Popen(['rm', '-rf', '--', trash_path],
+                             stdin=subprocess.DEVNULL,
+                             stdout=subprocess.DEVNULL,
+                             stderr=subprocess.DEVNULL,
+                             start_new_session=True)
+            return
+        # Forget finished deletions, so a long-lived remover (such as a
+        # worker's) doesn't accumulate threads
+        self._threads = [t for t in self._threads if t.is_alive()]
+        thread = threading.Thread(target=shutil.rmtree,
+                                  args=(trash_path,),
+                                  kwargs={'ignore_errors': True},
+                                  daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def wait(self):
+        """Wait for background deletions in threads to finish."""
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+
+class DiskUsageReporter(object):
+    """Pipeline listener that logs a build directory's disk usage and the
+    free space on its filesystem after each phase.
+
+    Pipeline listeners run on the pipeline's scheduler thread, so the
+    directory is measured in a background thread rather than delaying the
+    next phases. Call :meth:`close` to wait for pending measurements.
+
+    Parameters
+    ----------
+    build_dir : str
+        Build directory to measure.
+    report : :class:`ltdmason.runreport.RunReport`, optional
+        Report that the disk usage after each phase is also recorded in
+        (see :meth:`ltdmason.runreport.RunReport.disk_usage`).
+
+    Attributes
+    ----------
+    usage : dict
+        Disk usage of ``build_dir``, in bytes, after each phase (keyed by
+        phase name).
+    """
+    def __init__(self, build_dir, report=None):
+        super().__init__()
+        self.build_dir = build_dir
+        self.report = report
+        self.usage = {}
+        self._executor = ThreadPoolExecutor(max_workers=1,
+                                            thread_name_prefix='disk-usage')
+
+    def __call__(self, phase, error):
+        self._executor.submit(self._measure, phase.name)
+
+    def _measure(self, phase_name):
+        try:
+            usage = disk_usage(self.build_dir)
+            self.usage[phase_name] = usage
+            if self.report is not None:
+                self.report.disk_usage(phase_name, usage)
+            log.info('Disk usage after %s: %s (%s free)', phase_name,
+                     format_size(usage),
+                     format_size(free_space(self.build_dir)))
+        except Exception:
+            log.exception('Could not measure the disk usage of %s',
+                          self.build_dir)
+
+    def close(self):
+        """Wait for pending measurements to finish."""
+        self._executor.shutdown(wait=True)
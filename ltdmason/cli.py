@@ -2,16 +2,36 @@
 
 import os
 import argparse
+import glob
 import textwrap
 import sys
 from io import open
 import tempfile
-import shutil
 import logging
 
+from .autotune import ConcurrencyTuner, parse_concurrency
+from .bandwidth import BandwidthLimiter
+from .batch import add_batch_phases, default_resources
+from .buildcache import BuildCache
+from .builddir import (BUILD_DIR_PREFIX, DiskUsageReporter, TreeRemover,
+                       choose_build_root, parse_size)
+from .intersphinxcache import DEFAULT_TTL, InventoryCache
+from .fingerprint import AssetFingerprinter, DEFAULT_CACHE_CONTROL
+from .imageopt import ImageOptimizer
+from .headerpolicy import load_policy
 from .manifest import Manifest
-from .product import Product
-from .uploader import upload
+from .normalize import HTMLNormalizer, load_rules
+from .openmetrics import BuildMetrics
+from .s3stats import S3CallStats
+from .packagediff import BuildState
+from .pipeline import Pipeline
+from .product import Product, add_build_phases
+from .profiling import Profiler
+from .progress import UploadProgress
+from .runreport import RunReport
+from .sphinxrunner import SphinxRunner
+from .tracing import Tracer, span
+from .uploader import add_upload_phases
 
 
 log = logging.getLogger(__name__)
@@ -32,37 +52,241 @@ def run_ltd_mason():
     else:
         logging.basicConfig(level=logging.INFO)
 
-    if args.manifest_path is None:
-        # Read manifest from stdin
-        manifest_data = sys.stdin.read()
+    if args.s3_stats is not None or args.report is not None \
+            or args.metrics_file is not None:
+        call_stats = S3CallStats()
     else:
-        # Read manifest from file
-        with open(args.manifest_path, mode='r', encoding='utf-8') as f:
-            manifest_data = f.read()
-    manifest = Manifest(manifest_data)
+        call_stats = None
 
+    if args.profile is not None:
+        profiler = Profiler(args.profile, output_dir=args.profile_dir,
+                            name='ltd-mason')
+        profiler.start()
+    else:
+        profiler = None
+
+    if args.trace is not None:
+        tracer = Tracer(sample_rate=args.trace_sample_rate)
+    else:
+        tracer = None
+
+    report = RunReport(args.report, command='ltd-mason',
+                       call_stats=call_stats)
+    try:
+        with report:
+            _run_build(args, report, call_stats, profiler=profiler,
+                       tracer=tracer)
+    finally:
+        if profiler is not None:
+            profiler.stop()
+        if tracer is not None:
+            tracer.write(args.trace)
+        if args.metrics_file is not None:
+            metrics = BuildMetrics(args.metrics_file, command='ltd-mason')
+            metrics.add(report)
+            metrics.write()
+
+
+def _run_build(args, report, call_stats, profiler=None, tracer=None):
+    """Build and upload the manifests given on the command line, timing
+    the run in a :class:`ltdmason.runreport.RunReport`.
+    """
+    with report.timer('manifest'), span(tracer, 'manifest', 'phase'):
+        if not args.manifest_paths:
+            # Read manifest from stdin
+            manifests = [Manifest(sys.stdin.read())]
+        else:
+            # Read manifests from files
+            manifests = []
+            for manifest_path in args.manifest_paths:
+                with open(manifest_path, mode='r', encoding='utf-8') as f:
+                    manifests.append(Manifest(f.read()))
+
+    remover = TreeRemover()
     if args.build_dir is None:
         # Use a temporary directory by default
-        build_dir = tempfile.mkdtemp()
+        build_root = choose_build_root(
+            args.build_root, min_free=parse_size(args.build_root_min_free))
+        # Sweep in detached processes: this run may well exit first
+        remover.sweep(build_root, pattern=BUILD_DIR_PREFIX + '*',
+                      detach=True)
+        build_dir = tempfile.mkdtemp(prefix=BUILD_DIR_PREFIX, dir=build_root)
     else:
         # Use a debug directory
         build_dir = os.path.abspath(args.build_dir)
         assert build_dir is not os.getcwd(), "--build-dir can't be CWD"
-        if os.path.exists(build_dir):
-            shutil.rmtree(build_dir)
-        os.makedirs(build_dir)
+        # Only sweep earlier removals of this build directory; its parent
+        # belongs to the user
+        remover.sweep(os.path.dirname(build_dir),
+                      pattern=glob.escape(os.path.basename(build_dir)),
+                      detach=True)
+        if os.path.exists(build_dir) and not args.incremental:
+            # Deleted in the background so the build starts right away, and
+            # in a detached process so the deletion survives this run
+            remover.remove(build_dir, detach=True)
+        os.makedirs(build_dir, exist_ok=True)
+    log.info('Building in %s', build_dir)
+
+    listeners = [report]
+    if profiler is not None:
+        listeners.append(profiler)
+    if tracer is not None:
+        listeners.append(tracer)
+    if args.disk_usage:
+        disk_usage_reporter = DiskUsageReporter(build_dir, report=report)
+        listeners.append(disk_usage_reporter)
+    else:
+        disk_usage_reporter = None
+
+    if args.cache_dir is not None:
+        cache = BuildCache(args.cache_dir)
+    else:
+        cache = None
 
-    product = Product(manifest, build_dir)
-    product.clone_doc_repo()
-    product.link_package_repos()
-    product.install_dependencies()
-    product.build_sphinx()
+    if args.state_dir is not None:
+        state = BuildState(args.state_dir)
+    else:
+        state = None
+
+    if args.intersphinx_cache_dir is not None:
+        inventory_cache = InventoryCache(args.intersphinx_cache_dir,
+                                         ttl=args.intersphinx_ttl,
+                                         offline=args.offline)
+    else:
+        inventory_cache = None
+
+    postprocessors = []
+    if args.normalize or args.normalize_rules is not None:
+        if args.normalize_rules is not None:
+            postprocessors.append(HTMLNormalizer(
+                load_rules(args.normalize_rules)))
+        else:
+            postprocessors.append(HTMLNormalizer())
+    if args.optimize_images:
+        # Before fingerprinting, so hashes are of the optimized images
+        postprocessors.append(ImageOptimizer(
+            cache_dir=args.image_cache_dir,
+            processes=args.image_processes))
+
+    # User rules come first since the first matching rule wins
+    cache_control_rules = list(args.cache_control_rules or [])
+    if args.fingerprint_assets:
+        postprocessors.append(AssetFingerprinter())
+        cache_control_rules.extend(DEFAULT_CACHE_CONTROL)
+
+    if args.header_policy is not None:
+        header_policy = load_policy(args.header_policy)
+    else:
+        header_policy = None
+
+    if args.progress:
+        progress = UploadProgress.for_terminal(
+            interval=args.progress_interval)
+    else:
+        progress = None
 
-    if not args.no_upload:
-        upload(manifest, product)
+    if args.upload_concurrency == 'auto':
+        tuner = ConcurrencyTuner(state_path=args.upload_tuning_state)
+        max_workers = 1
+    else:
+        tuner = None
+        max_workers = args.upload_concurrency
+
+    if args.max_bandwidth is not None:
+        bandwidth = BandwidthLimiter(
+            parse_size(args.max_bandwidth),
+            bypass_size=parse_size(args.bandwidth_bypass_size))
+    else:
+        bandwidth = None
+
+    if len(manifests) == 1:
+        manifest = manifests[0]
+        if args.sphinx_mode == 'in-process':
+            sphinx_runner = SphinxRunner()
+        else:
+            sphinx_runner = None
+
+        product = Product(manifest, build_dir, sphinx_runner=sphinx_runner,
+                          incremental=args.incremental,
+                          inventory_cache=inventory_cache)
+
+        pipeline = Pipeline(listeners=listeners)
+        build_phase = add_build_phases(pipeline, product, cache=cache,
+                                       state=state,
+                                       postprocessors=postprocessors)
+        if not args.no_upload:
+            add_upload_phases(pipeline, manifest, product,
+                              requires=[build_phase],
+                              stream=args.stream_upload,
+                              skip_unchanged=args.skip_unchanged,
+                              cache_control_rules=cache_control_rules,
+                              header_policy=header_policy,
+                              call_stats=call_stats,
+                              report=report,
+                              tracer=tracer,
+                              progress=progress,
+                              max_workers=max_workers,
+                              tuner=tuner,
+                              bandwidth=bandwidth)
+        try:
+            pipeline.run()
+        finally:
+            if sphinx_runner is not None:
+                sphinx_runner.close()
+    else:
+        # Batch mode: one pipeline schedules the phases of all manifests
+        resources = default_resources(sphinx_jobs=args.jobs)
+        if args.sphinx_mode == 'in-process':
+            sphinx_runner = SphinxRunner(processes=resources['cpu'])
+        else:
+            sphinx_runner = None
+
+        pipeline = Pipeline(resources=resources, keep_going=True,
+                            listeners=listeners)
+        add_batch_phases(pipeline, manifests, build_dir,
+                         upload=not args.no_upload,
+                         cache=cache,
+                         sphinx_runner=sphinx_runner,
+                         incremental=args.incremental,
+                         inventory_cache=inventory_cache,
+                         stream_upload=args.stream_upload,
+                         postprocessors=postprocessors,
+                         skip_unchanged=args.skip_unchanged,
+                         cache_control_rules=cache_control_rules,
+                         header_policy=header_policy,
+                         call_stats=call_stats,
+                         report=report,
+                         tracer=tracer,
+                         progress=progress,
+                         max_workers=max_workers,
+                         tuner=tuner,
+                         bandwidth=bandwidth)
+        try:
+            pipeline.run()
+        finally:
+            if sphinx_runner is not None:
+                sphinx_runner.close()
+
+    if args.s3_stats is not None:
+        call_stats.write(args.s3_stats)
+    if tuner is not None:
+        tuner.save()
+    if disk_usage_reporter is not None:
+        disk_usage_reporter.close()
 
     if args.build_dir is None:
-        shutil.rmtree(build_dir)
+        # Finish deleting in a detached process rather than making the
+        # build wait for it
+        remover.remove(build_dir, detach=True)
+
+
+def _cache_control_rule(value):
+    """Parse a ``GLOB=VALUE`` argument into a ``(glob, value)`` rule."""
+    glob, sep, cache_control = value.partition('=')
+    if not sep or not glob or not cache_control:
+        raise argparse.ArgumentTypeError(
+            'expected GLOB=VALUE, got {0!r}'.format(value))
+    return glob, cache_control
 
 
 def parse_args():
@@ -83,6 +307,12 @@ def parse_args():
 
             cat manifest.yaml | ltd-mason
 
+            Several manifests can be built in batch mode by repeating
+            `--manifest`. Batch mode runs the clones, builds and uploads of
+            all manifests concurrently, limiting concurrent Sphinx builds to
+            the number of CPUs (see `--jobs`), and builds manifests with
+            identical inputs only once.
+
             ltd-mason's use of Amazon S3 and LTD Keeper are configured with
             environment variables:
 
@@ -116,15 +346,216 @@ def parse_args():
         epilog='See https://github.com/lsst-sqre/ltd-mason for more info.')
     parser.add_argument(
         '--manifest',
-        dest='manifest_path',
+        dest='manifest_paths',
+        action='append',
         default=None,
-        help='Path to YAML manifest file that defines the doc build.')
+        help='Path to YAML manifest file that defines the doc build. Repeat '
+             'to build several manifests in batch mode.')
+    parser.add_argument(
+        '--jobs',
+        type=int,
+        default=None,
+        help='Maximum number of concurrent Sphinx builds in batch mode. '
+             'Defaults to the number of CPUs.')
     parser.add_argument(
         '--no-upload',
         dest='no_upload',
         default=False,
         action='store_true',
         help='Skip the upload to S3 and ltd-keeper; only build the docs')
+    parser.add_argument(
+        '--stream-upload',
+        dest='stream_upload',
+        default=False,
+        action='store_true',
+        help='Upload HTML files to S3 while Sphinx is still writing them, '
+             'then reconcile files that were rewritten late (such as the '
+             'search index) and delete stale objects once the build '
+             'finishes. Not available with post-build stages such as '
+             '--normalize.')
+    parser.add_argument(
+        '--normalize',
+        default=False,
+        action='store_true',
+        help='Strip volatile fragments, such as "Last updated on" dates, '
+             'from the built HTML so unchanged pages are byte-identical '
+             'between builds.')
+    parser.add_argument(
+        '--normalize-rules',
+        dest='normalize_rules',
+        default=None,
+        help='YAML file of normalization rules (a list of glob, pattern '
+             'and replacement mappings) to use instead of the defaults. '
+             'Implies --normalize.')
+    parser.add_argument(
+        '--skip-unchanged',
+        dest='skip_unchanged',
+        default=False,
+        action='store_true',
+        help='Copy files whose MD5 hash matches the ETag of the object in '
+             'the previous build of the edition from that build within the '
+             'bucket, instead of uploading them.')
+    parser.add_argument(
+        '--optimize-images',
+        dest='optimize_images',
+        default=False,
+        action='store_true',
+        help='Losslessly recompress the PNG and JPEG files in _images/ '
+             'and _static/ before uploading. optipng/oxipng and jpegtran '
+             'are used if installed.')
+    parser.add_argument(
+        '--image-cache-dir',
+        dest='image_cache_dir',
+        default=None,
+        help='Directory of optimized images, keyed by content hash, so each '
+             'unique image is only optimized once across builds. Implies '
+             '--optimize-images. Defaults to $LTD_MASON_IMAGE_CACHE with '
+             '--optimize-images.')
+    parser.add_argument(
+        '--image-processes',
+        dest='image_processes',
+        type=int,
+        default=None,
+        help='Number of processes that optimize images. Defaults to the '
+             'number of CPUs.')
+    parser.add_argument(
+        '--fingerprint-assets',
+        dest='fingerprint_assets',
+        default=False,
+        action='store_true',
+        help='Add content-hashed copies of the files in _static/, point the '
+             'HTML at them, and upload them with an immutable, one-year '
+             'Cache-Control header while HTML pages are revalidated after '
+             'five minutes.')
+    parser.add_argument(
+        '--cache-control',
+        dest='cache_control_rules',
+        action='append',
+        type=_cache_control_rule,
+        default=None,
+        metavar='GLOB=VALUE',
+        help='Cache-Control header for uploaded files whose path matches '
+             'GLOB, such as "*.html=max-age=60". Repeatable; the first '
+             'matching rule wins. Other files are cached for one year.')
+    parser.add_argument(
+        '--header-policy',
+        dest='header_policy',
+        default=os.getenv('LTD_MASON_HEADER_POLICY'),
+        help='YAML file of per-glob Content-Type, Cache-Control, '
+             'Content-Encoding and metadata rules for uploaded files, and '
+             'extra extension to Content-Type mappings. --cache-control '
+             'rules take precedence. Defaults to $LTD_MASON_HEADER_POLICY.')
+    parser.add_argument(
+        '--upload-concurrency',
+        dest='upload_concurrency',
+        default=os.getenv('LTD_MASON_UPLOAD_CONCURRENCY', '1'),
+        metavar='N|auto',
+        help='Number of files of a directory to upload to S3 concurrently, '
+             'or "auto" to ramp it up while throughput increases and back '
+             'off when latency rises or S3 throttles requests. Defaults to '
+             '$LTD_MASON_UPLOAD_CONCURRENCY or 1.')
+    parser.add_argument(
+        '--upload-tuning-state',
+        dest='upload_tuning_state',
+        default=os.getenv('LTD_MASON_UPLOAD_TUNING_STATE'),
+        metavar='PATH',
+        help='JSON file in which --upload-concurrency auto saves the best '
+             'concurrency of each host, for the next run to start from. '
+             'Defaults to $LTD_MASON_UPLOAD_TUNING_STATE.')
+    parser.add_argument(
+        '--max-bandwidth',
+        dest='max_bandwidth',
+        default=os.getenv('LTD_MASON_MAX_BANDWIDTH'),
+        metavar='SIZE',
+        help='Cap the total bandwidth of S3 uploads, of all the builds of a '
+             'batch, to this many bytes per second, such as 20M. Defaults '
+             'to $LTD_MASON_MAX_BANDWIDTH; uncapped if unset.')
+    parser.add_argument(
+        '--bandwidth-bypass-size',
+        dest='bandwidth_bypass_size',
+        default='0',
+        metavar='SIZE',
+        help='Send S3 requests of at most this size, such as 64K, without '
+             'waiting for --max-bandwidth, so that small files keep the '
+             'request rate up; their bytes still count towards the cap.')
+    parser.add_argument(
+        '--progress',
+        dest='progress',
+        default=False,
+        action='store_true',
+        help='Report the progress of the S3 upload: files and bytes done, '
+             'throughput, request rate and the estimated time left. A bar '
+             'is drawn if standard error is a terminal; otherwise a line '
+             'is logged every --progress-interval seconds.')
+    parser.add_argument(
+        '--progress-interval',
+        dest='progress_interval',
+        type=float,
+        default=10.,
+        metavar='SECONDS',
+        help='Seconds between --progress log lines (default: 10).')
+    parser.add_argument(
+        '--s3-stats',
+        dest='s3_stats',
+        default=None,
+        metavar='PATH',
+        help='Write the number of S3 API calls, retries, errors, bytes and '
+             'latency of each S3 operation of the uploads to this JSON '
+             'file.')
+    parser.add_argument(
+        '--report',
+        dest='report',
+        default=os.getenv('LTD_MASON_REPORT'),
+        metavar='PATH',
+        help='Write a JSON report of the run to this file: the duration of '
+             'each phase (manifest parsing, clone, link, pip, Sphinx, LTD '
+             'Keeper registration, the listing, delete, upload and '
+             'redirect steps of the S3 upload, and confirmation), file and '
+             'byte counts, and S3 API call statistics. Defaults to '
+             '$LTD_MASON_REPORT.')
+    parser.add_argument(
+        '--metrics-file',
+        dest='metrics_file',
+        default=os.getenv('LTD_MASON_METRICS_FILE'),
+        metavar='PATH',
+        help='Write OpenMetrics text of the run (phase durations, files and '
+             'bytes uploaded and skipped, upload throughput, and S3 '
+             'requests, retries and errors by operation) to this file when '
+             'ltd-mason finishes, for example into the directory of '
+             "node-exporter's textfile collector. Defaults to "
+             '$LTD_MASON_METRICS_FILE.')
+    parser.add_argument(
+        '--trace',
+        dest='trace',
+        default=os.getenv('LTD_MASON_TRACE'),
+        metavar='PATH',
+        help='Write a trace of the run to this file in Chrome trace event '
+             'format (for chrome://tracing, Perfetto or speedscope), with '
+             'spans for each phase, each directory sync and each S3 API call. '
+             'Defaults to $LTD_MASON_TRACE.')
+    parser.add_argument(
+        '--trace-sample-rate',
+        dest='trace_sample_rate',
+        type=float,
+        default=1.,
+        help='Fraction of directory and S3 API call spans to record in '
+             '--trace, for large builds (default: 1).')
+    parser.add_argument(
+        '--profile',
+        dest='profile',
+        default=None,
+        choices=['cpu', 'memory'],
+        help='Profile the run. "cpu" writes a cProfile dump (.prof) and '
+             'collapsed stacks for flame graph tools (.collapsed); '
+             '"memory" writes the top allocators at each phase boundary '
+             '(.memory.txt) and tracemalloc snapshots of the start and end '
+             'of the run. Files are written to --profile-dir.')
+    parser.add_argument(
+        '--profile-dir',
+        dest='profile_dir',
+        default=os.getenv('LTD_MASON_PROFILE_DIR', '.'),
+        help='Directory for --profile output. Defaults to '
+             '$LTD_MASON_PROFILE_DIR or the current directory.')
     parser.add_argument(
         '--build-dir',
         default=None,
@@ -132,7 +563,88 @@ def parse_args():
         help='Directory to use for building the documentation. By default a '
              'temporary directory is created an deleted. This manually-set '
              'directory is not deleted to aid debugging. Beware that any '
-             'existing content in that directory will be deleted.')
+             'existing content in that directory will be deleted, unless '
+             '--incremental is set.')
+    parser.add_argument(
+        '--build-root',
+        default=os.getenv('LTD_MASON_BUILD_ROOT'),
+        dest='build_root',
+        help='Directory in which the temporary build directory is created '
+             'when --build-dir is not set, for example a tmpfs mount such '
+             'as /dev/shm. Falls back to the system temporary directory if '
+             'it lacks --build-root-min-free free space. Defaults to '
+             '$LTD_MASON_BUILD_ROOT.')
+    parser.add_argument(
+        '--build-root-min-free',
+        default='1G',
+        dest='build_root_min_free',
+        help='Minimum free space required on --build-root, such as 512M '
+             'or 2G (default: 1G).')
+    parser.add_argument(
+        '--disk-usage',
+        default=False,
+        action='store_true',
+        dest='disk_usage',
+        help='Log the disk usage of the build directory after each phase, '
+             'and record it in the run report and metrics.')
+    parser.add_argument(
+        '--incremental',
+        default=False,
+        action='store_true',
+        help='Reuse the build tree in --build-dir from a previous build: '
+             'the doc repo clone is updated, package links are reconciled '
+             'and Sphinx only rebuilds outdated documents. Combine with '
+             '--state-dir to invalidate the output of changed packages.')
+    parser.add_argument(
+        '--cache-dir',
+        default=os.getenv('LTD_MASON_CACHE_DIR'),
+        dest='cache_dir',
+        help='Directory of a build cache. Builds whose inputs (doc repo and '
+             'package refs and commits) match a cached build reuse the '
+             'cached HTML instead of running Sphinx. Defaults to '
+             '$LTD_MASON_CACHE_DIR; caching is disabled if neither is set.')
+    parser.add_argument(
+        '--state-dir',
+        default=None,
+        dest='state_dir',
+        help='Directory where the inputs of the last build of each product '
+             'are recorded. When set, ltd-mason reports which packages were '
+             'added, removed or changed since the last build, invalidates '
+             'only their parts of the reused build tree, and with '
+             '--skip-unchanged uploads their output without comparing it. '
+             'Requires --incremental. Defaults to $LTD_MASON_STATE_DIR '
+             'with --incremental.')
+    parser.add_argument(
+        '--intersphinx-cache-dir',
+        default=os.getenv('LTD_MASON_INTERSPHINX_CACHE'),
+        dest='intersphinx_cache_dir',
+        help='Directory of a shared intersphinx inventory cache. Sphinx '
+             'builds read objects.inv inventories from it and only fetch '
+             'inventories that are missing or older than --intersphinx-ttl. '
+             'Manage it with ltd-mason-intersphinx. Defaults to '
+             '$LTD_MASON_INTERSPHINX_CACHE.')
+    parser.add_argument(
+        '--intersphinx-ttl',
+        type=float,
+        default=DEFAULT_TTL,
+        dest='intersphinx_ttl',
+        help='Age, in seconds, after which cached intersphinx inventories '
+             'are fetched again (default: 86400).')
+    parser.add_argument(
+        '--offline',
+        default=False,
+        action='store_true',
+        help='Never fetch intersphinx inventories; use the cached copies '
+             'from --intersphinx-cache-dir whatever their age.')
+    parser.add_argument(
+        '--sphinx-mode',
+        default='subprocess',
+        choices=['subprocess', 'in-process'],
+        dest='sphinx_mode',
+        help='How to run Sphinx. "subprocess" runs the sphinx-build '
+             'command. "in-process" drives Sphinx from pre-warmed worker '
+             'processes, avoiding start-up costs when ltd-mason builds '
+             'repeatedly.')
     parser.add_argument(
         '--verbose',
         dest='verbose',
@@ -140,4 +652,38 @@ def parse_args():
         action='store_true',
         help='Full logging of debug messages')
     args, unknown_args = parser.parse_known_args()
+    if args.incremental and args.build_dir is None:
+        parser.error('--incremental requires --build-dir')
+    if args.state_dir is not None and not args.incremental:
+        parser.error('--state-dir requires --incremental')
+    if args.incremental and args.state_dir is None:
+        args.state_dir = os.getenv('LTD_MASON_STATE_DIR')
+    if args.image_cache_dir is not None:
+        args.optimize_images = True
+    elif args.optimize_images:
+        args.image_cache_dir = os.getenv('LTD_MASON_IMAGE_CACHE')
+    if args.stream_upload and (
+            args.normalize or args.normalize_rules is not None
+            or args.optimize_images or args.fingerprint_assets):
+        # Post-build stages rewrite files that may already be streamed
+        parser.error('--stream-upload can\'t be combined with --normalize, '
+                     '--optimize-images or --fingerprint-assets')
+    if args.offline and args.intersphinx_cache_dir is None:
+        parser.error('--offline requires --intersphinx-cache-dir')
+    if not 0. <= args.trace_sample_rate <= 1.:
+        parser.error('--trace-sample-rate must be between 0 and 1')
+    if args.progress_interval <= 0.:
+        parser.error('--progress-interval must be positive')
+    try:
+        args.upload_concurrency = parse_concurrency(args.upload_concurrency)
+    except ValueError as e:
+        parser.error('--upload-concurrency: {0}'.format(e))
+    try:
+        parse_size(args.build_root_min_free)
+        parse_size(args.bandwidth_bypass_size)
+        if args.max_bandwidth is not None and \
+                parse_size(args.max_bandwidth) <= 0:
+            parser.error('--max-bandwidth must be positive')
+    except ValueError as e:
+        parser.error(str(e))
     return args, unknown_args
@@ -0,0 +1,56 @@
+"""Atomic file writes.
+
+Caches, state files and metrics are read by concurrent builds and by other
+programs, and post-build stages rewrite files of a site in place. All of
+them are written with :func:`write_atomic`, so that readers see either the
+old or the new content of a file, never a partial write.
+"""
+
+import logging
+import os
+import shutil
+import tempfile
+
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+
+def write_atomic(path, data, prefix='.ltd-mason-', mode=None,
+                 mode_from=None):
+    """Replace the content of a file atomically.
+
+    The data are written to a temporary file in the same directory, which
+    is then renamed over ``path``.
+
+    Parameters
+    ----------
+    path : str
+        Path of the file to write.
+    data : bytes or str
+        New content of the file; `str` is encoded as UTF-8.
+    prefix : str, optional
+        Prefix of the name of the temporary file. Start it with ``'.'`` to
+        keep the temporary file out of directory listings that skip hidden
+        files.
+    mode : int, optional
+        Permission bits of the file, such as ``0o644``.
+    mode_from : str, optional
+        File whose permission bits are copied, such as the original of a
+        file being rewritten. By default, and if neither ``mode`` nor
+        ``mode_from`` is given, the file is only readable by its owner.
+    """
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(path)), prefix=prefix)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        if mode is not None:
+            os.chmod(tmp_path, mode)
+        elif mode_from is not None:
+            shutil.copymode(mode_from, tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
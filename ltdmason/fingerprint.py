@@ -0,0 +1,183 @@
+"""Content fingerprinting of static assets in built HTML sites.
+
+An :class:`AssetFingerprinter` gives each file under ``_static/`` a copy
+whose name contains a hash of its content (``pygments.css`` gets a
+``pygments.3f2a9c0b1d4e.css`` copy) and points the ``href`` and ``src``
+attributes of HTML pages, and the ``url()`` references of stylesheets, at
+those copies. Since a fingerprinted file's content never changes, it can be
+cached for a long time, with the ``immutable`` Cache-Control directive,
+while HTML pages get a short TTL (see :data:`DEFAULT_CACHE_CONTROL`).
+
+The original files are kept so that references that aren't rewritten, such
+as URLs built by JavaScript, keep working.
+"""
+
+import hashlib
+import logging
+import os
+import posixpath
+import re
+import time
+from urllib.parse import urlsplit
+
+from .fileutils import write_atomic
+
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+HASH_LENGTH = 12
+"""Number of hexadecimal digits of the content hash in file names."""
+
+FINGERPRINTED_GLOBS = [
+    '*.' + '[0-9a-f]' * HASH_LENGTH + '.*',
+    '*.' + '[0-9a-f]' * HASH_LENGTH,
+]
+"""Globs matching fingerprinted file names."""
+
+DEFAULT_CACHE_CONTROL = \
+    [(glob, 'max-age=31536000, immutable') for glob in FINGERPRINTED_GLOBS] \
+    + [('*.html', 'max-age=300, must-revalidate')]
+"""``(glob, Cache-Control)`` rules for fingerprinted sites: fingerprinted
+assets are immutable, and HTML pages are revalidated after five minutes.
+"""
+
+_FINGERPRINTED_RE = re.compile(
+    r'\.[0-9a-f]{{{0:d}}}(\.[^./]+)?$'.format(HASH_LENGTH))
+
+_HTML_REF_RE = re.compile(
+    r'''((?:href|src)\s*=\s*)(["'])([^"']+)\2''', re.IGNORECASE)
+
+_CSS_REF_RE = re.compile(r'''(url\(\s*)(["']?)([^"')]+)\2(\s*\))''')
+
+
+def fingerprinted_name(filename, digest):
+    """Insert a content digest into a file name, before its extension."""
+    root, ext = os.path.splitext(filename)
+    return '{0}.{1}{2}'.format(root, digest[:HASH_LENGTH], ext)
+
+
+class AssetFingerprinter(object):
+    """Post-build stage that fingerprints static assets and rewrites the
+    references to them.
+
+    Parameters
+    ----------
+    static_dir : str, optional
+        Directory of assets, relative to the HTML root.
+    """
+    name = 'fingerprint'
+    """Name of the pipeline phase that runs this stage."""
+
+    def __init__(self, static_dir='_static'):
+        super().__init__()
+        self.static_dir = static_dir
+
+    @property
+    def settings(self):
+        """Configuration that determines the output of this stage, for
+        the build cache's key.
+        """
+        return {'static_dir': self.static_dir}
+
+    def __call__(self, html_dir):
+        """Fingerprint the assets of a built HTML site.
+
+        Returns
+        -------
+        fingerprinted : dict
+            Fingerprinted paths keyed by original path, both relative to
+            ``html_dir`` with ``/`` separators.
+        """
+        start = time.perf_counter()
+        assets = []
+        stylesheets = []
+        for rootdir, dirnames, filenames in \
+                os.walk(os.path.join(html_dir, self.static_dir)):
+            for filename in filenames:
+                if filename.startswith('.') \
+                        or _FINGERPRINTED_RE.search(filename):
+                    continue
+                rel_path = os.path.relpath(os.path.join(rootdir, filename),
+                                           html_dir).replace(os.sep, '/')
+                if filename.endswith('.css'):
+                    stylesheets.append(rel_path)
+                else:
+                    assets.append(rel_path)
+
+        mapping = {}
+        for rel_path in assets:
+            with open(os.path.join(html_dir, rel_path), 'rb') as f:
+                content = f.read()
+            mapping[rel_path] = self._write_copy(html_dir, rel_path,
+                                                 content)
+        # Stylesheets are hashed after their references are rewritten, so a
+        # changed font or image also changes the stylesheet's name
+        css_mapping = {}
+        for rel_path in stylesheets:
+            with open(os.path.join(html_dir, rel_path), 'rb') as f:
+                text = f.read().decode('utf-8', 'surrogateescape')
+            text = self._rewrite(_CSS_REF_RE, text, rel_path, mapping)
+            content = text.encode('utf-8', 'surrogateescape')
+            css_mapping[rel_path] = self._write_copy(html_dir, rel_path,
+                                                     content)
+        mapping.update(css_mapping)
+
+        pages = 0
+        for rootdir, dirnames, filenames in os.walk(html_dir):
+            for filename in filenames:
+                if filename.endswith('.html'):
+                    path = os.path.join(rootdir, filename)
+                    if self._rewrite_page(html_dir, path, mapping):
+                        pages += 1
+        log.info('Fingerprinted %d assets and rewrote %d pages in %.2f s',
+                 len(mapping), pages, time.perf_counter() - start)
+        return mapping
+
+    def _write_copy(self, html_dir, rel_path, content):
+        digest = hashlib.sha256(content).hexdigest()
+        new_rel_path = posixpath.join(
+            posixpath.dirname(rel_path),
+            fingerprinted_name(posixpath.basename(rel_path), digest))
+        path = os.path.join(html_dir, rel_path)
+        new_path = os.path.join(html_dir, new_rel_path)
+        if not os.path.exists(new_path):
+            # Not a hard link: incremental builds rewrite the original in
+            # place, which would change the content of the immutable copy
+            write_atomic(new_path, content, prefix='.fingerprint-',
+                         mode_from=path)
+        return new_rel_path
+
+    def _rewrite_page(self, html_dir, path, mapping):
+        with open(path, 'rb') as f:
+            original = f.read()
+        rel_path = os.path.relpath(path, html_dir).replace(os.sep, '/')
+        text = original.decode('utf-8', 'surrogateescape')
+        text = self._rewrite(_HTML_REF_RE, text, rel_path, mapping)
+        content = text.encode('utf-8', 'surrogateescape')
+        if content == original:
+            return False
+        write_atomic(path, content, prefix='.fingerprint-', mode_from=path)
+        return True
+
+    @staticmethod
+    def _rewrite(regex, text, rel_path, mapping):
+        """Point the references matched by ``regex`` in a file at
+        fingerprinted copies. The reference is the regex's third group.
+        """
+        base_dir = posixpath.dirname(rel_path)
+
+        def replace(match):
+            url = match.group(3)
+            parts = urlsplit(url)
+            if parts.scheme or parts.netloc or not parts.path \
+                    or parts.path.startswith('/'):
+                return match.group(0)
+            target = posixpath.normpath(posixpath.join(base_dir, parts.path))
+            if target not in mapping:
+                return match.group(0)
+            new_url = posixpath.join(posixpath.dirname(parts.path),
+                                     posixpath.basename(mapping[target]))
+            new_url += url[len(parts.path):]  # query and fragment
+            return match.group(0).replace(url, new_url, 1)
+
+        return regex.sub(replace, text)
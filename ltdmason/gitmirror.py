@@ -0,0 +1,75 @@
+"""Local bare mirrors of Git repositories, used to speed up repeated clones.
+"""
+
+import hashlib
+import logging
+import os
+import threading
+from io import BytesIO
+from urllib.parse import urlparse
+
+import sh
+
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+
+class GitMirrorCache(object):
+    """A directory of ``git clone --mirror`` repositories.
+
+    Clones that reference a mirror (``git clone --reference``) only need to
+    fetch objects that the mirror lacks, which makes repeated clones of the
+    same documentation repository nearly free.
+
+    Parameters
+    ----------
+    mirror_dir : str
+        Directory where mirrors are stored. It is created if necessary.
+    """
+    def __init__(self, mirror_dir):
+        super().__init__()
+        self.mirror_dir = os.path.abspath(mirror_dir)
+        if not os.path.isdir(self.mirror_dir):
+            os.makedirs(self.mirror_dir)
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+    def mirror_path(self, url):
+        """Path of the mirror for a repository URL (`str`)."""
+        name = os.path.splitext(urlparse(url).path)[0].split('/')[-1]
+        digest = hashlib.sha1(url.encode('utf-8')).hexdigest()[:12]
+        return os.path.join(self.mirror_dir,
+                            '{0}-{1}.git'.format(name, digest))
+
+    def _lock(self, url):
+        with self._locks_lock:
+            return self._locks.setdefault(url, threading.Lock())
+
+    def update(self, url):
+        """Create or fetch the mirror of a repository.
+
+        Parameters
+        ----------
+        url : str
+            Git URL of the repository.
+
+        Returns
+        -------
+        path : str
+            Path of the up-to-date mirror.
+        """
+        path = self.mirror_path(url)
+        out_log = BytesIO()
+        err_log = BytesIO()
+        with self._lock(url):
+            if os.path.isdir(path):
+                log.debug('Updating mirror %s', path)
+                sh.git('remote', 'update', '--prune', _cwd=path,
+                       _out=out_log, _err=err_log)
+            else:
+                log.debug('Creating mirror of %s at %s', url, path)
+                sh.git.clone('--mirror', url, path,
+                             _out=out_log, _err=err_log)
+        log.debug(out_log.getvalue())
+        log.debug(err_log.getvalue())
+        return path
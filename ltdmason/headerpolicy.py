@@ -0,0 +1,243 @@
+"""Per-path HTTP headers for uploaded objects.
+
+A :class:`HeaderPolicy` decides the Content-Type, Cache-Control,
+Content-Encoding and extra ``x-amz-meta-*`` metadata of each uploaded file
+from an ordered list of :class:`HeaderRule` objects. Rules match glob
+patterns against paths relative to the site root, and for each header the
+first matching rule that sets it wins. Files that no rule gives a
+Content-Type get one from their extension, using :data:`EXTRA_TYPES` in
+addition to the types known to :mod:`mimetypes`.
+
+Policies can be loaded from YAML files (see :func:`load_policy`)::
+
+   types:
+     .bib: text/x-bibtex
+   rules:
+     - glob: '*.html'
+       cache_control: 'max-age=300, must-revalidate'
+     - glob: '_static/*.svgz'
+       content_type: image/svg+xml
+       content_encoding: gzip
+     - glob: 'downloads/*'
+       metadata:
+         content-disposition: attachment
+
+The policy is evaluated for every uploaded file, so matching is
+precompiled: rules whose glob is a plain ``*.ext`` suffix are looked up by
+extension, and only the remaining rules are matched as regular expressions.
+"""
+
+import fnmatch
+import mimetypes
+import posixpath
+import re
+
+import ruamel.yaml
+
+EXTRA_TYPES = {
+    '.eot': 'application/vnd.ms-fontobject',
+    '.ipynb': 'application/x-ipynb+json',
+    '.js': 'text/javascript',
+    '.json': 'application/json',
+    '.map': 'application/json',
+    '.mjs': 'text/javascript',
+    '.otf': 'font/otf',
+    '.svg': 'image/svg+xml',
+    '.ttf': 'font/ttf',
+    '.wasm': 'application/wasm',
+    '.webmanifest': 'application/manifest+json',
+    '.webp': 'image/webp',
+    '.woff': 'font/woff',
+    '.woff2': 'font/woff2',
+    '.yaml': 'application/yaml',
+    '.yml': 'application/yaml',
+}
+"""Content types of extensions that :mod:`mimetypes` misses or gets wrong
+on some platforms.
+"""
+
+_SUFFIX_GLOB_RE = re.compile(r'^\*(\.[^*?\[\]/]+)$')
+
+_RULE_KEYS = {'glob', 'content_type', 'cache_control', 'content_encoding',
+              'metadata'}
+
+
+class HeaderRule(object):
+    """Headers for the files whose path matches a glob.
+
+    Parameters
+    ----------
+    glob : str
+        Shell-style pattern matched against paths relative to the site
+        root, such as ``'*.html'`` or ``'_static/fonts/*'``. ``*`` also
+        matches ``/``.
+    content_type, cache_control, content_encoding : str, optional
+        Values of the Content-Type, Cache-Control and Content-Encoding
+        headers. `None` leaves the header to later rules or the default.
+    metadata : dict, optional
+        Extra ``x-amz-meta-*`` metadata.
+    """
+    def __init__(self, glob, content_type=None, cache_control=None,
+                 content_encoding=None, metadata=None):
+        super().__init__()
+        self.glob = glob
+        self.content_type = content_type
+        self.cache_control = cache_control
+        self.content_encoding = content_encoding
+        self.metadata = dict(metadata) if metadata else {}
+
+    def __repr__(self):
+        return 'HeaderRule({0!r})'.format(self.glob)
+
+
+class HeaderPolicy(object):
+    """Ordered header rules with precompiled matching.
+
+    Parameters
+    ----------
+    rules : list of :class:`HeaderRule`, optional
+        Rules, in order of precedence.
+    types : dict, optional
+        Content types keyed by extension (including the dot), used in
+        addition to :data:`EXTRA_TYPES` and :mod:`mimetypes`.
+    """
+    def __init__(self, rules=None, types=None):
+        super().__init__()
+        self.rules = list(rules) if rules else []
+        self.types = dict(EXTRA_TYPES)
+        if types:
+            self.types.update({ext.lower(): t for ext, t in types.items()})
+
+        # Suffix rules are found by a dict lookup; others by regex
+        self._suffix_rules = {}
+        self._regex_rules = []
+        for index, rule in enumerate(self.rules):
+            match = _SUFFIX_GLOB_RE.match(rule.glob)
+            if match is not None:
+                self._suffix_rules.setdefault(match.group(1), []).append(
+                    (index, rule))
+            else:
+                self._regex_rules.append(
+                    (index, re.compile(fnmatch.translate(rule.glob)), rule))
+
+    def with_rules(self, rules):
+        """A new policy with ``rules`` taking precedence over this one's."""
+        return HeaderPolicy(list(rules) + self.rules, types=self.types)
+
+    def matching_rules(self, rel_path):
+        """Rules that apply to a path, in order of precedence."""
+        matches = []
+        basename = posixpath.basename(rel_path)
+        # A '*.tar.gz' glob is a suffix of '.gz' and '.tar.gz' paths
+        dot = basename.find('.')
+        while dot != -1:
+            matches.extend(self._suffix_rules.get(basename[dot:], []))
+            dot = basename.find('.', dot + 1)
+        matches.extend((index, rule) for index, regex, rule
+                       in self._regex_rules if regex.match(rel_path))
+        matches.sort(key=lambda match: match[0])
+        return [rule for _, rule in matches]
+
+    def guess_type(self, path):
+        """Guess a Content-Type from a path's extension, or `None`."""
+        ext = posixpath.splitext(path)[1].lower()
+        if ext in self.types:
+            return self.types[ext]
+        # guess_type returns None if it cannot detect a type
+        content_type, _ = mimetypes.guess_type(path, strict=False)
+        return content_type
+
+    def headers_for(self, rel_path):
+        """Headers of a file.
+
+        Returns
+        -------
+        headers : dict
+            ``content_type`` (from the rules or the extension),
+            ``cache_control`` and ``content_encoding`` (`None` unless a rule
+            sets them) and ``metadata`` (`dict`) keys.
+        """
+        headers = {'content_type': None, 'cache_control': None,
+                   'content_encoding': None, 'metadata': {}}
+        for rule in self.matching_rules(rel_path):
+            for key in ('content_type', 'cache_control', 'content_encoding'):
+                if headers[key] is None:
+                    headers[key] = getattr(rule, key)
+            for key, value in rule.metadata.items():
+                headers['metadata'].setdefault(key, value)
+        if headers['content_type'] is None:
+            headers['content_type'] = self.guess_type(rel_path)
+        return headers
+
+    def extra_args(self, rel_path, metadata=None, acl=None,
+                   cache_control=None):
+        """boto3 ``ExtraArgs`` for uploading a file.
+
+        Parameters
+        ----------
+        rel_path : str
+            Path of the file relative to the site root.
+        metadata : dict, optional
+            Metadata of all files, such as the surrogate key. Rules can add
+            keys but not override these.
+        acl : str, optional
+            Pre-canned ACL.
+        cache_control : str, optional
+            Cache-Control header of files that no rule gives one.
+        """
+        headers = self.headers_for(rel_path)
+        extra_args = {}
+        if acl is not None:
+            extra_args['ACL'] = acl
+        if metadata or headers['metadata']:
+            merged = dict(headers['metadata'])
+            merged.update(metadata or {})
+            extra_args['Metadata'] = merged
+        if headers['cache_control'] is not None:
+            extra_args['CacheControl'] = headers['cache_control']
+        elif cache_control is not None:
+            extra_args['CacheControl'] = cache_control
+        if headers['content_type'] is not None:
+            extra_args['ContentType'] = headers['content_type']
+        if headers['content_encoding'] is not None:
+            extra_args['ContentEncoding'] = headers['content_encoding']
+        return extra_args
+
+
+def make_policy(data):
+    """Create a :class:`HeaderPolicy` from a ``{'types', 'rules'}`` mapping.
+
+    Raises
+    ------
+    ValueError
+        Raised if the policy is malformed.
+    """
+    if data is None:
+        data = {}
+    if not isinstance(data, dict):
+        raise ValueError('A header policy must be a mapping')
+    unknown = set(data) - {'types', 'rules'}
+    if unknown:
+        raise ValueError('Unknown header policy keys: {0}'.format(
+            ', '.join(sorted(unknown))))
+    rules = []
+    for i, rule_data in enumerate(data.get('rules') or []):
+        if not isinstance(rule_data, dict) or 'glob' not in rule_data:
+            raise ValueError('Header rule {0:d} needs a glob'.format(i))
+        unknown = set(rule_data) - _RULE_KEYS
+        if unknown:
+            raise ValueError('Unknown keys in header rule {0:d}: {1}'.format(
+                i, ', '.join(sorted(unknown))))
+        rules.append(HeaderRule(**rule_data))
+    types = data.get('types') or {}
+    for ext in types:
+        if not ext.startswith('.'):
+            raise ValueError('Extension {0!r} must start with a '
+                             'dot'.format(ext))
+    return HeaderPolicy(rules, types=types)
+
+
+def load_policy(path):
+    """Load a :class:`HeaderPolicy` from a YAML file."""
+    with open(path, encoding='utf-8') as f:
+        return make_policy(ruamel.yaml.YAML(typ='safe').load(f))
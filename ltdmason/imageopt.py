@@ -0,0 +1,301 @@
+"""Lossless optimization of the images in built HTML sites.
+
+Sphinx copies figures into ``_images/`` and ``_static/`` verbatim, and they
+are usually most of a site's bytes. An :class:`ImageOptimizer` recompresses
+them in a pool of worker processes:
+
+- PNG files are optimized by ``oxipng`` or ``optipng`` if either is
+  installed, and otherwise by recompressing their image data with maximum
+  zlib compression, which leaves the pixels and all other chunks untouched.
+- JPEG files are optimized by ``jpegtran`` (Huffman table optimization
+  only), if installed.
+
+SVG files are left alone: the default preset of ``svgo`` rounds coordinates
+and removes elements, which isn't lossless.
+
+An optimized file only replaces the original if it is smaller. With a cache
+directory, results are stored by content hash, so each unique image is only
+optimized once across builds.
+"""
+
+import hashlib
+import logging
+import multiprocessing
+import os
+import shutil
+import struct
+import subprocess
+import tempfile
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+from .fileutils import write_atomic
+
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+TOOLS = {
+    '.png': [
+        ['oxipng', '--quiet', '--opt', '2', '--out', '{output}', '{input}'],
+        ['optipng', '-quiet', '-o2', '-out', '{output}', '{input}'],
+    ],
+    '.jpg': [
+        ['jpegtran', '-copy', 'all', '-optimize', '-outfile', '{output}',
+         '{input}'],
+    ],
+}
+"""Command templates of external optimizers, in order of preference, keyed
+by file extension. The first installed tool for each extension is used.
+"""
+
+_EXTENSIONS = {'.png': '.png', '.jpg': '.jpg', '.jpeg': '.jpg'}
+
+_PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+def find_tools(tools=None):
+    """Find the installed optimizer for each extension.
+
+    Returns
+    -------
+    commands : dict
+        Command templates keyed by extension; extensions without an
+        installed tool are omitted.
+    """
+    if tools is None:
+        tools = TOOLS
+    commands = {}
+    for ext, templates in tools.items():
+        for template in templates:
+            if shutil.which(template[0]) is not None:
+                commands[ext] = template
+                break
+    return commands
+
+
+class ImageOptimizer(object):
+    """Post-build stage that losslessly recompresses images in place.
+
+    Parameters
+    ----------
+    cache_dir : str, optional
+        Directory of optimized images, keyed by the content hash of the
+        original and by the optimizers in use.
+    processes : int, optional
+        Number of worker processes. Defaults to the number of CPUs.
+    image_dirs : list of str, optional
+        Directories, relative to the HTML root, whose images are optimized.
+    tools : dict, optional
+        Command templates of external optimizers (see :data:`TOOLS`).
+    """
+    name = 'optimize-images'
+    """Name of the pipeline phase that runs this stage."""
+
+    def __init__(self, cache_dir=None, processes=None,
+                 image_dirs=('_images', '_static'), tools=None):
+        super().__init__()
+        self.commands = find_tools(tools)
+        self.processes = processes
+        self.image_dirs = list(image_dirs)
+        if cache_dir is not None:
+            # Results depend on the optimizers, so each set has its own dir
+            key = hashlib.sha256(
+                repr(sorted(self.commands.items())).encode('utf-8'))
+            cache_dir = os.path.join(os.path.abspath(cache_dir),
+                                     key.hexdigest()[:12])
+            os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+
+    @property
+    def settings(self):
+        """Configuration that determines the output of this stage, for
+        the build cache's key.
+        """
+        return {'commands': self.commands, 'image_dirs': self.image_dirs}
+
+    def __call__(self, html_dir):
+        """Optimize the images of a built HTML site.
+
+        Returns
+        -------
+        stats : dict
+            Numbers of ``'images'``, ``'optimized'`` (smaller) images and
+            ``'cached'`` results, ``'bytes_before'`` and ``'bytes_after'``,
+            and the elapsed ``'seconds'``.
+        """
+        start = time.perf_counter()
+        paths = []
+        for image_dir in self.image_dirs:
+            for rootdir, dirnames, filenames in \
+                    os.walk(os.path.join(html_dir, image_dir)):
+                for filename in filenames:
+                    ext = os.path.splitext(filename)[1].lower()
+                    if ext in _EXTENSIONS:
+                        paths.append(os.path.join(rootdir, filename))
+
+        stats = {'images': len(paths), 'optimized': 0, 'cached': 0,
+                 'bytes_before': 0, 'bytes_after': 0}
+        if paths:
+            # forkserver, since forking a process with running threads
+            # (such as the pipeline's) isn't safe
+            context = multiprocessing.get_context('forkserver')
+            with ProcessPoolExecutor(max_workers=self.processes,
+                                     mp_context=context) as executor:
+                results = executor.map(
+                    optimize_image, paths,
+                    [self.commands] * len(paths),
+                    [self.cache_dir] * len(paths),
+                    chunksize=16)
+                for before, after, cached in results:
+                    stats['bytes_before'] += before
+                    stats['bytes_after'] += after
+                    stats['optimized'] += after < before
+                    stats['cached'] += cached
+        stats['seconds'] = time.perf_counter() - start
+        log.info('Optimized %d of %d images (%d cached), saving %d bytes '
+                 'in %.1f s', stats['optimized'], stats['images'],
+                 stats['cached'], stats['bytes_before'] - stats['bytes_after'],
+                 stats['seconds'])
+        return stats
+
+
+def optimize_image(path, commands, cache_dir=None):
+    """Losslessly optimize an image file in place.
+
+    This runs in the worker processes of :class:`ImageOptimizer`.
+
+    Parameters
+    ----------
+    path : str
+        Path of a PNG or JPEG file.
+    commands : dict
+        Command templates of installed optimizers keyed by extension (see
+        :func:`find_tools`).
+    cache_dir : str, optional
+        Cache directory of optimized images.
+
+    Returns
+    -------
+    bytes_before : int
+        Size of the original file.
+    bytes_after : int
+        Size of the file after optimization.
+    cached : bool
+        `True` if the result came from the cache.
+    """
+    ext = _EXTENSIONS[os.path.splitext(path)[1].lower()]
+    with open(path, 'rb') as f:
+        original = f.read()
+
+    cached = False
+    cache_path = None
+    if cache_dir is not None:
+        digest = hashlib.sha256(original).hexdigest()
+        cache_path = os.path.join(cache_dir, digest + ext)
+        unchanged_path = os.path.join(cache_dir, digest + '.unchanged')
+        if os.path.exists(unchanged_path):
+            return len(original), len(original), True
+        try:
+            with open(cache_path, 'rb') as f:
+                optimized = f.read()
+            cached = True
+        except FileNotFoundError:
+            pass
+
+    if not cached:
+        try:
+            optimized = _optimize(original, ext, commands)
+        except Exception as e:
+            log.warning('Could not optimize %s: %s', path, e)
+            # Not cached, since the failure may be transient
+            return len(original), len(original), False
+        if cache_path is not None:
+            if len(optimized) < len(original):
+                write_atomic(cache_path, optimized, prefix='.imageopt-')
+                # Optimized images can't be improved any further
+                write_atomic(os.path.join(
+                    cache_dir,
+                    hashlib.sha256(optimized).hexdigest() + '.unchanged'),
+                    b'', prefix='.imageopt-')
+            else:
+                write_atomic(unchanged_path, b'', prefix='.imageopt-')
+
+    if len(optimized) >= len(original):
+        return len(original), len(original), cached
+    write_atomic(path, optimized, prefix='.imageopt-', mode_from=path)
+    return len(original), len(optimized), cached
+
+
+def _optimize(data, ext, commands):
+    if ext in commands:
+        return _run_tool(data, ext, commands[ext])
+    if ext == '.png':
+        return recompress_png(data)
+    return data
+
+
+def _run_tool(data, ext, template):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        input_path = os.path.join(tmp_dir, 'input' + ext)
+        output_path = os.path.join(tmp_dir, 'output' + ext)
+        with open(input_path, 'wb') as f:
+            f.write(data)
+        command = [arg.format(input=input_path, output=output_path)
+                   for arg in template]
+        subprocess.run(command, check=True, stdin=subprocess.DEVNULL,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        if not os.path.exists(output_path):
+            # Some tools don't write an output if they can't improve
+            return data
+        with open(output_path, 'rb') as f:
+            return f.read()
+
+
+def recompress_png(data):
+    """Recompress the image data of a PNG with maximum zlib compression.
+
+    The decompressed image data, and so the pixels, are unchanged, and all
+    other chunks are kept as they are.
+
+    Returns
+    -------
+    data : bytes
+        The recompressed PNG, or the original if it isn't smaller or isn't
+        a valid PNG.
+    """
+    if not data.startswith(_PNG_SIGNATURE):
+        return data
+    chunks = []
+    pos = len(_PNG_SIGNATURE)
+    try:
+        while pos < len(data):
+            length, chunk_type = struct.unpack('>I4s', data[pos:pos + 8])
+            chunks.append((chunk_type, data[pos + 8:pos + 8 + length]))
+            pos += length + 12
+        idat = b''.join(body for chunk_type, body in chunks
+                        if chunk_type == b'IDAT')
+        raw = zlib.decompress(idat)
+    except (struct.error, zlib.error):
+        return data
+
+    best = idat
+    for strategy in (zlib.Z_DEFAULT_STRATEGY, zlib.Z_FILTERED):
+        compressor = zlib.compressobj(9, zlib.DEFLATED, 15, 9, strategy)
+        candidate = compressor.compress(raw) + compressor.flush()
+        if len(candidate) < len(best):
+            best = candidate
+    if best is idat:
+        return data
+
+    parts = [_PNG_SIGNATURE]
+    idat_written = False
+    for chunk_type, body in chunks:
+        if chunk_type == b'IDAT':
+            if idat_written:
+                continue
+            body = best
+            idat_written = True
+        parts.append(struct.pack('>I4s', len(body), chunk_type) + body +
+                     struct.pack('>I', zlib.crc32(chunk_type + body)))
+    return b''.join(parts)
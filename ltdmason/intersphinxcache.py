@@ -0,0 +1,286 @@
+"""Shared, local cache of intersphinx inventories.
+
+Doc repos that use ``sphinx.ext.intersphinx`` fetch the ``objects.inv``
+inventories of other projects at the start of every fresh Sphinx build, and a
+slow or unreachable remote stalls the build. An :class:`InventoryCache` keeps
+those inventories in a directory shared by all builds:
+
+- inventories younger than the cache's TTL are served without any network
+  access;
+- stale inventories are fetched again, but served from the cache if the
+  remote can't be reached;
+- in offline mode the network is never used.
+
+Builds use the cache through :func:`install`, which routes the inventory
+requests that Sphinx makes through :mod:`sphinx.util.requests` to the cache.
+The cache can be seeded and refreshed out of band with the
+``ltd-mason-intersphinx`` command.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+
+import requests
+
+from .fileutils import write_atomic
+
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+DEFAULT_TTL = 86400.
+"""Default age, in seconds, after which inventories are fetched again."""
+
+
+class InventoryCache(object):
+    """Directory of cached intersphinx inventories.
+
+    Each inventory is stored as ``<sha256 of URL>.inv`` with a ``.json``
+    sidecar recording its URL and when it was fetched. Instances are
+    picklable, so they can be passed to Sphinx worker processes.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Cache directory. It is created if necessary.
+    ttl : float, optional
+        Age, in seconds, after which a cached inventory is fetched again.
+    offline : bool, optional
+        Never use the network; only serve cached inventories, whatever their
+        age.
+    """
+    def __init__(self, cache_dir, ttl=DEFAULT_TTL, offline=False):
+        super().__init__()
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.ttl = ttl
+        self.offline = offline
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    def _path(self, url, extension):
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, key + extension)
+
+    def _write(self, path, data):
+        # Atomic, since several builds can share the cache
+        write_atomic(path, data)
+
+    def lookup(self, url):
+        """Look up a cached inventory.
+
+        Returns
+        -------
+        entry : dict or `None`
+            ``{'url', 'final_url', 'fetched', 'data'}``, where ``final_url``
+            is the URL after redirects and ``fetched`` is a Unix timestamp,
+            or `None` if ``url`` isn't cached.
+        """
+        try:
+            with open(self._path(url, '.json'), encoding='utf-8') as f:
+                entry = json.load(f)
+            with open(self._path(url, '.inv'), 'rb') as f:
+                entry['data'] = f.read()
+        except (OSError, ValueError):
+            return None
+        return entry
+
+    def store(self, url, data, final_url=None):
+        """Store an inventory in the cache.
+
+        Parameters
+        ----------
+        url : str
+            URL of the inventory.
+        data : bytes
+            Content of the ``objects.inv`` file.
+        final_url : str, optional
+            URL after redirects, if different from ``url``.
+        """
+        self._write(self._path(url, '.inv'), data)
+        entry = {'url': url, 'final_url': final_url or url,
+                 'fetched': time.time()}
+        self._write(self._path(url, '.json'),
+                    json.dumps(entry, sort_keys=True).encode('utf-8'))
+
+    def urls(self):
+        """URLs of all cached inventories (`list` of `str`)."""
+        urls = []
+        for entry in os.scandir(self.cache_dir):
+            if not entry.name.endswith('.json'):
+                continue
+            try:
+                with open(entry.path, encoding='utf-8') as f:
+                    urls.append(json.load(f)['url'])
+            except (OSError, ValueError, KeyError):
+                continue
+        return sorted(urls)
+
+    def is_fresh(self, entry):
+        """`True` if a cached entry is younger than the TTL."""
+        return time.time() - entry['fetched'] < self.ttl
+
+    def get(self, url, fetch=None):
+        """Get an inventory, fetching it if it isn't cached or is stale.
+
+        Parameters
+        ----------
+        url : str
+            URL of the inventory.
+        fetch : callable, optional
+            Called with ``url`` to download the inventory, returning a
+            ``requests.Response``. Defaults to :func:`requests.get`.
+
+        Returns
+        -------
+        data : bytes
+            Content of the inventory.
+        final_url : str
+            URL of the inventory after redirects.
+
+        Raises
+        ------
+        InventoryUnavailable
+            Raised if the inventory isn't cached and can't be fetched
+            (always the case for uncached inventories in offline mode).
+        """
+        entry = self.lookup(url)
+        if entry is not None and (self.offline or self.is_fresh(entry)):
+            return entry['data'], entry['final_url']
+        if self.offline:
+            raise InventoryUnavailable(
+                'Inventory {0} is not cached and ltd-mason is '
+                'offline'.format(url))
+
+        if fetch is None:
+            fetch = _fetch
+        try:
+            response = fetch(url)
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            if entry is not None:
+                log.warning('Could not refresh inventory %s (%s); using '
+                            'the cached copy', url, e)
+                return entry['data'], entry['final_url']
+            raise InventoryUnavailable(
+                'Could not fetch inventory {0}: {1}'.format(url, e))
+        self.store(url, response.content, final_url=response.url)
+        log.debug('Cached inventory %s', url)
+        return response.content, response.url
+
+    def refresh(self, urls=None):
+        """Fetch inventories again, regardless of their age.
+
+        Parameters
+        ----------
+        urls : list of str, optional
+            URLs to refresh (or add to the cache). Defaults to all cached
+            URLs.
+
+        Returns
+        -------
+        failed : list of str
+            URLs that could not be fetched; their cached copies are kept.
+        """
+        if self.offline:
+            raise InventoryUnavailable('Cannot refresh while offline')
+        failed = []
+        for url in (self.urls() if urls is None else urls):
+            try:
+                response = _fetch(url)
+                response.raise_for_status()
+            except requests.exceptions.RequestException as e:
+                log.warning('Could not refresh inventory %s: %s', url, e)
+                failed.append(url)
+                continue
+            self.store(url, response.content, final_url=response.url)
+            log.info('Refreshed inventory %s', url)
+        return failed
+
+    def seed(self, url, path):
+        """Pre-seed the cache with a local copy of an inventory.
+
+        Parameters
+        ----------
+        url : str
+            URL that Sphinx fetches the inventory from.
+        path : str
+            Path of a local ``objects.inv`` file.
+        """
+        with open(path, 'rb') as f:
+            self.store(url, f.read())
+
+
+def _fetch(url, **kwargs):
+    kwargs.setdefault('timeout', 30.)
+    return requests.get(url, **kwargs)
+
+
+def is_inventory_url(url):
+    """`True` if ``url`` is a remote intersphinx inventory."""
+    path = url.split('?', 1)[0].split('#', 1)[0]
+    return '://' in url and path.endswith('.inv')
+
+
+def install(cache):
+    """Serve the intersphinx inventories of Sphinx builds in this process
+    from a cache.
+
+    This wraps :func:`sphinx.util.requests.get`, which intersphinx uses to
+    download inventories; other requests are passed through. It is meant to
+    be called in a process dedicated to a Sphinx build.
+
+    Parameters
+    ----------
+    cache : :class:`InventoryCache`
+        The inventory cache.
+    """
+    from sphinx.util import requests as sphinx_requests
+
+    original_get = getattr(sphinx_requests.get, '__wrapped__',
+                           sphinx_requests.get)
+
+    def get(url, **kwargs):
+        if not is_inventory_url(url):
+            return original_get(url, **kwargs)
+        try:
+            data, final_url = cache.get(
+                url, fetch=lambda u: original_get(u, **kwargs))
+        except InventoryUnavailable as e:
+            # Sphinx reports this as an unreachable inventory and carries on
+            raise requests.exceptions.ConnectionError(str(e))
+        return _cached_response(url, data, final_url)
+
+    get.__wrapped__ = original_get
+    sphinx_requests.get = get
+
+
+class _CachedRaw(object):
+    """File-like ``Response.raw`` for code that streams the response."""
+    def __init__(self, data):
+        super().__init__()
+        self._offset = 0
+        self._data = data
+
+    def read(self, amt=None, decode_content=False):
+        if amt is None:
+            amt = len(self._data) - self._offset
+        chunk = self._data[self._offset:self._offset + amt]
+        self._offset += len(chunk)
+        return chunk
+
+
+def _cached_response(url, data, final_url):
+    response = requests.models.Response()
+    response.status_code = 200
+    response.url = final_url
+    response._content = data
+    response.raw = _CachedRaw(data)
+    response.request = requests.Request('GET', url).prepare()
+    return response
+
+
+class InventoryUnavailable(Exception):
+    """An inventory is neither cached nor fetchable."""
+    pass
@@ -0,0 +1,87 @@
+"""Command line interface to manage the intersphinx inventory cache."""
+
+import argparse
+import datetime
+import logging
+import os
+import sys
+import textwrap
+
+from .intersphinxcache import InventoryCache
+
+
+def run():
+    """Entrypoint for the ltd-mason-intersphinx command."""
+    args = parse_args()
+
+    if args.verbose:
+        logging.basicConfig(level=logging.DEBUG)
+    else:
+        logging.basicConfig(level=logging.INFO)
+
+    cache = InventoryCache(args.cache_dir)
+
+    if args.command == 'seed':
+        cache.seed(args.url, args.path)
+    elif args.command == 'refresh':
+        failed = cache.refresh(urls=args.urls or None)
+        if failed:
+            sys.exit(1)
+    elif args.command == 'list':
+        for url in cache.urls():
+            entry = cache.lookup(url)
+            fetched = datetime.datetime.fromtimestamp(entry['fetched'])
+            print('{0}  {1}'.format(fetched.isoformat(' ', 'seconds'), url))
+
+
+def parse_args():
+    """Create an ``argparse.ArgumentParser`` instance that defines the
+    command line interface for ltd-mason-intersphinx.
+    """
+    parser = argparse.ArgumentParser(
+        prog='ltd-mason-intersphinx',
+        description=textwrap.dedent("""
+            Manage the intersphinx inventory cache used by ltd-mason and
+            ltd-mason-worker (--intersphinx-cache-dir).
+
+            ltd-mason-intersphinx seed URL objects.inv
+               Pre-seed the cache with a local copy of the inventory that
+               Sphinx fetches from URL.
+
+            ltd-mason-intersphinx refresh [URL ...]
+               Fetch inventories again, regardless of their age. By default
+               all cached inventories are refreshed. Run this out of band,
+               for example from cron, so builds never wait for inventories.
+
+            ltd-mason-intersphinx list
+               List cached inventories and when they were fetched.
+            """),
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog='See https://github.com/lsst-sqre/ltd-mason for more info.')
+    parser.add_argument(
+        '--cache-dir',
+        dest='cache_dir',
+        default=os.getenv('LTD_MASON_INTERSPHINX_CACHE'),
+        help='Directory of the inventory cache. Defaults to '
+             '$LTD_MASON_INTERSPHINX_CACHE.')
+    parser.add_argument(
+        '--verbose',
+        dest='verbose',
+        default=False,
+        action='store_true',
+        help='Full logging of debug messages')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+    seed_parser = subparsers.add_parser('seed', help='Seed an inventory.')
+    seed_parser.add_argument('url', help='URL of the inventory.')
+    seed_parser.add_argument('path', help='Local objects.inv file.')
+    refresh_parser = subparsers.add_parser('refresh',
+                                           help='Refresh inventories.')
+    refresh_parser.add_argument('urls', nargs='*',
+                                help='URLs to refresh (default: all).')
+    subparsers.add_parser('list', help='List cached inventories.')
+    args = parser.parse_args()
+    if args.cache_dir is None:
+        parser.error('--cache-dir or $LTD_MASON_INTERSPHINX_CACHE is '
+                     'required')
+    return args
@@ -34,6 +34,16 @@ class BaseManifest(object):
         """
         return
 
+    @property
+    def doc_repo_clone_options(self):
+        """Options for cloning the documentation repository (:class:`dict`).
+
+        Possible keys are ``'depth'`` (shallow clone depth), ``'filter'``
+        (partial clone filter, like ``'blob:none'``) and ``'sparse'`` (list of
+        sparse-checkout patterns). An empty dict means a full clone.
+        """
+        return {}
+
     @property
     def doc_repo_name(self):
         """Name of the product's Git documentation repository (:class:`str`).
@@ -123,6 +133,20 @@ class Manifest(BaseManifest):
         """
         return self.data['doc_repo']['ref']
 
+    @property
+    def doc_repo_clone_options(self):
+        """Options for cloning the documentation repository (:class:`dict`),
+        from the optional ``doc_repo.clone`` field.
+
+        Possible keys are ``'depth'`` (shallow clone depth), ``'filter'``
+        (partial clone filter, like ``'blob:none'``) and ``'sparse'`` (list of
+        sparse-checkout patterns). An empty dict means a full clone.
+        """
+        if 'clone' in self.data['doc_repo']:
+            return dict(self.data['doc_repo']['clone'])
+        else:
+            return {}
+
     @property
     def product_name(self):
         """Name of the documentation product."""
@@ -0,0 +1,179 @@
+"""Normalization of volatile fragments in built HTML sites.
+
+Sphinx output contains fragments that change on every build even when the
+documentation doesn't, such as the "Last updated on" date in page footers.
+Those fragments make every file look changed to byte- or hash-based change
+detection, such as ``s3upload.upload(skip_unchanged=True)``. An
+:class:`HTMLNormalizer` strips or stabilizes them with a set of
+:class:`NormalizationRule` regular expression substitutions, after the
+Sphinx build and before the site is cached or uploaded.
+
+Rules can be loaded from a YAML file (see :func:`load_rules`) that contains
+a list of rules like::
+
+   - glob: '*.html'
+     pattern: 'Last updated on [^<]*?\\.'
+     replacement: ''
+
+Sphinx's ``.buildinfo`` file is deliberately not normalized by the default
+rules since incremental builds use it to detect configuration changes.
+"""
+
+import fnmatch
+import logging
+import os
+import re
+import time
+
+import ruamel.yaml
+
+from .fileutils import write_atomic
+
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+DEFAULT_RULES = [
+    {'glob': '*.html',
+     'pattern': r'\s*Last updated on [^<]*?\.',
+     'replacement': ''},
+]
+"""Rules used when no rule file is given."""
+
+
+class NormalizationRule(object):
+    """A regular expression substitution applied to matching files.
+
+    Parameters
+    ----------
+    glob : str
+        Shell-style pattern matched against file paths relative to the HTML
+        root, such as ``'*.html'`` or ``'_static/*.js'``. ``*`` also
+        matches ``/``.
+    pattern : str
+        Regular expression of the volatile fragment.
+    replacement : str, optional
+        Replacement, which can refer to groups of ``pattern``.
+    """
+    def __init__(self, glob, pattern, replacement=''):
+        super().__init__()
+        self.glob = glob
+        self.pattern = re.compile(pattern)
+        self.replacement = replacement
+        self._glob_re = re.compile(fnmatch.translate(glob))
+
+    def __repr__(self):
+        return 'NormalizationRule({0!r}, {1!r}, {2!r})'.format(
+            self.glob, self.pattern.pattern, self.replacement)
+
+    def matches(self, rel_path):
+        """`True` if the rule applies to a path relative to the HTML root."""
+        return self._glob_re.match(rel_path) is not None
+
+    def apply(self, text):
+        """Apply the substitution to the content of a file (`str`)."""
+        return self.pattern.sub(self.replacement, text)
+
+
+def make_rules(rule_data):
+    """Create :class:`NormalizationRule` objects from a list of
+    ``{'glob', 'pattern', 'replacement'}`` mappings.
+
+    Raises
+    ------
+    ValueError
+        Raised if a rule is malformed.
+    """
+    rules = []
+    for i, data in enumerate(rule_data):
+        try:
+            rules.append(NormalizationRule(data['glob'], data['pattern'],
+                                           data.get('replacement', '')))
+        except (KeyError, TypeError, AttributeError, re.error) as e:
+            raise ValueError('Invalid normalization rule {0:d}: {1}'.format(
+                i, e))
+    return rules
+
+
+def load_rules(path):
+    """Load normalization rules from a YAML file.
+
+    Returns
+    -------
+    rules : list of :class:`NormalizationRule`
+    """
+    with open(path, encoding='utf-8') as f:
+        rule_data = ruamel.yaml.YAML(typ='safe').load(f)
+    if not isinstance(rule_data, list):
+        raise ValueError('{0} must contain a list of rules'.format(path))
+    return make_rules(rule_data)
+
+
+class HTMLNormalizer(object):
+    """Post-build stage that normalizes volatile fragments in place.
+
+    Files are only rewritten if a rule changed their content, and are
+    replaced atomically so concurrent readers (such as a streaming upload)
+    never see partial files.
+
+    Parameters
+    ----------
+    rules : list of :class:`NormalizationRule`, optional
+        Rules to apply. Defaults to :data:`DEFAULT_RULES`.
+    """
+    name = 'normalize'
+    """Name of the pipeline phase that runs this stage."""
+
+    def __init__(self, rules=None):
+        super().__init__()
+        if rules is None:
+            rules = make_rules(DEFAULT_RULES)
+        self.rules = rules
+
+    @property
+    def settings(self):
+        """Configuration that determines the output of this stage, for
+        the build cache's key.
+        """
+        return {'rules': [[rule.glob, rule.pattern.pattern, rule.replacement]
+                          for rule in self.rules]}
+
+    def __call__(self, html_dir):
+        """Normalize the files of a built HTML site.
+
+        Returns
+        -------
+        stats : dict
+            Numbers of ``'matched'`` files (that any rule applies to) and
+            ``'changed'`` files, and the elapsed ``'seconds'``.
+        """
+        start = time.perf_counter()
+        matched = 0
+        changed = 0
+        for rootdir, dirnames, filenames in os.walk(html_dir):
+            for filename in filenames:
+                path = os.path.join(rootdir, filename)
+                rel_path = os.path.relpath(path, html_dir)
+                rules = [r for r in self.rules if r.matches(rel_path)]
+                if not rules:
+                    continue
+                matched += 1
+                if self._normalize_file(path, rules):
+                    changed += 1
+        stats = {'matched': matched, 'changed': changed,
+                 'seconds': time.perf_counter() - start}
+        log.info('Normalized %d of %d files in %.2f s',
+                 stats['changed'], stats['matched'], stats['seconds'])
+        return stats
+
+    def _normalize_file(self, path, rules):
+        with open(path, 'rb') as f:
+            original = f.read()
+        # surrogateescape round-trips bytes that aren't valid UTF-8
+        text = original.decode('utf-8', 'surrogateescape')
+        for rule in rules:
+            text = rule.apply(text)
+        content = text.encode('utf-8', 'surrogateescape')
+        if content == original:
+            return False
+        write_atomic(path, content, prefix='.normalize-', mode_from=path)
+        return True
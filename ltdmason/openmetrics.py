@@ -0,0 +1,229 @@
+"""Build and upload metrics in the OpenMetrics text format.
+
+A :class:`BuildMetrics` adds up the :class:`ltdmason.runreport.RunReport`
+of each run into counters and gauges and writes them as an OpenMetrics text
+file, for example into the directory of node-exporter's textfile collector.
+``ltd-mason`` and ``ltd-mason-travis`` write the metrics of their run when
+they finish; ``ltd-mason-worker`` rewrites the file as jobs start and
+finish, so its counters cover every build since the worker started.
+
+All metrics have a ``command`` label, so that several commands can write to
+the same collector directory. Phase names are stripped of the product
+prefixes of batch builds to keep the number of series bounded. All names
+start with ``ltd_mason_``:
+
+- ``runs_total{status}``: runs that succeeded or failed, and
+  ``runs_in_progress``: runs that haven't finished yet;
+- ``last_run_timestamp_seconds`` and ``last_run_duration_seconds``: end
+  time and duration of the last run;
+- ``phase_seconds_total{phase}``, ``phase_calls_total{phase}`` and
+  ``phase_errors_total{phase}``: time spent in, calls of, and failed calls
+  of each phase, and ``last_phase_duration_seconds{phase}``: its duration
+  in the last run that ran it. The ``keeper-auth``, ``keeper-register``
+  and ``keeper-confirm`` phases measure LTD Keeper latency;
+- ``last_phase_disk_usage_bytes{phase}``: disk usage of the build
+  directory after each phase, in the last run that measured it (see
+  :class:`ltdmason.builddir.DiskUsageReporter`);
+- ``upload_files_total{result}`` and ``upload_bytes_total{result}``: files
+  and bytes that were ``uploaded``, ``copied`` from the previous build, or
+  skipped because they were ``unchanged`` in the bucket or
+  ``already_uploaded`` by a streaming upload;
+- ``upload_deleted_objects_total`` and ``upload_redirects_total``: stale
+  objects deleted and directory redirect objects uploaded;
+- ``last_upload_throughput_bytes_per_second``: bytes uploaded per second of
+  the ``upload-files`` step, in the last run that uploaded files;
+- ``s3_requests_total{operation}``, ``s3_request_errors_total``,
+  ``s3_request_retries_total``, ``s3_request_seconds_total``,
+  ``s3_sent_bytes_total`` and ``s3_received_bytes_total``: S3 API calls by
+  operation (see :mod:`ltdmason.s3stats`).
+"""
+
+import logging
+import threading
+import time
+
+from .fileutils import write_atomic
+
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+_PREFIX = 'ltd_mason_'
+
+_FAMILIES = (
+    ('runs', 'counter', 'Finished runs.'),
+    ('runs_in_progress', 'gauge', 'Runs that have not finished yet.'),
+    ('last_run_timestamp_seconds', 'gauge',
+     'Unix time at which the last run finished.'),
+    ('last_run_duration_seconds', 'gauge', 'Duration of the last run.'),
+    ('phase_seconds', 'counter', 'Time spent in each phase.'),
+    ('phase_calls', 'counter', 'Calls of each phase.'),
+    ('phase_errors', 'counter', 'Failed calls of each phase.'),
+    ('last_phase_duration_seconds', 'gauge',
+     'Duration of each phase in the last run that ran it.'),
+    ('last_phase_disk_usage_bytes', 'gauge',
+     'Disk usage of the build directory after each phase in the last run '
+     'that measured it.'),
+    ('upload_files', 'counter', 'Files uploaded or skipped.'),
+    ('upload_bytes', 'counter', 'Bytes of files uploaded or skipped.'),
+    ('upload_deleted_objects', 'counter', 'Stale objects deleted.'),
+    ('upload_redirects', 'counter',
+     'Directory redirect objects uploaded.'),
+    ('last_upload_throughput_bytes_per_second', 'gauge',
+     'Upload throughput of the last run that uploaded files.'),
+    ('s3_requests', 'counter', 'S3 API calls.'),
+    ('s3_request_errors', 'counter', 'Failed S3 API calls.'),
+    ('s3_request_retries', 'counter', 'Retried S3 API call attempts.'),
+    ('s3_request_seconds', 'counter', 'Latency of S3 API calls.'),
+    ('s3_sent_bytes', 'counter', 'Bytes sent in S3 API calls.'),
+    ('s3_received_bytes', 'counter', 'Bytes received in S3 API calls.'),
+)
+
+_UPLOAD_RESULTS = (
+    ('uploaded', 'files_uploaded', 'bytes_uploaded'),
+    ('copied', 'files_copied', 'bytes_copied'),
+    ('unchanged', 'files_unchanged', 'bytes_unchanged'),
+    ('already_uploaded', 'files_already_uploaded',
+     'bytes_already_uploaded'),
+)
+
+_S3_FIELDS = (
+    ('s3_requests', 'calls'),
+    ('s3_request_errors', 'errors'),
+    ('s3_request_retries', 'retries'),
+    ('s3_request_seconds', 'seconds'),
+    ('s3_sent_bytes', 'bytes_sent'),
+    ('s3_received_bytes', 'bytes_received'),
+)
+
+
+class BuildMetrics(object):
+    """Metrics of the runs of a command, in OpenMetrics text format.
+
+    Instances are thread-safe, so a worker's concurrent jobs can share one.
+
+    Parameters
+    ----------
+    path : str, optional
+        Text file that :meth:`write` writes to by default. Node-exporter's
+        textfile collector only reads files ending in ``.prom``.
+    command : str, optional
+        Value of the ``command`` label of all metrics.
+    """
+    def __init__(self, path=None, command='ltd-mason'):
+        super().__init__()
+        self.path = path
+        self.command = command
+        self._lock = threading.Lock()
+        self._values = {name: {} for name, _, _ in _FAMILIES}
+        self._values['runs_in_progress'][()] = 0
+
+    def _add(self, name, labels, value):
+        values = self._values[name]
+        values[labels] = values.get(labels, 0) + value
+
+    def _set(self, name, labels, value):
+        self._values[name][labels] = value
+
+    def start(self):
+        """Count a run as in progress; pass ``started=True`` to :meth:`add`
+        when it finishes.
+        """
+        with self._lock:
+            self._add('runs_in_progress', (), 1)
+
+    def add(self, report, started=False):
+        """Add up the timings and counts of a finished run.
+
+        Parameters
+        ----------
+        report : :class:`ltdmason.runreport.RunReport`
+            Report of the run.
+        started : bool, optional
+            `True` if the run was counted as in progress by :meth:`start`.
+        """
+        data = report.as_dict()
+        counts = data['counts']
+        with self._lock:
+            if started:
+                self._add('runs_in_progress', (), -1)
+            self._add('runs', (('status', data['status']),), 1)
+            self._set('last_run_timestamp_seconds', (), time.time())
+            self._set('last_run_duration_seconds', (), data['seconds'])
+
+            for name, entry in data['phases'].items():
+                # Strip the product prefix of batch builds
+                labels = (('phase', name.rsplit(':', 1)[-1]),)
+                self._add('phase_seconds', labels, entry['seconds'])
+                self._add('phase_calls', labels, entry['calls'])
+                self._add('phase_errors', labels, entry['errors'])
+                self._set('last_phase_duration_seconds', labels,
+                          entry['seconds'])
+                if 'disk_usage_bytes' in entry:
+                    self._set('last_phase_disk_usage_bytes', labels,
+                              entry['disk_usage_bytes'])
+
+            for result, files_key, bytes_key in _UPLOAD_RESULTS:
+                labels = (('result', result),)
+                self._add('upload_files', labels, counts.get(files_key, 0))
+                self._add('upload_bytes', labels, counts.get(bytes_key, 0))
+            self._add('upload_deleted_objects', (),
+                      counts.get('objects_deleted', 0))
+            self._add('upload_redirects', (),
+                      counts.get('redirects_uploaded', 0))
+            upload_seconds = data['phases'].get(
+                'upload-files', {}).get('seconds', 0.)
+            if counts.get('bytes_uploaded') and upload_seconds > 0.:
+                self._set('last_upload_throughput_bytes_per_second', (),
+                          counts['bytes_uploaded'] / upload_seconds)
+
+            operations = data.get('s3', {}).get('operations', {})
+            for operation, entry in operations.items():
+                labels = (('operation', operation),)
+                for name, field in _S3_FIELDS:
+                    self._add(name, labels, entry[field])
+
+    def render(self):
+        """The metrics as OpenMetrics text (`str`)."""
+        command = ('command', self.command)
+        lines = []
+        with self._lock:
+            for name, metric_type, help_text in _FAMILIES:
+                values = self._values[name]
+                if not values:
+                    continue
+                family = _PREFIX + name
+                lines.append('# TYPE {0} {1}'.format(family, metric_type))
+                lines.append('# HELP {0} {1}'.format(family, help_text))
+                sample = family + '_total' if metric_type == 'counter' \
+                    else family
+                for labels in sorted(values):
+                    lines.append('{0}{{{1}}} {2}'.format(
+                        sample, _format_labels((command,) + labels),
+                        _format_value(values[labels])))
+        lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path=None):
+        """Write the metrics to a text file.
+
+        The file is replaced atomically, so that collectors never read a
+        partly written file.
+        """
+        if path is None:
+            path = self.path
+        text = self.render()
+        write_atomic(path, text, prefix='.ltd-mason-metrics-', mode=0o644)
+        log.debug('Wrote metrics to %s', path)
+
+
+def _format_labels(labels):
+    return ','.join('{0}="{1}"'.format(
+        name, str(value).replace('\\', '\\\\').replace('"', '\\"')
+        .replace('\n', '\\n'))
+        for name, value in labels)
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
@@ -0,0 +1,237 @@
+"""Detect which packages changed since the last build of a product.
+
+:class:`BuildState` persists the inputs of the last successful build of each
+product, and :func:`diff_packages` compares them with a new manifest. The
+resulting :class:`PackageDiff` tells an incremental build which package
+subtrees of the documentation site must be invalidated, and which output
+directories an upload needs to focus on.
+
+The saved state is tied to the build tree it produced, so a build tree that
+was replaced, or modified by a build that failed, is never mistaken for the
+output of the last successful build.
+"""
+
+import json
+import logging
+import os
+import uuid
+
+from .buildcache import resolve_git_sha
+from .fileutils import write_atomic
+
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+
+def manifest_inputs(manifest, product=None):
+    """Summarize the inputs of a build for :class:`BuildState`.
+
+    Parameters
+    ----------
+    manifest : :class:`ltdmason.manifest.BaseManifest`
+        Manifest of the build.
+    product : :class:`ltdmason.product.Product`, optional
+        If set, commit SHAs are resolved from the doc repo clone and the
+        package directories.
+
+    Returns
+    -------
+    inputs : dict
+        ``{'doc_repo': {...}, 'packages': {name: {'url', 'ref', 'sha'}}}``.
+    """
+    inputs = {
+        'doc_repo': {'url': manifest.doc_repo_url,
+                     'ref': manifest.doc_repo_ref,
+                     'sha': None},
+        'packages': {}
+    }
+    if product is not None:
+        inputs['doc_repo']['sha'] = resolve_git_sha(product.doc_dir)
+    for name, data in manifest.packages.items():
+        sha = resolve_git_sha(data['dir']) if product is not None else None
+        inputs['packages'][str(name)] = {'url': data['url'],
+                                         'ref': data['ref'],
+                                         'sha': sha}
+    return inputs
+
+
+class PackageDiff(object):
+    """Package-level difference between two builds of a product.
+
+    Parameters
+    ----------
+    added : set
+        Names of packages only in the new build.
+    removed : set
+        Names of packages only in the previous build.
+    changed : set
+        Names of packages whose URL, ref or resolved commit changed.
+    doc_repo_changed : bool
+        `True` if the doc repo itself changed, which affects the whole site.
+    """
+    def __init__(self, added, removed, changed, doc_repo_changed):
+        super().__init__()
+        self.added = set(added)
+        self.removed = set(removed)
+        self.changed = set(changed)
+        self.doc_repo_changed = doc_repo_changed
+
+    def __repr__(self):
+        return ('PackageDiff(added={0!r}, removed={1!r}, changed={2!r}, '
+                'doc_repo_changed={3!r})').format(
+                    sorted(self.added), sorted(self.removed),
+                    sorted(self.changed), self.doc_repo_changed)
+
+    @property
+    def affected(self):
+        """Names of all added, removed or changed packages (`set`)."""
+        return self.added | self.removed | self.changed
+
+    @property
+    def is_empty(self):
+        """`True` if nothing changed."""
+        return not self.affected and not self.doc_repo_changed
+
+    @property
+    def output_dirs(self):
+        """Directories of the built HTML site, relative to the HTML root,
+        whose content depends on affected packages (`list` of `str`).
+
+        If the doc repo changed, the whole site is affected and this is
+        ``['']``.
+        """
+        if self.doc_repo_changed:
+            return ['']
+        dirs = []
+        for name in sorted(self.affected):
+            dirs.extend([name,
+                         os.path.join('_static', name),
+                         os.path.join('_sources', name)])
+        return dirs
+
+
+def diff_packages(previous, current):
+    """Compare the inputs of two builds.
+
+    Parameters
+    ----------
+    previous : dict
+        Inputs of the previous build (see :func:`manifest_inputs`), or `None`
+        if there was no previous build.
+    current : dict
+        Inputs of the new build.
+
+    Returns
+    -------
+    diff : :class:`PackageDiff`
+        The package-level difference. With no previous build, every package
+        is added and the doc repo is considered changed.
+    """
+    if previous is None:
+        return PackageDiff(current['packages'], set(), set(), True)
+
+    def same(a, b):
+        if a['url'] != b['url'] or a['ref'] != b['ref']:
+            return False
+        # Refs like branches can move; compare commits when both are known
+        if a.get('sha') and b.get('sha'):
+            return a['sha'] == b['sha']
+        return True
+
+    old = previous['packages']
+    new = current['packages']
+    added = set(new) - set(old)
+    removed = set(old) - set(new)
+    changed = {name for name in set(old) & set(new)
+               if not same(old[name], new[name])}
+    doc_repo_changed = not same(previous['doc_repo'], current['doc_repo'])
+    return PackageDiff(added, removed, changed, doc_repo_changed)
+
+
+class BuildState(object):
+    """Persisted inputs of the last successful build of each product.
+
+    The state of a product is stored as ``<state_dir>/<product_name>.json``.
+    State saved with a build directory also records a random identifier of
+    the build tree, which is written to a ``.ltd-mason-state`` file in the
+    build directory.
+
+    Parameters
+    ----------
+    state_dir : str
+        Directory where build state is stored. It is created if necessary.
+    """
+    def __init__(self, state_dir):
+        super().__init__()
+        self.state_dir = os.path.abspath(state_dir)
+        if not os.path.isdir(self.state_dir):
+            os.makedirs(self.state_dir)
+
+    def _path(self, product_name):
+        return os.path.join(self.state_dir, '{0}.json'.format(product_name))
+
+    def load(self, product_name, build_dir=None):
+        """Load the inputs of a product's last build, or `None`.
+
+        Parameters
+        ----------
+        product_name : str
+            Name of the product.
+        build_dir : str, optional
+            If set, `None` is also returned unless ``build_dir`` holds the
+            build tree of the product's last build, unmodified since (see
+            :meth:`save` and :meth:`detach`).
+        """
+        try:
+            with open(self._path(product_name), encoding='utf-8') as f:
+                inputs = json.load(f)
+        except FileNotFoundError:
+            return None
+        if build_dir is not None and \
+                inputs.get('tree_id') != _read_tree_id(build_dir):
+            log.info('%s does not hold the last build of %s',
+                     build_dir, product_name)
+            return None
+        return inputs
+
+    def save(self, product_name, inputs, build_dir=None):
+        """Record the inputs of a product's successful build.
+
+        Parameters
+        ----------
+        product_name : str
+            Name of the product.
+        inputs : dict
+            Inputs of the build (see :func:`manifest_inputs`).
+        build_dir : str, optional
+            Build directory of the build, whose tree the state is tied to.
+        """
+        if build_dir is not None:
+            inputs = dict(inputs, tree_id=uuid.uuid4().hex)
+            with open(_tree_id_path(build_dir), 'w',
+                      encoding='utf-8') as f:
+                f.write(inputs['tree_id'])
+        write_atomic(self._path(product_name),
+                     json.dumps(inputs, indent=2, sort_keys=True))
+
+    @staticmethod
+    def detach(build_dir):
+        """Mark the build tree in ``build_dir`` as modified, so that it
+        matches no saved state until the next :meth:`save`.
+        """
+        try:
+            os.remove(_tree_id_path(build_dir))
+        except FileNotFoundError:
+            pass
+
+
+def _tree_id_path(build_dir):
+    return os.path.join(build_dir, '.ltd-mason-state')
+
+
+def _read_tree_id(build_dir):
+    try:
+        with open(_tree_id_path(build_dir), encoding='utf-8') as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
@@ -0,0 +1,293 @@
+"""Dependency-graph executor for the phases of a documentation build.
+
+A :class:`Pipeline` is a set of named phases (callables) with declared
+requirements. Phases whose requirements are satisfied run concurrently in a
+thread pool, so independent steps (for example, ``pip install`` and linking
+package docs, or registering the build with LTD Keeper) overlap rather than
+run back-to-back. After a run, :attr:`Pipeline.critical_path` reports the
+chain of phases that determined the total wall time.
+
+Phases can be tagged with a named *resource* (such as ``'cpu'`` for Sphinx
+builds) whose concurrency the pipeline limits, so that many builds can share
+one pipeline without oversubscribing the machine.
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+DEFAULT_MAX_WORKERS = 32
+"""Default maximum number of phases of a :class:`Pipeline` that run at
+once.
+"""
+
+
+class Phase(object):
+    """A named unit of work in a :class:`Pipeline`.
+
+    Parameters
+    ----------
+    name : str
+        Unique name of the phase.
+    func : callable
+        Callable, taking no arguments, that performs the phase's work. Its
+        return value is stored in :attr:`Pipeline.results`.
+    requires : list of str, optional
+        Names of phases that must complete before this phase starts.
+    resource : str, optional
+        Name of the resource this phase occupies while it runs. See
+        :class:`Pipeline`.
+
+    Attributes
+    ----------
+    start_time, end_time : float
+        :func:`time.monotonic` times at which the phase started and ended.
+    thread_id : int
+        Identifier of the thread that ran the phase.
+    """
+    def __init__(self, name, func, requires=None, resource=None):
+        super().__init__()
+        self.name = name
+        self.func = func
+        self.requires = list(requires) if requires else []
+        self.resource = resource
+        self.start_time = None
+        self.end_time = None
+        self.thread_id = None
+
+    @property
+    def duration(self):
+        """Wall time of the phase in seconds (`float`), or `None` if the
+        phase has not run.
+        """
+        if self.start_time is None or self.end_time is None:
+            return None
+        return self.end_time - self.start_time
+
+    def run(self):
+        self.thread_id = threading.get_ident()
+        self.start_time = time.monotonic()
+        try:
+            return self.func()
+        finally:
+            self.end_time = time.monotonic()
+
+
+class Pipeline(object):
+    """Run a graph of :class:`Phase` objects, overlapping independent phases.
+
+    Parameters
+    ----------
+    max_workers : int, optional
+        Maximum number of phases that run at once. Defaults to the number of
+        phases in the pipeline, up to :data:`DEFAULT_MAX_WORKERS`. A phase
+        that waits for other phases to finish (see :meth:`is_finished`)
+        holds a worker while it waits, so limit such phases with a resource
+        to fewer than ``max_workers``.
+    resources : dict, optional
+        Maximum number of concurrently running phases for each resource
+        name. Phases whose resource isn't listed are not limited.
+    keep_going : bool, optional
+        If `True`, a failed phase only prevents the phases that depend on
+        it from running, rather than stopping the whole pipeline.
+    listeners : list of callable, optional
+        Callables that are called with each :class:`Phase` (and the
+        exception it raised, or `None`) once it finishes. Listeners run in
+        the thread that schedules phases, so they should be quick.
+
+    Attributes
+    ----------
+    results : dict
+        Return values of completed phases, keyed by phase name.
+    errors : dict
+        Exceptions raised by failed phases, keyed by phase name.
+    skipped : set
+        Names of phases that were skipped because a requirement failed.
+    """
+    def __init__(self, max_workers=None, resources=None, keep_going=False,
+                 listeners=None):
+        super().__init__()
+        self.max_workers = max_workers
+        self.resources = dict(resources) if resources else {}
+        self.keep_going = keep_going
+        self.listeners = list(listeners) if listeners else []
+        self.results = {}
+        self.errors = {}
+        self.skipped = set()
+        self._phases = {}
+
+    def add(self, name, func, requires=None, resource=None):
+        """Add a phase to the pipeline.
+
+        Parameters
+        ----------
+        name : str
+            Unique name of the phase.
+        func : callable
+            Callable, taking no arguments, that performs the work.
+        requires : list of str, optional
+            Names of phases that must complete first. These phases must
+            already have been added.
+        resource : str, optional
+            Name of the resource this phase occupies while it runs.
+
+        Returns
+        -------
+        phase : :class:`Phase`
+            The added phase.
+        """
+        if name in self._phases:
+            raise PipelineError('Phase {0!r} already exists'.format(name))
+        requires = list(requires) if requires else []
+        for required_name in requires:
+            if required_name not in self._phases:
+                raise PipelineError(
+                    'Phase {0!r} requires unknown phase {1!r}'.format(
+                        name, required_name))
+        phase = Phase(name, func, requires=requires, resource=resource)
+        self._phases[name] = phase
+        return phase
+
+    def __contains__(self, name):
+        return name in self._phases
+
+    def __getitem__(self, name):
+        return self._phases[name]
+
+    @property
+    def phases(self):
+        """Phases in the order they were added (`list` of :class:`Phase`)."""
+        return list(self._phases.values())
+
+    def run(self):
+        """Run all phases, starting each as soon as its requirements finish.
+
+        If a phase raises, no further phases are started; phases that are
+        already running are allowed to finish, and then the original
+        exception is re-raised. With ``keep_going``, only the phases that
+        depend on the failed phase are skipped, and a :class:`PipelineError`
+        is raised at the end if any phase failed.
+
+        Returns
+        -------
+        results : dict
+            Return values of the phases, keyed by phase name.
+        """
+        pending = dict(self._phases)
+        done = set()
+        failed = set()
+        running = {}
+        in_use = {name: 0 for name in self.resources}
+        max_workers = self.max_workers or \
+            min(max(len(pending), 1), DEFAULT_MAX_WORKERS)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while pending or running:
+                skipped = False
+                if not self.errors or self.keep_going:
+                    for name, phase in list(pending.items()):
+                        if any(r in failed for r in phase.requires):
+                            log.warning('Skipping phase %s', name)
+                            failed.add(name)
+                            self.skipped.add(name)
+                            del pending[name]
+                            skipped = True
+                        elif all(r in done for r in phase.requires):
+                            if not self._acquire(phase.resource, in_use):
+                                continue
+                            log.debug('Starting phase %s', name)
+                            running[executor.submit(phase.run)] = phase
+                            del pending[name]
+                if not running:
+                    if skipped:
+                        # Dependents of skipped phases can now be skipped
+                        continue
+                    break
+                finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    phase = running.pop(future)
+                    if phase.resource in in_use:
+                        in_use[phase.resource] -= 1
+                    exc = future.exception()
+                    for listener in self.listeners:
+                        listener(phase, exc)
+                    if exc is not None:
+                        log.error('Phase %s failed after %.1f s',
+                                  phase.name, phase.duration)
+                        self.errors[phase.name] = exc
+                        failed.add(phase.name)
+                        continue
+                    self.results[phase.name] = future.result()
+                    done.add(phase.name)
+                    log.info('Finished phase %s in %.1f s',
+                             phase.name, phase.duration)
+
+        if self.errors:
+            if self.keep_going:
+                raise PipelineError('Failed phases: {0}'.format(
+                    ', '.join(sorted(self.errors))))
+            raise next(iter(self.errors.values()))
+
+        path = self.critical_path
+        if path:
+            log.info('Critical path: %s (%.1f s)',
+                     ' -> '.join(p.name for p in path),
+                     path[-1].end_time - path[0].start_time)
+        return self.results
+
+    def is_finished(self, name):
+        """`True` if a phase has completed, failed or was skipped, or will
+        never start because the pipeline is stopping after a failure.
+
+        A long-running phase can poll this to follow the progress of other
+        phases of a running pipeline.
+        """
+        if name in self.results or name in self.errors \
+                or name in self.skipped:
+            return True
+        stopping = bool(self.errors) and not self.keep_going
+        return stopping and self._phases[name].start_time is None
+
+    def _acquire(self, resource, in_use):
+        if resource not in self.resources:
+            return True
+        if in_use[resource] >= self.resources[resource]:
+            return False
+        in_use[resource] += 1
+        return True
+
+    @property
+    def critical_path(self):
+        """Chain of completed phases that determined the pipeline's wall time
+        (`list` of :class:`Phase`, in execution order).
+
+        The path ends at the last phase to finish and is traced backwards
+        through whichever requirement finished last, since that requirement
+        is what held up the start of its dependent phase.
+        """
+        completed = [p for p in self._phases.values()
+                     if p.end_time is not None]
+        if not completed:
+            return []
+        phase = max(completed, key=lambda p: p.end_time)
+        path = [phase]
+        while phase.requires:
+            required = [self._phases[r] for r in phase.requires
+                        if self._phases[r].end_time is not None]
+            if not required:
+                break
+            phase = max(required, key=lambda p: p.end_time)
+            path.append(phase)
+        path.reverse()
+        return path
+
+
+class PipelineError(Exception):
+    """Error in the definition of a :class:`Pipeline`, or failed phases in a
+    ``keep_going`` pipeline.
+    """
+    pass
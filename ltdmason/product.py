@@ -3,14 +3,27 @@
 
 import os
 import logging
+import hashlib
+import json
+import re
+import shutil
+import sys
+import threading
+import time
 from io import BytesIO
 import abc
 
 import sh
 
+from .packagediff import manifest_inputs, diff_packages
+
 log = logging.getLogger(__name__)
 log.addHandler(logging.NullHandler())
 
+_PINNED_RE = re.compile(
+    r'^[A-Za-z0-9][A-Za-z0-9._-]*(\[[^\]]*\])?\s*===?\s*[^\s*;,]+'
+    r'\s*(;.*)?$')
+
 
 class BaseProduct(object):
     """Abstract base class specifying the minimum API for products classes."""
@@ -41,15 +54,41 @@ class Product(BaseProduct):
         documentation input.
     build_dir : str
         Directory where documentation will be built.
+    sphinx_runner : :class:`ltdmason.sphinxrunner.SphinxRunner`, optional
+        If set, Sphinx is run in-process by this runner's pre-warmed worker
+        processes rather than by a ``sphinx-build`` subprocess.
+    git_mirrors : :class:`ltdmason.gitmirror.GitMirrorCache`, optional
+        If set, the doc repo is cloned with reference to a local mirror so
+        that only new objects are fetched.
+    installed_requirements : :class:`InstalledRequirements`, optional
+        Record of the ``requirements.txt`` files that are already installed
+        in this environment. Long-running processes share one across builds
+        so that ``pip install`` only runs when a doc repo's requirements
+        change.
+    incremental : bool, optional
+        Reuse an existing build tree in ``build_dir``: an existing doc repo
+        clone is fetched and checked out rather than cloned, and Sphinx only
+        rebuilds outdated documents instead of the whole site. See
+        :meth:`invalidate_packages`.
+    inventory_cache : `ltdmason.intersphinxcache.InventoryCache`, optional
+        If set, the intersphinx inventories of the Sphinx build are served
+        from this shared cache.
     """
     # Package directories/files that won't get linked into product doc repo
     # Note that _static/ is handled separately
     package_excludes = ['_static', '_build', '_templates', 'conf.py', '.git']
 
-    def __init__(self, manifest, build_dir):
+    def __init__(self, manifest, build_dir, sphinx_runner=None,
+                 git_mirrors=None, installed_requirements=None,
+                 incremental=False, inventory_cache=None):
         super().__init__()
         self.manifest = manifest
         self.build_dir = build_dir
+        self.sphinx_runner = sphinx_runner
+        self.git_mirrors = git_mirrors
+        self.installed_requirements = installed_requirements
+        self.incremental = incremental
+        self.inventory_cache = inventory_cache
 
     @property
     def doc_dir(self):
@@ -64,27 +103,132 @@ class Product(BaseProduct):
     def clone_doc_repo(self):
         """Git clones the Sphinx documentation repository for this build
         product (specified in the :attr:`manifest`) into :attr:`build_dir`.
+
+        The manifest's
+        :attr:`~ltdmason.manifest.BaseManifest.doc_repo_clone_options` can
+        make this a shallow (``depth``), partial (``filter``) and/or sparse
+        (``sparse``) clone. If a shallow clone can't fetch the ref, for
+        example because it is a commit SHA, a full clone is made instead.
+
+        In :attr:`incremental` mode an existing clone is updated instead.
         """
-        # Clone
-        clone_out_log = BytesIO()
-        clone_err_log = BytesIO()
-        git_clone = sh.git.bake(_cwd=self.build_dir)
-        git_clone.clone(self.manifest.doc_repo_url, self.doc_dir,
-                        _out=clone_out_log,
-                        _err=clone_err_log)
-        log.debug(clone_out_log.getvalue())
-        log.debug(clone_err_log.getvalue())
+        if self.incremental and \
+                os.path.isdir(os.path.join(self.doc_dir, '.git')):
+            self._update_doc_repo()
+            return
+
+        options = self.manifest.doc_repo_clone_options
+        ref = self.manifest.doc_repo_ref
+
+        clone_args = []
+        if self.git_mirrors is not None:
+            mirror = self.git_mirrors.update(self.manifest.doc_repo_url)
+            clone_args += ['--reference', mirror, '--dissociate']
+        if options.get('filter'):
+            clone_args += ['--filter', options['filter']]
+        if options.get('sparse'):
+            # Set up the sparse-checkout patterns before checking out files
+            clone_args.append('--no-checkout')
+
+        cloned = False
+        if options.get('depth'):
+            # A shallow clone can only fetch branches and tags by name; if
+            # the ref is a commit (or isn't found), fall back to a full clone
+            try:
+                self._git_clone(clone_args + ['--depth', str(options['depth']),
+                                              '--branch', ref])
+            except sh.ErrorReturnCode:
+                log.warning('Shallow clone of %s at %r failed; falling back '
+                            'to a full clone',
+                            self.manifest.doc_repo_url, ref)
+                if os.path.exists(self.doc_dir):
+                    shutil.rmtree(self.doc_dir)
+            else:
+                cloned = True
+        if not cloned:
+            self._git_clone(clone_args)
 
         # Checkout the appropriate ref
         checkout_out_log = BytesIO()
         checkout_err_log = BytesIO()
         git = sh.git.bake(_cwd=self.doc_dir)
-        git.checkout(self.manifest.doc_repo_ref,
+        if options.get('sparse'):
+            git('sparse-checkout', 'set', '--no-cone', *options['sparse'],
+                _out=checkout_out_log,
+                _err=checkout_err_log)
+        git.checkout(ref,
                      _out=checkout_out_log,
                      _err=checkout_err_log)
+        if options.get('sparse'):
+            # Populate the work tree if ref was already checked out
+            git('read-tree', '-mu', 'HEAD',
+                _out=checkout_out_log,
+                _err=checkout_err_log)
         log.debug(checkout_out_log.getvalue())
         log.debug(checkout_err_log.getvalue())
 
+    def _git_clone(self, clone_args):
+        clone_out_log = BytesIO()
+        clone_err_log = BytesIO()
+        git_clone = sh.git.bake(_cwd=self.build_dir)
+        try:
+            git_clone.clone(*clone_args,
+                            self.manifest.doc_repo_url, self.doc_dir,
+                            _out=clone_out_log,
+                            _err=clone_err_log)
+        finally:
+            log.debug(clone_out_log.getvalue())
+            log.debug(clone_err_log.getvalue())
+
+    def _update_doc_repo(self):
+        """Fetch an existing doc repo clone and check out the manifest's ref.
+        """
+        out_log = BytesIO()
+        err_log = BytesIO()
+        git = sh.git.bake(_cwd=self.doc_dir, _out=out_log, _err=err_log)
+        git.fetch('--prune', 'origin')
+        ref = self.manifest.doc_repo_ref
+        git.checkout('--force', ref)
+        try:
+            git('rev-parse', '--verify', '--quiet',
+                'refs/remotes/origin/{0}'.format(ref))
+        except sh.ErrorReturnCode:
+            # A tag or commit, rather than a branch
+            pass
+        else:
+            git.reset('--hard', 'origin/{0}'.format(ref))
+        log.debug(out_log.getvalue())
+        log.debug(err_log.getvalue())
+
+    def invalidate_packages(self, diff):
+        """Invalidate the parts of an existing build tree that depend on
+        added, removed or changed packages.
+
+        The built HTML, ``_static/`` and ``_sources/`` output directories of
+        affected packages are removed, so that pages of documents a package
+        no longer has don't linger in the site. Sphinx itself re-reads the
+        documents whose sources are newer than its saved environment, so a
+        package checked out at a new ref is rebuilt without rebuilding the
+        whole site. The links of removed packages are cleaned up by
+        :meth:`link_package_repos`.
+
+        Parameters
+        ----------
+        diff : :class:`ltdmason.packagediff.PackageDiff`
+            Package changes since the build that produced the existing tree.
+        """
+        if not os.path.isdir(self.html_dir):
+            return
+        for package_name in sorted(diff.affected):
+            for path in (os.path.join(self.html_dir, package_name),
+                         os.path.join(self.html_dir, '_static',
+                                      package_name),
+                         os.path.join(self.html_dir, '_sources',
+                                      package_name)):
+                if os.path.isdir(path):
+                    log.debug('Invalidating %s', path)
+                    shutil.rmtree(path)
+
     def link_package_repos(self):
         """Link the doc/ directories of packages into the ``lsstsw``
         checked-out documunetation repository.
@@ -94,78 +238,402 @@ class Product(BaseProduct):
 
         All other content of the package's ``doc/`` directory is linked into
         the ``<pkgname>/`` directory in the root of the documentation repo.
+
+        Links are reconciled with an existing build tree: missing links are
+        created, links pointing to an old source are replaced, and links
+        made for packages that are no longer in the manifest are removed
+        (the links made by each run are recorded in :attr:`build_dir`).
+
+        Returns
+        -------
+        stats : dict
+            Number of links ``'created'``, ``'updated'``, ``'removed'`` and
+            ``'unchanged'``, and the elapsed ``'seconds'``.
         """
-        doc_static_dir = os.path.join(self.doc_dir, '_static')
-        if not os.path.exists(doc_static_dir):
-            os.makedirs(doc_static_dir)
+        start_time = time.monotonic()
+        stats = {'created': 0, 'updated': 0, 'removed': 0, 'unchanged': 0}
 
+        # Map link paths, relative to doc_dir, to their source paths
+        links = {}
+        package_dirs = []
         for package_name, package_data in self.manifest.packages.items():
-            pkg_dir = str(package_data['dir'])
-
-            # validate that the package's doc directory exists; skip if not
-            source_doc_dir = os.path.join(pkg_dir, 'doc')
-            if not os.path.isdir(source_doc_dir):
+            package_name = str(package_name)
+            source_doc_dir = os.path.join(str(package_data['dir']), 'doc')
+            try:
+                entries = list(os.scandir(source_doc_dir))
+            except (FileNotFoundError, NotADirectoryError):
                 log.debug(
                     'Skipping {0}: no doc/ directory'.format(package_name))
                 continue
+            package_dirs.append(package_name)
 
-            # Link _static/<pkgname>
-            source_static_dir = os.path.join(source_doc_dir, '_static',
-                                             package_name)
-            if not os.path.isdir(source_static_dir):
-                log.debug(
-                    'No _static/ directory found for {0}; skipping'
-                    .format(package_name))
-            else:
-                target = os.path.join(self.doc_dir, '_static', package_name)
-                log.debug(
-                    'Linking {0} to {1}'.format(source_static_dir, target))
-                os.symlink(source_static_dir, target)
-
-            # Link all other entities in the doc/ directory to the package's
-            # directory in the documentation repo
-            target_doc_dir = os.path.join(self.doc_dir, package_name)
-            if not os.path.exists(target_doc_dir):
-                os.makedirs(target_doc_dir)
-            for entity in os.listdir(source_doc_dir):
-                if entity in self.package_excludes:
+            for entry in entries:
+                if entry.name == '_static':
+                    # Link _static/<pkgname>
+                    source_static_dir = os.path.join(entry.path, package_name)
+                    if os.path.isdir(source_static_dir):
+                        links[os.path.join('_static', package_name)] = \
+                            source_static_dir
+                if entry.name in self.package_excludes:
                     # skips protected dirs like _build, _templates, _static
                     # _static is linked separately, above
                     continue
-                src = os.path.join(source_doc_dir, entity)
-                target = os.path.join(target_doc_dir, entity)
+                # Link all other entities in the doc/ directory to the
+                # package's directory in the documentation repo
+                links[os.path.join(package_name, entry.name)] = entry.path
+
+        # Remove links (and then empty directories) of dropped packages
+        previous_links, previous_dirs = self._read_link_record()
+        for link in sorted(set(previous_links) - set(links)):
+            path = os.path.join(self.doc_dir, link)
+            if os.path.islink(path):
+                log.debug('Removing link {0}'.format(path))
+                os.remove(path)
+                stats['removed'] += 1
+        for package_dir in set(previous_dirs) - set(package_dirs):
+            path = os.path.join(self.doc_dir, package_dir)
+            try:
+                os.rmdir(path)
+            except OSError:
+                # Not empty (or already gone), so not only ours to delete
+                pass
+
+        for package_dir in ['_static'] + package_dirs:
+            os.makedirs(os.path.join(self.doc_dir, package_dir),
+                        exist_ok=True)
+
+        for link, src in links.items():
+            target = os.path.join(self.doc_dir, link)
+            try:
+                current_src = os.readlink(target)
+            except FileNotFoundError:
                 log.debug('Linking {0} to {1}'.format(src, target))
                 os.symlink(src, target)
+                stats['created'] += 1
+                continue
+            except OSError:
+                # A real file or directory, so part of the doc repo itself
+                # and not ours to replace
+                raise FileExistsError(
+                    'Cannot link {0} to {1}: the doc repo already has a '
+                    'file or directory there'.format(src, target))
+            if current_src == src:
+                stats['unchanged'] += 1
+                continue
+            # Replace the stale link atomically
+            log.debug('Relinking {0} to {1}'.format(src, target))
+            tmp_target = target + '.ltd-mason-tmp'
+            if os.path.lexists(tmp_target):
+                os.remove(tmp_target)
+            os.symlink(src, tmp_target)
+            os.replace(tmp_target, target)
+            stats['updated'] += 1
+
+        self._write_link_record(sorted(links), package_dirs)
+
+        stats['seconds'] = time.monotonic() - start_time
+        log.info('Linked package docs in %.2f s: %d created, %d updated, '
+                 '%d removed, %d unchanged', stats['seconds'],
+                 stats['created'], stats['updated'], stats['removed'],
+                 stats['unchanged'])
+        return stats
+
+    @property
+    def _link_record_path(self):
+        return os.path.join(self.build_dir, '.ltd-mason-links.json')
+
+    def _read_link_record(self):
+        try:
+            with open(self._link_record_path, encoding='utf-8') as f:
+                record = json.load(f)
+        except FileNotFoundError:
+            return [], []
+        return record['links'], record['package_dirs']
+
+    def _write_link_record(self, links, package_dirs):
+        with open(self._link_record_path, 'w', encoding='utf-8') as f:
+            json.dump({'links': links, 'package_dirs': package_dirs}, f)
 
     def install_dependencies(self):
         """Install dependencies specific in the doc repo's requirements.txt"""
-        if os.path.exists(os.path.join(self.doc_dir, 'requirements.txt')):
-            pip_out_log = BytesIO()
-            pip_err_log = BytesIO()
-            pip = sh.pip.bake(_cwd=self.doc_dir)
-            pip.install('-r', 'requirements.txt',
-                        _out=pip_out_log,
-                        _err=pip_err_log)
-            log.debug(pip_out_log.getvalue())
-            log.debug(pip_err_log.getvalue())
+        requirements_path = os.path.join(self.doc_dir, 'requirements.txt')
+        if not os.path.exists(requirements_path):
+            return
+        if self.installed_requirements is None:
+            self._pip_install()
+            return
+        with open(requirements_path, 'rb') as f:
+            content = f.read()
+        digest = hashlib.sha256(content).hexdigest()
+        pinned = requirements_pinned(content.decode('utf-8', 'replace'))
+        with self.installed_requirements.lock:
+            if digest in self.installed_requirements:
+                log.debug('Requirements already installed; skipping pip')
+                return
+            # Unpinned requirements are only refreshed with --upgrade
+            self._pip_install(upgrade=not pinned)
+            self.installed_requirements.add(digest, pinned=pinned)
+
+    def _pip_install(self, upgrade=False):
+        args = ['-r', 'requirements.txt']
+        if upgrade:
+            args.insert(0, '--upgrade')
+        pip_out_log = BytesIO()
+        pip_err_log = BytesIO()
+        pip = sh.pip.bake(_cwd=self.doc_dir)
+        pip.install(*args,
+                    _out=pip_out_log,
+                    _err=pip_err_log)
+        log.debug(pip_out_log.getvalue())
+        log.debug(pip_err_log.getvalue())
 
     def build_sphinx(self):
         """Run the Sphinx build process to produce HTML documentation.
 
-        This method calls ``sphinx-build``, which is installed by Sphinx.
+        This method calls ``sphinx-build``, which is installed by Sphinx,
+        unless the product has a :attr:`sphinx_runner`. With an
+        :attr:`inventory_cache`, ``sphinx-build`` is run through
+        ``python -m ltdmason.sphinxrunner`` so that the cache is used.
         """
-        builder = sh.Command('sphinx-build')
+        if self.sphinx_runner is not None:
+            self.sphinx_runner.build(self.doc_dir, self.html_dir,
+                                     builder='html',
+                                     force_all=not self.incremental,
+                                     inventory_cache=self.inventory_cache)
+            return
+
+        build_args = ['-b', 'html']  # HTML builder
+        if not self.incremental:
+            build_args.append('-a')  # build all, without caching
+        build_args.extend([self.doc_dir, self.html_dir])
+        if self.inventory_cache is None:
+            builder = sh.Command('sphinx-build')
+        else:
+            builder = sh.Command(sys.executable).bake(
+                '-m', 'ltdmason.sphinxrunner',
+                '--inventory-cache', self.inventory_cache.cache_dir,
+                '--inventory-ttl', str(self.inventory_cache.ttl))
+            if self.inventory_cache.offline:
+                builder = builder.bake('--offline')
         build_out_log = BytesIO()
         build_err_log = BytesIO()
-        builder(self.doc_dir, self.html_dir,
-                b='html',  # HTML builder
-                a=True,  # build all, without caching
+        builder(*build_args,
                 _out=build_out_log,
                 _err=build_err_log)
         log.debug(build_out_log.getvalue())
         log.debug(build_err_log.getvalue())
 
 
+class InstalledRequirements(object):
+    """Record of the doc repo requirements installed in this environment.
+
+    ``requirements.txt`` files are keyed by the digest of their content.
+    A file that pins every requirement to a version (see
+    :func:`requirements_pinned`) is installed once. Installs of other files,
+    whose version ranges or VCS and URL requirements can resolve to newer
+    code later, expire after ``ttl`` seconds, and are then refreshed with
+    ``pip install --upgrade``.
+
+    Instances are thread-safe. Builds hold :attr:`lock` while they check
+    and install requirements, since concurrent pip installs into one
+    environment conflict.
+
+    Parameters
+    ----------
+    ttl : float, optional
+        Seconds after which installs of unpinned requirements expire.
+    """
+    def __init__(self, ttl=3600.):
+        super().__init__()
+        self.ttl = ttl
+        self.lock = threading.RLock()
+        self._installed = {}
+
+    def __contains__(self, digest):
+        with self.lock:
+            entry = self._installed.get(digest)
+        if entry is None:
+            return False
+        pinned, install_time = entry
+        return pinned or time.monotonic() - install_time < self.ttl
+
+    def add(self, digest, pinned=True):
+        """Record the install of a requirements file.
+
+        Parameters
+        ----------
+        digest : str
+            SHA-256 digest of the file's content.
+        pinned : bool, optional
+            Whether the file pins all of its requirements; if not, the
+            install expires after :attr:`ttl` seconds.
+        """
+        with self.lock:
+            self._installed[digest] = (pinned, time.monotonic())
+
+
+def requirements_pinned(text):
+    """Whether a ``requirements.txt`` file pins every requirement to an
+    exact version (``name==version``).
+
+    Editable, VCS and URL requirements, version ranges, and nested
+    requirements or constraints files (``-r``, ``-c``) aren't pinned.
+    """
+    for line in text.splitlines():
+        line = line.split(' #', 1)[0].strip().rstrip('\\').strip()
+        if not line or line.startswith('#'):
+            continue
+        if line.startswith(('--hash', '--index-url', '--extra-index-url',
+                            '-i ')):
+            continue
+        line = line.split(' --hash', 1)[0].strip()
+        if _PINNED_RE.match(line) is None:
+            return False
+    return True
+
+
+def add_build_phases(pipeline, product, cache=None, prefix='', state=None,
+                     postprocessors=None):
+    """Add the phases that build a product's HTML site to a pipeline.
+
+    Linking package docs and installing the doc repo's dependencies only
+    need the clone, so they run concurrently. The pip phase uses the
+    ``'pip'`` pipeline resource, and the Sphinx phase the ``'cpu'``
+    resource.
+
+    Parameters
+    ----------
+    pipeline : :class:`ltdmason.pipeline.Pipeline`
+        Pipeline to add phases to.
+    product : :class:`ltdmason.product.Product`
+        Product to build.
+    cache : :class:`ltdmason.buildcache.BuildCache`, optional
+        If set, the build's inputs are fingerprinted after the clone. On a
+        cache hit the cached HTML site is restored instead of running the
+        link, pip and Sphinx phases; on a miss the new build is stored.
+        Builds whose commits can't be resolved are neither restored nor
+        stored (see :meth:`~ltdmason.buildcache.BuildCache.fingerprint`).
+    prefix : str, optional
+        Prefix for phase names, so that several products can be built in
+        one pipeline.
+    state : :class:`ltdmason.packagediff.BuildState`, optional
+        If set, packages are compared with the last build of the product
+        after the clone, provided that the product's build directory still
+        holds that build's tree; otherwise every package counts as added.
+        The package changes are logged and the affected parts of an
+        existing build tree are invalidated (see
+        :meth:`Product.invalidate_packages`). The ``package-diff`` phase
+        returns the new build's inputs and the
+        :class:`~ltdmason.packagediff.PackageDiff`, whose output
+        directories :func:`ltdmason.uploader.add_upload_phases` uses. The
+        new build's inputs are saved once the build succeeds.
+    postprocessors : list, optional
+        Post-build stages, such as :class:`ltdmason.normalize.HTMLNormalizer`,
+        that modify :attr:`product.html_dir` after the Sphinx build. Each is
+        a callable taking the HTML directory, with a ``name`` attribute that
+        names its phase. They run in order, using the ``'cpu'`` resource,
+        before the site is stored in the build cache; their names and
+        ``settings`` are part of the build's fingerprint, so a cached site is
+        only restored if it was processed the same way.
+
+    Returns
+    -------
+    phase_name : str
+        Name of the phase after which :attr:`product.html_dir` is complete.
+    """
+    def name(phase_name):
+        return prefix + phase_name
+
+    def add_postprocessors(requires, wrap=None):
+        for postprocessor in postprocessors or []:
+            def run(postprocessor=postprocessor):
+                return postprocessor(product.html_dir)
+            pipeline.add(name(postprocessor.name),
+                         wrap(run) if wrap else run,
+                         requires=[requires], resource='cpu')
+            requires = name(postprocessor.name)
+        return requires
+
+    pipeline.add(name('clone'), product.clone_doc_repo, resource='network')
+    link_requires = [name('clone')]
+
+    if state is not None:
+        def diff():
+            inputs = manifest_inputs(product.manifest, product)
+            previous = state.load(product.manifest.product_name,
+                                  build_dir=product.build_dir)
+            # Until the build succeeds, the tree matches no saved state
+            state.detach(product.build_dir)
+            package_diff = diff_packages(previous, inputs)
+            log.info('Changes since the last build: %r', package_diff)
+            log.info('Affected output directories: %r',
+                     package_diff.output_dirs)
+            product.invalidate_packages(package_diff)
+            return inputs, package_diff
+
+        pipeline.add(name('package-diff'), diff, requires=[name('clone')])
+        link_requires = [name('package-diff')]
+
+    if cache is None:
+        pipeline.add(name('link'), product.link_package_repos,
+                     requires=link_requires)
+        pipeline.add(name('pip'), product.install_dependencies,
+                     requires=[name('clone')], resource='pip')
+        pipeline.add(name('sphinx'), product.build_sphinx,
+                     requires=[name('link'), name('pip')], resource='cpu')
+        build_phase = add_postprocessors(name('sphinx'))
+    else:
+        def fingerprint():
+            fingerprint = cache.fingerprint(product,
+                                            postprocessors=postprocessors)
+            if fingerprint is None:
+                return None, False
+            hit = fingerprint in cache
+            log.info('Build fingerprint %s (cache %s)',
+                     fingerprint, 'hit' if hit else 'miss')
+            return fingerprint, hit
+
+        def unless_cached(func):
+            def run():
+                _, hit = pipeline.results[name('fingerprint')]
+                if not hit:
+                    return func()
+            return run
+
+        def sync_cache():
+            fingerprint, hit = pipeline.results[name('fingerprint')]
+            if hit:
+                if os.path.isdir(product.html_dir):
+                    shutil.rmtree(product.html_dir)
+                cache.restore(fingerprint, product.html_dir)
+            elif fingerprint is not None:
+                cache.store(fingerprint, product.html_dir)
+
+        pipeline.add(name('fingerprint'), fingerprint,
+                     requires=[name('clone')])
+        pipeline.add(name('link'), unless_cached(product.link_package_repos),
+                     requires=[name('fingerprint')] + link_requires)
+        pipeline.add(name('pip'), unless_cached(product.install_dependencies),
+                     requires=[name('fingerprint')], resource='pip')
+        pipeline.add(name('sphinx'), unless_cached(product.build_sphinx),
+                     requires=[name('link'), name('pip')], resource='cpu')
+        html_phase = add_postprocessors(name('sphinx'), wrap=unless_cached)
+        pipeline.add(name('build-cache'), sync_cache,
+                     requires=[html_phase])
+        build_phase = name('build-cache')
+
+    if state is not None:
+        def save_state():
+            inputs, _ = pipeline.results[name('package-diff')]
+            state.save(product.manifest.product_name, inputs,
+                       build_dir=product.build_dir)
+
+        pipeline.add(name('build-state'), save_state, requires=[build_phase])
+        build_phase = name('build-state')
+
+    return build_phase
+
+
 class TravisProduct(BaseProduct):
     """Representation of a documentation product in the Travis environment.
 
@@ -0,0 +1,266 @@
+"""CPU and memory profiling of ltd-mason runs.
+
+A :class:`Profiler` wraps a run of ``ltd-mason``, ``ltd-mason-travis`` or
+``ltd-mason-worker`` (``--profile cpu`` or ``--profile memory``) and writes
+its results into an output directory:
+
+- In ``cpu`` mode, the main thread and every thread started during the run
+  (such as the pipeline's phases and the upload threads) are profiled with
+  :mod:`cProfile`: by one profiler per thread before Python 3.12, and by a
+  single profiler, which sees all threads, since. The merged statistics are
+  written as a :mod:`pstats` dump (``<name>-<pid>.prof``, for
+  ``python -m pstats`` or snakeviz), and as collapsed stacks
+  (``<name>-<pid>.collapsed``) that flame graph tools such as
+  ``flamegraph.pl`` or speedscope read.
+- In ``memory`` mode, :mod:`tracemalloc` traces allocations, and a snapshot
+  is taken at the start of the run, at each phase boundary (the profiler is
+  a pipeline listener) and at the end of the run. The top allocators of
+  each snapshot, and their growth since the previous snapshot, are written
+  to ``<name>-<pid>.memory.txt``. The start and end snapshots are dumped
+  (``<name>-<pid>-<n>-<label>.tracemalloc``, for
+  :meth:`tracemalloc.Snapshot.load`); those of phases only on request,
+  since a batch run has many phases and each dump holds every traced
+  allocation.
+
+Work done in other processes, such as in-process Sphinx builds and image
+optimization, isn't profiled.
+"""
+
+import cProfile
+import logging
+import os
+import pstats
+import re
+import sys
+import threading
+import tracemalloc
+
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+MODES = ('cpu', 'memory')
+"""Profiling modes."""
+
+
+class Profiler(object):
+    """Profile a run's CPU time or memory allocations.
+
+    Use the profiler as a context manager around the run, and add it to
+    the listeners of the run's pipelines so that memory snapshots are taken
+    at phase boundaries.
+
+    Parameters
+    ----------
+    mode : str
+        ``'cpu'`` or ``'memory'``.
+    output_dir : str, optional
+        Directory that the results are written to. Defaults to the current
+        directory.
+    name : str, optional
+        Prefix of the output file names, such as the command name.
+    top : int, optional
+        Number of top allocators listed for each memory snapshot.
+    dump_phases : bool, optional
+        Also dump the memory snapshots taken at phase boundaries, not only
+        those of the start and end of the run.
+    """
+    def __init__(self, mode, output_dir='.', name='ltd-mason', top=10,
+                 dump_phases=False):
+        super().__init__()
+        if mode not in MODES:
+            raise ValueError('Unknown profiling mode {0!r}'.format(mode))
+        self.mode = mode
+        self.output_dir = output_dir
+        self.name = name
+        self.top = top
+        self.dump_phases = dump_phases
+        self._prefix = os.path.join(
+            output_dir, '{0}-{1:d}'.format(name, os.getpid()))
+        self._lock = threading.Lock()
+        self._profiles = []
+        self._snapshots = 0
+        self._last_snapshot = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        return False
+
+    def __call__(self, phase, error):
+        if self.mode == 'memory':
+            self.snapshot(phase.name, dump=self.dump_phases)
+
+    def start(self):
+        """Start profiling."""
+        os.makedirs(self.output_dir, exist_ok=True)
+        if self.mode == 'cpu':
+            if sys.version_info < (3, 12):
+                # A profiler only sees the thread that enabled it
+                threading.setprofile(self._profile_thread)
+            profile = cProfile.Profile()
+            self._profiles.append(profile)
+            profile.enable()
+        else:
+            tracemalloc.start()
+            self.snapshot('start', dump=True)
+
+    def _profile_thread(self, frame, event, arg):
+        # Called once in each new thread, to replace itself with a profiler
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Python 3.12+ allows only one profiler at a time; don't leave
+            # this hook to be called on every call of the thread
+            sys.setprofile(None)
+            return
+        with self._lock:
+            self._profiles.append(profile)
+
+    def stop(self):
+        """Stop profiling and write the results."""
+        if self.mode == 'cpu':
+            threading.setprofile(None)
+            with self._lock:
+                profiles = list(self._profiles)
+            # Disable all the profiles before merging any of them. Before
+            # Python 3.12, disabling a thread's profiler from another thread
+            # doesn't stop it, so the statistics of every profile are also
+            # frozen at this point, and threads that are still running
+            # don't add to them while they are merged.
+            for profile in profiles:
+                profile.disable()
+            frozen = [_FrozenProfile(profile) for profile in profiles]
+            stats = pstats.Stats(frozen[0])
+            for profile in frozen[1:]:
+                stats.add(profile)
+            stats.dump_stats(self._prefix + '.prof')
+            with open(self._prefix + '.collapsed', 'w',
+                      encoding='utf-8') as f:
+                for stack, microseconds in sorted(
+                        collapse_stats(stats).items()):
+                    f.write('{0} {1:d}\n'.format(stack, microseconds))
+            log.info('Wrote CPU profile of %d threads to %s.prof and %s',
+                     len(profiles), self._prefix, self._prefix + '.collapsed')
+        else:
+            self.snapshot('end', dump=True)
+            tracemalloc.stop()
+            log.info('Wrote memory profile to %s',
+                     self._prefix + '.memory.txt')
+
+    def snapshot(self, label, dump=False):
+        """Take a memory snapshot, and write its top allocators.
+
+        Parameters
+        ----------
+        label : str
+            Name of the snapshot, such as the phase that just finished.
+        dump : bool, optional
+            Also dump the snapshot, for :meth:`tracemalloc.Snapshot.load`.
+        """
+        if not tracemalloc.is_tracing():
+            return
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        ))
+        current, peak = tracemalloc.get_traced_memory()
+        with self._lock:
+            self._snapshots += 1
+            number = self._snapshots
+            previous = self._last_snapshot
+            self._last_snapshot = snapshot
+            if dump:
+                snapshot.dump('{0}-{1:03d}-{2}.tracemalloc'.format(
+                    self._prefix, number, re.sub(r'[^\w.-]+', '_', label)))
+            lines = ['== {0} ({1:d}): {2:d} bytes traced, {3:d} bytes '
+                     'peak'.format(label, number, current, peak),
+                     'Top allocators:']
+            lines.extend('  {0}'.format(stat) for stat in
+                         snapshot.statistics('lineno')[:self.top])
+            if previous is not None:
+                lines.append('Top growth since the previous snapshot:')
+                lines.extend('  {0}'.format(stat) for stat in
+                             snapshot.compare_to(previous, 'lineno')
+                             [:self.top])
+            with open(self._prefix + '.memory.txt', 'a',
+                      encoding='utf-8') as f:
+                f.write('\n'.join(lines) + '\n\n')
+        log.info('Memory after %s: %d bytes traced, %d bytes peak',
+                 label, current, peak)
+
+
+class _FrozenProfile(object):
+    """Statistics of a :class:`cProfile.Profile` at one point in time,
+    which :class:`pstats.Stats` loads like a profile.
+    """
+    def __init__(self, profile):
+        super().__init__()
+        profile.snapshot_stats()
+        self.stats = profile.stats
+
+    def create_stats(self):
+        pass
+
+
+def collapse_stats(stats, max_depth=100, min_seconds=1e-5):
+    """Reconstruct collapsed stacks from profile statistics.
+
+    :mod:`cProfile` only records caller-callee pairs, so the time of a
+    function that is called from several places is split between its call
+    paths in proportion to the time spent in each caller-callee pair, as
+    flame graph converters for pstats do.
+
+    Parameters
+    ----------
+    stats : :class:`pstats.Stats`
+        Profile statistics.
+    max_depth : int, optional
+        Maximum stack depth.
+    min_seconds : float, optional
+        Call paths that account for less time are dropped.
+
+    Returns
+    -------
+    stacks : dict
+        Time in microseconds (`int`) keyed by stack, whose frames are
+        joined by ``;`` from the outermost, as in ``flamegraph.pl`` input.
+    """
+    entries = stats.stats
+    callees = {}
+    for func, (_, _, _, _, callers) in entries.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, {})[func] = edge[3]
+
+    stacks = {}
+    todo = [((func,), 1.) for func, entry in entries.items()
+            if not entry[4]]
+    while todo:
+        path, fraction = todo.pop()
+        func = path[-1]
+        own_time = entries[func][2] * fraction
+        if own_time >= min_seconds:
+            stack = ';'.join(_frame_name(f) for f in path)
+            stacks[stack] = stacks.get(stack, 0) + int(own_time * 1e6)
+        if len(path) >= max_depth:
+            continue
+        for callee, edge_time in callees.get(func, {}).items():
+            callee_time = entries[callee][3]
+            if callee in path or callee_time <= 0.:
+                continue
+            callee_fraction = fraction * edge_time / callee_time
+            if callee_time * callee_fraction >= min_seconds:
+                todo.append((path + (callee,), callee_fraction))
+    return {stack: us for stack, us in stacks.items() if us > 0}
+
+
+def _frame_name(func):
+    filename, lineno, name = func
+    if filename == '~':
+        # Built-in functions
+        return name.replace(';', ':')
+    return '{0} ({1}:{2:d})'.format(
+        name, os.path.basename(filename), lineno).replace(';', ':')
@@ -0,0 +1,231 @@
+"""Live progress reporting of uploads.
+
+An :class:`UploadProgress` is given to :func:`ltdmason.s3upload.upload`,
+which walks the site first to total its files and bytes, and then reports
+each file as it is uploaded or skipped. While uploads are in progress, a
+background thread periodically reports the files and bytes done, the
+current throughput and S3 request rate (over the last interval), and an
+estimate of the time left. The report is either a log line, which suits CI
+logs, or a bar redrawn in place on a terminal.
+
+Several uploads can share one progress reporter, such as the concurrent
+uploads of a batch build: their totals are added up.
+"""
+
+import logging
+import sys
+import threading
+import time
+
+from .botoevents import attach
+from .builddir import format_size
+
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+
+class UploadProgress(object):
+    """Periodically report the progress of uploads.
+
+    Parameters
+    ----------
+    interval : float, optional
+        Seconds between reports.
+    stream : file object, optional
+        Terminal to draw a progress bar on. By default, progress is logged
+        at INFO level instead.
+    width : int, optional
+        Width of the progress bar, in characters.
+    """
+    def __init__(self, interval=10., stream=None, width=30):
+        super().__init__()
+        self.interval = interval
+        self.stream = stream
+        self.width = width
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._active = 0
+        self._thread = None
+        self._reset()
+
+    def _reset(self):
+        self.total_files = 0
+        self.total_bytes = 0
+        self.files = 0
+        self.bytes = 0
+        self.requests = 0
+        self._start_time = time.monotonic()
+        self._last = (self._start_time, 0, 0)
+
+    @classmethod
+    def for_terminal(cls, interval=10., stream=None):
+        """Create a progress reporter that draws a bar if ``stream``
+        (standard error by default) is a terminal, and logs otherwise.
+        """
+        if stream is None:
+            stream = sys.stderr
+        if not stream.isatty():
+            stream = None
+        if stream is not None:
+            # A bar can be redrawn much more often than a log line
+            interval = min(interval, 1.)
+        return cls(interval=interval, stream=stream)
+
+    def attach(self, client):
+        """Count the HTTP requests, including retries, sent by a botocore
+        client, for the request rate.
+
+        Attaching the same client more than once has no effect.
+        """
+        attach(client, self, [('before-send.s3', self._before_send)])
+
+    def _before_send(self, **kwargs):
+        with self._lock:
+            self.requests += 1
+
+    def start(self, files, bytes):
+        """Add an upload of ``files`` files totalling ``bytes`` bytes, and
+        start reporting if no other upload is in progress.
+        """
+        with self._lock:
+            if self._active == 0:
+                self._reset()
+            self._active += 1
+            self.total_files += files
+            self.total_bytes += bytes
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='upload-progress', daemon=True)
+                self._thread.start()
+
+    def add(self, files=1, bytes=0):
+        """Add files to the totals of an upload added by :meth:`start`,
+        for uploads that find their files as they go, such as
+        :func:`ltdmason.s3upload.stream_upload`.
+        """
+        with self._lock:
+            self.total_files += files
+            self.total_bytes += bytes
+
+    def update(self, files=1, bytes=0):
+        """Count files that were uploaded or skipped."""
+        with self._lock:
+            self.files += files
+            self.bytes += bytes
+
+    def finish(self):
+        """End an upload added by :meth:`start`; the final progress is
+        reported once no upload is in progress.
+        """
+        with self._lock:
+            self._active -= 1
+            if self._active > 0:
+                return
+            thread = self._thread
+            self._thread = None
+            self._wake.notify_all()
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+        self._report(final=True)
+
+    def _run(self):
+        # Runs until finish() replaces the thread
+        current = threading.current_thread()
+        with self._lock:
+            while self._thread is current:
+                self._wake.wait(self.interval)
+                if self._thread is not current:
+                    break
+                self._lock.release()
+                try:
+                    self._report()
+                finally:
+                    self._lock.acquire()
+
+    def snapshot(self):
+        """Progress so far.
+
+        Returns
+        -------
+        progress : dict
+            ``files``, ``bytes``, ``total_files``, ``total_bytes``,
+            ``requests`` and ``seconds`` since the uploads started;
+            ``bytes_per_second`` and ``requests_per_second`` over the time
+            since the previous snapshot; and ``eta_seconds``, the time left
+            at the average throughput so far (`None` until bytes are done).
+        """
+        now = time.monotonic()
+        with self._lock:
+            data = {'files': self.files, 'bytes': self.bytes,
+                    'total_files': self.total_files,
+                    'total_bytes': self.total_bytes,
+                    'requests': self.requests,
+                    'seconds': now - self._start_time}
+            last_time, last_bytes, last_requests = self._last
+            self._last = (now, self.bytes, self.requests)
+        elapsed = now - last_time
+        if elapsed > 0.:
+            data['bytes_per_second'] = (data['bytes'] - last_bytes) / elapsed
+            data['requests_per_second'] = \
+                (data['requests'] - last_requests) / elapsed
+        else:
+            data['bytes_per_second'] = 0.
+            data['requests_per_second'] = 0.
+        if data['bytes'] > 0 and data['seconds'] > 0.:
+            remaining = max(0, data['total_bytes'] - data['bytes'])
+            data['eta_seconds'] = \
+                remaining * data['seconds'] / data['bytes']
+        else:
+            data['eta_seconds'] = None
+        return data
+
+    def _report(self, final=False):
+        data = self.snapshot()
+        if final:
+            # Averages over the whole upload
+            if data['seconds'] > 0.:
+                data['bytes_per_second'] = data['bytes'] / data['seconds']
+                data['requests_per_second'] = \
+                    data['requests'] / data['seconds']
+            data['eta_seconds'] = 0.
+        line = format_progress(data)
+        if self.stream is None:
+            log.info('Upload %s', line)
+            return
+        if data['total_bytes']:
+            fraction = min(1., data['bytes'] / data['total_bytes'])
+        elif data['total_files']:
+            fraction = min(1., data['files'] / data['total_files'])
+        else:
+            fraction = 1.
+        filled = int(round(fraction * self.width))
+        self.stream.write('\r[{0}{1}] {2}\x1b[K'.format(
+            '#' * filled, '.' * (self.width - filled), line))
+        if final:
+            self.stream.write('\n')
+        self.stream.flush()
+
+
+def format_progress(data):
+    """Format a :meth:`UploadProgress.snapshot` as one line of text."""
+    if data['eta_seconds'] is None:
+        eta = '?'
+    else:
+        eta = _format_duration(data['eta_seconds'])
+    return ('{0:d}/{1:d} files, {2}/{3}, {4}/s, {5:.1f} req/s, '
+            'ETA {6}'.format(data['files'], data['total_files'],
+                             format_size(data['bytes']),
+                             format_size(data['total_bytes']),
+                             format_size(data['bytes_per_second']),
+                             data['requests_per_second'], eta))
+
+
+def _format_duration(seconds):
+    seconds = int(round(seconds))
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    if hours:
+        return '{0:d}h{1:02d}m{2:02d}s'.format(hours, minutes, seconds)
+    if minutes:
+        return '{0:d}m{1:02d}s'.format(minutes, seconds)
+    return '{0:d}s'.format(seconds)
@@ -14,7 +14,9 @@ import logging
 
 import boto3
 
+from .s3stats import S3CallStats
 from .s3upload import _upload_object
+from .storage import S3Backend
 
 
 log = logging.getLogger(__name__)
@@ -31,11 +33,13 @@ def run():
     session = boto3.session.Session(
         aws_access_key_id=args.aws_id,
         aws_secret_access_key=args.aws_secret)
-    s3 = session.resource('s3')
-    bucket = s3.Bucket(args.bucket)
+    backend = S3Backend(session, args.bucket)
+    call_stats = S3CallStats()
+    for client in backend.clients:
+        call_stats.attach(client)
 
     directories = []
-    for obj in bucket.objects.filter(Prefix=args.base_dir):
+    for obj in backend.list(args.base_dir):
         dirname = os.path.dirname(obj.key)
         if dirname:
             directories.append(dirname)
@@ -51,11 +55,15 @@ def run():
         if not args.dry_run:
             _upload_object(dirname,
                            content='',
-                           bucket=bucket,
+                           backend=backend,
                            metadata=redirect_metadata,
                            acl='public-read',
                            cache_control=cache_control)
 
+    call_stats.log_summary()
+    if args.s3_stats is not None:
+        call_stats.write(args.s3_stats)
+
 
 def parse_args():
     """Create an ``argparse.ArgumentParser`` instance that defines the
@@ -98,4 +106,11 @@ subsequently.
         help='Dry-run, prevents objects from being uploaded',
         action='store_true',
         default=False)
+    parser.add_argument(
+        '--s3-stats',
+        dest='s3_stats',
+        default=None,
+        metavar='PATH',
+        help='Write the number of S3 API calls, retries, errors, bytes and '
+             'latency of each S3 operation to this JSON file.')
     return parser.parse_args()
@@ -0,0 +1,191 @@
+"""Machine-readable reports of where the time of a run goes.
+
+A :class:`RunReport` times the phases of an ``ltd-mason`` or
+``ltd-mason-travis`` run with a monotonic clock, counts the files and bytes
+it handles, and writes both to a JSON file that dashboards can compare
+across builds. It records:
+
+- every :class:`ltdmason.pipeline.Pipeline` phase (``clone``, ``link``,
+  ``pip``, ``sphinx``, ``keeper-register``, ``upload``,
+  ``keeper-confirm``, ...), as a pipeline listener;
+- steps outside a pipeline, such as parsing and validating the manifest,
+  through :meth:`RunReport.timer`;
+- the steps of :func:`ltdmason.s3upload.upload`: ``upload-list``,
+  ``upload-delete``, ``upload-files`` and ``upload-redirects``. These run
+  once per directory of the site, so their entries add up the time of
+  every call;
+- the disk usage of the build directory after each phase
+  (``disk_usage_bytes``), if a
+  :class:`ltdmason.builddir.DiskUsageReporter` measures it.
+
+For example::
+
+   {"command": "ltd-mason", "status": "succeeded", "seconds": 312.4,
+    "phases": {"sphinx": {"start": 4.1, "end": 290.2, "seconds": 286.1,
+                          "calls": 1, "errors": 0}, ...},
+    "counts": {"files": 5210, "bytes": 81234567, "files_uploaded": 212,
+               ...},
+    "s3": {"operations": {...}, "totals": {...}}}
+
+``start`` and ``end`` are offsets in seconds from the start of the run.
+"""
+
+import datetime
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+from .fileutils import write_atomic
+
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+
+class RunReport(object):
+    """Timings and counts of a run, written as JSON.
+
+    A report is also a pipeline listener (see
+    :class:`ltdmason.pipeline.Pipeline`) and a context manager around the
+    run: on exit it records whether the run failed and, if it has a
+    ``path``, writes itself there. Instances are thread-safe, so the phases
+    of a batch build can share one; steps and counts of the same name are
+    then added up over all products.
+
+    Parameters
+    ----------
+    path : str, optional
+        JSON file to write when the run finishes.
+    command : str, optional
+        Name of the command being run.
+    call_stats : :class:`ltdmason.s3stats.S3CallStats`, optional
+        Accounting of the run's S3 API calls, which is included in the
+        report.
+    """
+    def __init__(self, path=None, command=None, call_stats=None):
+        super().__init__()
+        self.path = path
+        self.command = command
+        self.call_stats = call_stats
+        self.started_at = datetime.datetime.now(datetime.timezone.utc)
+        self.start_time = time.monotonic()
+        self.end_time = None
+        self.error = None
+        self._lock = threading.Lock()
+        self._phases = {}
+        self._counts = {}
+        self._disk_usage = {}
+
+    def __call__(self, phase, error):
+        self.add(phase.name, phase.start_time, phase.end_time, error=error)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.finish(error=exc)
+        if self.path is not None:
+            self.write(self.path)
+        return False
+
+    def add(self, name, start_time, end_time, error=None):
+        """Record a call of a phase.
+
+        Parameters
+        ----------
+        name : str
+            Name of the phase. Calls of the same phase are added up.
+        start_time, end_time : float
+            :func:`time.monotonic` times at which the call started and
+            ended.
+        error : Exception, optional
+            Exception raised by the call, if it failed.
+        """
+        start = start_time - self.start_time
+        end = end_time - self.start_time
+        with self._lock:
+            entry = self._phases.get(name)
+            if entry is None:
+                entry = {'start': start, 'end': end, 'seconds': 0.,
+                         'calls': 0, 'errors': 0}
+                self._phases[name] = entry
+            entry['start'] = min(entry['start'], start)
+            entry['end'] = max(entry['end'], end)
+            entry['seconds'] += end - start
+            entry['calls'] += 1
+            entry['errors'] += error is not None
+
+    @contextmanager
+    def timer(self, name):
+        """Context manager that records the time spent in its block as a
+        call of the ``name`` phase.
+        """
+        start_time = time.monotonic()
+        try:
+            yield
+        except BaseException as e:
+            self.add(name, start_time, time.monotonic(), error=e)
+            raise
+        self.add(name, start_time, time.monotonic())
+
+    def count(self, name, n=1):
+        """Add ``n`` to the ``name`` counter, such as ``'files_uploaded'``
+        or ``'bytes_uploaded'``.
+        """
+        with self._lock:
+            self._counts[name] = self._counts.get(name, 0) + n
+
+    def disk_usage(self, name, nbytes):
+        """Record the disk usage of the build directory after the ``name``
+        phase, in bytes. The last measurement of a phase wins.
+        """
+        with self._lock:
+            self._disk_usage[name] = nbytes
+
+    def finish(self, error=None):
+        """Mark the end of the run, and the exception that failed it."""
+        self.end_time = time.monotonic()
+        self.error = error
+
+    def as_dict(self):
+        """The report in machine-readable form (see the module docs)."""
+        end_time = self.end_time if self.end_time is not None \
+            else time.monotonic()
+        with self._lock:
+            phases = {name: dict(entry)
+                      for name, entry in self._phases.items()}
+            counts = dict(self._counts)
+            for name, nbytes in self._disk_usage.items():
+                if name in phases:
+                    phases[name]['disk_usage_bytes'] = nbytes
+        report = {
+            'command': self.command,
+            'started_at': self.started_at.isoformat(),
+            'seconds': end_time - self.start_time,
+            'status': 'failed' if self.error is not None else 'succeeded',
+            'error': None,
+            'phases': phases,
+            'counts': counts,
+        }
+        if self.error is not None:
+            report['error'] = '{0}: {1}'.format(
+                type(self.error).__name__, self.error)
+        if self.call_stats is not None:
+            report['s3'] = self.call_stats.as_dict()
+        return report
+
+    def write(self, path):
+        """Write the report to a JSON file."""
+        write_atomic(path, json.dumps(self.as_dict(), indent=2,
+                                      sort_keys=True), mode=0o644)
+        log.info('Wrote run report to %s', path)
+
+
+def timer(report, name):
+    """:meth:`RunReport.timer` of ``report``, or a context manager that does
+    nothing if ``report`` is `None`.
+    """
+    if report is None:
+        return nullcontext()
+    return report.timer(name)
@@ -0,0 +1,155 @@
+"""Accounting of S3 API calls through botocore event hooks.
+
+An :class:`S3CallStats` registers handlers on the event systems of boto3
+clients and counts, per S3 operation (``PutObject``, ``ListObjects``,
+``DeleteObjects``, ...), the calls made, failed calls, retried attempts,
+bytes sent and received, and call latency (from the start of a call to its
+parsed response, including retries). Requests are what S3 bills and
+throttles by, so this is the basic instrumentation for upload optimizations.
+
+:func:`ltdmason.s3upload.upload` accounts for its calls in an
+:class:`S3CallStats` that it logs a summary of and returns; the
+``ltd-mason --s3-stats`` and ``ltd-mason-make-redirects --s3-stats``
+options write the same numbers as JSON.
+"""
+
+import json
+import logging
+import threading
+import time
+
+from .botoevents import attach
+from .fileutils import write_atomic
+
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+_START_KEY = 'ltdmason_s3stats_start'
+
+_FIELDS = ('calls', 'errors', 'attempts', 'bytes_sent', 'bytes_received',
+           'seconds', 'max_seconds')
+
+
+class S3CallStats(object):
+    """Per-operation counters of S3 API calls.
+
+    Instances are thread-safe, so one can account for the calls of several
+    threads and clients, such as the threads of a streaming upload.
+    """
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+        self._operations = {}
+
+    def attach(self, client):
+        """Count the calls made by a botocore client.
+
+        Attaching the same client more than once has no effect.
+
+        Parameters
+        ----------
+        client : :class:`botocore.client.BaseClient`
+            An S3 client, such as ``session.client('s3')`` or the
+            ``meta.client`` of an S3 resource.
+        """
+        attach(client, self, [('before-call.s3', self._before_call),
+                              ('before-send.s3', self._before_send),
+                              ('after-call.s3', self._after_call),
+                              ('after-call-error.s3', self._after_error)])
+
+    def _entry(self, operation):
+        if operation not in self._operations:
+            self._operations[operation] = dict.fromkeys(_FIELDS, 0)
+        return self._operations[operation]
+
+    def _before_call(self, context=None, **kwargs):
+        if context is not None:
+            context[_START_KEY] = time.perf_counter()
+
+    def _before_send(self, request=None, event_name='', **kwargs):
+        # Sent once per attempt, so retried requests count their bytes again
+        try:
+            size = int(request.headers.get('Content-Length', 0))
+        except (AttributeError, TypeError, ValueError):
+            size = 0
+        with self._lock:
+            entry = self._entry(event_name.split('.')[-1])
+            entry['attempts'] += 1
+            entry['bytes_sent'] += size
+
+    def _after_call(self, http_response=None, model=None, context=None,
+                    **kwargs):
+        try:
+            size = int(http_response.headers.get('Content-Length', 0))
+        except (AttributeError, TypeError, ValueError):
+            size = 0
+        # Error responses are parsed too; the client then raises ClientError
+        error = getattr(http_response, 'status_code', 200) >= 300
+        self._finish(model.name, context, size, error)
+
+    def _after_error(self, context=None, event_name='', **kwargs):
+        # Exceptions without a response, such as connection errors. The
+        # event has no operation model, only the name in the event name.
+        self._finish(event_name.rsplit('.', 1)[-1], context, 0, True)
+
+    def _finish(self, operation, context, bytes_received, error):
+        start = (context or {}).get(_START_KEY)
+        elapsed = time.perf_counter() - start if start is not None else 0.
+        with self._lock:
+            entry = self._entry(operation)
+            entry['calls'] += 1
+            entry['errors'] += error
+            entry['bytes_received'] += bytes_received
+            entry['seconds'] += elapsed
+            entry['max_seconds'] = max(entry['max_seconds'], elapsed)
+
+    def as_dict(self):
+        """Counters in machine-readable form.
+
+        Returns
+        -------
+        stats : dict
+            ``'operations'`` maps operation names to ``calls``, ``errors``,
+            ``retries``, ``bytes_sent``, ``bytes_received``, ``seconds``
+            (total latency), ``mean_seconds`` and ``max_seconds``;
+            ``'totals'`` sums the counters over all operations.
+        """
+        with self._lock:
+            operations = {name: dict(entry)
+                          for name, entry in self._operations.items()}
+        totals = {'calls': 0, 'errors': 0, 'retries': 0, 'bytes_sent': 0,
+                  'bytes_received': 0, 'seconds': 0., 'max_seconds': 0.}
+        for entry in operations.values():
+            # Calls answered without being sent were never attempted
+            entry['retries'] = max(0, entry.pop('attempts') - entry['calls'])
+            for field in totals:
+                if field == 'max_seconds':
+                    totals[field] = max(totals[field], entry[field])
+                else:
+                    totals[field] += entry[field]
+        for entry in list(operations.values()) + [totals]:
+            entry['mean_seconds'] = \
+                entry['seconds'] / entry['calls'] if entry['calls'] else 0.
+        return {'operations': operations, 'totals': totals}
+
+    def write(self, path):
+        """Write the counters to a JSON file (see :meth:`as_dict`)."""
+        write_atomic(path, json.dumps(self.as_dict(), indent=2,
+                                      sort_keys=True), mode=0o644)
+
+    def log_summary(self, logger=None):
+        """Log a line per operation, and the totals, at INFO level."""
+        if logger is None:
+            logger = log
+        stats = self.as_dict()
+        for name in sorted(stats['operations']):
+            _log_line(logger, name, stats['operations'][name])
+        _log_line(logger, 'total', stats['totals'])
+
+
+def _log_line(logger, name, entry):
+    logger.info('S3 %s: %d calls, %d retries, %d errors, %d bytes sent, '
+                '%d bytes received, %.1f ms mean, %.1f ms max latency',
+                name, entry['calls'], entry['retries'], entry['errors'],
+                entry['bytes_sent'], entry['bytes_received'],
+                entry['mean_seconds'] * 1000., entry['max_seconds'] * 1000.)
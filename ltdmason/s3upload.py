@@ -1,21 +1,36 @@
 """S3 upload/sync utilities."""
 
 import os
+import hashlib
 import logging
-import mimetypes
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
 import boto3
 
+from .headerpolicy import HeaderPolicy, HeaderRule
+from .runreport import RunReport
+from .s3stats import S3CallStats
+from .storage import S3Backend, S3Error  # NOQA
+from .tracing import span
+
 log = logging.getLogger(__name__)
 log.addHandler(logging.NullHandler())
 
+_DEFAULT_POLICY = HeaderPolicy()
+
 
 def upload(bucket_name, path_prefix, source_dir,
            upload_dir_redirect_objects=True,
            surrogate_key=None, acl=None,
            cache_control_max_age=31536000,
            aws_access_key_id=None, aws_secret_access_key=None,
-           aws_profile=None):
+           aws_profile=None, session=None, already_uploaded=None,
+           skip_unchanged=False, cache_control_rules=None,
+           header_policy=None, endpoint_url=None, backend=None,
+           call_stats=None, report=None, tracer=None, progress=None,
+           max_workers=1, tuner=None, bandwidth=None, changed_dirs=None,
+           previous_prefix=None):
     """Upload built documentation to S3.
 
     This function places the contents of the Sphinx HTML build directory
@@ -66,16 +81,105 @@ def upload(bucket_name, path_prefix, source_dir,
         Name of AWS profile in :file:`~/.aws/credentials`. Use this instead
         of `aws_access_key_id` and `aws_secret_access_key` for file-based
         credentials.
+    session : :class:`boto3.session.Session`, optional
+        An existing boto3 session to upload with, instead of creating one
+        from the credential arguments. Long-running processes pass a shared
+        session to avoid re-creating it for every upload.
+    already_uploaded : dict, optional
+        Signatures of files that :func:`stream_upload` already uploaded,
+        keyed by local path. Files whose signature (see
+        :func:`file_signature`) still matches are not uploaded again, so
+        this call acts as a final reconcile pass.
+    skip_unchanged : bool, optional
+        Don't upload files whose MD5 hash matches the ETag of the existing
+        object in the bucket. Object headers aren't compared. Normalize
+        volatile fragments of the HTML first (see
+        :mod:`ltdmason.normalize`) for this to skip most unchanged files.
+        With ``previous_prefix``, the objects of the previous upload are
+        compared instead.
+    cache_control_rules : list of tuple, optional
+        ``(glob, cache_control)`` pairs that override the Cache-Control
+        header of files whose path relative to ``source_dir`` matches the
+        glob (``*`` also matches ``/``). The first matching rule wins; other
+        files use ``cache_control_max_age``. See
+        :data:`ltdmason.fingerprint.DEFAULT_CACHE_CONTROL`. These rules take
+        precedence over ``header_policy``.
+    header_policy : :class:`ltdmason.headerpolicy.HeaderPolicy`, optional
+        Per-path Content-Type, Cache-Control, Content-Encoding and metadata
+        of uploaded files. By default the Content-Type is guessed from the
+        file extension.
+    endpoint_url : str, optional
+        URL of an S3-compatible service to use instead of AWS, such as the
+        local stand-in of the benchmark suite in ``benchmarks/``.
+    backend : :class:`ltdmason.storage.StorageBackend`, optional
+        Storage to publish to instead of the S3 bucket, such as a
+        :class:`ltdmason.storage.FilesystemBackend` mirror. ``bucket_name``,
+        the credentials, ``session`` and ``endpoint_url`` are then ignored.
+    call_stats : :class:`ltdmason.s3stats.S3CallStats`, optional
+        Accounting of S3 API calls to add this upload's calls to. By
+        default a new one is created.
+    report : :class:`ltdmason.runreport.RunReport`, optional
+        Report to add the time spent listing, deleting, uploading files and
+        uploading directory redirects (the ``upload-list``,
+        ``upload-delete``, ``upload-files`` and ``upload-redirects`` steps)
+        to, and counts of the files and bytes of the site, and of those
+        uploaded, copied, skipped and deleted.
+    tracer : :class:`ltdmason.tracing.Tracer`, optional
+        Tracer that records the sync of each directory, and each S3 API
+        call, as spans.
+    progress : :class:`ltdmason.progress.UploadProgress`, optional
+        Reporter of the files and bytes uploaded or skipped, the upload
+        throughput and request rate, and the time left. The site is walked
+        once first to total its files and bytes.
+    max_workers : int, optional
+        Maximum number of concurrent file uploads. Uploads are queued across
+        directories, so the next directory is listed while the files of the
+        previous ones are still uploading.
+    tuner : :class:`ltdmason.autotune.ConcurrencyTuner`, optional
+        Tuner that adjusts the number of concurrent file uploads to the
+        measured throughput, instead of ``max_workers``.
+    bandwidth : :class:`ltdmason.bandwidth.BandwidthLimiter`, optional
+        Cap of the bandwidth of the S3 requests, which can be shared with
+        other uploads.
+    changed_dirs : list of str, optional
+        Directories of the site, relative to ``source_dir`` (``''`` for the
+        whole site), that are known to have changed since the objects under
+        ``path_prefix``, or ``previous_prefix``, were uploaded, such as the
+        :attr:`~ltdmason.packagediff.PackageDiff.output_dirs` of an
+        incremental build. With ``skip_unchanged``, their files are
+        uploaded without hashing them or listing their ETags.
+    previous_prefix : str, optional
+        The root directory in the bucket of a previous upload of the site,
+        such as the previous build of the LTD Keeper edition, when
+        ``path_prefix`` is a new, empty prefix. With ``skip_unchanged``,
+        files whose MD5 hash matches the ETag of the previous upload's
+        object are copied from it within the bucket, with the headers of
+        this upload, instead of being uploaded.
+
+    Returns
+    -------
+    call_stats : :class:`ltdmason.s3stats.S3CallStats`
+        Accounting of the S3 API calls made, whose summary is also logged.
     """
     log.debug('s3upload.upload({0}, {1}, {2})'.format(
         bucket_name, path_prefix, source_dir))
 
-    session = boto3.session.Session(
-        profile_name=aws_profile,
-        aws_access_key_id=aws_access_key_id,
-        aws_secret_access_key=aws_secret_access_key)
-    s3 = session.resource('s3')
-    bucket = s3.Bucket(bucket_name)
+    if backend is None:
+        if session is None:
+            session = boto3.session.Session(
+                profile_name=aws_profile,
+                aws_access_key_id=aws_access_key_id,
+                aws_secret_access_key=aws_secret_access_key)
+        backend = S3Backend(session, bucket_name, endpoint_url=endpoint_url)
+    if call_stats is None:
+        call_stats = S3CallStats()
+    for client in backend.clients:
+        call_stats.attach(client)
+    if report is None:
+        report = RunReport()
+    if tracer is not None:
+        for client in backend.clients:
+            tracer.attach(client)
 
     metadata = None
     if surrogate_key is not None:
@@ -88,68 +192,253 @@ def upload(bucket_name, path_prefix, source_dir,
     else:
         cache_control = None
 
-    manager = ObjectManager(session, bucket_name, path_prefix)
-
-    for (rootdir, dirnames, filenames) in os.walk(source_dir):
-        log.debug('rootdir=%r dirnames=%r filenames=%r',
-                  rootdir, dirnames, filenames)
-
-        # name of root directory on S3 bucket
-        bucket_root = os.path.relpath(rootdir, start=source_dir)
-        if bucket_root in ('.', '/'):
-            bucket_root = ''
-        log.debug('bucket_root=%r', bucket_root)
-
-        # Delete bucket directories that no longer exist in source
+    header_policy = _make_header_policy(header_policy, cache_control_rules)
+    manager = ObjectManager(session, bucket_name, path_prefix,
+                            backend=backend)
+    if previous_prefix is not None and \
+            previous_prefix.strip('/') != path_prefix.strip('/'):
+        previous_manager = ObjectManager(session, bucket_name,
+                                         previous_prefix, backend=backend)
+    else:
+        previous_manager = None
+
+    if progress is not None:
+        for client in backend.clients:
+            progress.attach(client)
+        sizes = [signature[0] for signature in
+                 _scan_signatures(source_dir).values()]
+        progress.start(len(sizes), sum(sizes))
+    if tuner is not None:
+        for client in backend.clients:
+            tuner.attach(client)
+        max_workers = tuner.maximum
+    if bandwidth is not None:
+        for client in backend.clients:
+            bandwidth.attach(client)
+    if max_workers > 1:
+        executor = ThreadPoolExecutor(max_workers=max_workers,
+                                      thread_name_prefix='upload')
+    else:
+        executor = None
+    # Uploads in flight, from all directories
+    pending = set()
+    try:
+        for (rootdir, dirnames, filenames) in os.walk(source_dir):
+            log.debug('rootdir=%r dirnames=%r filenames=%r',
+                      rootdir, dirnames, filenames)
+
+            # name of root directory on S3 bucket
+            bucket_root = os.path.relpath(rootdir, start=source_dir)
+            if bucket_root in ('.', '/'):
+                bucket_root = ''
+            log.debug('bucket_root=%r', bucket_root)
+
+            with span(tracer, 'sync /' + bucket_root, 'directory',
+                      sample_key=bucket_root, files=len(filenames),
+                      dirs=len(dirnames)):
+                _sync_directory(
+                    bucket_root, rootdir, dirnames, filenames, path_prefix,
+                    manager, backend, report,
+                    already_uploaded=already_uploaded,
+                    skip_unchanged=skip_unchanged,
+                    upload_dir_redirect_objects=upload_dir_redirect_objects,
+                    metadata=metadata, acl=acl, cache_control=cache_control,
+                    header_policy=header_policy, progress=progress,
+                    executor=executor, tuner=tuner,
+                    changed=_in_dirs(bucket_root, changed_dirs),
+                    pending=pending, max_pending=2 * max_workers,
+                    previous_manager=previous_manager)
+        if pending:
+            with report.timer('upload-files'):
+                _wait_pending(pending, 0)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        if progress is not None:
+            progress.finish()
+
+    call_stats.log_summary()
+    return call_stats
+
+
+def _sync_directory(bucket_root, rootdir, dirnames, filenames, path_prefix,
+                    manager, backend, report, already_uploaded=None,
+                    skip_unchanged=False, upload_dir_redirect_objects=True,
+                    metadata=None, acl=None, cache_control=None,
+                    header_policy=None, progress=None, executor=None,
+                    tuner=None, changed=False, pending=None,
+                    max_pending=0, previous_manager=None):
+    """Sync one directory of the site for :func:`upload`: delete stale
+    objects, upload its files and its directory redirect object.
+
+    Files are uploaded with ``executor``, if given, and gated by ``tuner``,
+    if given. Their futures are added to the ``pending`` set without
+    waiting for them, unless it has more than ``max_pending`` (see
+    :func:`_wait_pending`). The files of a ``changed`` directory aren't
+    compared with the bucket, even with ``skip_unchanged``. With a
+    ``previous_manager``, unchanged files are copied from the previous
+    upload that it manages.
+    """
+    def upload_file(local_path, bucket_path, rel_path, size,
+                    copy_source=None):
+        _upload_file(local_path, bucket_path, backend,
+                     metadata=metadata, acl=acl,
+                     cache_control=cache_control,
+                     header_policy=header_policy,
+                     rel_path=rel_path, copy_source=copy_source)
+        if copy_source is None:
+            report.count('files_uploaded')
+            report.count('bytes_uploaded', size)
+        else:
+            report.count('files_copied')
+            report.count('bytes_copied', size)
+        if progress is not None:
+            progress.update(bytes=size)
+
+    # Delete bucket directories that no longer exist in source
+    with report.timer('upload-list'):
         bucket_dirnames = manager.list_dirnames_in_directory(bucket_root)
-        log.debug('bucket_dirnames=%r', bucket_dirnames)
-        for bucket_dirname in bucket_dirnames:
-            if bucket_dirname not in dirnames:
-                log.debug(('Deleting bucket directory {0}'.format(
-                    bucket_dirname)))
-                manager.delete_directory(bucket_dirname)
-
-        # Delete files that no longer exist in source
-        bucket_filenames = manager.list_filenames_in_directory(bucket_root)
-        log.debug('bucket_filenames=%r', bucket_dirnames)
-        for bucket_filename in bucket_filenames:
-            if bucket_filename not in filenames:
-                bucket_filename = os.path.join(bucket_root, bucket_filename)
-                log.debug('Deleting bucket file {0}'.format(bucket_filename))
-                manager.delete_file(bucket_filename)
-
-        # Upload files in directory
+    log.debug('bucket_dirnames=%r', bucket_dirnames)
+    for bucket_dirname in bucket_dirnames:
+        if bucket_dirname not in dirnames:
+            bucket_dirname = os.path.join(bucket_root, bucket_dirname)
+            log.debug(('Deleting bucket directory {0}'.format(
+                bucket_dirname)))
+            with report.timer('upload-delete'):
+                report.count('objects_deleted',
+                             manager.delete_directory(bucket_dirname))
+
+    # Delete files that no longer exist in source
+    with report.timer('upload-list'):
+        bucket_etags = {}
+        previous_etags = {}
+        if skip_unchanged and not changed and previous_manager is None:
+            bucket_etags = manager.list_etags_in_directory(bucket_root)
+            bucket_filenames = list(bucket_etags)
+        else:
+            bucket_filenames = manager.list_filenames_in_directory(
+                bucket_root)
+            if skip_unchanged and not changed:
+                previous_etags = previous_manager.list_etags_in_directory(
+                    bucket_root)
+    log.debug('bucket_filenames=%r', bucket_filenames)
+    for bucket_filename in bucket_filenames:
+        # The redirect objects of subdirectories look like files; those
+        # of the local subdirectories are uploaded again when synced
+        if bucket_filename not in filenames and \
+                bucket_filename not in dirnames:
+            bucket_filename = os.path.join(bucket_root, bucket_filename)
+            log.debug('Deleting bucket file {0}'.format(bucket_filename))
+            with report.timer('upload-delete'):
+                report.count('objects_deleted',
+                             manager.delete_file(bucket_filename))
+
+    # Upload files in directory
+    with report.timer('upload-files'):
         for filename in filenames:
             local_path = os.path.join(rootdir, filename)
+            size = os.path.getsize(local_path)
+            report.count('files')
+            report.count('bytes', size)
+            if already_uploaded and \
+                    already_uploaded.get(local_path) \
+                    == file_signature(local_path):
+                log.debug('Already uploaded {0}'.format(local_path))
+                report.count('files_already_uploaded')
+                report.count('bytes_already_uploaded', size)
+                if progress is not None:
+                    progress.update(bytes=size)
+                continue
+            if filename in bucket_etags and \
+                    bucket_etags[filename] == file_md5(local_path):
+                log.debug('Unchanged {0}'.format(local_path))
+                report.count('files_unchanged')
+                report.count('bytes_unchanged', size)
+                if progress is not None:
+                    progress.update(bytes=size)
+                continue
             bucket_path = os.path.join(path_prefix, bucket_root, filename)
-            log.debug('Uploading to {0}'.format(bucket_path))
-            _upload_file(local_path, bucket_path, bucket,
-                         metadata=metadata, acl=acl,
-                         cache_control=cache_control)
-
-        # Upload a directory redirect object
-        if upload_dir_redirect_objects is True:
-            bucket_dir_path = os.path.join(path_prefix, bucket_root)
-            bucket_dir_path = bucket_dir_path.rstrip('/')
-            if metadata:
-                redirect_metadata = dict(metadata)
+            args = (local_path, bucket_path,
+                    os.path.join(bucket_root, filename), size)
+            if filename in previous_etags and \
+                    previous_etags[filename] == file_md5(local_path):
+                copy_source = previous_manager.key(
+                    os.path.join(bucket_root, filename))
+                log.debug('Copying {0} to {1}'.format(copy_source,
+                                                      bucket_path))
+                # Nothing is sent to the bucket but the request
+                nbytes = 0
+            else:
+                copy_source = None
+                log.debug('Uploading to {0}'.format(bucket_path))
+                nbytes = size
+            if executor is None:
+                upload_file(*args, copy_source=copy_source)
+                continue
+            if tuner is None:
+                future = executor.submit(upload_file, *args,
+                                         copy_source=copy_source)
             else:
-                redirect_metadata = {}
-            redirect_metadata['dir-redirect'] = 'true'
+                future = tuner.submit(executor, nbytes, upload_file, *args,
+                                      copy_source=copy_source)
+            pending.add(future)
+            # Keep the queue short, so that a failed upload stops the sync
+            # early and the memory use doesn't grow with the site
+            _wait_pending(pending, max_pending)
+
+    # Upload a directory redirect object
+    if upload_dir_redirect_objects is True:
+        bucket_dir_path = os.path.join(path_prefix, bucket_root)
+        bucket_dir_path = bucket_dir_path.rstrip('/')
+        if metadata:
+            redirect_metadata = dict(metadata)
+        else:
+            redirect_metadata = {}
+        redirect_metadata['dir-redirect'] = 'true'
+        with report.timer('upload-redirects'):
             _upload_object(bucket_dir_path,
                            content='',
-                           bucket=bucket,
+                           backend=backend,
                            metadata=redirect_metadata,
                            acl=acl,
                            cache_control=cache_control)
+        report.count('redirects_uploaded')
 
 
-def _upload_file(local_path, bucket_path, bucket,
-                 metadata=None, acl=None, cache_control=None):
-    """Upload a file to the S3 bucket.
+def _wait_pending(pending, max_pending):
+    """Wait until at most ``max_pending`` of the ``pending`` upload futures
+    are left, removing the finished ones, and raise the error of the first
+    failed upload.
+    """
+    for future in [f for f in pending if f.done()]:
+        pending.discard(future)
+        future.result()
+    while len(pending) > max_pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            pending.discard(future)
+            future.result()
+
+
+def _in_dirs(rel_dir, dirs):
+    """Whether the site directory ``rel_dir`` (``''`` for the root) is one
+    of ``dirs``, or inside one of them.
+    """
+    for dirname in dirs or []:
+        dirname = dirname.strip('/')
+        if dirname in ('', '.') or rel_dir == dirname or \
+                rel_dir.startswith(dirname + '/'):
+            return True
+    return False
 
-    This function uses the mimetypes module to guess and then set the
-    Content-Type and Encoding-Type headers.
+
+def _upload_file(local_path, bucket_path, backend,
+                 metadata=None, acl=None, cache_control=None,
+                 header_policy=None, rel_path=None, copy_source=None):
+    """Upload a file to the storage backend.
+
+    The Content-Type and other headers are set by a header policy, which by
+    default guesses the Content-Type from the file extension.
 
     Parameters
     ----------
@@ -158,8 +447,8 @@ def _upload_file(local_path, bucket_path, bucket,
     bucket_path : str
         Destination path (also known as the key name) of the file in the
         S3 bucket.
-    bucket : `boto3` Bucket instance
-        S3 bucket.
+    backend : :class:`ltdmason.storage.StorageBackend`
+        Storage, such as an S3 bucket.
     metadata : dict, optional
         Header metadata values. These keys will appear in headers as
         ``x-amz-meta-*``.
@@ -169,31 +458,264 @@ def _upload_file(local_path, bucket_path, bucket,
     cache_control : str, optional
         The cache-control header value. For example, 'max-age=31536000'.
         ``'
+    header_policy : :class:`ltdmason.headerpolicy.HeaderPolicy`, optional
+        Per-path headers, which take precedence over ``cache_control``.
+    rel_path : str, optional
+        Path of the file relative to the site root, which the
+        ``header_policy`` rules are matched against. Defaults to
+        ``local_path``.
+    copy_source : str, optional
+        Key of an object in the backend with the same content as the file,
+        which is copied, with the headers of the file, instead of uploading
+        the file.
     """
-    extra_args = {}
-    if acl is not None:
-        extra_args['ACL'] = acl
-    if metadata is not None:
-        extra_args['Metadata'] = metadata
-    if cache_control is not None:
-        extra_args['CacheControl'] = cache_control
+    if header_policy is None:
+        header_policy = _DEFAULT_POLICY
+    extra_args = header_policy.extra_args(rel_path or local_path,
+                                          metadata=metadata, acl=acl,
+                                          cache_control=cache_control)
+    log.debug(str(extra_args))
+    if copy_source is not None:
+        backend.copy(copy_source, bucket_path, extra_args=extra_args)
+    else:
+        backend.put(bucket_path, path=local_path, extra_args=extra_args)
 
-    # guess_type returns None if it cannot detect a type
-    content_type, content_encoding = mimetypes.guess_type(local_path,
-                                                          strict=False)
-    if content_type is not None:
-        extra_args['ContentType'] = content_type
 
-    log.debug(str(extra_args))
+def _make_header_policy(header_policy, cache_control_rules):
+    """Combine a header policy with ``(glob, cache_control)`` rules that
+    take precedence over it.
+    """
+    if header_policy is None:
+        header_policy = _DEFAULT_POLICY
+    if cache_control_rules:
+        header_policy = header_policy.with_rules(
+            HeaderRule(glob, cache_control=value)
+            for glob, value in cache_control_rules)
+    return header_policy
+
+
+def file_signature(local_path):
+    """Signature of a local file's content, as ``(size, mtime_ns)``, or
+    `None` if the file doesn't exist.
+    """
+    try:
+        stat = os.stat(local_path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_size, stat.st_mtime_ns)
 
-    obj = bucket.Object(bucket_path)
-    # no return status from the upload_file api
-    obj.upload_file(local_path, ExtraArgs=extra_args)
 
+def file_md5(local_path):
+    """Hex MD5 digest of a file, which is the ETag S3 gives objects
+    uploaded in a single part.
+    """
+    md5 = hashlib.md5()
+    with open(local_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def _scan_signatures(source_dir):
+    signatures = {}
+    stack = [source_dir]
+    while stack:
+        try:
+            entries = os.scandir(stack.pop())
+        except FileNotFoundError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir():
+                    stack.append(entry.path)
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                signatures[entry.path] = (stat.st_size, stat.st_mtime_ns)
+    return signatures
+
+
+def stream_upload(bucket_name, path_prefix, source_dir, until,
+                  since=None, poll_interval=1., max_workers=8,
+                  surrogate_key=None, acl=None,
+                  cache_control_max_age=31536000,
+                  aws_access_key_id=None, aws_secret_access_key=None,
+                  aws_profile=None, session=None, cache_control_rules=None,
+                  header_policy=None, endpoint_url=None, backend=None,
+                  call_stats=None, report=None, tracer=None, progress=None,
+                  tuner=None, bandwidth=None):
+    """Upload files to S3 while they are still being written to a
+    directory, for example by a running Sphinx build.
+
+    ``source_dir`` is polled every ``poll_interval`` seconds. A file is
+    uploaded once its size and modification time are unchanged between two
+    polls, so files that are still being written aren't uploaded. Polling
+    stops once ``until()`` returns `True`.
+
+    Files that were last modified before ``since`` aren't streamed at all:
+    they are left over from an earlier build (in incremental builds, for
+    example), and may yet be rewritten or deleted.
+
+    This function only adds and overwrites objects. Pass its return value
+    to :func:`upload` as ``already_uploaded`` once the directory is
+    complete: that final reconcile pass uploads files that were written or
+    rewritten late (such as the search index), deletes stale objects, and
+    uploads directory redirect objects.
+
+    Parameters
+    ----------
+    bucket_name : str
+        Name of the S3 bucket where documentation is uploaded.
+    path_prefix : str
+        The root directory in the bucket where documentation is stored.
+    source_dir : str
+        Directory being written. It doesn't need to exist yet.
+    until : callable
+        Called without arguments before each poll; returns `True` once
+        ``source_dir`` is complete.
+    since : float, optional
+        Start time of the build, in seconds since the epoch (as returned by
+        :func:`time.time`). By default files are streamed whatever their
+        age.
+    poll_interval : float, optional
+        Seconds between polls of ``source_dir``.
+    max_workers : int, optional
+        Maximum number of concurrent file uploads.
+    surrogate_key, acl, cache_control_max_age : optional
+        Headers, as for :func:`upload`.
+    cache_control_rules, header_policy : optional
+        Per-path headers, as for :func:`upload`.
+    aws_access_key_id, aws_secret_access_key, aws_profile, session : optional
+        Credentials or an existing boto3 session, as for :func:`upload`.
+    endpoint_url : str, optional
+        URL of an S3-compatible service, as for :func:`upload`.
+    backend : :class:`ltdmason.storage.StorageBackend`, optional
+        Storage to publish to instead of the S3 bucket, as for
+        :func:`upload`.
+    call_stats : :class:`ltdmason.s3stats.S3CallStats`, optional
+        Accounting of S3 API calls to add this upload's calls to.
+    report : :class:`ltdmason.runreport.RunReport`, optional
+        Report to add the counts of the files and bytes streamed
+        (``files_streamed`` and ``bytes_streamed``) to.
+    tracer : :class:`ltdmason.tracing.Tracer`, optional
+        Tracer that records each S3 API call as a span.
+    progress : :class:`ltdmason.progress.UploadProgress`, optional
+        Reporter of the files and bytes streamed, whose totals grow as
+        files are found.
+    tuner : :class:`ltdmason.autotune.ConcurrencyTuner`, optional
+        Tuner that adjusts the number of concurrent uploads, instead of
+        ``max_workers``.
+    bandwidth : :class:`ltdmason.bandwidth.BandwidthLimiter`, optional
+        Cap of the bandwidth of the S3 requests, as for :func:`upload`.
+
+    Returns
+    -------
+    uploaded : dict
+        Signatures (see :func:`file_signature`) of the uploaded files at the
+        time they were uploaded, keyed by local path.
+    """
+    if backend is None:
+        if session is None:
+            session = boto3.session.Session(
+                profile_name=aws_profile,
+                aws_access_key_id=aws_access_key_id,
+                aws_secret_access_key=aws_secret_access_key)
+        backend = S3Backend(session, bucket_name, endpoint_url=endpoint_url)
+    if call_stats is not None:
+        for client in backend.clients:
+            call_stats.attach(client)
+    if report is None:
+        report = RunReport()
+    if tracer is not None:
+        for client in backend.clients:
+            tracer.attach(client)
+    if progress is not None:
+        for client in backend.clients:
+            progress.attach(client)
+    if tuner is not None:
+        for client in backend.clients:
+            tuner.attach(client)
+        max_workers = tuner.maximum
+    if bandwidth is not None:
+        for client in backend.clients:
+            bandwidth.attach(client)
+
+    metadata = None
+    if surrogate_key is not None:
+        metadata = {'surrogate-key': surrogate_key}
+    if cache_control_max_age is not None:
+        cache_control = 'max-age={0:d}'.format(cache_control_max_age)
+    else:
+        cache_control = None
 
-def _upload_object(bucket_path, bucket, content='',
+    header_policy = _make_header_policy(header_policy, cache_control_rules)
+
+    def upload_file(local_path, size):
+        rel_path = os.path.relpath(local_path, source_dir)
+        backend.put(
+            os.path.join(path_prefix, rel_path), path=local_path,
+            extra_args=header_policy.extra_args(
+                rel_path, metadata=metadata, acl=acl,
+                cache_control=cache_control))
+        report.count('files_streamed')
+        report.count('bytes_streamed', size)
+        if progress is not None:
+            progress.update(bytes=size)
+
+    if since is not None:
+        since_ns = int(since * 1e9)
+    else:
+        since_ns = None
+
+    uploaded = {}
+    futures = {}
+    previous = {}
+    if progress is not None:
+        progress.start(0, 0)
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while True:
+                complete = until()
+                current = _scan_signatures(source_dir)
+                for local_path, signature in current.items():
+                    if since_ns is not None and signature[1] < since_ns:
+                        continue
+                    if previous.get(local_path) == signature \
+                            and uploaded.get(local_path) != signature:
+                        uploaded[local_path] = signature
+                        if progress is not None:
+                            progress.add(bytes=signature[0])
+                        args = (local_path, signature[0])
+                        if tuner is None:
+                            future = executor.submit(upload_file, *args)
+                        else:
+                            future = tuner.submit(executor, signature[0],
+                                                  upload_file, *args)
+                        futures[future] = (local_path, signature)
+                previous = current
+                if complete:
+                    break
+                time.sleep(poll_interval)
+    finally:
+        if progress is not None:
+            progress.finish()
+
+    for future, (local_path, signature) in futures.items():
+        if future.exception() is not None:
+            # Left for the final reconcile pass
+            log.warning('Streaming upload of %s failed: %s',
+                        local_path, future.exception())
+            if uploaded.get(local_path) == signature:
+                del uploaded[local_path]
+    log.info('Streamed %d files from %s', len(uploaded), source_dir)
+    return uploaded
+
+
+def _upload_object(bucket_path, backend, content='',
                    metadata=None, acl=None, cache_control=None):
-    """Upload an arbitrary object to an S3 bucket.
+    """Upload an arbitrary object to a storage backend.
 
     Parameters
     ----------
@@ -202,8 +724,8 @@ def _upload_object(bucket_path, bucket, content='',
         S3 bucket.
     content : str or bytes
         Object content, optional
-    bucket : `boto3` Bucket instance
-        S3 bucket.
+    backend : :class:`ltdmason.storage.StorageBackend`
+        Storage, such as an S3 bucket.
     metadata : dict, optional
         Header metadata values. These keys will appear in headers as
         ``x-amz-meta-*``.
@@ -221,8 +743,7 @@ def _upload_object(bucket_path, bucket, content='',
         args['ACL'] = acl
     if cache_control is not None:
         args['CacheControl'] = cache_control
-    obj = bucket.Object(bucket_path)
-    obj.put(Body=content, **args)
+    backend.put(bucket_path, body=content, extra_args=args)
 
 
 class ObjectManager(object):
@@ -240,13 +761,19 @@ class ObjectManager(object):
     bucket_root : str
         The version slug is the name root directory in the bucket where
         documentation is stored.
+    endpoint_url : str, optional
+        URL of an S3-compatible service to use instead of AWS.
+    backend : :class:`ltdmason.storage.StorageBackend`, optional
+        Storage to manage instead of the S3 bucket. ``session``,
+        ``bucket_name`` and ``endpoint_url`` are then ignored.
     """
-    def __init__(self, session, bucket_name, bucket_root):
+    def __init__(self, session, bucket_name, bucket_root, endpoint_url=None,
+                 backend=None):
         super().__init__()
-        s3 = session.resource('s3')
-        bucket = s3.Bucket(bucket_name)
-        self._session = session
-        self._bucket = bucket
+        if backend is None:
+            backend = S3Backend(session, bucket_name,
+                                endpoint_url=endpoint_url)
+        self._backend = backend
         self._bucket_root = bucket_root
         # Strip trailing '/' from bucket_root for comparisons
         if self._bucket_root.endswith('/'):
@@ -269,7 +796,7 @@ class ObjectManager(object):
         """
         prefix = self._create_prefix(dirname)
         filenames = []
-        for obj in self._bucket.objects.filter(Prefix=prefix):
+        for obj in self._backend.list(prefix):
             if obj.key.endswith('/'):
                 continue
             obj_dirname = os.path.dirname(obj.key)
@@ -279,6 +806,32 @@ class ObjectManager(object):
                                                  start=prefix))
         return filenames
 
+    def list_etags_in_directory(self, dirname):
+        """List the ETags of all file-type objects that exist at the root of
+        this bucket directory.
+
+        Parameters
+        ----------
+        dirname : str
+            Directory name in the bucket relative to ``bucket_root/``.
+
+        Returns
+        -------
+        etags : dict
+            ETags (`str`, without quotes) keyed by file name relative to
+            ``dirname``. Objects uploaded in several parts have ETags that
+            aren't MD5 digests.
+        """
+        prefix = self._create_prefix(dirname)
+        etags = {}
+        for obj in self._backend.list(prefix):
+            if obj.key.endswith('/'):
+                continue
+            if os.path.dirname(obj.key) == prefix:
+                filename = os.path.relpath(obj.key, start=prefix)
+                etags[filename] = obj.etag
+        return etags
+
     def list_dirnames_in_directory(self, dirname):
         """List all names of directories that exist at the root of this
         bucket directory.
@@ -299,7 +852,7 @@ class ObjectManager(object):
         """
         prefix = self._create_prefix(dirname)
         dirnames = []
-        for obj in self._bucket.objects.filter(Prefix=prefix):
+        for obj in self._backend.list(prefix):
             dirname = os.path.dirname(obj.key)
             # if the object is a directory redirect, make it look like a dir
             if dirname == '':
@@ -318,6 +871,16 @@ class ObjectManager(object):
 
         return dirnames
 
+    def key(self, filename):
+        """Key of a file in the bucket.
+
+        Parameters
+        ----------
+        filename : str
+            Name of the file, relative to ``bucket_root/``.
+        """
+        return os.path.join(self._bucket_root, filename)
+
     def _create_prefix(self, dirname):
         if dirname in ('.', '/'):
             dirname = ''
@@ -335,11 +898,17 @@ class ObjectManager(object):
         ----------
         filename : str
             Name of the file, relative to ``bucket_root/``.
+
+        Returns
+        -------
+        count : int
+            Number of objects deleted.
         """
         key = os.path.join(self._bucket_root, filename)
-        objects = list(self._bucket.objects.filter(Prefix=key))
-        for obj in objects:
-            obj.delete()
+        # Not by prefix, which would also match 'filename/...' and siblings
+        # such as 'filename.txt'
+        self._backend.delete([key])
+        return 1
 
     def delete_directory(self, dirname):
         """Delete a directory (and contents) from the bucket.
@@ -348,25 +917,17 @@ class ObjectManager(object):
         ----------
         dirname : str
             Name of the directory, relative to ``bucket_root/``.
+
+        Returns
+        -------
+        count : int
+            Number of objects deleted.
         """
         key = os.path.join(self._bucket_root, dirname)
         if not key.endswith('/'):
             key += '/'
 
-        delete_keys = {'Objects': []}
-        key_objects = [{'Key': obj.key}
-                       for obj in self._bucket.objects.filter(Prefix=key)]
-        assert len(key_objects) > 0
-        delete_keys['Objects'] = key_objects
-        # based on http://stackoverflow.com/a/34888103
-        s3 = self._session.resource('s3')
-        r = s3.meta.client.delete_objects(Bucket=self._bucket.name,
-                                          Delete=delete_keys)
-        log.debug(r)
-        if 'Errors' in r:
-            raise S3Error('S3 could not delete {0}'.format(key))
-
-
-class S3Error(Exception):
-    """General errors in S3 API usage."""
-    pass
+        keys = [obj.key for obj in self._backend.list(key)]
+        assert len(keys) > 0
+        self._backend.delete(keys)
+        return len(keys)
@@ -0,0 +1,166 @@
+"""In-process Sphinx builds run in pre-warmed worker processes.
+
+Running ``sphinx-build`` as a subprocess pays for interpreter start-up and
+for importing Sphinx and its extensions on every build. A
+:class:`SphinxRunner` instead drives :class:`sphinx.application.Sphinx`
+directly in worker processes forked from a ``forkserver`` that has already
+imported Sphinx. Each worker runs exactly one build and then exits, so a
+doc repo's ``conf.py`` cannot leak ``sys.path`` changes, monkeypatches or
+registered extensions into later builds, while the next worker is already
+started and warm.
+
+``python -m ltdmason.sphinxrunner`` runs ``sphinx-build`` (taking the same
+arguments) with an intersphinx inventory cache installed; see
+:mod:`ltdmason.intersphinxcache`.
+"""
+
+import argparse
+import logging
+import multiprocessing
+import os
+import sys
+import traceback
+from io import StringIO
+
+from .intersphinxcache import DEFAULT_TTL, InventoryCache
+from .intersphinxcache import install as install_inventory_cache
+
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+PRELOAD_MODULES = [
+    'docutils.parsers.rst',
+    'sphinx.application',
+    'sphinx.builders.html',
+    'sphinx.ext.autodoc',
+    'sphinx.ext.intersphinx',
+    'sphinx.ext.mathjax',
+    'sphinx.util.docutils',
+]
+"""Modules imported by the forkserver so that workers start warm."""
+
+
+class SphinxRunner(object):
+    """Run Sphinx builds in isolated, pre-warmed worker processes.
+
+    Parameters
+    ----------
+    processes : int, optional
+        Number of worker processes, which is the number of builds that can
+        run concurrently.
+    preload : list of str, optional
+        Modules to import in the forkserver before workers are forked.
+        Defaults to :data:`PRELOAD_MODULES`.
+    """
+    def __init__(self, processes=1, preload=None):
+        super().__init__()
+        if preload is None:
+            preload = PRELOAD_MODULES
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload(list(preload))
+        # maxtasksperchild=1 gives each build a fresh process
+        self._pool = context.Pool(processes=processes, maxtasksperchild=1)
+
+    def build(self, source_dir, output_dir, builder='html', force_all=True,
+              inventory_cache=None):
+        """Build a Sphinx project.
+
+        Parameters
+        ----------
+        source_dir : str
+            Directory of the Sphinx project (containing ``conf.py``).
+        output_dir : str
+            Output directory. Doctrees are written to ``.doctrees/`` inside
+            it, as ``sphinx-build`` does.
+        builder : str, optional
+            Name of the Sphinx builder.
+        force_all : bool, optional
+            Write all output files, like ``sphinx-build -a``. As with
+            ``sphinx-build``, a saved environment in ``output_dir`` is
+            reused either way.
+        inventory_cache : `ltdmason.intersphinxcache.InventoryCache`, optional
+            Cache that serves the build's intersphinx inventories.
+
+        Raises
+        ------
+        SphinxBuildError
+            Raised if the build fails.
+        """
+        status_code, status, warning = self._pool.apply(
+            _build, (os.path.abspath(source_dir),
+                     os.path.abspath(output_dir),
+                     builder, force_all, inventory_cache))
+        log.debug(status)
+        log.debug(warning)
+        if status_code != 0:
+            raise SphinxBuildError(
+                'Sphinx build of {0} failed with status {1:d}\n{2}'.format(
+                    source_dir, status_code, warning))
+
+    def close(self):
+        """Shut down the worker processes."""
+        self._pool.close()
+        self._pool.join()
+
+
+def _build(source_dir, output_dir, builder, force_all, inventory_cache=None):
+    """Run a Sphinx build; this is executed in a worker process.
+
+    Returns
+    -------
+    status_code : int
+        Zero if the build succeeded.
+    status : str
+        Sphinx's status output.
+    warning : str
+        Sphinx's warning output, and the traceback of any exception.
+    """
+    from sphinx.application import Sphinx
+    from sphinx.util.docutils import docutils_namespace, patch_docutils
+
+    status = StringIO()
+    warning = StringIO()
+    try:
+        if inventory_cache is not None:
+            install_inventory_cache(inventory_cache)
+        with patch_docutils(source_dir), docutils_namespace():
+            app = Sphinx(source_dir, source_dir, output_dir,
+                         os.path.join(output_dir, '.doctrees'),
+                         builder, status=status, warning=warning)
+            app.build(force_all=force_all)
+            status_code = app.statuscode
+    except Exception:
+        warning.write(traceback.format_exc())
+        status_code = 1
+    return status_code, status.getvalue(), warning.getvalue()
+
+
+class SphinxBuildError(Exception):
+    """A Sphinx build failed."""
+    pass
+
+
+def main(argv=None):
+    """Run ``sphinx-build`` with an intersphinx inventory cache.
+
+    The ``--inventory-cache``, ``--inventory-ttl`` and ``--offline``
+    options configure the cache; all other arguments are passed to
+    ``sphinx-build``.
+    """
+    parser = argparse.ArgumentParser(prog='python -m ltdmason.sphinxrunner',
+                                     add_help=False)
+    parser.add_argument('--inventory-cache', required=True)
+    parser.add_argument('--inventory-ttl', type=float, default=DEFAULT_TTL)
+    parser.add_argument('--offline', action='store_true', default=False)
+    args, sphinx_args = parser.parse_known_args(argv)
+
+    from sphinx.cmd.build import main as sphinx_build
+
+    install_inventory_cache(InventoryCache(args.inventory_cache,
+                                           ttl=args.inventory_ttl,
+                                           offline=args.offline))
+    return sphinx_build(sphinx_args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
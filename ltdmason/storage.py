@@ -0,0 +1,432 @@
+"""Storage backends that the upload engine publishes to.
+
+:mod:`ltdmason.s3upload` syncs a built site through a
+:class:`StorageBackend`, which lists, puts, copies, heads and batch-deletes
+objects by key. Three backends are provided:
+
+- :class:`S3Backend` publishes to an S3 bucket (or an S3-compatible
+  service) with boto3;
+- :class:`FilesystemBackend` publishes to a local directory, for example a
+  mirror served by a static web server;
+- :class:`MemoryBackend` keeps objects in memory, so the sync engine can be
+  tested and benchmarked offline at full speed.
+
+Object headers are passed and returned in the form of boto3 ``ExtraArgs``:
+a `dict` with ``ContentType``, ``CacheControl``, ``ContentEncoding``,
+``ACL`` and ``Metadata`` keys.
+"""
+
+import abc
+import base64
+import collections
+import hashlib
+import json
+import os
+import threading
+
+from .fileutils import write_atomic
+
+__all__ = ['ObjectInfo', 'StorageBackend', 'S3Backend', 'FilesystemBackend',
+           'MemoryBackend', 'StorageError', 'S3Error']
+
+ObjectInfo = collections.namedtuple('ObjectInfo',
+                                    ['key', 'size', 'etag', 'headers'])
+"""An object in a storage backend: its key, size in bytes, ETag (the hex
+MD5 digest of objects uploaded in one part, without quotes) and headers
+(`None` in listings, where they aren't available).
+"""
+
+_HEADER_KEYS = ('ContentType', 'CacheControl', 'ContentEncoding',
+                'Metadata')
+
+
+class StorageBackend(abc.ABC):
+    """Interface of storage backends.
+
+    Backends must be safe to use from several threads at once.
+    """
+
+    @abc.abstractmethod
+    def list(self, prefix=''):
+        """Iterate over the objects whose keys start with ``prefix``.
+
+        Yields
+        ------
+        info : :class:`ObjectInfo`
+            Objects in key order, with ``headers`` set to `None`.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def put(self, key, path=None, body=None, extra_args=None):
+        """Write an object, from a local file or from memory.
+
+        Parameters
+        ----------
+        key : str
+            Key of the object.
+        path : str, optional
+            Local file with the object's content.
+        body : bytes or str, optional
+            Content of the object, if ``path`` isn't set.
+        extra_args : dict, optional
+            Headers, in the form of boto3 ``ExtraArgs``.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def copy(self, source_key, key, extra_args=None):
+        """Copy an object within the backend.
+
+        Parameters
+        ----------
+        source_key : str
+            Key of the object to copy.
+        key : str
+            Key of the copy.
+        extra_args : dict, optional
+            Headers of the copy. By default the source's headers are kept.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def delete(self, keys):
+        """Delete objects; keys that don't exist are ignored.
+
+        Raises
+        ------
+        StorageError
+            Raised if some objects could not be deleted.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def head(self, key):
+        """Get an object's :class:`ObjectInfo` with its headers, or `None`
+        if it doesn't exist.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get(self, key):
+        """Get an object's content (`bytes`), or `None` if it doesn't
+        exist.
+        """
+        raise NotImplementedError
+
+    @property
+    def clients(self):
+        """botocore clients that the backend makes API calls with, for
+        instrumentation (see :class:`ltdmason.s3stats.S3CallStats`).
+        """
+        return []
+
+
+class S3Backend(StorageBackend):
+    """Objects in an S3 bucket.
+
+    Parameters
+    ----------
+    session : :class:`boto3.session.Session`
+        A boto3 session provisioned with the correct identities.
+    bucket_name : str
+        Name of the S3 bucket.
+    endpoint_url : str, optional
+        URL of an S3-compatible service to use instead of AWS.
+    """
+
+    max_delete = 1000
+    """Maximum number of keys in a DeleteObjects request."""
+
+    def __init__(self, session, bucket_name, endpoint_url=None):
+        super().__init__()
+        self.bucket_name = bucket_name
+        self._bucket = session.resource(
+            's3', endpoint_url=endpoint_url).Bucket(bucket_name)
+        # Unlike resources, clients can be shared between threads
+        self._client = session.client('s3', endpoint_url=endpoint_url)
+
+    @property
+    def clients(self):
+        return [self._client, self._bucket.meta.client]
+
+    def list(self, prefix=''):
+        for obj in self._bucket.objects.filter(Prefix=prefix):
+            yield ObjectInfo(obj.key, obj.size, obj.e_tag.strip('"'), None)
+
+    def put(self, key, path=None, body=None, extra_args=None):
+        extra_args = extra_args or {}
+        if path is not None:
+            # upload_file switches to multipart uploads for large files
+            self._client.upload_file(path, self.bucket_name, key,
+                                     ExtraArgs=extra_args)
+        else:
+            self._client.put_object(Bucket=self.bucket_name, Key=key,
+                                    Body=body or b'', **extra_args)
+
+    def copy(self, source_key, key, extra_args=None):
+        kwargs = {}
+        if extra_args is not None:
+            kwargs = dict(extra_args, MetadataDirective='REPLACE')
+            kwargs.setdefault('Metadata', {})
+        self._client.copy_object(
+            Bucket=self.bucket_name, Key=key,
+            CopySource={'Bucket': self.bucket_name, 'Key': source_key},
+            **kwargs)
+
+    def delete(self, keys):
+        keys = list(keys)
+        for start in range(0, len(keys), self.max_delete):
+            batch = keys[start:start + self.max_delete]
+            response = self._client.delete_objects(
+                Bucket=self.bucket_name,
+                Delete={'Objects': [{'Key': key} for key in batch]})
+            if response.get('Errors'):
+                raise S3Error('S3 could not delete {0}'.format(
+                    ', '.join(e['Key'] for e in response['Errors'])))
+
+    def head(self, key):
+        try:
+            response = self._client.head_object(Bucket=self.bucket_name,
+                                                Key=key)
+        except self._client.exceptions.ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                return None
+            raise
+        headers = {name: response[name] for name in _HEADER_KEYS
+                   if response.get(name)}
+        return ObjectInfo(key, response['ContentLength'],
+                          response['ETag'].strip('"'), headers)
+
+    def get(self, key):
+        try:
+            response = self._client.get_object(Bucket=self.bucket_name,
+                                               Key=key)
+        except self._client.exceptions.NoSuchKey:
+            return None
+        return response['Body'].read()
+
+
+class MemoryBackend(StorageBackend):
+    """Objects in memory.
+
+    ``objects`` maps keys to ``(body, etag, extra_args)`` tuples.
+    """
+    def __init__(self):
+        super().__init__()
+        self.objects = {}
+        self._lock = threading.Lock()
+
+    def list(self, prefix=''):
+        with self._lock:
+            items = sorted((key, len(body), etag) for key, (body, etag, _)
+                           in self.objects.items() if key.startswith(prefix))
+        for key, size, etag in items:
+            yield ObjectInfo(key, size, etag, None)
+
+    def put(self, key, path=None, body=None, extra_args=None):
+        if path is not None:
+            with open(path, 'rb') as f:
+                body = f.read()
+        body = _as_bytes(body)
+        etag = hashlib.md5(body).hexdigest()
+        with self._lock:
+            self.objects[key] = (body, etag, dict(extra_args or {}))
+
+    def copy(self, source_key, key, extra_args=None):
+        with self._lock:
+            if source_key not in self.objects:
+                raise StorageError('{0} does not exist'.format(source_key))
+            body, etag, source_args = self.objects[source_key]
+            if extra_args is None:
+                extra_args = source_args
+            self.objects[key] = (body, etag, dict(extra_args))
+
+    def delete(self, keys):
+        with self._lock:
+            for key in keys:
+                self.objects.pop(key, None)
+
+    def head(self, key):
+        with self._lock:
+            if key not in self.objects:
+                return None
+            body, etag, extra_args = self.objects[key]
+        return ObjectInfo(key, len(body), etag, dict(extra_args))
+
+    def get(self, key):
+        with self._lock:
+            if key not in self.objects:
+                return None
+            return self.objects[key][0]
+
+
+class FilesystemBackend(StorageBackend):
+    """Objects in a local directory.
+
+    An object is written to the path of its key under ``root``, so the
+    directory can be served as a mirror of the bucket. Headers and ETags
+    are kept in JSON sidecars under ``root/.ltd-meta/``. Objects whose key
+    is also a directory, such as directory redirect objects, are stored
+    inside their sidecar.
+
+    Parameters
+    ----------
+    root : str
+        Root directory. It is created if necessary.
+    """
+
+    meta_dirname = '.ltd-meta'
+    """Name of the sidecar directory in ``root``."""
+
+    def __init__(self, root):
+        super().__init__()
+        self.root = os.path.abspath(root)
+        self._meta_root = os.path.join(self.root, self.meta_dirname)
+        os.makedirs(self._meta_root, exist_ok=True)
+        self._lock = threading.RLock()
+
+    def _path(self, key):
+        parts = key.split('/')
+        if not key or key.startswith('/') or '..' in parts or '.' in parts \
+                or '' in parts or parts[0] == self.meta_dirname:
+            raise ValueError('Invalid key {0!r}'.format(key))
+        return os.path.join(self.root, *parts)
+
+    def _meta_path(self, key):
+        return os.path.join(self._meta_root, *key.split('/')) + '.json'
+
+    def _read_meta(self, key):
+        try:
+            with open(self._meta_path(key), encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _write_meta(self, key, meta):
+        path = self._meta_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_atomic(path, json.dumps(meta, sort_keys=True),
+                     prefix='.storage-', mode=0o644)
+
+    def _inline(self, key, meta):
+        """Move the body of an object into its sidecar, so its path can
+        become a directory.
+        """
+        path = self._path(key)
+        with open(path, 'rb') as f:
+            meta['body'] = base64.b64encode(f.read()).decode('ascii')
+        self._write_meta(key, meta)
+        os.remove(path)
+
+    def list(self, prefix=''):
+        # Only the sidecar directory that contains the prefix is walked
+        start = os.path.join(self._meta_root, *prefix.split('/')[:-1])
+        infos = []
+        for rootdir, dirnames, filenames in os.walk(start):
+            for filename in filenames:
+                if not filename.endswith('.json'):
+                    continue
+                path = os.path.join(rootdir, filename)
+                key = os.path.relpath(path, self._meta_root)[:-len('.json')]
+                key = key.replace(os.sep, '/')
+                if not key.startswith(prefix):
+                    continue
+                try:
+                    with open(path, encoding='utf-8') as f:
+                        meta = json.load(f)
+                except FileNotFoundError:
+                    continue
+                infos.append(ObjectInfo(key, meta['size'], meta['etag'],
+                                        None))
+        return iter(sorted(infos))
+
+    def put(self, key, path=None, body=None, extra_args=None):
+        target = self._path(key)
+        if path is not None:
+            with open(path, 'rb') as f:
+                body = f.read()
+        body = _as_bytes(body)
+        meta = {'size': len(body), 'etag': hashlib.md5(body).hexdigest(),
+                'headers': dict(extra_args or {})}
+        with self._lock:
+            # Objects at the paths of parent directories move aside
+            parts = key.split('/')
+            for i in range(1, len(parts)):
+                parent_key = '/'.join(parts[:i])
+                if os.path.isfile(self._path(parent_key)):
+                    self._inline(parent_key,
+                                 self._read_meta(parent_key) or {})
+            if os.path.isdir(target):
+                meta['body'] = base64.b64encode(body).decode('ascii')
+            else:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                write_atomic(target, body, prefix='.storage-', mode=0o644)
+            self._write_meta(key, meta)
+
+    def copy(self, source_key, key, extra_args=None):
+        with self._lock:
+            source = self.head(source_key)
+            if source is None:
+                raise StorageError('{0} does not exist'.format(source_key))
+            if extra_args is None:
+                extra_args = source.headers
+            self.put(key, body=self.get(source_key), extra_args=extra_args)
+
+    def delete(self, keys):
+        with self._lock:
+            for key in keys:
+                meta = self._read_meta(key)
+                if meta is None:
+                    continue
+                if 'body' not in meta:
+                    path = self._path(key)
+                    os.remove(path)
+                    self._prune(os.path.dirname(path), self.root)
+                meta_path = self._meta_path(key)
+                os.remove(meta_path)
+                self._prune(os.path.dirname(meta_path), self._meta_root)
+
+    @staticmethod
+    def _prune(directory, root):
+        """Remove empty directories from ``directory`` up to ``root``."""
+        while directory != root:
+            try:
+                os.rmdir(directory)
+            except OSError:
+                return
+            directory = os.path.dirname(directory)
+
+    def head(self, key):
+        meta = self._read_meta(key)
+        if meta is None:
+            return None
+        return ObjectInfo(key, meta['size'], meta['etag'], meta['headers'])
+
+    def get(self, key):
+        with self._lock:
+            meta = self._read_meta(key)
+            if meta is None:
+                return None
+            if 'body' in meta:
+                return base64.b64decode(meta['body'])
+            with open(self._path(key), 'rb') as f:
+                return f.read()
+
+
+def _as_bytes(body):
+    if body is None:
+        return b''
+    if isinstance(body, str):
+        return body.encode('utf-8')
+    return body
+
+
+class StorageError(Exception):
+    """General errors of storage backends."""
+    pass
+
+
+class S3Error(StorageError):
+    """General errors in S3 API usage."""
+    pass
@@ -0,0 +1,221 @@
+"""Span tracing of the build and upload pipeline.
+
+A :class:`Tracer` records *spans*, intervals of work on a given thread, and
+writes them as a Chrome trace event file (the JSON format read by
+``chrome://tracing``, Perfetto and speedscope). Unlike the aggregate
+timings of :mod:`ltdmason.runreport`, a trace shows what ran concurrently
+on each thread, and so stalls, head-of-line blocking and idle gaps. It
+records:
+
+- pipeline phases, as a pipeline listener (category ``phase``);
+- the sync of each directory by :func:`ltdmason.s3upload.upload`
+  (category ``directory``);
+- each S3 API call, with its operation, key, bytes sent, HTTP status and
+  retries, through botocore event hooks on the upload's clients (category
+  ``request``).
+
+Large builds make many thousands of requests, so directory and request
+spans can be sampled (``sample_rate``). Sampling is by key, so that the
+same objects are traced from one build to the next.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+from contextlib import contextmanager, nullcontext
+
+from .botoevents import attach
+from .fileutils import write_atomic
+
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+_CONTEXT_KEY = 'ltdmason_trace'
+
+
+class Tracer(object):
+    """Record spans and write them as a Chrome trace event file.
+
+    A tracer is also a pipeline listener (see
+    :class:`ltdmason.pipeline.Pipeline`). Instances are thread-safe.
+
+    Parameters
+    ----------
+    sample_rate : float, optional
+        Fraction of the directory and request spans that are recorded.
+        Phases are always recorded.
+    """
+    def __init__(self, sample_rate=1.):
+        super().__init__()
+        self.sample_rate = sample_rate
+        self.start_time = time.monotonic()
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._events = []
+        self._threads = {}
+
+    def __call__(self, phase, error):
+        args = {}
+        if error is not None:
+            args['error'] = '{0}: {1}'.format(type(error).__name__, error)
+        self.add(phase.name, 'phase', phase.start_time, phase.end_time,
+                 thread_id=phase.thread_id, args=args)
+
+    def is_sampled(self, key):
+        """`True` if spans about ``key`` (such as an object key) are
+        recorded.
+        """
+        if self.sample_rate >= 1.:
+            return True
+        return zlib.crc32(key.encode('utf-8')) < self.sample_rate * 2 ** 32
+
+    def add(self, name, category, start_time, end_time, thread_id=None,
+            args=None):
+        """Record a span.
+
+        Parameters
+        ----------
+        name : str
+            Name of the span.
+        category : str
+            Category of the span, such as ``'phase'`` or ``'request'``.
+        start_time, end_time : float
+            :func:`time.monotonic` times of the start and end of the span.
+        thread_id : int, optional
+            Identifier of the thread that did the work. Defaults to the
+            current thread.
+        args : dict, optional
+            Attributes of the span, shown by trace viewers.
+        """
+        if thread_id is None:
+            thread = threading.current_thread()
+            thread_id = thread.ident
+        else:
+            thread = None
+        event = {'name': name, 'cat': category, 'ph': 'X',
+                 'ts': (start_time - self.start_time) * 1e6,
+                 'dur': (end_time - start_time) * 1e6,
+                 'pid': self._pid, 'tid': thread_id}
+        if args:
+            event['args'] = args
+        with self._lock:
+            self._events.append(event)
+            if thread is not None:
+                self._threads[thread_id] = thread.name
+
+    @contextmanager
+    def span(self, name, category, sample_key=None, **args):
+        """Context manager that records its block as a span.
+
+        Parameters
+        ----------
+        name : str
+            Name of the span.
+        category : str
+            Category of the span.
+        sample_key : str, optional
+            If set, the span is only recorded if this key is sampled (see
+            :meth:`is_sampled`).
+        **args
+            Attributes of the span.
+        """
+        if sample_key is not None and not self.is_sampled(sample_key):
+            yield
+            return
+        start_time = time.monotonic()
+        try:
+            yield
+        except BaseException as e:
+            args['error'] = '{0}: {1}'.format(type(e).__name__, e)
+            raise
+        finally:
+            self.add(name, category, start_time, time.monotonic(),
+                     args=args)
+
+    def attach(self, client):
+        """Record a span for each API call of a botocore client.
+
+        Attaching the same client more than once has no effect.
+        """
+        attach(client, self,
+               [('before-parameter-build.s3', self._before_call),
+                ('before-send.s3', self._before_send),
+                ('after-call.s3', self._after_call),
+                ('after-call-error.s3', self._after_error)])
+
+    def _before_call(self, model=None, params=None, context=None,
+                     **kwargs):
+        # Parameters as given by the caller, before serialization
+        if context is None:
+            return
+        params = params or {}
+        key = params.get('Key') or params.get('Prefix') or ''
+        if not self.is_sampled(key or model.name):
+            return
+        context[_CONTEXT_KEY] = {'start_time': time.monotonic(),
+                                 'key': key, 'attempts': 0, 'bytes_sent': 0}
+
+    def _before_send(self, request=None, **kwargs):
+        # The request context is that of the call
+        context = getattr(request, 'context', None) or {}
+        call = context.get(_CONTEXT_KEY)
+        if call is None:
+            return
+        call['attempts'] += 1
+        try:
+            call['bytes_sent'] = int(request.headers.get('Content-Length', 0))
+        except (AttributeError, TypeError, ValueError):
+            pass
+
+    def _after_call(self, http_response=None, model=None, context=None,
+                    **kwargs):
+        self._finish(model.name, context,
+                     getattr(http_response, 'status_code', None))
+
+    def _after_error(self, context=None, exception=None, event_name='',
+                     **kwargs):
+        # The event has no operation model, only the name in the event name
+        self._finish(event_name.rsplit('.', 1)[-1], context, None,
+                     error=exception)
+
+    def _finish(self, operation, context, status, error=None):
+        call = (context or {}).get(_CONTEXT_KEY)
+        if call is None:
+            return
+        args = {'operation': operation, 'key': call['key'],
+                'bytes_sent': call['bytes_sent'], 'status': status,
+                'retries': max(0, call['attempts'] - 1)}
+        if error is not None:
+            args['error'] = '{0}: {1}'.format(type(error).__name__, error)
+        name = '{0} {1}'.format(operation, call['key']).rstrip()
+        self.add(name, 'request', call['start_time'], time.monotonic(),
+                 args=args)
+
+    def as_dict(self):
+        """The trace in Chrome trace event format."""
+        with self._lock:
+            events = list(self._events)
+            threads = dict(self._threads)
+        for thread_id, thread_name in sorted(threads.items()):
+            events.append({'name': 'thread_name', 'ph': 'M',
+                           'pid': self._pid, 'tid': thread_id,
+                           'args': {'name': thread_name}})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms',
+                'otherData': {'sample_rate': self.sample_rate}}
+
+    def write(self, path):
+        """Write the trace to a JSON file."""
+        write_atomic(path, json.dumps(self.as_dict()), mode=0o644)
+        log.info('Wrote trace to %s', path)
+
+
+def span(tracer, name, category, **args):
+    """:meth:`Tracer.span` of ``tracer``, or a context manager that does
+    nothing if ``tracer`` is `None`.
+    """
+    if tracer is None:
+        return nullcontext()
+    return tracer.span(name, category, **args)
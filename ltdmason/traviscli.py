@@ -7,8 +7,17 @@ import logging
 import argparse
 import textwrap
 
+from .autotune import ConcurrencyTuner, parse_concurrency
+from .bandwidth import BandwidthLimiter
+from .builddir import parse_size
 from .manifest import TravisManifest
+from .openmetrics import BuildMetrics
 from .product import TravisProduct
+from .profiling import Profiler
+from .progress import UploadProgress
+from .runreport import RunReport
+from .s3stats import S3CallStats
+from .tracing import Tracer, span
 from .uploader import upload
 
 
@@ -54,11 +63,70 @@ def run():
         logger.info('ltd-mason-travis skipping PR build')
         sys.exit(0)
 
-    manifest = TravisManifest()
-    product = TravisProduct(os.path.abspath(os.path.expandvars(args.html_dir)))
+    if args.report is not None or args.metrics_file is not None:
+        call_stats = S3CallStats()
+    else:
+        call_stats = None
+
+    if args.profile is not None:
+        profiler = Profiler(args.profile, output_dir=args.profile_dir,
+                            name='ltd-mason-travis')
+        profiler.start()
+    else:
+        profiler = None
 
-    if not args.no_upload:
-        upload(manifest, product)
+    if args.trace is not None:
+        tracer = Tracer(sample_rate=args.trace_sample_rate)
+    else:
+        tracer = None
+
+    if args.progress:
+        progress = UploadProgress.for_terminal(
+            interval=args.progress_interval)
+    else:
+        progress = None
+
+    if args.upload_concurrency == 'auto':
+        tuner = ConcurrencyTuner(state_path=args.upload_tuning_state)
+        max_workers = 1
+    else:
+        tuner = None
+        max_workers = args.upload_concurrency
+
+    if args.max_bandwidth is not None:
+        bandwidth = BandwidthLimiter(
+            parse_size(args.max_bandwidth),
+            bypass_size=parse_size(args.bandwidth_bypass_size))
+    else:
+        bandwidth = None
+
+    report = RunReport(args.report, command='ltd-mason-travis',
+                       call_stats=call_stats)
+    try:
+        with report:
+            with report.timer('manifest'), \
+                    span(tracer, 'manifest', 'phase'):
+                manifest = TravisManifest()
+            product = TravisProduct(
+                os.path.abspath(os.path.expandvars(args.html_dir)))
+
+            if not args.no_upload:
+                upload(manifest, product, call_stats=call_stats,
+                       report=report, tracer=tracer, progress=progress,
+                       max_workers=max_workers, tuner=tuner,
+                       bandwidth=bandwidth)
+                if tuner is not None:
+                    tuner.save()
+    finally:
+        if profiler is not None:
+            profiler.stop()
+        if tracer is not None:
+            tracer.write(args.trace)
+        if args.metrics_file is not None:
+            metrics = BuildMetrics(args.metrics_file,
+                                   command='ltd-mason-travis')
+            metrics.add(report)
+            metrics.write()
 
 
 def parse_args():
@@ -130,10 +198,122 @@ def parse_args():
         default=False,
         action='store_true',
         help='Skip the upload to S3 and ltd-keeper')
+    parser.add_argument(
+        '--upload-concurrency',
+        dest='upload_concurrency',
+        default=os.getenv('LTD_MASON_UPLOAD_CONCURRENCY', '1'),
+        metavar='N|auto',
+        help='Number of files of a directory to upload to S3 concurrently, '
+             'or "auto" to ramp it up while throughput increases and back '
+             'off when latency rises or S3 throttles requests. Defaults to '
+             '$LTD_MASON_UPLOAD_CONCURRENCY or 1.')
+    parser.add_argument(
+        '--upload-tuning-state',
+        dest='upload_tuning_state',
+        default=os.getenv('LTD_MASON_UPLOAD_TUNING_STATE'),
+        metavar='PATH',
+        help='JSON file in which --upload-concurrency auto saves the best '
+             'concurrency of each host, for the next run to start from. '
+             'Defaults to $LTD_MASON_UPLOAD_TUNING_STATE.')
+    parser.add_argument(
+        '--max-bandwidth',
+        dest='max_bandwidth',
+        default=os.getenv('LTD_MASON_MAX_BANDWIDTH'),
+        metavar='SIZE',
+        help='Cap the total bandwidth of S3 uploads to this many bytes '
+             'per second, such as 20M. Defaults to $LTD_MASON_MAX_BANDWIDTH; '
+             'uncapped if unset.')
+    parser.add_argument(
+        '--bandwidth-bypass-size',
+        dest='bandwidth_bypass_size',
+        default='0',
+        metavar='SIZE',
+        help='Send S3 requests of at most this size, such as 64K, without '
+             'waiting for --max-bandwidth, so that small files keep the '
+             'request rate up; their bytes still count towards the cap.')
+    parser.add_argument(
+        '--progress',
+        dest='progress',
+        default=False,
+        action='store_true',
+        help='Report the progress of the S3 upload: files and bytes done, '
+             'throughput, request rate and the estimated time left. A bar '
+             'is drawn if standard error is a terminal; otherwise a line '
+             'is logged every --progress-interval seconds.')
+    parser.add_argument(
+        '--progress-interval',
+        dest='progress_interval',
+        type=float,
+        default=10.,
+        metavar='SECONDS',
+        help='Seconds between --progress log lines (default: 10).')
+    parser.add_argument(
+        '--report',
+        dest='report',
+        default=os.getenv('LTD_MASON_REPORT'),
+        metavar='PATH',
+        help='Write a JSON report of the run to this file: the duration of '
+             'each step (manifest parsing, LTD Keeper authentication and '
+             'registration, the listing, delete, upload and redirect steps '
+             'of the S3 upload, and confirmation), file and byte counts, '
+             'and S3 API call statistics. Defaults to $LTD_MASON_REPORT.')
+    parser.add_argument(
+        '--metrics-file',
+        dest='metrics_file',
+        default=os.getenv('LTD_MASON_METRICS_FILE'),
+        metavar='PATH',
+        help='Write OpenMetrics text of the run (step durations, files and '
+             'bytes uploaded and skipped, upload throughput, and S3 '
+             'requests, retries and errors by operation) to this file. '
+             'Defaults to $LTD_MASON_METRICS_FILE.')
+    parser.add_argument(
+        '--trace',
+        dest='trace',
+        default=os.getenv('LTD_MASON_TRACE'),
+        metavar='PATH',
+        help='Write a trace of the run to this file in Chrome trace event '
+             'format (for chrome://tracing, Perfetto or speedscope), with '
+             'spans for each step, each directory sync and each S3 API call. '
+             'Defaults to $LTD_MASON_TRACE.')
+    parser.add_argument(
+        '--trace-sample-rate',
+        dest='trace_sample_rate',
+        type=float,
+        default=1.,
+        help='Fraction of directory and S3 API call spans to record in '
+             '--trace, for large builds (default: 1).')
+    parser.add_argument(
+        '--profile',
+        dest='profile',
+        default=None,
+        choices=['cpu', 'memory'],
+        help='Profile the run. "cpu" writes a cProfile dump (.prof) and '
+             'collapsed stacks for flame graph tools (.collapsed); '
+             '"memory" writes tracemalloc snapshots and the top allocators '
+             'at the start and end of the run (.memory.txt). Files are '
+             'written to --profile-dir.')
+    parser.add_argument(
+        '--profile-dir',
+        dest='profile_dir',
+        default=os.getenv('LTD_MASON_PROFILE_DIR', '.'),
+        help='Directory for --profile output. Defaults to '
+             '$LTD_MASON_PROFILE_DIR or the current directory.')
     parser.add_argument(
         '--verbose',
         dest='verbose',
         default=False,
         action='store_true',
         help='Full logging of debug messages')
-    return parser.parse_args()
+    args = parser.parse_args()
+    try:
+        args.upload_concurrency = parse_concurrency(args.upload_concurrency)
+    except ValueError as e:
+        parser.error('--upload-concurrency: {0}'.format(e))
+    try:
+        parse_size(args.bandwidth_bypass_size)
+        if args.max_bandwidth is not None and \
+                parse_size(args.max_bandwidth) <= 0:
+            parser.error('--max-bandwidth must be positive')
+    except ValueError as e:
+        parser.error(str(e))
+    return args
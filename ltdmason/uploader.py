@@ -2,28 +2,44 @@
 
 import os
 import logging
+import threading
+import time
 
 import requests
 
+from .runreport import timer
+from .tracing import span
+
 # weird import helps with mocking
 from .s3upload import upload as s3upload_upload
+from .s3upload import stream_upload as s3upload_stream_upload
 
 
 log = logging.getLogger(__name__)
 log.addHandler(logging.NullHandler())
 
 
-def upload(manifest, product):
+def upload(manifest, product, call_stats=None, report=None, tracer=None,
+           progress=None, max_workers=1, tuner=None, bandwidth=None):
     aws_credentials = read_aws_credentials()
     keeper_credentials = read_keeper_credentials()
-    keeper_token = get_keeper_token(
-        keeper_credentials['keeper_url'],
-        keeper_credentials['keeper_username'],
-        keeper_credentials['keeper_password'])
+    with timer(report, 'keeper-auth'), \
+            span(tracer, 'keeper-auth', 'phase'):
+        keeper_token = get_keeper_token(
+            keeper_credentials['keeper_url'],
+            keeper_credentials['keeper_username'],
+            keeper_credentials['keeper_password'])
     upload_via_keeper(manifest, product,
                       keeper_url=keeper_credentials['keeper_url'],
                       keeper_token=keeper_token,
-                      aws_credentials=aws_credentials)
+                      aws_credentials=aws_credentials,
+                      call_stats=call_stats,
+                      report=report,
+                      tracer=tracer,
+                      progress=progress,
+                      max_workers=max_workers,
+                      tuner=tuner,
+                      bandwidth=bandwidth)
 
 
 def read_aws_credentials():
@@ -58,10 +74,14 @@ def read_keeper_credentials():
     return c
 
 
-def get_keeper_token(base_url, username, password):
-    """Get a temporary auth token from ltd-keeper."""
+def get_keeper_token(base_url, username, password, session=None):
+    """Get a temporary auth token from ltd-keeper.
+
+    A `requests.Session` can be passed as ``session`` to reuse its
+    connection pool.
+    """
     token_endpoint = base_url + '/token'
-    r = requests.get(token_endpoint, auth=(username, password))
+    r = (session or requests).get(token_endpoint, auth=(username, password))
     if r.status_code != 200:
         raise RuntimeError('Could not authenticate to {0}: error {1:d}\n{2}'.
                            format(base_url, r.status_code, r.json()))
@@ -70,7 +90,9 @@ def get_keeper_token(base_url, username, password):
 
 def upload_via_keeper(manifest, product,
                       keeper_url, keeper_token,
-                      aws_credentials=None):
+                      aws_credentials=None, call_stats=None, report=None,
+                      tracer=None, progress=None, max_workers=1,
+                      tuner=None, bandwidth=None):
     """Upload built documentation to S3 via ltd-keeper.
 
     This runs a three-step pipeline:
@@ -109,6 +131,23 @@ def upload_via_keeper(manifest, product,
 
         See http://boto3.readthedocs.org/en/latest/guide/configuration.html
         for information on :file:`~/.aws/credentials`.
+    call_stats : :class:`ltdmason.s3stats.S3CallStats`, optional
+        Accounting that the S3 API calls of the upload are added to.
+    report : :class:`ltdmason.runreport.RunReport`, optional
+        Report that the three steps (``keeper-register``, ``upload`` and
+        ``keeper-confirm``) are timed in.
+    tracer : :class:`ltdmason.tracing.Tracer`, optional
+        Tracer that records the three steps, and the upload's directories
+        and S3 API calls, as spans.
+    progress : :class:`ltdmason.progress.UploadProgress`, optional
+        Reporter of the upload's progress.
+    max_workers : int, optional
+        Maximum number of concurrent file uploads.
+    tuner : :class:`ltdmason.autotune.ConcurrencyTuner`, optional
+        Tuner of the number of concurrent file uploads, instead of
+        ``max_workers``.
+    bandwidth : :class:`ltdmason.bandwidth.BandwidthLimiter`, optional
+        Cap of the upload's bandwidth.
 
     Raises
     ------
@@ -116,31 +155,373 @@ def upload_via_keeper(manifest, product,
        Any anomaly with LTD Keeper interaction.
     """
     # Register the documentation build for this product
-    build_resource = _register_build(manifest, keeper_url, keeper_token)
+    with timer(report, 'keeper-register'), \
+            span(tracer, 'keeper-register', 'phase'):
+        build_resource = _register_build(manifest, keeper_url, keeper_token)
 
     log.info('Registered build %r', build_resource['self_url'])
 
     # Upload documentation site to S3
+    with timer(report, 'upload'), span(tracer, 'upload', 'phase'):
+        _upload_build(build_resource, product,
+                      aws_credentials=aws_credentials,
+                      call_stats=call_stats, report=report, tracer=tracer,
+                      progress=progress, max_workers=max_workers,
+                      tuner=tuner, bandwidth=bandwidth)
+
+    # Confirm upload to ltd-keeper
+    with timer(report, 'keeper-confirm'), \
+            span(tracer, 'keeper-confirm', 'phase'):
+        _confirm_upload(build_resource['self_url'], keeper_token)
+
+    log.info('Finished upload for %r', build_resource['self_url'])
+
+
+class KeeperClient(object):
+    """Connection to LTD Keeper that caches its auth token.
+
+    Long-running processes (see :mod:`ltdmason.worker`) use a single
+    :class:`KeeperClient` for many builds so that they neither
+    re-authenticate nor re-open HTTP connections for every build.
+
+    Parameters
+    ----------
+    keeper_url : str
+        URL of the ltd-keeper HTTP API service.
+    username : str
+        Username for the LTD Keeper instance.
+    password : str
+        Password for the LTD Keeper instance.
+    token_max_age : float, optional
+        Seconds after which a new token is requested. This should be shorter
+        than the token expiration configured on LTD Keeper.
+    """
+    def __init__(self, keeper_url, username, password, token_max_age=1800.):
+        super().__init__()
+        self.url = keeper_url
+        self.session = requests.Session()
+        self._username = username
+        self._password = password
+        self._token_max_age = token_max_age
+        self._token = None
+        self._token_time = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, **kwargs):
+        """Create a client from the ``LTD_KEEPER_*`` environment variables
+        (see :func:`read_keeper_credentials`).
+        """
+        c = read_keeper_credentials()
+        return cls(c['keeper_url'], c['keeper_username'],
+                   c['keeper_password'], **kwargs)
+
+    @property
+    def token(self):
+        """A current LTD Keeper auth token (`str`)."""
+        with self._lock:
+            if self._token is None or \
+                    time.monotonic() - self._token_time > self._token_max_age:
+                self._token = get_keeper_token(self.url, self._username,
+                                               self._password,
+                                               session=self.session)
+                self._token_time = time.monotonic()
+            return self._token
+
+
+def add_upload_phases(pipeline, manifest, product, requires=None,
+                      keeper=None, s3_session=None, prefix='', stream=False,
+                      skip_unchanged=False, cache_control_rules=None,
+                      header_policy=None, call_stats=None, report=None,
+                      tracer=None, progress=None, max_workers=1, tuner=None,
+                      bandwidth=None):
+    """Add the LTD Keeper and S3 upload steps to a build pipeline.
+
+    This is the :class:`ltdmason.pipeline.Pipeline` equivalent of
+    :func:`upload`. Authenticating to LTD Keeper doesn't depend on the
+    built documentation, so it runs concurrently with the build itself.
+    The build is only registered once the ``requires`` phases succeed, so
+    that a failed build doesn't leave a build that is never confirmed on
+    LTD Keeper; a registered build whose upload fails is deregistered.
+
+    Parameters
+    ----------
+    pipeline : :class:`ltdmason.pipeline.Pipeline`
+        Pipeline to add phases to.
+    manifest : :class:`ltdmason.manifest.Manifest`
+        The manifest for the documentation build.
+    product : :class:`ltdmason.product.Product`
+        The :class:`~ltdmason.product.Product` that builds the documentation.
+    requires : list of str, optional
+        Names of the phases that produce :attr:`product.html_dir`.
+    keeper : :class:`KeeperClient`, optional
+        Client for LTD Keeper. By default a new client is created from the
+        ``LTD_KEEPER_*`` environment variables.
+    s3_session : :class:`boto3.session.Session`, optional
+        Session to upload with. It is only used by the ``upload-stream``
+        and ``upload`` phases, which run one after the other, so it must
+        not be shared with other pipelines or threads: boto3 sessions
+        aren't thread-safe. By default a session is created from the
+        ``LTD_MASON_AWS_*`` environment variables.
+    prefix : str, optional
+        Prefix for phase names, so that several products can be uploaded
+        from one pipeline. The S3 upload phase uses the ``'upload'``
+        pipeline resource, and the streaming upload phase the
+        ``'upload-stream'`` resource.
+    stream : bool, optional
+        Add an ``upload-stream`` phase that uploads files from
+        :attr:`product.html_dir` while the ``requires`` phases are still
+        writing them (see :func:`ltdmason.s3upload.stream_upload`). The
+        ``upload`` phase then only reconciles what changed since. Files
+        older than this call, such as the output of a previous incremental
+        build, are left for the ``upload`` phase. The ``upload-stream``
+        phase registers the build itself, instead of a ``keeper-register``
+        phase, and deregisters it if the ``requires`` phases fail. Don't
+        stream builds with post-build stages (see
+        :func:`ltdmason.product.add_build_phases`): these rewrite files
+        that may already have been streamed.
+    skip_unchanged : bool, optional
+        Copy the files whose content matches the ETag of the object in the
+        previous build of the edition (see :func:`_previous_build`) from
+        that build within the bucket, instead of uploading them (see
+        :func:`ltdmason.s3upload.upload`). A ``keeper-previous`` phase
+        looks up the previous build while the documentation builds. If
+        the pipeline has a ``package-diff`` phase with the same ``prefix``
+        (see :func:`ltdmason.product.add_build_phases`), the output
+        directories of the changed packages are uploaded without comparing
+        them.
+    cache_control_rules : list of tuple, optional
+        ``(glob, cache_control)`` rules for the Cache-Control header of
+        uploaded files (see :func:`ltdmason.s3upload.upload`).
+    header_policy : :class:`ltdmason.headerpolicy.HeaderPolicy`, optional
+        Per-path headers of uploaded files.
+    call_stats : :class:`ltdmason.s3stats.S3CallStats`, optional
+        Accounting that the S3 API calls of the upload phases are added to.
+    report : :class:`ltdmason.runreport.RunReport`, optional
+        Report that the steps and file counts of the S3 upload are added to
+        (see :func:`ltdmason.s3upload.upload`). Add the report to the
+        pipeline's listeners to also time the phases themselves.
+    tracer : :class:`ltdmason.tracing.Tracer`, optional
+        Tracer that records the directories and S3 API calls of the upload
+        phases as spans. Add it to the pipeline's listeners to also record
+        the phases.
+    progress : :class:`ltdmason.progress.UploadProgress`, optional
+        Reporter of the progress of the ``upload-stream`` and ``upload``
+        phases (see :func:`ltdmason.s3upload.upload`).
+    max_workers : int, optional
+        Maximum number of concurrent file uploads of the ``upload-stream``
+        and ``upload`` phases.
+    tuner : :class:`ltdmason.autotune.ConcurrencyTuner`, optional
+        Tuner of the number of concurrent file uploads of the
+        ``upload-stream`` and ``upload`` phases, instead of
+        ``max_workers``.
+    bandwidth : :class:`ltdmason.bandwidth.BandwidthLimiter`, optional
+        Cap of the bandwidth of the ``upload-stream`` and ``upload``
+        phases.
+
+    Returns
+    -------
+    phase_name : str
+        Name of the final (upload confirmation) phase.
+    """
+    requires = list(requires) if requires else []
+    # Anything older in html_dir predates this build
+    started = time.time()
+
+    def name(phase_name):
+        return prefix + phase_name
+
+    def authenticate():
+        client = keeper if keeper is not None else KeeperClient.from_env()
+        client.token
+        return client
+
+    def register():
+        client = pipeline.results[name('keeper-auth')]
+        build_resource = _register_build(manifest, client.url, client.token,
+                                         session=client.session)
+        log.info('Registered build %r', build_resource['self_url'])
+        return build_resource
+
+    def s3_args():
+        if s3_session is not None:
+            return {'session': s3_session}
+        return read_aws_credentials()
+
+    def deregister(build_resource):
+        client = pipeline.results[name('keeper-auth')]
+        try:
+            _deregister_build(build_resource['self_url'], client.token,
+                              session=client.session)
+        except Exception:
+            log.exception('Could not deregister build %r',
+                          build_resource['self_url'])
+        else:
+            log.info('Deregistered build %r', build_resource['self_url'])
+
+    def previous_build():
+        client = pipeline.results[name('keeper-auth')]
+        try:
+            return _previous_build(manifest, client.url, client.token,
+                                   session=client.session)
+        except (KeeperError, requests.RequestException):
+            # Only an optimization: upload every file instead
+            log.warning('Could not find the previous build of %s',
+                        manifest.product_name, exc_info=True)
+            return None
+
+    def registered_build():
+        if stream:
+            return pipeline.results[name('upload-stream')][0]
+        return pipeline.results[name('keeper-register')]
+
+    def stream_files():
+        build_resource = register()
+        try:
+            uploaded = stream_upload(build_resource)
+        except Exception:
+            deregister(build_resource)
+            raise
+        if not all(r in pipeline.results for r in requires):
+            # The build failed, so the upload will never be confirmed
+            deregister(build_resource)
+        return build_resource, uploaded
+
+    def stream_upload(build_resource):
+        return s3upload_stream_upload(
+            build_resource['bucket_name'],
+            build_resource['bucket_root_dir'],
+            product.html_dir,
+            lambda: all(pipeline.is_finished(r) for r in requires),
+            since=started,
+            max_workers=max_workers,
+            surrogate_key=build_resource['surrogate_key'],
+            acl=None,
+            cache_control_max_age=31536000,
+            cache_control_rules=cache_control_rules,
+            header_policy=header_policy,
+            call_stats=call_stats,
+            report=report,
+            tracer=tracer,
+            progress=progress,
+            tuner=tuner,
+            bandwidth=bandwidth,
+            **s3_args())
+
+    def upload_files():
+        build_resource = registered_build()
+        if stream:
+            _, already_uploaded = pipeline.results[name('upload-stream')]
+        else:
+            already_uploaded = None
+        if name('package-diff') in pipeline.results:
+            _, package_diff = pipeline.results[name('package-diff')]
+            changed_dirs = package_diff.output_dirs
+        else:
+            changed_dirs = None
+        previous_prefix = None
+        if skip_unchanged:
+            previous = pipeline.results[name('keeper-previous')]
+            if previous is not None and \
+                    previous['bucket_name'] == build_resource['bucket_name']:
+                previous_prefix = previous['bucket_root_dir']
+        try:
+            _upload_build(build_resource, product,
+                          aws_credentials=s3_args(),
+                          already_uploaded=already_uploaded,
+                          skip_unchanged=skip_unchanged,
+                          cache_control_rules=cache_control_rules,
+                          header_policy=header_policy,
+                          call_stats=call_stats,
+                          report=report,
+                          tracer=tracer,
+                          progress=progress,
+                          max_workers=max_workers,
+                          tuner=tuner,
+                          bandwidth=bandwidth,
+                          changed_dirs=changed_dirs,
+                          previous_prefix=previous_prefix)
+        except Exception:
+            deregister(build_resource)
+            raise
+
+    def confirm():
+        client = pipeline.results[name('keeper-auth')]
+        build_resource = registered_build()
+        _confirm_upload(build_resource['self_url'], client.token,
+                        session=client.session)
+        log.info('Finished upload for %r', build_resource['self_url'])
+
+    pipeline.add(name('keeper-auth'), authenticate)
+    if stream:
+        # Once started, it runs until the build finishes, so a build that
+        # it registered is always deregistered if the build fails
+        pipeline.add(name('upload-stream'), stream_files,
+                     requires=[name('keeper-auth')],
+                     resource='upload-stream')
+        upload_requires = [name('upload-stream')] + requires
+    else:
+        pipeline.add(name('keeper-register'), register,
+                     requires=[name('keeper-auth')] + requires)
+        upload_requires = [name('keeper-register')] + requires
+    if skip_unchanged:
+        pipeline.add(name('keeper-previous'), previous_build,
+                     requires=[name('keeper-auth')])
+        upload_requires.append(name('keeper-previous'))
+    pipeline.add(name('upload'), upload_files,
+                 requires=upload_requires,
+                 resource='upload')
+    pipeline.add(name('keeper-confirm'), confirm,
+                 requires=[name('upload')])
+    return name('keeper-confirm')
+
+
+def _upload_build(build_resource, product, aws_credentials=None,
+                  session=None, already_uploaded=None, skip_unchanged=False,
+                  cache_control_rules=None, header_policy=None,
+                  call_stats=None, report=None, tracer=None, progress=None,
+                  max_workers=1, tuner=None, bandwidth=None,
+                  changed_dirs=None, previous_prefix=None):
+    """Upload the built documentation to the S3 location given by an LTD
+    Keeper build resource.
+
+    Either ``aws_credentials`` (see :func:`upload_via_keeper`) or an existing
+    boto3 ``session`` can be given. ``already_uploaded``,
+    ``skip_unchanged``, ``cache_control_rules``, ``header_policy``,
+    ``call_stats``, ``report``, ``tracer``, ``progress``, ``max_workers``,
+    ``tuner``, ``bandwidth``, ``changed_dirs`` and ``previous_prefix`` are
+    passed to :func:`ltdmason.s3upload.upload`.
+    """
     if aws_credentials is None:
         # Fall back to using default AWS credentials the user might have set
         aws_credentials = {}
+    if session is not None:
+        aws_credentials = {'session': session}
     s3upload_upload(build_resource['bucket_name'],
                     build_resource['bucket_root_dir'],
                     product.html_dir,
                     surrogate_key=build_resource['surrogate_key'],
                     acl=None,
                     cache_control_max_age=31536000,
+                    already_uploaded=already_uploaded,
+                    skip_unchanged=skip_unchanged,
+                    cache_control_rules=cache_control_rules,
+                    header_policy=header_policy,
+                    call_stats=call_stats,
+                    report=report,
+                    tracer=tracer,
+                    progress=progress,
+                    max_workers=max_workers,
+                    tuner=tuner,
+                    bandwidth=bandwidth,
+                    changed_dirs=changed_dirs,
+                    previous_prefix=previous_prefix,
                     **aws_credentials)
     log.debug('Upload complete: {0}:{1}'.format(
         build_resource['bucket_name'], build_resource['bucket_root_dir']))
 
-    # Confirm upload to ltd-keeper
-    _confirm_upload(build_resource['self_url'], keeper_token)
 
-    log.info('Finished upload for %r', build_resource['self_url'])
-
-
-def _register_build(manifest, keeper_url, keeper_token):
+def _register_build(manifest, keeper_url, keeper_token, session=None):
     """Register this documentation build with LTD Keeper
 
     This registration step tells ltd-mason where to upload the documentation
@@ -157,7 +538,7 @@ def _register_build(manifest, keeper_url, keeper_token):
     if manifest.requester_github_handle is not None:
         data['github_requester'] = manifest.requester_github_handle
 
-    r = requests.post(
+    r = (session or requests).post(
         keeper_url + '/products/{p}/builds/'.format(
             p=manifest.product_name),
         auth=(keeper_token, ''),
@@ -170,7 +551,55 @@ def _register_build(manifest, keeper_url, keeper_token):
     return build_info
 
 
-def _confirm_upload(build_url, keeper_token):
+def _previous_build(manifest, keeper_url, keeper_token, session=None):
+    """Get the LTD Keeper build resource of the edition that tracks the
+    Git refs of a build, or of the product's ``main`` edition if none does.
+
+    Returns
+    -------
+    build_info : dict or None
+        The build resource, or `None` if the edition has no build.
+
+    Raises
+    ------
+    KeeperError
+       Any anomaly with LTD Keeper interaction.
+    """
+    def get(url):
+        r = (session or requests).get(url, auth=(keeper_token, ''))
+        if r.status_code != 200:
+            raise KeeperError(r)
+        return r.json()
+
+    editions = [get(url) for url in get(
+        keeper_url + '/products/{p}/editions/'.format(
+            p=manifest.product_name))['editions']]
+    tracking = [e for e in editions
+                if e.get('tracked_refs') == manifest.refs]
+    if not tracking:
+        tracking = [e for e in editions if e.get('slug') == 'main']
+    if not tracking or not tracking[0].get('build_url'):
+        return None
+    build_info = get(tracking[0]['build_url'])
+    log.debug(build_info)
+    return build_info
+
+
+def _deregister_build(build_url, keeper_token, session=None):
+    """Delete a registered build from LTD Keeper, such as one whose upload
+    failed.
+
+    Raises
+    ------
+    KeeperError
+       Any anomaly with LTD Keeper interaction.
+    """
+    r = (session or requests).delete(build_url, auth=(keeper_token, ''))
+    if r.status_code not in (200, 202, 204):
+        raise KeeperError(r)
+
+
+def _confirm_upload(build_url, keeper_token, session=None):
     """Patch the build on LTD Keeper to say that the upload is successful.
 
     Raises
@@ -178,9 +607,9 @@ def _confirm_upload(build_url, keeper_token):
     KeeperError
        Any anomaly with LTD Keeper interaction.
     """
-    r = requests.patch(build_url,
-                       auth=(keeper_token, ''),
-                       json={'uploaded': True})
+    r = (session or requests).patch(build_url,
+                                    auth=(keeper_token, ''),
+                                    json={'uploaded': True})
     if r.status_code != 200:
         raise KeeperError(r)
     log.debug(r.json())
@@ -0,0 +1,391 @@
+"""Long-running build worker that consumes manifests from a queue.
+
+Where ``ltd-mason`` runs a single build per process, a :class:`Worker`
+processes many builds while keeping warm state between them: the LTD Keeper
+token and HTTP connection pool (:class:`ltdmason.uploader.KeeperClient`),
+boto3 sessions, Git mirrors of doc repositories, the record of
+already-installed doc repo requirements, and pre-warmed Sphinx worker
+processes.
+
+Two queues are provided:
+
+- :class:`DirectorySpool`, a directory into which manifest files are dropped.
+- :class:`HTTPQueue`, a minimal HTTP protocol that a queue service (or a
+  local stand-in) can implement.
+"""
+
+import logging
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import boto3
+import requests
+
+from .builddir import BUILD_DIR_PREFIX, TreeRemover
+from .manifest import Manifest
+from .pipeline import Pipeline
+from .product import InstalledRequirements, Product, add_build_phases
+from .runreport import RunReport
+from .s3stats import S3CallStats
+from .uploader import add_upload_phases, read_aws_credentials, KeeperClient
+
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+
+class Job(object):
+    """A build request claimed from a queue.
+
+    Parameters
+    ----------
+    job_id : str
+        Identifier of the job within its queue.
+    manifest_data : str
+        YAML-encoded manifest.
+    """
+    def __init__(self, job_id, manifest_data):
+        super().__init__()
+        self.job_id = job_id
+        self.manifest_data = manifest_data
+
+    def __repr__(self):
+        return 'Job({0!r})'.format(self.job_id)
+
+
+class DirectorySpool(object):
+    """A queue of manifest files in a spool directory.
+
+    Manifests (``*.yaml`` or ``*.yml`` files) are claimed oldest first by
+    renaming them into ``processing/``, so several workers can share a spool.
+    Completed manifests are moved to ``done/`` or ``failed/``; a failed
+    manifest is accompanied by a ``<name>.error`` file with the error message.
+
+    Writers should create manifests under a different name (or in another
+    directory on the same filesystem) and rename them into the spool, so that
+    a worker never claims a partially-written file.
+
+    Parameters
+    ----------
+    spool_dir : str
+        The spool directory.
+    """
+
+    extensions = ('.yaml', '.yml')
+
+    def __init__(self, spool_dir):
+        super().__init__()
+        self.spool_dir = os.path.abspath(spool_dir)
+        for name in ('processing', 'done', 'failed'):
+            path = os.path.join(self.spool_dir, name)
+            if not os.path.isdir(path):
+                os.makedirs(path)
+
+    def claim(self):
+        """Claim the oldest manifest in the spool.
+
+        Returns
+        -------
+        job : :class:`Job`
+            The claimed job, or `None` if the spool is empty.
+        """
+        entries = []
+        for entry in os.scandir(self.spool_dir):
+            if not entry.is_file() or \
+                    os.path.splitext(entry.name)[1] not in self.extensions:
+                continue
+            try:
+                mtime = entry.stat().st_mtime
+            except FileNotFoundError:
+                # Claimed by another worker
+                continue
+            entries.append((mtime, entry))
+        entries.sort(key=lambda item: item[0])
+        for _, entry in entries:
+            processing_path = os.path.join(self.spool_dir, 'processing',
+                                           entry.name)
+            try:
+                os.rename(entry.path, processing_path)
+            except FileNotFoundError:
+                # Claimed by another worker
+                continue
+            with open(processing_path, encoding='utf-8') as f:
+                return Job(entry.name, f.read())
+        return None
+
+    def complete(self, job, error=None):
+        """Mark a job as done, or as failed if ``error`` is set.
+
+        Parameters
+        ----------
+        job : :class:`Job`
+            A job claimed from this spool.
+        error : str, optional
+            Error message for a failed job.
+        """
+        status_dir = 'done' if error is None else 'failed'
+        os.rename(os.path.join(self.spool_dir, 'processing', job.job_id),
+                  os.path.join(self.spool_dir, status_dir, job.job_id))
+        if error is not None:
+            error_path = os.path.join(self.spool_dir, 'failed',
+                                      job.job_id + '.error')
+            with open(error_path, 'w', encoding='utf-8') as f:
+                f.write(error)
+
+
+class HTTPQueue(object):
+    """A queue of manifests served over HTTP.
+
+    The queue service implements two endpoints:
+
+    ``POST <base_url>/claim``
+       Claims the next job. Responds ``200`` with a JSON body
+       ``{"id": "...", "manifest": "<YAML manifest>"}``, or ``204`` if the
+       queue is empty.
+
+    ``POST <base_url>/jobs/<id>/complete``
+       Reports a job's outcome with a JSON body
+       ``{"status": "succeeded" | "failed", "message": "..." | null}``.
+
+    Parameters
+    ----------
+    base_url : str
+        Base URL of the queue service.
+    """
+    def __init__(self, base_url):
+        super().__init__()
+        self.base_url = base_url.rstrip('/')
+        self.session = requests.Session()
+
+    def claim(self):
+        """Claim the next job.
+
+        Returns
+        -------
+        job : :class:`Job`
+            The claimed job, or `None` if the queue is empty.
+        """
+        r = self.session.post(self.base_url + '/claim')
+        if r.status_code == 204:
+            return None
+        if r.status_code != 200:
+            raise QueueError('Could not claim a job from {0}: error {1:d}'
+                             .format(self.base_url, r.status_code))
+        data = r.json()
+        return Job(data['id'], data['manifest'])
+
+    def complete(self, job, error=None):
+        """Report a job as succeeded, or as failed if ``error`` is set."""
+        data = {'status': 'succeeded' if error is None else 'failed',
+                'message': error}
+        r = self.session.post(
+            '{0}/jobs/{1}/complete'.format(self.base_url, job.job_id),
+            json=data)
+        if r.status_code not in (200, 204):
+            raise QueueError('Could not complete {0!r}: error {1:d}'
+                             .format(job, r.status_code))
+
+
+class Worker(object):
+    """Build and upload the manifests in a queue with bounded concurrency.
+
+    Parameters
+    ----------
+    queue : :class:`DirectorySpool` or :class:`HTTPQueue`
+        Queue to claim jobs from.
+    concurrency : int, optional
+        Maximum number of builds processed at once.
+    build_root : str, optional
+        Directory in which temporary build directories are created.
+    upload : bool, optional
+        Upload builds to S3 and LTD Keeper. If `False`, builds are only
+        built.
+    poll_interval : float, optional
+        Seconds to wait before polling an empty queue again.
+    cache : :class:`ltdmason.buildcache.BuildCache`, optional
+        Build cache shared by all builds.
+    git_mirrors : :class:`ltdmason.gitmirror.GitMirrorCache`, optional
+        Git mirrors shared by all builds.
+    sphinx_runner : :class:`ltdmason.sphinxrunner.SphinxRunner`, optional
+        Runner for in-process Sphinx builds.
+    keeper : :class:`ltdmason.uploader.KeeperClient`, optional
+        LTD Keeper client. By default it is created from the ``LTD_KEEPER_*``
+        environment variables when ``upload`` is `True`.
+    inventory_cache : `ltdmason.intersphinxcache.InventoryCache`, optional
+        Intersphinx inventory cache shared by all builds.
+    stream_upload : bool, optional
+        Stream HTML to S3 while Sphinx is writing it (see
+        :func:`ltdmason.uploader.add_upload_phases`). It can't be combined
+        with ``postprocessors``.
+    postprocessors : list, optional
+        Post-build stages run on each build's HTML (see
+        :func:`ltdmason.product.add_build_phases`).
+    skip_unchanged : bool, optional
+        Skip uploading files that are unchanged in the bucket.
+    cache_control_rules : list of tuple, optional
+        ``(glob, cache_control)`` rules for uploaded files.
+    header_policy : :class:`ltdmason.headerpolicy.HeaderPolicy`, optional
+        Per-path headers of uploaded files.
+    metrics : :class:`ltdmason.openmetrics.BuildMetrics`, optional
+        Metrics that every job is added to. Their file is rewritten when a
+        job starts and when it finishes.
+    listeners : list of callable, optional
+        Extra listeners of the pipeline of every job (see
+        :class:`ltdmason.pipeline.Pipeline`), such as a
+        :class:`ltdmason.profiling.Profiler`.
+    bandwidth : :class:`ltdmason.bandwidth.BandwidthLimiter`, optional
+        Cap of the total bandwidth of the uploads of all jobs.
+    """
+    def __init__(self, queue, concurrency=1, build_root=None, upload=True,
+                 poll_interval=5., cache=None, git_mirrors=None,
+                 sphinx_runner=None, keeper=None, inventory_cache=None,
+                 stream_upload=False, postprocessors=None,
+                 skip_unchanged=False, cache_control_rules=None,
+                 header_policy=None, metrics=None, listeners=None,
+                 bandwidth=None):
+        super().__init__()
+        if upload and stream_upload and postprocessors:
+            raise ValueError('Streamed uploads can\'t be post-processed')
+        self.queue = queue
+        self.concurrency = concurrency
+        self.build_root = build_root
+        self.upload = upload
+        self.poll_interval = poll_interval
+        self.cache = cache
+        self.git_mirrors = git_mirrors
+        self.sphinx_runner = sphinx_runner
+        if upload and keeper is None:
+            keeper = KeeperClient.from_env()
+        self.keeper = keeper
+        self.inventory_cache = inventory_cache
+        self.stream_upload = stream_upload
+        self.postprocessors = postprocessors
+        self.skip_unchanged = skip_unchanged
+        self.cache_control_rules = cache_control_rules
+        self.header_policy = header_policy
+        self.metrics = metrics
+        self.listeners = list(listeners) if listeners else []
+        self.bandwidth = bandwidth
+        self.installed_requirements = InstalledRequirements()
+        self._stop = threading.Event()
+        self._remover = TreeRemover()
+
+    def stop(self):
+        """Stop claiming jobs; jobs in progress are allowed to finish."""
+        self._stop.set()
+
+    def run(self, once=False):
+        """Process jobs until :meth:`stop` is called.
+
+        Errors claiming jobs from the queue, or reporting their outcome to
+        it, are logged, and the worker keeps polling.
+
+        Parameters
+        ----------
+        once : bool, optional
+            Return once the queue is empty (or can't be reached) and all
+            claimed jobs are done, instead of polling for new jobs.
+        """
+        if self.build_root is not None:
+            self._remover.sweep(self.build_root,
+                                pattern=BUILD_DIR_PREFIX + '*')
+        running = set()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            while not self._stop.is_set():
+                queue_empty = False
+                while len(running) < self.concurrency:
+                    try:
+                        job = self.queue.claim()
+                    except Exception:
+                        log.exception('Could not claim a job')
+                        job = None
+                    if job is None:
+                        queue_empty = True
+                        break
+                    log.info('Claimed %r', job)
+                    running.add(executor.submit(self.process, job))
+                if once and queue_empty and not running:
+                    break
+                if running:
+                    finished, running = wait(running,
+                                             timeout=self.poll_interval,
+                                             return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        try:
+                            future.result()
+                        except Exception:
+                            log.exception('Could not complete a job')
+                else:
+                    self._stop.wait(self.poll_interval)
+            wait(running)
+        self._remover.wait()
+
+    @staticmethod
+    def _s3_session():
+        c = read_aws_credentials()
+        return boto3.session.Session(
+            profile_name=c.get('aws_profile'),
+            aws_access_key_id=c.get('aws_access_key_id'),
+            aws_secret_access_key=c.get('aws_secret_access_key'))
+
+    def process(self, job):
+        """Build (and upload) a single job, then report its outcome to the
+        queue. Errors in the build are reported to the queue, not raised.
+        """
+        build_dir = tempfile.mkdtemp(prefix=BUILD_DIR_PREFIX,
+                                     dir=self.build_root)
+        error = None
+        call_stats = S3CallStats()
+        report = RunReport(command='ltd-mason-worker',
+                           call_stats=call_stats)
+        if self.metrics is not None:
+            self.metrics.start()
+            self.metrics.write()
+        try:
+            manifest = Manifest(job.manifest_data)
+            product = Product(
+                manifest, build_dir,
+                sphinx_runner=self.sphinx_runner,
+                git_mirrors=self.git_mirrors,
+                installed_requirements=self.installed_requirements,
+                inventory_cache=self.inventory_cache)
+            pipeline = Pipeline(listeners=[report] + self.listeners)
+            build_phase = add_build_phases(
+                pipeline, product, cache=self.cache,
+                postprocessors=self.postprocessors)
+            if self.upload:
+                # boto3 sessions aren't thread-safe, so each job gets its
+                # own; only its upload phases use it, one after the other
+                add_upload_phases(pipeline, manifest, product,
+                                  requires=[build_phase],
+                                  keeper=self.keeper,
+                                  s3_session=self._s3_session(),
+                                  stream=self.stream_upload,
+                                  skip_unchanged=self.skip_unchanged,
+                                  cache_control_rules=(
+                                      self.cache_control_rules),
+                                  header_policy=self.header_policy,
+                                  call_stats=call_stats,
+                                  report=report,
+                                  bandwidth=self.bandwidth)
+            pipeline.run()
+        except Exception as e:
+            log.exception('Build of %r failed', job)
+            error = '{0}: {1}'.format(type(e).__name__, e)
+            report.finish(error=e)
+        else:
+            log.info('Build of %r succeeded', job)
+            report.finish()
+        finally:
+            # Report the job without waiting for its build tree's deletion
+            self._remover.remove(build_dir)
+            if self.metrics is not None:
+                self.metrics.add(report, started=True)
+                self.metrics.write()
+        self.queue.complete(job, error=error)
+
+
+class QueueError(Exception):
+    """Error communicating with a job queue."""
+    pass
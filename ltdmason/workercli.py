@@ -0,0 +1,268 @@
+"""Command line interface for the long-running ltd-mason build worker."""
+
+import argparse
+import logging
+import os
+import signal
+import textwrap
+
+from .bandwidth import BandwidthLimiter
+from .buildcache import BuildCache
+from .builddir import choose_build_root, parse_size
+from .gitmirror import GitMirrorCache
+from .intersphinxcache import DEFAULT_TTL, InventoryCache
+from .openmetrics import BuildMetrics
+from .profiling import Profiler
+from .sphinxrunner import SphinxRunner
+from .worker import Worker, DirectorySpool, HTTPQueue
+
+
+def run():
+    """Entrypoint for the ltd-mason-worker command."""
+    args = parse_args()
+
+    if args.verbose:
+        logging.basicConfig(level=logging.DEBUG)
+    else:
+        logging.basicConfig(level=logging.INFO)
+
+    if args.spool_dir is not None:
+        queue = DirectorySpool(args.spool_dir)
+    else:
+        queue = HTTPQueue(args.queue_url)
+
+    cache = BuildCache(args.cache_dir) if args.cache_dir else None
+    git_mirrors = GitMirrorCache(args.git_mirror_dir) \
+        if args.git_mirror_dir else None
+    inventory_cache = InventoryCache(args.intersphinx_cache_dir,
+                                     ttl=args.intersphinx_ttl,
+                                     offline=args.offline) \
+        if args.intersphinx_cache_dir else None
+    if args.sphinx_mode == 'in-process':
+        sphinx_runner = SphinxRunner(processes=args.concurrency)
+    else:
+        sphinx_runner = None
+
+    if args.build_root is not None:
+        build_root = choose_build_root(
+            args.build_root, min_free=parse_size(args.build_root_min_free))
+    else:
+        build_root = None
+
+    if args.metrics_file is not None:
+        metrics = BuildMetrics(args.metrics_file, command='ltd-mason-worker')
+        metrics.write()
+    else:
+        metrics = None
+
+    if args.max_bandwidth is not None:
+        bandwidth = BandwidthLimiter(
+            parse_size(args.max_bandwidth),
+            bypass_size=parse_size(args.bandwidth_bypass_size))
+    else:
+        bandwidth = None
+
+    if args.profile is not None:
+        profiler = Profiler(args.profile, output_dir=args.profile_dir,
+                            name='ltd-mason-worker')
+    else:
+        profiler = None
+
+    worker = Worker(queue,
+                    concurrency=args.concurrency,
+                    build_root=build_root,
+                    upload=not args.no_upload,
+                    poll_interval=args.poll_interval,
+                    cache=cache,
+                    git_mirrors=git_mirrors,
+                    sphinx_runner=sphinx_runner,
+                    inventory_cache=inventory_cache,
+                    stream_upload=args.stream_upload,
+                    bandwidth=bandwidth,
+                    metrics=metrics,
+                    listeners=[profiler] if profiler else None)
+
+    def handle_signal(signum, frame):
+        logging.getLogger(__name__).info(
+            'Received signal %d; finishing current builds', signum)
+        worker.stop()
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+
+    if profiler is not None:
+        profiler.start()
+    try:
+        worker.run(once=args.once)
+    finally:
+        if profiler is not None:
+            profiler.stop()
+        if sphinx_runner is not None:
+            sphinx_runner.close()
+
+
+def parse_args():
+    """Create an ``argparse.ArgumentParser`` instance that defines the
+    command line interface for ltd-mason-worker.
+    """
+    parser = argparse.ArgumentParser(
+        prog='ltd-mason-worker',
+        description=textwrap.dedent("""
+            Run a long-lived ltd-mason worker that builds and uploads the
+            manifests submitted to a queue.
+
+            The queue is either a spool directory (--spool-dir) into which
+            manifest YAML files are moved, or an HTTP queue service
+            (--queue-url). Between builds the worker keeps its LTD Keeper
+            token, boto3 sessions, Git mirrors, installed doc requirements
+            and Sphinx worker processes warm.
+
+            Credentials are read from the same environment variables as
+            ltd-mason (LTD_MASON_AWS_ID, LTD_MASON_AWS_SECRET,
+            LTD_MASON_AWS_PROFILE, LTD_KEEPER_URL, LTD_KEEPER_USER and
+            LTD_KEEPER_PASSWORD).
+            """),
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog='See https://github.com/lsst-sqre/ltd-mason for more info.')
+    queue_group = parser.add_mutually_exclusive_group(required=True)
+    queue_group.add_argument(
+        '--spool-dir',
+        dest='spool_dir',
+        help='Spool directory of manifest files to build.')
+    queue_group.add_argument(
+        '--queue-url',
+        dest='queue_url',
+        help='Base URL of an HTTP queue service.')
+    parser.add_argument(
+        '--concurrency',
+        type=int,
+        default=2,
+        help='Maximum number of builds to run at once.')
+    parser.add_argument(
+        '--build-root',
+        dest='build_root',
+        default=None,
+        help='Directory in which temporary build directories are created, '
+             'for example a tmpfs mount such as /dev/shm.')
+    parser.add_argument(
+        '--build-root-min-free',
+        dest='build_root_min_free',
+        default='1G',
+        help='Minimum free space required on --build-root, such as 512M or '
+             '2G; otherwise the system temporary directory is used '
+             '(default: 1G).')
+    parser.add_argument(
+        '--cache-dir',
+        dest='cache_dir',
+        default=None,
+        help='Directory of a build cache shared by all builds.')
+    parser.add_argument(
+        '--git-mirror-dir',
+        dest='git_mirror_dir',
+        default=None,
+        help='Directory of Git mirrors used to speed up doc repo clones.')
+    parser.add_argument(
+        '--intersphinx-cache-dir',
+        dest='intersphinx_cache_dir',
+        default=os.getenv('LTD_MASON_INTERSPHINX_CACHE'),
+        help='Directory of an intersphinx inventory cache shared by all '
+             'builds (see ltd-mason --help).')
+    parser.add_argument(
+        '--intersphinx-ttl',
+        dest='intersphinx_ttl',
+        type=float,
+        default=DEFAULT_TTL,
+        help='Age, in seconds, after which cached inventories are fetched '
+             'again.')
+    parser.add_argument(
+        '--offline',
+        default=False,
+        action='store_true',
+        help='Never fetch intersphinx inventories; only use cached ones.')
+    parser.add_argument(
+        '--sphinx-mode',
+        default='in-process',
+        choices=['subprocess', 'in-process'],
+        dest='sphinx_mode',
+        help='How to run Sphinx (see ltd-mason --help).')
+    parser.add_argument(
+        '--poll-interval',
+        dest='poll_interval',
+        type=float,
+        default=5.,
+        help='Seconds to wait before polling an empty queue again.')
+    parser.add_argument(
+        '--once',
+        default=False,
+        action='store_true',
+        help='Exit once the queue is empty instead of polling for new jobs.')
+    parser.add_argument(
+        '--no-upload',
+        dest='no_upload',
+        default=False,
+        action='store_true',
+        help='Skip the upload to S3 and ltd-keeper; only build the docs')
+    parser.add_argument(
+        '--stream-upload',
+        dest='stream_upload',
+        default=False,
+        action='store_true',
+        help='Upload HTML files while Sphinx is still writing them (see '
+             'ltd-mason --help).')
+    parser.add_argument(
+        '--max-bandwidth',
+        dest='max_bandwidth',
+        default=os.getenv('LTD_MASON_MAX_BANDWIDTH'),
+        metavar='SIZE',
+        help='Cap the total bandwidth of the S3 uploads of all concurrent '
+             'builds to this many bytes per second, such as 20M. Defaults '
+             'to $LTD_MASON_MAX_BANDWIDTH; uncapped if unset.')
+    parser.add_argument(
+        '--bandwidth-bypass-size',
+        dest='bandwidth_bypass_size',
+        default='0',
+        metavar='SIZE',
+        help='Send S3 requests of at most this size, such as 64K, without '
+             'waiting for --max-bandwidth, so that small files keep the '
+             'request rate up; their bytes still count towards the cap.')
+    parser.add_argument(
+        '--metrics-file',
+        dest='metrics_file',
+        default=os.getenv('LTD_MASON_METRICS_FILE'),
+        metavar='PATH',
+        help='OpenMetrics text file of build and upload metrics, such as '
+             "a .prom file in node-exporter's textfile collector "
+             'directory. It is rewritten as builds start and finish. '
+             'Defaults to $LTD_MASON_METRICS_FILE.')
+    parser.add_argument(
+        '--profile',
+        dest='profile',
+        default=None,
+        choices=['cpu', 'memory'],
+        help='Profile the worker. "cpu" writes a cProfile dump (.prof) and '
+             'collapsed stacks for flame graph tools (.collapsed) when it '
+             'exits; "memory" writes the top allocators at each phase '
+             'boundary of every build (.memory.txt) and tracemalloc '
+             'snapshots of the start and end of the run. Files are written '
+             'to --profile-dir.')
+    parser.add_argument(
+        '--profile-dir',
+        dest='profile_dir',
+        default=os.getenv('LTD_MASON_PROFILE_DIR', '.'),
+        help='Directory for --profile output. Defaults to '
+             '$LTD_MASON_PROFILE_DIR or the current directory.')
+    parser.add_argument(
+        '--verbose',
+        dest='verbose',
+        default=False,
+        action='store_true',
+        help='Full logging of debug messages')
+    args = parser.parse_args()
+    try:
+        parse_size(args.bandwidth_bypass_size)
+        if args.max_bandwidth is not None and \
+                parse_size(args.max_bandwidth) <= 0:
+            parser.error('--max-bandwidth must be positive')
+    except ValueError as e:
+        parser.error(str(e))
+    return args
@@ -50,6 +50,8 @@ setup(
             'ltd-mason = ltdmason.cli:run_ltd_mason',
             'ltd-mason-travis = ltdmason.traviscli:run',
             'ltd-mason-make-redirects = ltdmason.redirectdircli:run',
+            'ltd-mason-worker = ltdmason.workercli:run',
+            'ltd-mason-intersphinx = ltdmason.intersphinxcli:run',
         ]
     }
 )
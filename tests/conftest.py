@@ -0,0 +1,104 @@
+"""Shared fixtures of the ltd-mason tests."""
+
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import boto3
+import pytest
+
+_ERROR_CODES = {403: 'AccessDenied', 500: 'InternalError', 503: 'SlowDown'}
+
+
+class FakeS3(object):
+    """Local HTTP server answering the S3 requests of a boto3 client.
+
+    PUTs are accepted, except that the first one fails with
+    :attr:`first_put_status` if it is set, and DELETEs are denied. Nothing
+    is stored.
+
+    Attributes
+    ----------
+    first_put_status : int
+        HTTP status of the first PUT: 500 for a retryable error or 503 for
+        throttling. `None` (the default) to accept it.
+    puts : int
+        Number of PUT requests received, including failed ones.
+    """
+    def __init__(self):
+        super().__init__()
+        self.first_put_status = None
+        self.puts = 0
+        self.lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), _FakeS3Handler)
+        self._server.daemon_threads = True
+        self._server.fake = self
+        thread = threading.Thread(target=self._server.serve_forever,
+                                  daemon=True)
+        thread.start()
+
+    @property
+    def url(self):
+        """Endpoint URL of the server."""
+        return 'http://127.0.0.1:{0:d}'.format(self._server.server_address[1])
+
+    def client(self, max_attempts=None):
+        """Create an S3 client of the server, which retries failed requests
+        in the ``standard`` mode up to ``max_attempts`` times in total.
+        """
+        session = boto3.session.Session(aws_access_key_id='id',
+                                        aws_secret_access_key='secret',
+                                        region_name='us-east-1')
+        config = {'s3': {'addressing_style': 'path'}}
+        if max_attempts is not None:
+            config['retries'] = {'mode': 'standard',
+                                 'max_attempts': max_attempts}
+        return session.client('s3', endpoint_url=self.url,
+                              config=boto3.session.Config(**config))
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class _FakeS3Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _respond(self, status):
+        if status == 200:
+            body = b''
+        else:
+            body = '<Error><Code>{0}</Code></Error>'.format(
+                _ERROR_CODES[status]).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        if status == 200:
+            self.send_header('ETag', '"0"')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_PUT(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        fake = self.server.fake
+        with fake.lock:
+            fake.puts += 1
+            first = fake.puts == 1
+        if first and fake.first_put_status is not None:
+            self._respond(fake.first_put_status)
+        else:
+            self._respond(200)
+
+    def do_DELETE(self):
+        self._respond(403)
+
+
+@pytest.fixture
+def fake_s3():
+    """A running :class:`FakeS3` server; configure it before its first
+    request.
+    """
+    fake = FakeS3()
+    yield fake
+    fake.close()
@@ -0,0 +1,81 @@
+"""Tests for ltdmason.autotune."""
+
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from ltdmason.autotune import ConcurrencyTuner, parse_concurrency
+
+
+def test_ramp_up_and_back_off():
+    tuner = ConcurrencyTuner(initial=2, maximum=16)
+    tuner.adjust(100., 1.)
+    assert tuner.concurrency == 4
+    tuner.adjust(200., 1.)
+    assert tuner.concurrency == 8
+    # Throughput stopped increasing: settle on the best concurrency
+    tuner.adjust(205., 1.5)
+    assert (tuner.concurrency, tuner.settled) == (4, True)
+    tuner.adjust(250., 1.)
+    assert tuner.concurrency == 4
+    # Latency rose while throughput dropped
+    tuner.adjust(150., 3.)
+    assert tuner.concurrency == 3
+    tuner.adjust(150., 1., throttled=2)
+    assert tuner.concurrency == 1
+
+
+def test_ramp_up_stops_on_latency():
+    tuner = ConcurrencyTuner(initial=2)
+    tuner.adjust(100., 1.)
+    tuner.adjust(150., 2.5)
+    assert (tuner.concurrency, tuner.settled) == (4, True)
+    tuner.adjust(150., 1.)
+    assert tuner.concurrency == 4
+
+
+def test_throttling(fake_s3):
+    # Throttles the first PUT
+    fake_s3.first_put_status = 503
+    client = fake_s3.client(max_attempts=3)
+    tuner = ConcurrencyTuner(initial=2, window=0.)
+    tuner.attach(client)
+    with ThreadPoolExecutor(max_workers=tuner.maximum) as executor:
+        for key in ('a.html', 'b.html'):
+            tuner.submit(executor, 5, client.put_object, Bucket='bucket',
+                         Key=key, Body=b'hello').result()
+    assert fake_s3.puts == 3
+    assert (tuner.concurrency, tuner.settled) == (1, True)
+
+
+def test_state(tmpdir):
+    path = str(tmpdir.join('tuning.json'))
+    tuner = ConcurrencyTuner(initial=2, state_path=path, host='runner')
+    tuner.save()
+    assert not tmpdir.join('tuning.json').check()
+
+    tuner.adjust(100., 1.)
+    tuner.adjust(200., 1.)
+    tuner.adjust(200., 1.)
+    tuner.save()
+    with open(path) as f:
+        state = json.load(f)
+    assert state['runner']['concurrency'] == 4
+    assert state['runner']['bytes_per_second'] == 200.
+
+    assert ConcurrencyTuner(state_path=path, host='runner').concurrency == 4
+    assert ConcurrencyTuner(initial=8, state_path=path,
+                            host='worker').concurrency == 8
+
+    tmpdir.join('tuning.json').write('{')
+    assert ConcurrencyTuner(initial=8, state_path=path,
+                            host='runner').concurrency == 8
+
+
+def test_parse_concurrency():
+    assert parse_concurrency('8') == 8
+    assert parse_concurrency('Auto') == 'auto'
+    for value in ('0', 'many'):
+        with pytest.raises(ValueError):
+            parse_concurrency(value)
@@ -0,0 +1,51 @@
+"""Tests for ltdmason.bandwidth."""
+
+import threading
+import time
+
+import pytest
+
+from ltdmason.bandwidth import BandwidthLimiter
+
+
+def test_token_bucket(mocker):
+    sleep = mocker.patch('ltdmason.bandwidth.time.sleep')
+    limiter = BandwidthLimiter(1000., bypass_size=100)
+    # The burst allowance is sent right away
+    assert limiter.consume(1000) == 0.
+    # Later requests wait for their reservations
+    assert limiter.consume(500) == pytest.approx(0.5, abs=0.01)
+    assert limiter.consume(500) == pytest.approx(1., abs=0.01)
+    # Small requests aren't delayed, but are charged
+    assert limiter.consume(100) == 0.
+    assert limiter.consume(400) == pytest.approx(1.5, abs=0.01)
+    assert sleep.call_count == 3
+    assert limiter.seconds_waited == pytest.approx(3., abs=0.05)
+
+    with pytest.raises(ValueError):
+        BandwidthLimiter(0)
+
+
+def test_cap_across_threads(fake_s3):
+    client = fake_s3.client()
+    limiter = BandwidthLimiter(100000., burst=20000, bypass_size=1000)
+    limiter.attach(client)
+    limiter.attach(client)
+
+    def put(i):
+        client.put_object(Bucket='bucket', Key='{0:d}.bin'.format(i),
+                          Body=b'x' * 20000)
+
+    start = time.monotonic()
+    threads = [threading.Thread(target=put, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # 80000 bytes at 100000 B/s, less the 20000 byte burst
+    assert time.monotonic() - start >= 0.55
+    assert limiter.seconds_waited >= 0.55
+
+    start = time.monotonic()
+    client.put_object(Bucket='bucket', Key='small.html', Body=b'x' * 1000)
+    assert time.monotonic() - start < 0.3
@@ -0,0 +1,82 @@
+"""Tests for ltdmason.batch."""
+
+from pathlib import Path
+
+import pytest
+import ruamel.yaml
+from ruamel.yaml.compat import StringIO
+
+from ltdmason.batch import add_batch_phases, default_resources
+from ltdmason.manifest import Manifest
+from ltdmason.pipeline import Pipeline
+
+
+@pytest.fixture
+def manifests():
+    path = Path(__file__).parent / "demo_manifest.yaml"
+    yaml_str = path.read_text()
+    yaml = ruamel.yaml.YAML()
+    data = yaml.load(yaml_str)
+    data['doc_repo']['ref'] = 'tickets/DM-1'
+    stream = StringIO()
+    yaml.dump(data, stream)
+    return [Manifest(yaml_str), Manifest(yaml_str),
+            Manifest(stream.getvalue())]
+
+
+def test_default_resources():
+    resources = default_resources(sphinx_jobs=3)
+    assert resources['cpu'] == 3
+    assert resources['pip'] == 1
+
+
+def test_batch_deduplicates(tmpdir, manifests, mocker):
+    built = []
+
+    def add_build_phases(pipeline, product, cache=None, prefix='',
+                         postprocessors=None):
+        pipeline.add(prefix + 'sphinx', lambda: built.append(prefix),
+                     resource='cpu')
+        return prefix + 'sphinx'
+
+    mocker.patch('ltdmason.batch.add_build_phases', add_build_phases)
+
+    pipeline = Pipeline(resources=default_resources(), keep_going=True)
+    products = add_batch_phases(pipeline, manifests, str(tmpdir),
+                                upload=False)
+    pipeline.run()
+
+    assert len(products) == 3
+    assert products[0] is products[1]
+    assert products[0] is not products[2]
+    assert sorted(built) == ['lsst_apps[0]:', 'lsst_apps[2]:']
+
+
+def test_batch_clone_options(tmpdir, mocker):
+    """Manifests that differ only in their clone options aren't merged."""
+    def add_build_phases(pipeline, product, cache=None, prefix='',
+                         postprocessors=None):
+        pipeline.add(prefix + 'sphinx', lambda: None)
+        return prefix + 'sphinx'
+
+    mocker.patch('ltdmason.batch.add_build_phases', add_build_phases)
+
+    yaml_str = (Path(__file__).parent / "demo_manifest.yaml").read_text()
+    yaml = ruamel.yaml.YAML()
+    data = yaml.load(yaml_str)
+    data['doc_repo']['clone'] = {'sparse': ['doc/']}
+    stream = StringIO()
+    yaml.dump(data, stream)
+
+    products = add_batch_phases(
+        Pipeline(), [Manifest(yaml_str), Manifest(stream.getvalue())],
+        str(tmpdir), upload=False)
+    assert products[0] is not products[1]
+
+
+def test_batch_stream_postprocessors(tmpdir, manifests):
+    """Streamed uploads would publish files before they're post-processed.
+    """
+    with pytest.raises(ValueError):
+        add_batch_phases(Pipeline(), manifests, str(tmpdir),
+                         stream_upload=True, postprocessors=[object()])
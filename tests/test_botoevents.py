@@ -0,0 +1,35 @@
+"""Tests for ltdmason.botoevents."""
+
+import logging
+
+from ltdmason.botoevents import attach
+
+
+class Counter(object):
+
+    def __init__(self):
+        super().__init__()
+        self.sent = 0
+
+    def before_send(self, **kwargs):
+        self.sent += 1
+
+    def after_call(self, **kwargs):
+        raise RuntimeError('Bug in the handler')
+
+
+def test_attach(fake_s3, caplog):
+    client = fake_s3.client()
+    counter = Counter()
+    other = Counter()
+    handlers = [('before-send.s3', counter.before_send),
+                ('after-call.s3', counter.after_call)]
+    attach(client, counter, handlers)
+    attach(client, counter, handlers)  # no double counting
+    attach(client, other, [('before-send.s3', other.before_send)])
+
+    with caplog.at_level(logging.ERROR, logger='ltdmason.botoevents'):
+        client.put_object(Bucket='bucket', Key='a', Body=b'12345')
+    assert (counter.sent, other.sent) == (1, 1)
+    # Errors of handlers are logged, not raised
+    assert 'after-call.s3.PutObject' in caplog.text
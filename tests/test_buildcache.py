@@ -0,0 +1,203 @@
+"""Tests for ltdmason.buildcache."""
+
+import os
+from pathlib import Path
+
+import pytest
+import ruamel.yaml
+from ruamel.yaml.compat import StringIO
+
+from ltdmason.buildcache import BuildCache, compute_fingerprint
+from ltdmason.fingerprint import AssetFingerprinter
+from ltdmason.manifest import Manifest
+from ltdmason.normalize import HTMLNormalizer, make_rules
+from ltdmason.pipeline import Pipeline
+from ltdmason.product import add_build_phases
+
+
+@pytest.fixture
+def demo_manifest_data():
+    path = Path(__file__).parent / "demo_manifest.yaml"
+    return path.read_text()
+
+
+def _modify_manifest(yaml_str, func):
+    yaml = ruamel.yaml.YAML()
+    data = yaml.load(yaml_str)
+    func(data)
+    stream = StringIO()
+    yaml.dump(data, stream)
+    return Manifest(stream.getvalue())
+
+
+def test_fingerprint_stable(demo_manifest_data):
+    a = compute_fingerprint(Manifest(demo_manifest_data))
+    b = compute_fingerprint(Manifest(demo_manifest_data))
+    assert a == b
+
+
+def test_fingerprint_ignores_build_id(demo_manifest_data):
+    a = compute_fingerprint(Manifest(demo_manifest_data))
+
+    def change(data):
+        data['build_id'] = 'b2'
+
+    b = compute_fingerprint(_modify_manifest(demo_manifest_data, change))
+    assert a == b
+
+
+def test_fingerprint_package_ref(demo_manifest_data):
+    a = compute_fingerprint(Manifest(demo_manifest_data))
+
+    def change(data):
+        data['packages']['afw']['ref'] = 'tickets/DM-1'
+
+    b = compute_fingerprint(_modify_manifest(demo_manifest_data, change))
+    assert a != b
+
+
+def test_fingerprint_shas(demo_manifest_data):
+    manifest = Manifest(demo_manifest_data)
+    a = compute_fingerprint(manifest, doc_repo_sha='abc')
+    b = compute_fingerprint(manifest, doc_repo_sha='def')
+    c = compute_fingerprint(manifest, doc_repo_sha='abc',
+                            package_shas={'afw': '123'})
+    assert len({a, b, c}) == 3
+
+
+def _write_site(html_dir):
+    os.makedirs(os.path.join(html_dir, '_static'))
+    with open(os.path.join(html_dir, 'index.html'), 'w') as f:
+        f.write('<html></html>')
+    with open(os.path.join(html_dir, '_static', 'style.css'), 'w') as f:
+        f.write('body {}')
+
+
+def test_store_restore(tmpdir):
+    cache = BuildCache(str(tmpdir.join('cache')))
+    html_dir = str(tmpdir.join('html'))
+    _write_site(html_dir)
+
+    assert 'abc' not in cache
+    cache.store('abc', html_dir)
+    assert 'abc' in cache
+    # storing again is a no-op
+    cache.store('abc', html_dir)
+
+    restored_dir = str(tmpdir.join('restored', 'html'))
+    cache.restore('abc', restored_dir)
+    assert os.path.exists(os.path.join(restored_dir, 'index.html'))
+    assert os.path.exists(os.path.join(restored_dir, '_static', 'style.css'))
+
+
+class FakeProduct(object):
+    """Product stand-in that records which build steps ran."""
+
+    def __init__(self, html_dir):
+        self.html_dir = html_dir
+        self.calls = []
+
+    def clone_doc_repo(self):
+        self.calls.append('clone')
+
+    def link_package_repos(self):
+        self.calls.append('link')
+
+    def install_dependencies(self):
+        self.calls.append('pip')
+
+    def build_sphinx(self):
+        self.calls.append('sphinx')
+        _write_site(self.html_dir)
+
+
+def test_build_phases_cache_hit(tmpdir, mocker):
+    cache = BuildCache(str(tmpdir.join('cache')))
+    mocker.patch.object(BuildCache, 'fingerprint', return_value='abc')
+
+    first = FakeProduct(str(tmpdir.join('first', 'html')))
+    pipeline = Pipeline()
+    assert add_build_phases(pipeline, first, cache=cache) == 'build-cache'
+    pipeline.run()
+    assert sorted(first.calls) == ['clone', 'link', 'pip', 'sphinx']
+    assert 'abc' in cache
+
+    second = FakeProduct(str(tmpdir.join('second', 'html')))
+    pipeline = Pipeline()
+    add_build_phases(pipeline, second, cache=cache)
+    pipeline.run()
+    assert second.calls == ['clone']
+    assert os.path.exists(os.path.join(second.html_dir, 'index.html'))
+
+
+def test_build_phases_postprocessors(tmpdir, mocker):
+    """Post-build stages run before the site is cached, and not on a hit."""
+    cache = BuildCache(str(tmpdir.join('cache')))
+    mocker.patch.object(BuildCache, 'fingerprint', return_value='abc')
+    processed = []
+
+    def mark(html_dir):
+        processed.append(html_dir)
+        with open(os.path.join(html_dir, 'index.html'), 'a') as f:
+            f.write('<!-- processed -->')
+    mark.name = 'mark'
+
+    first = FakeProduct(str(tmpdir.join('first', 'html')))
+    pipeline = Pipeline()
+    add_build_phases(pipeline, first, cache=cache, postprocessors=[mark])
+    pipeline.run()
+    assert pipeline['mark'].requires == ['sphinx']
+    assert pipeline['build-cache'].requires == ['mark']
+    assert processed == [first.html_dir]
+
+    second = FakeProduct(str(tmpdir.join('second', 'html')))
+    pipeline = Pipeline()
+    add_build_phases(pipeline, second, cache=cache, postprocessors=[mark])
+    pipeline.run()
+    assert processed == [first.html_dir]
+    with open(os.path.join(second.html_dir, 'index.html')) as f:
+        assert f.read().endswith('<!-- processed -->')
+
+
+def test_fingerprint_clone_options(demo_manifest_data):
+    a = compute_fingerprint(Manifest(demo_manifest_data))
+
+    def change(data):
+        data['doc_repo']['clone'] = {'sparse': ['doc/']}
+
+    b = compute_fingerprint(_modify_manifest(demo_manifest_data, change))
+    assert a != b
+
+
+def test_build_phases_unresolved_sha(tmpdir, mocker, demo_manifest_data):
+    """Builds without a resolved commit are always built, never cached."""
+    cache = BuildCache(str(tmpdir.join('cache')))
+    mocker.patch('ltdmason.buildcache.resolve_git_sha', return_value=None)
+    for run in ('first', 'second'):
+        product = FakeProduct(str(tmpdir.join(run, 'html')))
+        product.manifest = Manifest(demo_manifest_data)
+        product.doc_dir = str(tmpdir.join(run, 'doc'))
+        pipeline = Pipeline()
+        add_build_phases(pipeline, product, cache=cache)
+        pipeline.run()
+        assert sorted(product.calls) == ['clone', 'link', 'pip', 'sphinx']
+    assert os.listdir(cache.cache_dir) == []
+
+
+def test_fingerprint_postprocessors(demo_manifest_data):
+    manifest = Manifest(demo_manifest_data)
+    fingerprints = {
+        compute_fingerprint(manifest),
+        compute_fingerprint(manifest, postprocessors=[HTMLNormalizer()]),
+        compute_fingerprint(manifest, postprocessors=[
+            HTMLNormalizer(make_rules([{'glob': '*.html',
+                                        'pattern': 'x'}]))]),
+        compute_fingerprint(manifest, postprocessors=[
+            HTMLNormalizer(), AssetFingerprinter()]),
+        compute_fingerprint(manifest, postprocessors=[
+            HTMLNormalizer(), AssetFingerprinter(static_dir='static')]),
+    }
+    assert len(fingerprints) == 5
+    assert compute_fingerprint(
+        manifest, postprocessors=[AssetFingerprinter()]) == \
+        compute_fingerprint(manifest, postprocessors=[AssetFingerprinter()])
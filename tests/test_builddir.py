@@ -0,0 +1,87 @@
+"""Tests for ltdmason.builddir."""
+
+import os
+import tempfile
+
+import pytest
+
+from ltdmason.builddir import (DiskUsageReporter, TreeRemover,
+                               choose_build_root, disk_usage, parse_size)
+from ltdmason.pipeline import Pipeline
+from ltdmason.runreport import RunReport
+
+
+def test_parse_size():
+    assert parse_size('512') == 512
+    assert parse_size('1K') == 1024
+    assert parse_size('2G') == 2 * 1024 ** 3
+    assert parse_size('1.5MiB') == int(1.5 * 1024 ** 2)
+    with pytest.raises(ValueError):
+        parse_size('lots')
+
+
+def test_choose_build_root(tmpdir):
+    assert choose_build_root(str(tmpdir)) == str(tmpdir)
+    # Not enough free space falls back to the default temporary directory
+    assert choose_build_root(str(tmpdir), min_free=2 ** 62) \
+        == tempfile.gettempdir()
+    assert choose_build_root(str(tmpdir.join('missing'))) \
+        == tempfile.gettempdir()
+
+
+def test_tree_remover(tmpdir):
+    tree = tmpdir.join('build')
+    tree.ensure('a', 'b', 'file.txt')
+    remover = TreeRemover()
+    remover.remove(str(tree))
+    # The path is free for reuse immediately
+    assert not tree.exists()
+    remover.wait()
+    assert tmpdir.listdir() == []
+    # Missing trees are ignored
+    remover.remove(str(tree))
+
+
+def test_tree_remover_sweep(tmpdir):
+    trash_id = '0123456789abcdef' * 2
+    tmpdir.ensure('.ltd-mason-x.trash-' + trash_id, 'file.txt')
+    # Trash of other programs and of other directories is left alone
+    tmpdir.ensure('.other.trash-' + trash_id, 'file.txt')
+    tmpdir.ensure('.ltd-mason-x.trash-backup', 'file.txt')
+    tmpdir.ensure('keep', 'file.txt')
+    remover = TreeRemover()
+    remover.sweep(str(tmpdir), pattern='ltd-mason-*')
+    remover.wait()
+    assert sorted(p.basename for p in tmpdir.listdir()) == [
+        '.ltd-mason-x.trash-backup', '.other.trash-' + trash_id, 'keep']
+
+
+def test_tree_remover_prunes_threads(tmpdir):
+    remover = TreeRemover()
+    for i in range(5):
+        tmpdir.ensure('build', 'file.txt')
+        remover.remove(str(tmpdir.join('build')))
+        for thread in remover._threads:
+            thread.join()
+    assert len(remover._threads) == 1
+    remover.wait()
+    assert remover._threads == []
+
+
+def test_disk_usage(tmpdir):
+    tmpdir.join('data.bin').write_binary(b'x' * 100000)
+    os.symlink(str(tmpdir), str(tmpdir.join('loop')))
+    assert disk_usage(str(tmpdir)) >= 100000
+
+
+def test_disk_usage_reporter(tmpdir):
+    report = RunReport()
+    reporter = DiskUsageReporter(str(tmpdir), report=report)
+    pipeline = Pipeline(listeners=[report, reporter])
+    pipeline.add('write', lambda: tmpdir.join('data.bin').write_binary(
+        b'x' * 100000))
+    pipeline.run()
+    reporter.close()
+    assert reporter.usage['write'] >= 100000
+    assert report.as_dict()['phases']['write']['disk_usage_bytes'] == \
+        reporter.usage['write']
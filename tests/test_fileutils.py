@@ -0,0 +1,35 @@
+"""Tests for ltdmason.fileutils."""
+
+import os
+import stat
+
+import pytest
+
+from ltdmason.fileutils import write_atomic
+
+
+def test_write_atomic(tmpdir):
+    path = str(tmpdir.join('state.json'))
+    write_atomic(path, '{"a": 1}')
+    assert tmpdir.join('state.json').read() == '{"a": 1}'
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+
+    write_atomic(path, b'{}', mode=0o644)
+    assert tmpdir.join('state.json').read() == '{}'
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o644
+
+    original = tmpdir.join('page.html')
+    original.write('original')
+    original.chmod(0o640)
+    write_atomic(str(original), b'rewritten', mode_from=str(original))
+    assert original.read() == 'rewritten'
+    assert stat.S_IMODE(os.stat(str(original)).st_mode) == 0o640
+
+
+def test_write_atomic_failure(tmpdir):
+    """A failed write leaves the file and no temporary file behind."""
+    tmpdir.join('state.json').write('old')
+    with pytest.raises(TypeError):
+        write_atomic(str(tmpdir.join('state.json')), 42)
+    assert tmpdir.join('state.json').read() == 'old'
+    assert [p.basename for p in tmpdir.listdir()] == ['state.json']
@@ -0,0 +1,82 @@
+"""Tests for ltdmason.fingerprint."""
+
+import fnmatch
+import hashlib
+import shutil
+
+from ltdmason.fingerprint import (AssetFingerprinter, DEFAULT_CACHE_CONTROL,
+                                  fingerprinted_name)
+
+
+def _digest(content):
+    return hashlib.sha256(content).hexdigest()[:12]
+
+
+def test_fingerprinted_name():
+    assert fingerprinted_name('basic.css', 'abcdef0123456789') \
+        == 'basic.abcdef012345.css'
+    assert fingerprinted_name('LICENSE', 'abcdef0123456789') \
+        == 'LICENSE.abcdef012345'
+
+
+def test_fingerprint_site(tmpdir):
+    tmpdir.join('_static', 'logo.png').write_binary(b'png', ensure=True)
+    tmpdir.join('_static', 'site.css').write(
+        'body { background: url("logo.png"); }')
+    tmpdir.join('index.html').write(
+        '<link rel="stylesheet" href="_static/site.css?v=1" />\n'
+        '<img src="_static/logo.png">\n'
+        '<a href="https://example.org/_static/logo.png">x</a>\n'
+        '<a href="page.html#_static">y</a>\n')
+    tmpdir.join('api', 'page.html').write(
+        "<img src='../_static/logo.png'>", ensure=True)
+
+    mapping = AssetFingerprinter()(str(tmpdir))
+
+    logo = '_static/logo.{0}.png'.format(_digest(b'png'))
+    css = tmpdir.join('_static', 'site.css').read()
+    css_digest = _digest(css.replace('logo.png', logo[8:]).encode())
+    assert mapping['_static/logo.png'] == logo
+    assert mapping['_static/site.css'] == \
+        '_static/site.{0}.css'.format(css_digest)
+    # Originals are kept, and fingerprinted stylesheets point at
+    # fingerprinted assets
+    assert tmpdir.join('_static', 'logo.png').check()
+    assert tmpdir.join(mapping['_static/site.css']).read() == \
+        'body {{ background: url("{0}"); }}'.format(logo[8:])
+
+    index = tmpdir.join('index.html').read()
+    assert 'href="{0}?v=1"'.format(mapping['_static/site.css']) in index
+    assert 'src="{0}"'.format(logo) in index
+    assert 'https://example.org/_static/logo.png' in index
+    assert 'page.html#_static' in index
+    assert tmpdir.join('api', 'page.html').read() == \
+        "<img src='../{0}'>".format(logo)
+
+    # Running again doesn't fingerprint fingerprinted copies
+    assert AssetFingerprinter()(str(tmpdir)) == mapping
+
+
+def test_fingerprinted_copy_is_independent(tmpdir):
+    """Rewriting an original in place, as incremental Sphinx builds do with
+    ``shutil.copyfile``, leaves its fingerprinted copy unchanged.
+    """
+    tmpdir.join('_static', 'logo.png').write_binary(b'png', ensure=True)
+    tmpdir.join('new.png').write_binary(b'new png')
+
+    mapping = AssetFingerprinter()(str(tmpdir))
+    shutil.copyfile(str(tmpdir.join('new.png')),
+                    str(tmpdir.join('_static', 'logo.png')))
+
+    assert tmpdir.join(mapping['_static/logo.png']).read_binary() == b'png'
+
+
+def test_default_cache_control():
+    def cache_control(path):
+        for glob, value in DEFAULT_CACHE_CONTROL:
+            if fnmatch.fnmatch(path, glob):
+                return value
+
+    assert 'immutable' in cache_control('_static/site.0123456789ab.css')
+    assert 'must-revalidate' in cache_control('api/index.html')
+    assert cache_control('_static/site.css') is None
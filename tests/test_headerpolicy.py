@@ -0,0 +1,80 @@
+"""Tests for ltdmason.headerpolicy."""
+
+import pytest
+
+from ltdmason.headerpolicy import (HeaderPolicy, HeaderRule, load_policy,
+                                   make_policy)
+
+
+def test_guess_type():
+    policy = HeaderPolicy(types={'.bib': 'text/x-bibtex'})
+    assert policy.guess_type('_static/fonts/font.woff2') == 'font/woff2'
+    assert policy.guess_type('_static/app.js.map') == 'application/json'
+    assert policy.guess_type('notebooks/demo.IPYNB') \
+        == 'application/x-ipynb+json'
+    assert policy.guess_type('refs.bib') == 'text/x-bibtex'
+    assert policy.guess_type('index.html') == 'text/html'
+    assert policy.guess_type('LICENSE') is None
+
+
+def test_first_matching_rule_wins():
+    policy = HeaderPolicy([
+        HeaderRule('_static/*.svgz', content_type='image/svg+xml',
+                   content_encoding='gzip'),
+        HeaderRule('*.html', cache_control='max-age=300'),
+        HeaderRule('api/*', cache_control='max-age=60',
+                   metadata={'section': 'api'}),
+        HeaderRule('*', cache_control='max-age=3600'),
+    ])
+    assert policy.headers_for('api/index.html') == {
+        'content_type': 'text/html', 'cache_control': 'max-age=300',
+        'content_encoding': None, 'metadata': {'section': 'api'}}
+    assert policy.headers_for('_static/logo.svgz') == {
+        'content_type': 'image/svg+xml', 'cache_control': 'max-age=3600',
+        'content_encoding': 'gzip', 'metadata': {}}
+    assert [r.glob for r in policy.matching_rules('a.b.html')] \
+        == ['*.html', '*']
+
+
+def test_extra_args():
+    policy = HeaderPolicy([HeaderRule('downloads/*', metadata={
+        'surrogate-key': 'ignored', 'disposition': 'attachment'})])
+    assert policy.extra_args('downloads/data.csv',
+                             metadata={'surrogate-key': 'k'},
+                             cache_control='max-age=31536000') == {
+        'Metadata': {'surrogate-key': 'k', 'disposition': 'attachment'},
+        'CacheControl': 'max-age=31536000',
+        'ContentType': 'text/csv'}
+    assert policy.extra_args('index.html', acl='public-read') == {
+        'ACL': 'public-read', 'ContentType': 'text/html'}
+
+
+def test_with_rules():
+    policy = HeaderPolicy([HeaderRule('*.html', cache_control='no-cache')])
+    policy = policy.with_rules([HeaderRule('*', cache_control='max-age=1')])
+    assert policy.headers_for('index.html')['cache_control'] == 'max-age=1'
+
+
+def test_load_policy(tmpdir):
+    path = tmpdir.join('headers.yaml')
+    path.write(
+        "types:\n"
+        "  .bib: text/x-bibtex\n"
+        "rules:\n"
+        "  - glob: '*.html'\n"
+        "    cache_control: 'max-age=300, must-revalidate'\n")
+    policy = load_policy(str(path))
+    assert policy.headers_for('index.html')['cache_control'] \
+        == 'max-age=300, must-revalidate'
+    assert policy.guess_type('refs.bib') == 'text/x-bibtex'
+
+
+def test_invalid_policy():
+    with pytest.raises(ValueError):
+        make_policy({'rules': [{'cache_control': 'no-cache'}]})
+    with pytest.raises(ValueError):
+        make_policy({'rules': [{'glob': '*', 'cache': 'no-cache'}]})
+    with pytest.raises(ValueError):
+        make_policy({'types': {'bib': 'text/x-bibtex'}})
+    with pytest.raises(ValueError):
+        make_policy({'headers': []})
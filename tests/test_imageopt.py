@@ -0,0 +1,115 @@
+"""Tests for ltdmason.imageopt."""
+
+import struct
+import zlib
+
+from ltdmason.imageopt import (ImageOptimizer, find_tools, optimize_image,
+                               recompress_png)
+
+
+def _chunk(chunk_type, body):
+    return struct.pack('>I4s', len(body), chunk_type) + body + \
+        struct.pack('>I', zlib.crc32(chunk_type + body))
+
+
+def _png(width=64, height=64, level=0):
+    """An RGB PNG whose image data is split over two IDAT chunks."""
+    raw = b''.join(
+        b'\x00' + b''.join(bytes((x * 4 % 256, y * 4 % 256, 0))
+                           for x in range(width))
+        for y in range(height))
+    idat = zlib.compress(raw, level)
+    half = len(idat) // 2
+    ihdr = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    return (b'\x89PNG\r\n\x1a\n' + _chunk(b'IHDR', ihdr) +
+            _chunk(b'tEXt', b'Comment\x00kept') +
+            _chunk(b'IDAT', idat[:half]) + _chunk(b'IDAT', idat[half:]) +
+            _chunk(b'IEND', b'')), raw
+
+
+def _image_data(png):
+    pos = 8
+    idat = b''
+    chunk_types = []
+    while pos < len(png):
+        length, chunk_type = struct.unpack('>I4s', png[pos:pos + 8])
+        body = png[pos + 8:pos + 8 + length]
+        crc, = struct.unpack('>I', png[pos + 8 + length:pos + 12 + length])
+        assert crc == zlib.crc32(chunk_type + body)
+        chunk_types.append(chunk_type)
+        if chunk_type == b'IDAT':
+            idat += body
+        pos += length + 12
+    return zlib.decompress(idat), chunk_types
+
+
+def test_recompress_png():
+    png, raw = _png()
+    optimized = recompress_png(png)
+
+    assert len(optimized) < len(png)
+    data, chunk_types = _image_data(optimized)
+    assert data == raw
+    assert chunk_types == [b'IHDR', b'tEXt', b'IDAT', b'IEND']
+    # Already optimal images are returned as they are
+    assert recompress_png(optimized) is optimized
+
+
+def test_recompress_invalid_png():
+    assert recompress_png(b'not a png') == b'not a png'
+    png, _ = _png()
+    truncated = png[:60]
+    assert recompress_png(truncated) == truncated
+
+
+def test_find_tools():
+    tools = {'.png': [['no-such-optimizer', '{input}'],
+                      ['true', '{input}']],
+             '.jpg': [['no-such-optimizer', '{input}']]}
+    assert find_tools(tools) == {'.png': ['true', '{input}']}
+
+
+def test_optimize_images(tmpdir):
+    png, raw = _png()
+    tmpdir.join('_images', 'plot.png').write_binary(png, ensure=True)
+    tmpdir.join('_static', 'logo.PNG').write_binary(png, ensure=True)
+    tmpdir.join('_static', 'photo.jpg').write_binary(b'jpeg', ensure=True)
+    tmpdir.join('other', 'skipped.png').write_binary(png, ensure=True)
+    cache_dir = tmpdir.join('cache')
+
+    optimizer = ImageOptimizer(cache_dir=str(cache_dir), processes=2,
+                               tools={})
+    stats = optimizer(str(tmpdir))
+
+    assert stats['images'] == 3
+    assert stats['optimized'] == 2
+    assert stats['bytes_after'] < stats['bytes_before']
+    for path in (tmpdir.join('_images', 'plot.png'),
+                 tmpdir.join('_static', 'logo.PNG')):
+        assert _image_data(path.read_binary())[0] == raw
+    assert tmpdir.join('_static', 'photo.jpg').read_binary() == b'jpeg'
+    assert tmpdir.join('other', 'skipped.png').read_binary() == png
+
+    # Each unique image is optimized once; later builds use the cache
+    tmpdir.join('_images', 'plot.png').write_binary(png)
+    stats = ImageOptimizer(cache_dir=str(cache_dir), tools={})(str(tmpdir))
+    assert stats['cached'] == 3
+    assert stats['optimized'] == 1
+    assert _image_data(
+        tmpdir.join('_images', 'plot.png').read_binary())[0] == raw
+
+
+def test_optimize_image_failure_not_cached(tmpdir):
+    """A failed optimizer leaves the image as it is, and is retried by the
+    next build.
+    """
+    png, _ = _png()
+    path = tmpdir.join('plot.png')
+    path.write_binary(png)
+    cache_dir = tmpdir.mkdir('cache')
+
+    result = optimize_image(str(path), {'.png': ['false', '{input}']},
+                            cache_dir=str(cache_dir))
+    assert result == (len(png), len(png), False)
+    assert path.read_binary() == png
+    assert cache_dir.listdir() == []
@@ -0,0 +1,59 @@
+"""Tests for ltdmason.intersphinxcache."""
+
+import pytest
+import responses
+
+from ltdmason.intersphinxcache import (InventoryCache, InventoryUnavailable,
+                                       is_inventory_url)
+
+INV_URL = 'https://docs.example.org/objects.inv'
+
+
+@responses.activate
+def test_get_caches(tmpdir):
+    responses.add(responses.GET, INV_URL, body=b'inventory')
+    cache = InventoryCache(str(tmpdir))
+    assert cache.get(INV_URL) == (b'inventory', INV_URL)
+    assert cache.get(INV_URL) == (b'inventory', INV_URL)
+    assert len(responses.calls) == 1
+    assert cache.urls() == [INV_URL]
+
+
+@responses.activate
+def test_get_stale(tmpdir):
+    cache = InventoryCache(str(tmpdir), ttl=0.)
+    cache.store(INV_URL, b'old')
+    responses.add(responses.GET, INV_URL, body=b'new')
+    assert cache.get(INV_URL) == (b'new', INV_URL)
+
+    # An unreachable remote falls back to the stale copy
+    responses.replace(responses.GET, INV_URL, status=503)
+    assert cache.get(INV_URL) == (b'new', INV_URL)
+
+
+@responses.activate
+def test_offline(tmpdir):
+    cache = InventoryCache(str(tmpdir), ttl=0., offline=True)
+    with pytest.raises(InventoryUnavailable):
+        cache.get(INV_URL)
+    inv_path = tmpdir.join('objects.inv')
+    inv_path.write_binary(b'seeded')
+    cache.seed(INV_URL, str(inv_path))
+    assert cache.get(INV_URL) == (b'seeded', INV_URL)
+    assert len(responses.calls) == 0
+
+
+@responses.activate
+def test_refresh(tmpdir):
+    cache = InventoryCache(str(tmpdir))
+    cache.store(INV_URL, b'old')
+    responses.add(responses.GET, INV_URL, body=b'new')
+    assert cache.refresh() == []
+    assert cache.lookup(INV_URL)['data'] == b'new'
+
+
+def test_is_inventory_url():
+    assert is_inventory_url(INV_URL)
+    assert is_inventory_url('https://docs.example.org/objects.inv?v=1')
+    assert not is_inventory_url('https://docs.example.org/logo.png')
+    assert not is_inventory_url('objects.inv')
@@ -116,3 +116,18 @@ def test_travis_manifest_missing_envvars(monkeypatch):
         manifest.product_name
     with pytest.raises(RuntimeError):
         manifest.refs
+
+
+def test_doc_repo_clone_options(demo_manifest):
+    manifest = Manifest(demo_manifest)
+    assert manifest.doc_repo_clone_options == {}
+
+    yaml = ruamel.yaml.YAML()
+    data = yaml.load(demo_manifest)
+    data['doc_repo']['clone'] = {'depth': 1, 'filter': 'blob:none',
+                                 'sparse': ['/*', '!/figures/']}
+    Manifest.validate(data)
+
+    data['doc_repo']['clone']['depth'] = 0
+    with pytest.raises(ValidationError):
+        Manifest.validate(data)
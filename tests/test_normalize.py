@@ -0,0 +1,64 @@
+"""Tests for ltdmason.normalize."""
+
+import os
+
+import pytest
+
+from ltdmason.normalize import (HTMLNormalizer, NormalizationRule,
+                                load_rules, make_rules)
+
+PAGE = """<div class="footer">
+  &copy; Copyright 2017.
+  Last updated on Jun 23, 2017.
+  Created using Sphinx.
+</div>
+"""
+
+
+def test_default_rules(tmpdir):
+    tmpdir.join('index.html').write(PAGE)
+    tmpdir.join('_static', 'app.js').write('Last updated on Jun 23, 2017.',
+                                           ensure=True)
+    stats = HTMLNormalizer()(str(tmpdir))
+    assert stats['matched'] == 1
+    assert stats['changed'] == 1
+    assert 'Last updated' not in tmpdir.join('index.html').read()
+    assert 'Created using Sphinx' in tmpdir.join('index.html').read()
+    assert 'Last updated' in tmpdir.join('_static', 'app.js').read()
+
+
+def test_unchanged_files_are_not_rewritten(tmpdir):
+    page = tmpdir.join('index.html')
+    page.write('<p>Stable</p>')
+    os.utime(str(page), ns=(1, 1))
+    stats = HTMLNormalizer()(str(tmpdir))
+    assert stats['changed'] == 0
+    assert os.stat(str(page)).st_mtime_ns == 1
+
+
+def test_load_rules(tmpdir):
+    rules_path = tmpdir.join('rules.yaml')
+    rules_path.write(
+        "- glob: 'api/*.html'\n"
+        "  pattern: 'Built at \\d+'\n"
+        "  replacement: 'Built'\n")
+    rules = load_rules(str(rules_path))
+    assert rules[0].matches('api/nested/page.html')
+    assert not rules[0].matches('index.html')
+    page = tmpdir.join('html', 'api', 'page.html')
+    page.write('Built at 1234', ensure=True)
+    HTMLNormalizer(rules)(str(tmpdir.join('html')))
+    assert page.read() == 'Built'
+
+
+def test_invalid_rules():
+    with pytest.raises(ValueError):
+        make_rules([{'glob': '*.html'}])
+    with pytest.raises(ValueError):
+        make_rules([{'glob': '*.html', 'pattern': '('}])
+
+
+def test_rule_preserves_invalid_utf8():
+    rule = NormalizationRule('*.html', 'x', 'y')
+    assert rule.apply(b'\xff x'.decode('utf-8', 'surrogateescape')) \
+        .encode('utf-8', 'surrogateescape') == b'\xff y'
@@ -0,0 +1,70 @@
+"""Tests for ltdmason.openmetrics."""
+
+import os
+from unittest import mock
+
+from ltdmason.openmetrics import BuildMetrics
+from ltdmason.runreport import RunReport
+
+
+def _report(status_error=None):
+    operation = {'calls': 3, 'errors': 1, 'retries': 1, 'bytes_sent': 300,
+                 'bytes_received': 0, 'seconds': 0.3, 'max_seconds': 0.2,
+                 'mean_seconds': 0.1}
+    call_stats = mock.Mock()
+    call_stats.as_dict.return_value = {
+        'operations': {'PutObject': operation}, 'totals': operation}
+    report = RunReport(call_stats=call_stats)
+    report.add('p[0]:sphinx', report.start_time, report.start_time + 2.)
+    report.disk_usage('p[0]:sphinx', 12345)
+    report.add('upload-files', report.start_time, report.start_time + 0.5)
+    report.count('files_uploaded', 2)
+    report.count('bytes_uploaded', 1000)
+    report.count('files_unchanged', 5)
+    report.count('bytes_unchanged', 4000)
+    report.finish(error=status_error)
+    return report
+
+
+def test_build_metrics(tmpdir):
+    path = str(tmpdir.join('ltd-mason.prom'))
+    metrics = BuildMetrics(path, command='ltd-mason')
+    metrics.start()
+    metrics.add(_report(), started=True)
+    metrics.add(_report(RuntimeError('boom')))
+    metrics.write()
+
+    with open(path) as f:
+        text = f.read()
+    lines = text.splitlines()
+    assert lines[-1] == '# EOF'
+    assert '# TYPE ltd_mason_runs counter' in lines
+    assert 'ltd_mason_runs_total{command="ltd-mason",status="failed"} 1' \
+        in lines
+    assert 'ltd_mason_runs_total{command="ltd-mason",status="succeeded"} 1' \
+        in lines
+    assert 'ltd_mason_runs_in_progress{command="ltd-mason"} 0' in lines
+    # Batch prefixes are stripped from phase names
+    assert 'ltd_mason_phase_seconds_total{command="ltd-mason",' \
+        'phase="sphinx"} 4.0' in lines
+    assert 'ltd_mason_last_phase_duration_seconds{command="ltd-mason",' \
+        'phase="sphinx"} 2.0' in lines
+    assert 'ltd_mason_last_phase_disk_usage_bytes{command="ltd-mason",' \
+        'phase="sphinx"} 12345' in lines
+    assert 'ltd_mason_last_phase_disk_usage_bytes{command="ltd-mason",' \
+        'phase="upload-files"}' not in text
+    assert 'ltd_mason_upload_bytes_total{command="ltd-mason",' \
+        'result="unchanged"} 8000' in lines
+    assert 'ltd_mason_upload_files_total{command="ltd-mason",' \
+        'result="uploaded"} 4' in lines
+    assert 'ltd_mason_last_upload_throughput_bytes_per_second' \
+        '{command="ltd-mason"} 2000.0' in lines
+    assert 'ltd_mason_s3_request_retries_total{command="ltd-mason",' \
+        'operation="PutObject"} 2' in lines
+    # No temporary files are left behind
+    assert os.listdir(str(tmpdir)) == ['ltd-mason.prom']
+
+
+def test_build_metrics_label_escaping():
+    metrics = BuildMetrics(command='a "quoted"\\name')
+    assert 'command="a \\"quoted\\"\\\\name"' in metrics.render()
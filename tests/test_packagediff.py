@@ -0,0 +1,104 @@
+"""Tests for ltdmason.packagediff."""
+
+import os
+from pathlib import Path
+
+from ltdmason.manifest import Manifest
+from ltdmason.packagediff import (BuildState, PackageDiff, diff_packages,
+                                  manifest_inputs)
+from ltdmason.product import Product
+
+
+def _inputs(packages, doc_ref='master'):
+    return {
+        'doc_repo': {'url': 'https://github.com/lsst/pipelines_docs.git',
+                     'ref': doc_ref, 'sha': None},
+        'packages': {name: {'url': 'https://github.com/lsst/' + name,
+                            'ref': ref, 'sha': sha}
+                     for name, (ref, sha) in packages.items()}
+    }
+
+
+def test_diff_packages():
+    previous = _inputs({'afw': ('master', 'a1'),
+                        'geom': ('master', None),
+                        'daf_base': ('master', 'd1'),
+                        'old_pkg': ('master', None)})
+    current = _inputs({'afw': ('master', 'a2'),
+                       'geom': ('tickets/DM-1', None),
+                       'daf_base': ('master', 'd1'),
+                       'new_pkg': ('master', None)})
+    diff = diff_packages(previous, current)
+    assert diff.added == {'new_pkg'}
+    assert diff.removed == {'old_pkg'}
+    assert diff.changed == {'afw', 'geom'}
+    assert not diff.doc_repo_changed
+    assert not diff.is_empty
+    assert 'afw' in diff.output_dirs
+    assert os.path.join('_static', 'afw') in diff.output_dirs
+
+
+def test_diff_packages_unchanged():
+    inputs = _inputs({'afw': ('master', 'a1')})
+    diff = diff_packages(inputs, inputs)
+    assert diff.is_empty
+    assert diff.output_dirs == []
+
+
+def test_diff_packages_first_build():
+    diff = diff_packages(None, _inputs({'afw': ('master', None)}))
+    assert diff.added == {'afw'}
+    assert diff.doc_repo_changed
+    assert diff.output_dirs == ['']
+
+
+def test_build_state(tmpdir):
+    state = BuildState(str(tmpdir.join('state')))
+    assert state.load('lsst_apps') is None
+    inputs = _inputs({'afw': ('master', None)})
+    state.save('lsst_apps', inputs)
+    assert state.load('lsst_apps') == inputs
+
+
+def test_build_state_tree(tmpdir):
+    """State saved with a build directory only matches that tree until it
+    is detached.
+    """
+    state = BuildState(str(tmpdir.join('state')))
+    build_dir = str(tmpdir.mkdir('build'))
+    other_dir = str(tmpdir.mkdir('other'))
+    inputs = _inputs({'afw': ('master', None)})
+    state.save('lsst_apps', inputs, build_dir=build_dir)
+
+    loaded = state.load('lsst_apps', build_dir=build_dir)
+    assert loaded['packages'] == inputs['packages']
+    assert state.load('lsst_apps', build_dir=other_dir) is None
+
+    state.detach(build_dir)
+    assert state.load('lsst_apps', build_dir=build_dir) is None
+    assert state.load('lsst_apps') is not None
+
+
+def test_manifest_inputs():
+    path = Path(__file__).parent / "demo_manifest.yaml"
+    manifest = Manifest(path.read_text())
+    inputs = manifest_inputs(manifest)
+    assert inputs['doc_repo']['ref'] == 'master'
+    assert inputs['packages']['afw']['ref'] == 'master'
+    assert inputs['packages']['afw']['sha'] is None
+
+
+def test_invalidate_packages(tmpdir):
+    path = Path(__file__).parent / "demo_manifest.yaml"
+    product = Product(Manifest(path.read_text()), str(tmpdir))
+    for rel_dir in ('afw', '_static/afw', 'geom', 'old_pkg'):
+        os.makedirs(os.path.join(product.html_dir, rel_dir))
+
+    diff = PackageDiff(added=[], removed=['old_pkg'], changed=['afw'],
+                       doc_repo_changed=False)
+    product.invalidate_packages(diff)
+
+    assert not os.path.exists(os.path.join(product.html_dir, 'afw'))
+    assert not os.path.exists(os.path.join(product.html_dir, '_static/afw'))
+    assert not os.path.exists(os.path.join(product.html_dir, 'old_pkg'))
+    assert os.path.exists(os.path.join(product.html_dir, 'geom'))
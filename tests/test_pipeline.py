@@ -0,0 +1,142 @@
+"""Tests for ltdmason.pipeline."""
+
+import threading
+import time
+
+import pytest
+
+from ltdmason.pipeline import DEFAULT_MAX_WORKERS, Pipeline, PipelineError
+
+
+def test_pipeline_order_and_results():
+    order = []
+    pipeline = Pipeline()
+    pipeline.add('a', lambda: order.append('a') or 1)
+    pipeline.add('b', lambda: order.append('b') or 2, requires=['a'])
+    pipeline.add('c', lambda: order.append('c') or 3, requires=['b'])
+    results = pipeline.run()
+    assert order == ['a', 'b', 'c']
+    assert results == {'a': 1, 'b': 2, 'c': 3}
+    assert [p.name for p in pipeline.critical_path] == ['a', 'b', 'c']
+
+
+def test_pipeline_overlaps_independent_phases():
+    """Two independent phases must run at the same time; each waits for the
+    other to start.
+    """
+    barrier = threading.Barrier(2, timeout=5)
+    pipeline = Pipeline()
+    pipeline.add('root', lambda: None)
+    pipeline.add('left', barrier.wait, requires=['root'])
+    pipeline.add('right', barrier.wait, requires=['root'])
+    pipeline.add('join', lambda: None, requires=['left', 'right'])
+    pipeline.run()
+    assert pipeline['join'].start_time >= pipeline['left'].end_time
+    assert pipeline['join'].start_time >= pipeline['right'].end_time
+
+
+def test_pipeline_critical_path():
+    pipeline = Pipeline()
+    pipeline.add('clone', lambda: None)
+    pipeline.add('link', lambda: None, requires=['clone'])
+    pipeline.add('pip', lambda: time.sleep(0.2), requires=['clone'])
+    pipeline.add('sphinx', lambda: None, requires=['link', 'pip'])
+    pipeline.add('register', lambda: None)
+    pipeline.run()
+    assert [p.name for p in pipeline.critical_path] \
+        == ['clone', 'pip', 'sphinx']
+
+
+def test_pipeline_failure_stops_dependents():
+    ran = []
+
+    def fail():
+        raise RuntimeError('boom')
+
+    pipeline = Pipeline()
+    pipeline.add('a', fail)
+    pipeline.add('b', lambda: ran.append('b'), requires=['a'])
+    with pytest.raises(RuntimeError):
+        pipeline.run()
+    assert ran == []
+
+
+def test_pipeline_unknown_requirement():
+    pipeline = Pipeline()
+    with pytest.raises(PipelineError):
+        pipeline.add('a', lambda: None, requires=['missing'])
+
+
+def test_pipeline_duplicate_phase():
+    pipeline = Pipeline()
+    pipeline.add('a', lambda: None)
+    with pytest.raises(PipelineError):
+        pipeline.add('a', lambda: None)
+
+
+def test_pipeline_resource_limit():
+    lock = threading.Lock()
+    active = []
+    peak = []
+
+    def job():
+        with lock:
+            active.append(1)
+            peak.append(len(active))
+        time.sleep(0.05)
+        with lock:
+            active.pop()
+
+    pipeline = Pipeline(resources={'cpu': 2})
+    for i in range(6):
+        pipeline.add('sphinx{0:d}'.format(i), job, resource='cpu')
+    pipeline.run()
+    assert max(peak) == 2
+
+
+def test_pipeline_default_max_workers():
+    """Large pipelines don't start a thread per phase."""
+    threads = set()
+
+    def job():
+        threads.add(threading.get_ident())
+        time.sleep(0.01)
+
+    pipeline = Pipeline()
+    for i in range(2 * DEFAULT_MAX_WORKERS):
+        pipeline.add('phase{0:d}'.format(i), job)
+    pipeline.run()
+    assert len(threads) <= DEFAULT_MAX_WORKERS
+
+
+def test_pipeline_keep_going():
+    ran = []
+
+    def fail():
+        raise RuntimeError('boom')
+
+    pipeline = Pipeline(keep_going=True)
+    pipeline.add('a', fail)
+    pipeline.add('b', lambda: ran.append('b'), requires=['a'])
+    pipeline.add('c', lambda: ran.append('c'), requires=['b'])
+    pipeline.add('x', lambda: ran.append('x'))
+    pipeline.add('y', lambda: ran.append('y'), requires=['x'])
+    with pytest.raises(PipelineError):
+        pipeline.run()
+    assert sorted(ran) == ['x', 'y']
+    assert list(pipeline.errors) == ['a']
+
+
+def test_is_finished():
+    pipeline = Pipeline()
+    seen = {}
+
+    def watch():
+        while not pipeline.is_finished('build'):
+            time.sleep(0.01)
+        seen['build'] = 'build' in pipeline.results
+
+    pipeline.add('build', lambda: time.sleep(0.05))
+    pipeline.add('watch', watch)
+    pipeline.run()
+    assert seen['build']
@@ -7,6 +7,7 @@ the packages are embedded in this repo's test_data/ directory.
 import os
 import tempfile
 import shutil
+import time
 from pathlib import Path
 
 import pytest
@@ -14,7 +15,8 @@ import sh
 import ruamel.yaml
 from ruamel.yaml.compat import StringIO
 
-from ltdmason.product import Product
+from ltdmason.product import (InstalledRequirements, Product,
+                              requirements_pinned)
 from ltdmason.manifest import Manifest
 
 
@@ -113,3 +115,158 @@ def test_link_package_repos(product):
 
 def test_sphinx_build(product):
     assert os.path.exists(os.path.join(product.doc_dir, '_build', 'html'))
+
+
+@pytest.fixture(scope='module')
+def local_doc_repo(tmpdir_factory):
+    """A local Git doc repo with a large file outside of the doc sources."""
+    repo_dir = str(tmpdir_factory.mktemp('repos').join('local_doc'))
+    os.makedirs(os.path.join(repo_dir, 'figures'))
+    git = sh.git.bake(_cwd=repo_dir)
+    git.init('-b', 'master')
+    git.config('user.email', 'mason@example.org')
+    git.config('user.name', 'Mason')
+    git.config('uploadpack.allowFilter', 'true')
+    with open(os.path.join(repo_dir, 'index.rst'), 'w') as f:
+        f.write('Docs\n====\n')
+    with open(os.path.join(repo_dir, 'figures', 'big.dat'), 'w') as f:
+        f.write('x' * 10000)
+    git.add('.')
+    git.commit('-m', 'first')
+    first_sha = str(git('rev-parse', 'HEAD')).strip()
+    with open(os.path.join(repo_dir, 'index.rst'), 'a') as f:
+        f.write('\nMore.\n')
+    git.commit('-am', 'second')
+    return repo_dir, first_sha
+
+
+def _local_product(tmpdir, repo_dir, ref, clone_options):
+    yaml = ruamel.yaml.YAML()
+    data = yaml.load(Path(__file__).parent.joinpath('mock_manifest.yaml')
+                     .read_text())
+    data['doc_repo']['url'] = 'file://' + repo_dir
+    data['doc_repo']['ref'] = ref
+    data['doc_repo']['clone'] = clone_options
+    stream = StringIO()
+    yaml.dump(data, stream)
+    build_dir = str(tmpdir.join('build'))
+    os.makedirs(build_dir)
+    return Product(Manifest(stream.getvalue()), build_dir)
+
+
+def test_clone_doc_repo_shallow_sparse(tmpdir, local_doc_repo):
+    repo_dir, _ = local_doc_repo
+    product = _local_product(tmpdir, repo_dir, 'master',
+                             {'depth': 1, 'filter': 'blob:none',
+                              'sparse': ['/*.rst']})
+    product.clone_doc_repo()
+
+    git = sh.git.bake(_cwd=product.doc_dir)
+    assert str(git('rev-list', '--count', 'HEAD')).strip() == '1'
+    assert os.path.exists(os.path.join(product.doc_dir, 'index.rst'))
+    assert not os.path.exists(os.path.join(product.doc_dir, 'figures'))
+
+
+def test_clone_doc_repo_shallow_fallback(tmpdir, local_doc_repo):
+    repo_dir, first_sha = local_doc_repo
+    product = _local_product(tmpdir, repo_dir, first_sha, {'depth': 1})
+    product.clone_doc_repo()
+
+    git = sh.git.bake(_cwd=product.doc_dir)
+    assert str(git('rev-parse', 'HEAD')).strip() == first_sha
+
+
+def test_link_package_repos_reconcile(tmpdir, mock_manifest):
+    """Linking into an existing build tree creates, fixes and removes links.
+    """
+    product = Product(Manifest(mock_manifest), str(tmpdir))
+    os.makedirs(product.doc_dir)
+
+    stats = product.link_package_repos()
+    assert stats['created'] > 0
+    assert os.path.islink(os.path.join(product.doc_dir, 'alpha',
+                                       'index.rst'))
+    assert os.path.islink(os.path.join(product.doc_dir, '_static', 'beta'))
+
+    # Relinking an up-to-date tree changes nothing
+    stats = product.link_package_repos()
+    assert stats['created'] == stats['updated'] == stats['removed'] == 0
+
+    # Point alpha at beta's sources and drop beta from the manifest
+    yaml = ruamel.yaml.YAML()
+    data = yaml.load(mock_manifest)
+    data['packages']['alpha']['dir'] = data['packages']['beta']['dir']
+    del data['packages']['beta']
+    stream = StringIO()
+    yaml.dump(data, stream)
+    product.manifest = Manifest(stream.getvalue())
+
+    stats = product.link_package_repos()
+    assert stats['updated'] > 0
+    assert stats['removed'] > 0
+    assert os.readlink(os.path.join(product.doc_dir, 'alpha', 'index.rst')) \
+        == os.path.join(product.manifest.packages['alpha']['dir'], 'doc',
+                        'index.rst')
+    assert not os.path.lexists(os.path.join(product.doc_dir, 'beta'))
+    assert not os.path.lexists(os.path.join(product.doc_dir, '_static',
+                                            'beta'))
+
+
+def test_link_package_repos_conflict(tmpdir, mock_manifest):
+    """Files of the doc repo are never replaced by links."""
+    product = Product(Manifest(mock_manifest), str(tmpdir))
+    os.makedirs(os.path.join(product.doc_dir, 'alpha'))
+    conflict = os.path.join(product.doc_dir, 'alpha', 'index.rst')
+    with open(conflict, 'w') as f:
+        f.write('Doc repo content')
+
+    with pytest.raises(FileExistsError) as excinfo:
+        product.link_package_repos()
+    assert conflict in str(excinfo.value)
+    with open(conflict) as f:
+        assert f.read() == 'Doc repo content'
+
+
+def test_requirements_pinned():
+    assert requirements_pinned('# docs\n'
+                               'Sphinx==7.2.6\n'
+                               'lsst-sphinx-bootstrap-theme[extra] == 0.2 '
+                               '; python_version >= "3.8"\n'
+                               'numpy==1.26.0 \\\n'
+                               '    --hash=sha256:abc\n')
+    assert not requirements_pinned('Sphinx>=7\n')
+    assert not requirements_pinned('Sphinx\n')
+    assert not requirements_pinned('Sphinx==7.*\n')
+    assert not requirements_pinned(
+        'git+https://github.com/lsst-sqre/documenteer.git@main\n')
+    assert not requirements_pinned('-e .\n')
+    assert not requirements_pinned('-r other.txt\n')
+
+
+def test_install_dependencies_once(tmpdir, mock_manifest, mocker):
+    """Pinned requirements are installed once; unpinned requirements are
+    refreshed with --upgrade once their install expires.
+    """
+    pip = mocker.patch('sh.pip', create=True)
+    installed = InstalledRequirements(ttl=60.)
+    manifest = Manifest(mock_manifest)
+
+    def install(requirements):
+        product = Product(manifest, str(tmpdir.mkdtemp()),
+                          installed_requirements=installed)
+        os.makedirs(product.doc_dir)
+        with open(os.path.join(product.doc_dir, 'requirements.txt'),
+                  'w') as f:
+            f.write(requirements)
+        product.install_dependencies()
+        return [c[0] for c in pip.bake.return_value.install.call_args_list]
+
+    assert install('Sphinx==7.2.6\n') == [('-r', 'requirements.txt')]
+    assert len(install('Sphinx==7.2.6\n')) == 1
+    assert len(install('Sphinx>=7\n')) == 2
+    assert len(install('Sphinx>=7\n')) == 2
+
+    mocker.patch('time.monotonic', return_value=time.monotonic() + 120.)
+    assert install('Sphinx>=7\n')[-1] == \
+        ('--upgrade', '-r', 'requirements.txt')
+    assert len(install('Sphinx==7.2.6\n')) == 3
@@ -0,0 +1,143 @@
+"""Tests for ltdmason.profiling."""
+
+import cProfile
+import os
+import pstats
+import sys
+import threading
+
+import pytest
+
+from ltdmason.pipeline import Pipeline
+from ltdmason.profiling import Profiler, collapse_stats
+
+
+def busy_function():
+    return sum(i * i for i in range(200000))
+
+
+def test_cpu_profile(tmpdir):
+    with Profiler('cpu', output_dir=str(tmpdir), name='test'):
+        thread = threading.Thread(target=busy_function)
+        thread.start()
+        thread.join()
+
+    prefix = str(tmpdir.join('test-{0:d}'.format(os.getpid())))
+    stats = pstats.Stats(prefix + '.prof')
+    assert any(func[2] == 'busy_function' for func in stats.stats)
+    with open(prefix + '.collapsed') as f:
+        lines = f.read().splitlines()
+    stacks = [line.rsplit(' ', 1) for line in lines]
+    assert all(int(us) > 0 for _, us in stacks)
+    assert any('busy_function (test_profiling.py:' in stack
+               for stack, _ in stacks)
+
+
+def test_cpu_profile_disables_all_before_merging(tmpdir, mocker):
+    """Every thread's profile is disabled, and its statistics frozen,
+    before any are merged, even if its thread is still running.
+    """
+    calls = []
+    disable = cProfile.Profile.disable
+    snapshot_stats = cProfile.Profile.snapshot_stats
+
+    def spy_disable(self):
+        calls.append('disable')
+        disable(self)
+
+    def spy_snapshot_stats(self):
+        calls.append('snapshot')
+        snapshot_stats(self)
+
+    mocker.patch('cProfile.Profile.disable', spy_disable)
+    mocker.patch('cProfile.Profile.snapshot_stats', spy_snapshot_stats)
+    done = threading.Event()
+
+    def run():
+        busy_function()
+        done.wait()
+
+    profiler = Profiler('cpu', output_dir=str(tmpdir), name='test')
+    profiler.start()
+    thread = threading.Thread(target=run)
+    thread.start()
+    profiler.stop()
+    done.set()
+    thread.join()
+
+    count = len(profiler._profiles)
+    assert calls == ['disable'] * count + ['snapshot'] * count
+
+
+def test_collapse_stats_splits_shared_callees():
+    def func(name):
+        return ('mod.py', 1, name)
+
+    stats = pstats.Stats.__new__(pstats.Stats)
+    # main calls a (3 s) and b (1 s); both call shared, which takes 2 s
+    stats.stats = {
+        func('main'): (1, 1, 0., 4., {}),
+        func('a'): (1, 1, 1.5, 3., {func('main'): (1, 1, 1.5, 3.)}),
+        func('b'): (1, 1, 0.5, 1., {func('main'): (1, 1, 0.5, 1.)}),
+        func('shared'): (2, 2, 2., 2., {func('a'): (1, 1, 1.5, 1.5),
+                                        func('b'): (1, 1, 0.5, 0.5)}),
+    }
+    assert collapse_stats(stats) == {
+        'main (mod.py:1);a (mod.py:1)': 1500000,
+        'main (mod.py:1);a (mod.py:1);shared (mod.py:1)': 1500000,
+        'main (mod.py:1);b (mod.py:1)': 500000,
+        'main (mod.py:1);b (mod.py:1);shared (mod.py:1)': 500000,
+    }
+
+
+def test_memory_profile(tmpdir):
+    kept = []
+    with Profiler('memory', output_dir=str(tmpdir), name='test') as profiler:
+        pipeline = Pipeline(listeners=[profiler])
+        pipeline.add('allocate', lambda: kept.append(bytearray(2 ** 20)))
+        pipeline.run()
+
+    prefix = 'test-{0:d}'.format(os.getpid())
+    # Only the start and end snapshots are dumped
+    assert sorted(os.listdir(str(tmpdir))) == [
+        prefix + '-001-start.tracemalloc',
+        prefix + '-003-end.tracemalloc',
+        prefix + '.memory.txt']
+    with open(str(tmpdir.join(prefix + '.memory.txt'))) as f:
+        text = f.read()
+    assert '== allocate (2)' in text
+    assert 'Top growth since the previous snapshot:' in text
+    assert 'test_profiling.py' in text
+
+    with Profiler('memory', output_dir=str(tmpdir.join('phases')),
+                  name='test', dump_phases=True) as profiler:
+        pipeline = Pipeline(listeners=[profiler])
+        pipeline.add('allocate', lambda: None)
+        pipeline.run()
+    assert prefix + '-002-allocate.tracemalloc' in \
+        os.listdir(str(tmpdir.join('phases')))
+
+
+def test_unknown_mode():
+    with pytest.raises(ValueError):
+        Profiler('disk')
+
+
+def test_profile_thread_unhooks_itself(tmpdir, mocker):
+    """If a thread's profiler can't be enabled, the thread's profile hook
+    is removed instead of being called on every call.
+    """
+    mocker.patch('cProfile.Profile.enable',
+                 side_effect=ValueError('another profiler is active'))
+    profiler = Profiler('cpu', output_dir=str(tmpdir))
+    hooks = []
+
+    def run():
+        sys.setprofile(profiler._profile_thread)
+        busy_function()
+        hooks.append(sys.getprofile())
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    thread.join()
+    assert hooks == [None]
@@ -0,0 +1,76 @@
+"""Tests for ltdmason.progress."""
+
+import io
+import logging
+import time
+
+from ltdmason.progress import UploadProgress, format_progress
+from ltdmason.s3upload import upload
+from ltdmason.storage import MemoryBackend
+
+
+def test_upload_progress(tmpdir, caplog):
+    site = tmpdir.mkdir('html')
+    site.join('index.html').write('index')
+    site.mkdir('a').join('page.html').write('page')
+    backend = MemoryBackend()
+    progress = UploadProgress(interval=60.)
+
+    with caplog.at_level(logging.INFO, logger='ltdmason.progress'):
+        upload('bucket', 'docs', str(site), backend=backend,
+               progress=progress)
+    snapshot = progress.snapshot()
+    assert snapshot['files'] == snapshot['total_files'] == 2
+    assert snapshot['bytes'] == snapshot['total_bytes'] == 9
+    assert snapshot['eta_seconds'] == 0.
+    messages = [r.getMessage() for r in caplog.records]
+    assert len(messages) == 1
+    assert messages[0].startswith('Upload 2/2 files, 9 B/9 B, ')
+    assert messages[0].endswith('ETA 0s')
+
+    # Skipped files count as done
+    progress = UploadProgress(interval=60.)
+    upload('bucket', 'docs', str(site), backend=backend,
+           skip_unchanged=True, progress=progress)
+    assert progress.snapshot()['bytes'] == 9
+
+
+def test_periodic_reports(caplog):
+    progress = UploadProgress(interval=0.01)
+    with caplog.at_level(logging.INFO, logger='ltdmason.progress'):
+        progress.start(4, 4000)
+        # Concurrent uploads share the reporter
+        progress.start(1, 1000)
+        progress.update(bytes=1000)
+        time.sleep(0.1)
+        progress.finish()
+        assert progress.snapshot()['total_files'] == 5
+        progress.update(files=4, bytes=4000)
+        progress.finish()
+    messages = [r.getMessage() for r in caplog.records]
+    assert len(messages) > 2
+    assert messages[0].startswith('Upload 1/5 files, 1000 B/4.9 KiB, ')
+    assert messages[-1].startswith('Upload 5/5 files, 4.9 KiB/4.9 KiB, ')
+
+
+def test_progress_bar():
+    stream = io.StringIO()
+    progress = UploadProgress(interval=60., stream=stream, width=10)
+    progress.start(2, 100)
+    progress.update(bytes=50)
+    progress.finish()
+    output = stream.getvalue()
+    assert output.startswith('\r[#####.....] 1/2 files, 50 B/100 B, ')
+    assert output.endswith('\n')
+
+
+def test_format_progress():
+    assert format_progress({
+        'files': 10, 'total_files': 40, 'bytes': 3 * 1024 ** 2,
+        'total_bytes': 12 * 1024 ** 2, 'bytes_per_second': 1536.,
+        'requests_per_second': 2.25, 'eta_seconds': 3725.}) == \
+        '10/40 files, 3.0 MiB/12.0 MiB, 1.5 KiB/s, 2.2 req/s, ETA 1h02m05s'
+    assert format_progress({
+        'files': 0, 'total_files': 1, 'bytes': 0, 'total_bytes': 1,
+        'bytes_per_second': 0., 'requests_per_second': 0.,
+        'eta_seconds': None}).endswith('ETA ?')
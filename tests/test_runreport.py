@@ -0,0 +1,80 @@
+"""Tests for ltdmason.runreport."""
+
+import json
+
+import pytest
+
+from ltdmason.pipeline import Pipeline
+from ltdmason.runreport import RunReport
+from ltdmason.s3upload import upload
+from ltdmason.storage import MemoryBackend
+
+
+def test_run_report_pipeline_phases(tmpdir):
+    path = str(tmpdir.join('report.json'))
+    with RunReport(path, command='ltd-mason') as report:
+        with report.timer('manifest'):
+            pass
+        pipeline = Pipeline(listeners=[report])
+        pipeline.add('clone', lambda: None)
+        pipeline.add('sphinx', lambda: None, requires=['clone'])
+        pipeline.run()
+        report.count('files', 2)
+        report.count('files')
+
+    with open(path) as f:
+        data = json.load(f)
+    assert data['command'] == 'ltd-mason'
+    assert data['status'] == 'succeeded'
+    assert data['error'] is None
+    assert set(data['phases']) == {'manifest', 'clone', 'sphinx'}
+    assert data['counts'] == {'files': 3}
+    manifest = data['phases']['manifest']
+    clone = data['phases']['clone']
+    sphinx = data['phases']['sphinx']
+    assert manifest['end'] <= clone['start']
+    assert clone['end'] <= sphinx['start']
+    assert sphinx['end'] <= data['seconds']
+    assert clone['calls'] == 1
+    assert clone['errors'] == 0
+    assert 's3' not in data
+
+
+def test_run_report_failure(tmpdir):
+    path = str(tmpdir.join('report.json'))
+    with pytest.raises(RuntimeError):
+        with RunReport(path) as report:
+            with report.timer('manifest'):
+                raise RuntimeError('invalid manifest')
+
+    with open(path) as f:
+        data = json.load(f)
+    assert data['status'] == 'failed'
+    assert data['error'] == 'RuntimeError: invalid manifest'
+    assert data['phases']['manifest']['errors'] == 1
+
+
+def test_run_report_upload_steps(tmpdir):
+    site = tmpdir.mkdir('html')
+    site.join('index.html').write('index')
+    site.join('page.html').write('page')
+    backend = MemoryBackend()
+    backend.put('docs/stale.html', body=b'stale')
+
+    report = RunReport()
+    upload('bucket', 'docs', str(site), backend=backend, report=report,
+           skip_unchanged=True)
+    data = report.as_dict()
+    assert set(data['phases']) == {'upload-list', 'upload-delete',
+                                   'upload-files', 'upload-redirects'}
+    assert data['phases']['upload-files']['calls'] == 1
+    assert data['counts'] == {'files': 2, 'bytes': 9, 'files_uploaded': 2,
+                              'bytes_uploaded': 9, 'objects_deleted': 1,
+                              'redirects_uploaded': 1}
+
+    report = RunReport()
+    upload('bucket', 'docs', str(site), backend=backend, report=report,
+           skip_unchanged=True)
+    counts = report.as_dict()['counts']
+    assert counts['files_unchanged'] == 2
+    assert 'files_uploaded' not in counts
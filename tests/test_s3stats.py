@@ -0,0 +1,67 @@
+"""Tests for ltdmason.s3stats."""
+
+import json
+
+import boto3
+import pytest
+
+from ltdmason.s3stats import S3CallStats
+
+
+@pytest.fixture
+def client(fake_s3):
+    # Fails the first PUT with a retryable error
+    fake_s3.first_put_status = 500
+    return fake_s3.client(max_attempts=2)
+
+
+def test_call_stats(client, tmpdir):
+    stats = S3CallStats()
+    stats.attach(client)
+    stats.attach(client)  # no double counting
+
+    client.put_object(Bucket='bucket', Key='a', Body=b'12345')
+    with pytest.raises(client.exceptions.ClientError):
+        client.delete_object(Bucket='bucket', Key='a')
+
+    data = stats.as_dict()
+    put = data['operations']['PutObject']
+    assert put['calls'] == 1
+    assert put['retries'] == 1
+    assert put['errors'] == 0
+    assert put['bytes_sent'] >= 10  # both attempts
+    assert put['mean_seconds'] == put['seconds'] > 0.
+    delete = data['operations']['DeleteObject']
+    assert delete['calls'] == 1
+    assert delete['errors'] == 1
+    assert data['totals']['calls'] == 2
+    assert data['totals']['retries'] == 1
+
+    path = tmpdir.join('stats.json')
+    stats.write(str(path))
+    assert json.loads(path.read()) == data
+
+
+def test_call_stats_connection_error():
+    """Connection errors are counted and raised as they are."""
+    import socket
+
+    import botocore.exceptions
+
+    # A port that nothing listens on
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    session = boto3.session.Session(aws_access_key_id='id',
+                                    aws_secret_access_key='secret',
+                                    region_name='us-east-1')
+    client = session.client(
+        's3', endpoint_url='http://127.0.0.1:{0:d}'.format(port),
+        config=boto3.session.Config(retries={'max_attempts': 0},
+                                    connect_timeout=1))
+    stats = S3CallStats()
+    stats.attach(client)
+    with pytest.raises(botocore.exceptions.EndpointConnectionError):
+        client.put_object(Bucket='bucket', Key='index.html', Body=b'hello')
+    entry = stats.as_dict()['operations']['PutObject']
+    assert (entry['calls'], entry['errors']) == (1, 1)
@@ -252,3 +252,316 @@ def _clean_bucket(session, bucket_name, root_path):
     # based on http://stackoverflow.com/a/34888103
     s3.meta.client.delete_objects(Bucket=bucket.name,
                                   Delete=delete_keys)
+
+
+def test_stream_upload(tmpdir):
+    """Files are uploaded once they are stable, while the directory is still
+    being written.
+    """
+    from unittest import mock
+
+    session = mock.MagicMock()
+    client = session.client.return_value
+    html_dir = tmpdir.join('html')
+    html_dir.join('index.html').write('<html></html>', ensure=True)
+    polls = []
+
+    def until():
+        polls.append(None)
+        if len(polls) == 3:
+            # Written late, so left for the final reconcile pass
+            html_dir.join('searchindex.js').write('{}')
+        return len(polls) == 3
+
+    uploaded = s3upload.stream_upload('bucket', 'prefix', str(html_dir),
+                                      until, poll_interval=0.01,
+                                      surrogate_key='key', session=session)
+
+    index_path = str(html_dir.join('index.html'))
+    assert list(uploaded) == [index_path]
+    assert uploaded[index_path] == s3upload.file_signature(index_path)
+    client.upload_file.assert_called_once_with(
+        index_path, 'bucket', 'prefix/index.html',
+        ExtraArgs={'Metadata': {'surrogate-key': 'key'},
+                   'CacheControl': 'max-age=31536000',
+                   'ContentType': 'text/html'})
+
+
+def test_stream_upload_since(tmpdir):
+    """Files left over from an earlier build are not streamed."""
+    import time
+    from unittest import mock
+
+    session = mock.MagicMock()
+    html_dir = tmpdir.join('html')
+    html_dir.join('old.html').write('old', ensure=True)
+    os.utime(str(html_dir.join('old.html')), (0, 0))
+    html_dir.join('new.html').write('new')
+    polls = []
+
+    def until():
+        polls.append(None)
+        return len(polls) == 2
+
+    uploaded = s3upload.stream_upload('bucket', 'prefix', str(html_dir),
+                                      until, since=time.time() - 60,
+                                      poll_interval=0.01, session=session)
+    assert list(uploaded) == [str(html_dir.join('new.html'))]
+
+
+def test_stream_upload_report(tmpdir):
+    """Streamed files are counted in the run report and the progress."""
+    from ltdmason.progress import UploadProgress
+    from ltdmason.runreport import RunReport
+    from ltdmason.storage import MemoryBackend
+
+    html_dir = tmpdir.join('html')
+    html_dir.join('index.html').write('<html></html>', ensure=True)
+    polls = []
+
+    def until():
+        polls.append(None)
+        return len(polls) == 2
+
+    report = RunReport()
+    progress = UploadProgress(interval=60.)
+    s3upload.stream_upload('bucket', 'prefix', str(html_dir), until,
+                           poll_interval=0.01, max_workers=2,
+                           backend=MemoryBackend(), report=report,
+                           progress=progress)
+    counts = report.as_dict()['counts']
+    assert counts['files_streamed'] == 1
+    assert counts['bytes_streamed'] == 13
+    assert (progress.files, progress.bytes) == (1, 13)
+    assert (progress.total_files, progress.total_bytes) == (1, 13)
+
+
+def test_upload_skip_unchanged(tmpdir):
+    """Files whose MD5 matches the existing object's ETag are skipped."""
+    import hashlib
+    from unittest import mock
+
+    tmpdir.join('index.html').write('unchanged')
+    tmpdir.join('new.html').write('new')
+    existing = mock.MagicMock(
+        key='prefix/index.html',
+        e_tag='"{0}"'.format(hashlib.md5(b'unchanged').hexdigest()))
+    session = mock.MagicMock()
+    bucket = session.resource.return_value.Bucket.return_value
+    bucket.objects.filter.return_value = [existing]
+
+    s3upload.upload('bucket', 'prefix', str(tmpdir),
+                    upload_dir_redirect_objects=False,
+                    session=session, skip_unchanged=True)
+
+    client = session.client.return_value
+    uploaded = [c[0][2] for c in client.upload_file.call_args_list]
+    assert uploaded == ['prefix/new.html']
+
+
+def test_upload_cache_control_rules(tmpdir):
+    from unittest import mock
+
+    tmpdir.join('index.html').write('page')
+    tmpdir.join('_static', 'site.0123456789ab.css').write('css', ensure=True)
+    session = mock.MagicMock()
+    bucket = session.resource.return_value.Bucket.return_value
+    bucket.objects.filter.return_value = []
+
+    s3upload.upload('bucket', 'prefix', str(tmpdir),
+                    upload_dir_redirect_objects=False, session=session,
+                    cache_control_rules=[('*.html', 'max-age=60')])
+
+    calls = session.client.return_value.upload_file.call_args_list
+    headers = {c[0][2]: c[1]['ExtraArgs']['CacheControl'] for c in calls}
+    assert headers == {'prefix/index.html': 'max-age=60',
+                       'prefix/_static/site.0123456789ab.css':
+                       'max-age=31536000'}
+
+
+def test_upload_concurrent(tmpdir):
+    """Files are uploaded concurrently with max_workers or a tuner, with the
+    same result as one at a time.
+    """
+    from ltdmason.autotune import ConcurrencyTuner
+    from ltdmason.storage import MemoryBackend
+
+    for i in range(20):
+        tmpdir.join('page{0:d}.html'.format(i)).write('page')
+        tmpdir.join('a', 'page{0:d}.html'.format(i)).write('a', ensure=True)
+
+    expected = MemoryBackend()
+    s3upload.upload('bucket', 'prefix', str(tmpdir), backend=expected)
+    for kwargs in ({'max_workers': 4},
+                   {'tuner': ConcurrencyTuner(initial=2, window=0.)}):
+        backend = MemoryBackend()
+        s3upload.upload('bucket', 'prefix', str(tmpdir), backend=backend,
+                        **kwargs)
+        assert [o.key for o in backend.list()] == \
+            [o.key for o in expected.list()]
+
+
+def test_upload_keeps_subdirectories(tmpdir):
+    """Re-uploading a site doesn't delete the objects of its subdirectories,
+    or of siblings that share their name as a prefix.
+    """
+    from ltdmason.runreport import RunReport
+    from ltdmason.storage import MemoryBackend
+
+    tmpdir.join('index.html').write('index')
+    tmpdir.join('sub', 'index.html').write('sub', ensure=True)
+    tmpdir.join('subway.html').write('subway')
+    backend = MemoryBackend()
+    s3upload.upload('bucket', 'prefix', str(tmpdir), backend=backend)
+    keys = [o.key for o in backend.list()]
+    assert 'prefix/sub' in keys
+
+    report = RunReport()
+    s3upload.upload('bucket', 'prefix', str(tmpdir), backend=backend,
+                    skip_unchanged=True, report=report)
+    assert [o.key for o in backend.list()] == keys
+    counts = report.as_dict()['counts']
+    assert 'objects_deleted' not in counts
+    assert counts['files_unchanged'] == 3
+
+    tmpdir.join('sub', 'deep', 'index.html').write('deep', ensure=True)
+    s3upload.upload('bucket', 'prefix', str(tmpdir), backend=backend)
+    assert 'prefix/sub/deep/index.html' in [o.key for o in backend.list()]
+
+    tmpdir.join('sub', 'deep').remove()
+    s3upload.upload('bucket', 'prefix', str(tmpdir), backend=backend)
+    assert [o.key for o in backend.list()] == keys
+
+    tmpdir.join('sub').remove()
+    s3upload.upload('bucket', 'prefix', str(tmpdir), backend=backend)
+    assert [o.key for o in backend.list()] == \
+        ['prefix', 'prefix/index.html', 'prefix/subway.html']
+
+
+def test_upload_changed_dirs(tmpdir):
+    """With skip_unchanged, the files of changed directories are uploaded
+    without comparing them.
+    """
+    from ltdmason.runreport import RunReport
+    from ltdmason.storage import MemoryBackend
+
+    tmpdir.join('index.html').write('index')
+    tmpdir.join('afw', 'index.html').write('afw', ensure=True)
+    tmpdir.join('afw', 'sub', 'index.html').write('sub', ensure=True)
+    tmpdir.join('geom', 'index.html').write('geom', ensure=True)
+    backend = MemoryBackend()
+    s3upload.upload('bucket', 'prefix', str(tmpdir), backend=backend)
+
+    report = RunReport()
+    s3upload.upload('bucket', 'prefix', str(tmpdir), backend=backend,
+                    skip_unchanged=True, changed_dirs=['afw'],
+                    report=report)
+    counts = report.as_dict()['counts']
+    assert counts['files_uploaded'] == 2
+    assert counts['files_unchanged'] == 2
+
+
+def test_upload_previous_prefix(tmpdir):
+    """Into a new prefix, as for each LTD Keeper build, unchanged files are
+    copied from the previous build with this build's headers.
+    """
+    from ltdmason.runreport import RunReport
+    from ltdmason.storage import MemoryBackend
+
+    tmpdir.join('index.html').write('index')
+    tmpdir.join('afw', 'index.html').write('afw', ensure=True)
+    tmpdir.join('geom', 'index.html').write('geom', ensure=True)
+    backend = MemoryBackend()
+    s3upload.upload('bucket', 'builds/b1', str(tmpdir), backend=backend,
+                    surrogate_key='b1')
+    previous = {k: v for k, v in backend.objects.items()}
+
+    tmpdir.join('index.html').write('new index')
+    report = RunReport()
+    s3upload.upload('bucket', 'builds/b2', str(tmpdir), backend=backend,
+                    surrogate_key='b2', skip_unchanged=True,
+                    previous_prefix='builds/b1', report=report)
+    counts = report.as_dict()['counts']
+    assert counts['files_uploaded'] == 1
+    assert counts['files_copied'] == 2
+    assert counts['bytes_copied'] == 7
+    assert 'files_unchanged' not in counts
+
+    body, _, extra_args = backend.objects['builds/b2/geom/index.html']
+    assert body == b'geom'
+    assert extra_args['Metadata'] == {'surrogate-key': 'b2'}
+    assert extra_args['ContentType'] == 'text/html'
+    assert backend.objects['builds/b2/index.html'][0] == b'new index'
+    assert {k: v for k, v in backend.objects.items()
+            if k.startswith('builds/b1')} == previous
+
+
+def test_upload_previous_prefix_changed_dirs(tmpdir):
+    """Into a new prefix, as for each LTD Keeper build, the files of
+    changed directories are uploaded without comparing them with the
+    previous build.
+    """
+    from ltdmason.runreport import RunReport
+    from ltdmason.storage import MemoryBackend
+
+    tmpdir.join('index.html').write('index')
+    tmpdir.join('afw', 'index.html').write('afw', ensure=True)
+    tmpdir.join('geom', 'index.html').write('geom', ensure=True)
+    backend = MemoryBackend()
+    s3upload.upload('bucket', 'builds/b1', str(tmpdir), backend=backend,
+                    surrogate_key='b1')
+
+    tmpdir.join('index.html').write('new index')
+    report = RunReport()
+    s3upload.upload('bucket', 'builds/b2', str(tmpdir), backend=backend,
+                    surrogate_key='b2', skip_unchanged=True,
+                    previous_prefix='builds/b1', changed_dirs=['afw'],
+                    report=report)
+    counts = report.as_dict()['counts']
+    assert counts['files_uploaded'] == 2
+    assert counts['files_copied'] == 1
+    assert counts['bytes_copied'] == 4
+    assert 'files_unchanged' not in counts
+    assert backend.objects['builds/b2/afw/index.html'][0] == b'afw'
+
+
+def test_upload_across_directories(tmpdir):
+    """The files of a directory start uploading before those of the
+    previous directory finish, and a failed upload fails the sync.
+    """
+    import threading
+
+    import pytest
+
+    from ltdmason.storage import MemoryBackend
+
+    tmpdir.join('a', 'index.html').write('a', ensure=True)
+    tmpdir.join('b', 'index.html').write('b', ensure=True)
+    # Both uploads must be in flight at once to pass the barrier
+    barrier = threading.Barrier(2, timeout=5)
+
+    class BarrierBackend(MemoryBackend):
+
+        def put(self, key, path=None, body=None, extra_args=None):
+            if key.endswith('index.html'):
+                barrier.wait()
+            super().put(key, path=path, body=body, extra_args=extra_args)
+
+    class BrokenBackend(MemoryBackend):
+
+        def put(self, key, path=None, body=None, extra_args=None):
+            if key.endswith('broken.html'):
+                raise RuntimeError('Upload failed')
+            super().put(key, path=path, body=body, extra_args=extra_args)
+
+    backend = BarrierBackend()
+    s3upload.upload('bucket', 'prefix', str(tmpdir), backend=backend,
+                    max_workers=4)
+    keys = [o.key for o in backend.list()]
+    assert 'prefix/a/index.html' in keys
+    assert 'prefix/b/index.html' in keys
+
+    tmpdir.join('b', 'broken.html').write('broken')
+    with pytest.raises(RuntimeError):
+        s3upload.upload('bucket', 'prefix', str(tmpdir),
+                        backend=BrokenBackend(), max_workers=4)
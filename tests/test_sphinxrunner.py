@@ -0,0 +1,81 @@
+"""Tests for ltdmason.sphinxrunner."""
+
+import os
+import sys
+
+import pytest
+
+from ltdmason.sphinxrunner import SphinxRunner, SphinxBuildError
+
+pytest.importorskip('sphinx')
+
+
+@pytest.fixture(scope='module')
+def runner():
+    runner = SphinxRunner()
+    yield runner
+    runner.close()
+
+
+def _write_project(source_dir, conf_extra=''):
+    os.makedirs(source_dir)
+    with open(os.path.join(source_dir, 'conf.py'), 'w') as f:
+        f.write("project = 'Demo'\n" + conf_extra)
+    with open(os.path.join(source_dir, 'index.rst'), 'w') as f:
+        f.write('Demo\n====\n\nHello.\n')
+
+
+def test_build(runner, tmpdir):
+    source_dir = str(tmpdir.join('doc'))
+    html_dir = str(tmpdir.join('doc', '_build', 'html'))
+    _write_project(source_dir)
+    runner.build(source_dir, html_dir)
+    assert os.path.exists(os.path.join(html_dir, 'index.html'))
+
+
+def test_build_is_isolated(runner, tmpdir):
+    """conf.py side effects must not leak into later builds or the parent."""
+    marker = str(tmpdir.join('marker'))
+    source_dir = str(tmpdir.join('a'))
+    _write_project(source_dir,
+                   conf_extra='import sys\nsys.path.insert(0, {0!r})\n'
+                   .format(marker))
+    runner.build(source_dir, str(tmpdir.join('a', '_build', 'html')))
+    assert marker not in sys.path
+
+    source_dir = str(tmpdir.join('b'))
+    _write_project(source_dir,
+                   conf_extra='import sys\nassert {0!r} not in sys.path\n'
+                   .format(marker))
+    runner.build(source_dir, str(tmpdir.join('b', '_build', 'html')))
+
+
+def test_build_failure(runner, tmpdir):
+    source_dir = str(tmpdir.join('doc'))
+    _write_project(source_dir, conf_extra='raise ValueError("bad conf")\n')
+    with pytest.raises(SphinxBuildError):
+        runner.build(source_dir, str(tmpdir.join('doc', '_build', 'html')))
+
+
+def test_build_with_inventory_cache(runner, tmpdir):
+    """Intersphinx inventories are served from the cache, even offline."""
+    from ltdmason.intersphinxcache import InventoryCache
+
+    other_dir = str(tmpdir.join('other'))
+    _write_project(other_dir)
+    runner.build(other_dir, str(tmpdir.join('other', '_build', 'html')))
+    cache = InventoryCache(str(tmpdir.join('cache')), offline=True)
+    cache.seed('https://other.example.org/objects.inv',
+               str(tmpdir.join('other', '_build', 'html', 'objects.inv')))
+
+    source_dir = str(tmpdir.join('doc'))
+    html_dir = str(tmpdir.join('doc', '_build', 'html'))
+    _write_project(source_dir, conf_extra=(
+        "extensions = ['sphinx.ext.intersphinx']\n"
+        "intersphinx_mapping = {'other': "
+        "('https://other.example.org', None)}\n"))
+    with open(os.path.join(source_dir, 'index.rst'), 'a') as f:
+        f.write('\nSee :doc:`other:index`.\n')
+    runner.build(source_dir, html_dir, inventory_cache=cache)
+    with open(os.path.join(html_dir, 'index.html')) as f:
+        assert 'https://other.example.org/index.html' in f.read()
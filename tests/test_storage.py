@@ -0,0 +1,122 @@
+"""Tests for ltdmason.storage."""
+
+import hashlib
+from unittest import mock
+
+import pytest
+
+from ltdmason import s3upload
+from ltdmason.storage import (FilesystemBackend, MemoryBackend, S3Backend,
+                              S3Error, StorageBackend, StorageError)
+
+
+@pytest.fixture(params=['memory', 'filesystem'])
+def backend(request, tmpdir):
+    if request.param == 'memory':
+        return MemoryBackend()
+    return FilesystemBackend(str(tmpdir.join('mirror')))
+
+
+def test_backend_put_head_get(backend, tmpdir):
+    tmpdir.join('page.html').write('<html></html>')
+    backend.put('a/page.html', path=str(tmpdir.join('page.html')),
+                extra_args={'ContentType': 'text/html'})
+    backend.put('a/b/data.txt', body='data')
+
+    info = backend.head('a/page.html')
+    assert info.size == 13
+    assert info.etag == hashlib.md5(b'<html></html>').hexdigest()
+    assert info.headers == {'ContentType': 'text/html'}
+    assert backend.get('a/b/data.txt') == b'data'
+    assert backend.head('missing') is None
+    assert backend.get('missing') is None
+    assert [o.key for o in backend.list('a/')] == ['a/b/data.txt',
+                                                   'a/page.html']
+    assert [o.key for o in backend.list('a/p')] == ['a/page.html']
+
+
+def test_backend_copy_delete(backend):
+    backend.put('src', body='x', extra_args={'CacheControl': 'max-age=1'})
+    backend.copy('src', 'dest')
+    backend.copy('src', 'other', extra_args={})
+    assert backend.head('dest').headers == {'CacheControl': 'max-age=1'}
+    assert backend.head('other').headers == {}
+    with pytest.raises(StorageError):
+        backend.copy('missing', 'dest')
+
+    backend.delete(['src', 'other', 'missing'])
+    assert [o.key for o in backend.list()] == ['dest']
+
+
+def test_filesystem_directory_objects(tmpdir):
+    """Objects whose keys are also directories, such as directory redirect
+    objects, don't clash with the files in those directories.
+    """
+    root = tmpdir.join('mirror')
+    backend = FilesystemBackend(str(root))
+    backend.put('docs/v', body='', extra_args={'Metadata': {'r': 'true'}})
+    backend.put('docs/v/index.html', body='index')
+    backend.put('docs', body='redirect')
+
+    assert root.join('docs', 'v', 'index.html').read() == 'index'
+    assert backend.get('docs/v') == b''
+    assert backend.get('docs') == b'redirect'
+    assert backend.head('docs/v').headers == {'Metadata': {'r': 'true'}}
+    assert [o.key for o in backend.list('docs')] == \
+        ['docs', 'docs/v', 'docs/v/index.html']
+
+    backend.delete(['docs/v/index.html', 'docs/v', 'docs'])
+    assert list(backend.list()) == []
+    assert root.listdir() == [root.join('.ltd-meta')]
+    with pytest.raises(ValueError):
+        backend.put('../escape', body='x')
+
+
+def test_upload_to_backend(tmpdir):
+    """The sync engine publishes to, and prunes, any backend."""
+    site = tmpdir.join('html')
+    site.join('index.html').write('index', ensure=True)
+    site.join('a', 'page.html').write('page', ensure=True)
+    site.join('b', 'old.html').write('old', ensure=True)
+    backend = MemoryBackend()
+
+    s3upload.upload('unused', 'prefix', str(site), surrogate_key='key',
+                    backend=backend)
+    assert sorted(backend.objects) == [
+        'prefix', 'prefix/a', 'prefix/a/page.html', 'prefix/b',
+        'prefix/b/old.html', 'prefix/index.html']
+    assert backend.head('prefix/index.html').headers['Metadata'] == \
+        {'surrogate-key': 'key'}
+    assert backend.head('prefix/a').headers['Metadata'] == \
+        {'surrogate-key': 'key', 'dir-redirect': 'true'}
+
+    site.join('b').remove()
+    site.join('a', 'page.html').write('changed')
+    s3upload.upload('unused', 'prefix', str(site), backend=backend)
+    assert backend.get('prefix/a/page.html') == b'changed'
+    assert not [k for k in backend.objects if k.startswith('prefix/b/')]
+
+
+def test_s3_backend_batch_delete():
+    session = mock.MagicMock()
+    client = session.client.return_value
+    client.delete_objects.return_value = {}
+    backend = S3Backend(session, 'bucket')
+
+    backend.delete(['key{0:d}'.format(i) for i in range(2500)])
+    batches = [len(c[1]['Delete']['Objects'])
+               for c in client.delete_objects.call_args_list]
+    assert batches == [1000, 1000, 500]
+
+    client.delete_objects.return_value = {'Errors': [{'Key': 'key0'}]}
+    with pytest.raises(S3Error):
+        backend.delete(['key0'])
+
+
+def test_backend_interface_is_abstract():
+    class Incomplete(StorageBackend):
+        def list(self, prefix=''):
+            return iter([])
+
+    with pytest.raises(TypeError):
+        Incomplete()
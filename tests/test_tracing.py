@@ -0,0 +1,121 @@
+"""Tests for ltdmason.tracing."""
+
+import json
+
+import boto3
+import pytest
+
+from ltdmason.pipeline import Pipeline
+from ltdmason.s3upload import upload
+from ltdmason.storage import MemoryBackend
+from ltdmason.tracing import Tracer
+
+
+@pytest.fixture
+def client(fake_s3):
+    # Fails the first PUT with a retryable error
+    fake_s3.first_put_status = 500
+    return fake_s3.client(max_attempts=2)
+
+
+def _spans(tracer, category):
+    return [e for e in tracer.as_dict()['traceEvents']
+            if e.get('cat') == category]
+
+
+def test_pipeline_spans(tmpdir):
+    tracer = Tracer()
+    pipeline = Pipeline(listeners=[tracer])
+
+    def sync():
+        with tracer.span('sync /', 'directory', files=3):
+            pass
+
+    pipeline.add('clone', lambda: None)
+    pipeline.add('upload', sync, requires=['clone'])
+    pipeline.run()
+
+    path = str(tmpdir.join('trace.json'))
+    tracer.write(path)
+    with open(path) as f:
+        events = json.load(f)['traceEvents']
+    phases = {e['name']: e for e in events if e.get('cat') == 'phase'}
+    assert set(phases) == {'clone', 'upload'}
+    assert phases['clone']['ph'] == 'X'
+    assert phases['clone']['ts'] + phases['clone']['dur'] \
+        <= phases['upload']['ts']
+    directory, = [e for e in events if e.get('cat') == 'directory']
+    assert directory['args'] == {'files': 3}
+    # The directory span nests in its phase, on the same thread
+    assert directory['tid'] == phases['upload']['tid']
+    assert phases['upload']['ts'] <= directory['ts']
+    names = {e['tid']: e['args']['name'] for e in events if e['ph'] == 'M'}
+    assert directory['tid'] in names
+
+
+def test_request_spans(client):
+    tracer = Tracer()
+    tracer.attach(client)
+    tracer.attach(client)
+    client.put_object(Bucket='bucket', Key='a/index.html', Body=b'hello')
+
+    span, = _spans(tracer, 'request')
+    assert span['name'] == 'PutObject a/index.html'
+    assert span['args'] == {'operation': 'PutObject', 'key': 'a/index.html',
+                            'bytes_sent': 5, 'status': 200, 'retries': 1}
+    assert span['dur'] > 0
+
+
+def test_sampling(client):
+    tracer = Tracer(sample_rate=0.5)
+    keys = ['page{0:d}.html'.format(i) for i in range(200)]
+    sampled = [key for key in keys if tracer.is_sampled(key)]
+    assert 50 < len(sampled) < 150
+    assert sampled == [key for key in keys if tracer.is_sampled(key)]
+
+    tracer = Tracer(sample_rate=0.)
+    tracer.attach(client)
+    client.put_object(Bucket='bucket', Key='a/index.html', Body=b'hello')
+    with tracer.span('sync /a', 'directory', sample_key='a'):
+        pass
+    with tracer.span('upload', 'phase'):
+        pass
+    assert [e['name'] for e in tracer.as_dict()['traceEvents']
+            if e['ph'] == 'X'] == ['upload']
+
+
+def test_upload_directory_spans(tmpdir):
+    site = tmpdir.mkdir('html')
+    site.join('index.html').write('index')
+    site.mkdir('a').join('index.html').write('a')
+    tracer = Tracer()
+    upload('bucket', 'docs', str(site), backend=MemoryBackend(),
+           tracer=tracer)
+    spans = _spans(tracer, 'directory')
+    assert sorted(s['name'] for s in spans) == ['sync /', 'sync /a']
+
+
+def test_connection_error_spans():
+    """Failed calls are recorded, and raise their own errors."""
+    import socket
+
+    import botocore.exceptions
+
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    session = boto3.session.Session(aws_access_key_id='id',
+                                    aws_secret_access_key='secret',
+                                    region_name='us-east-1')
+    client = session.client(
+        's3', endpoint_url='http://127.0.0.1:{0:d}'.format(port),
+        config=boto3.session.Config(retries={'max_attempts': 0},
+                                    connect_timeout=1))
+    tracer = Tracer()
+    tracer.attach(client)
+    with pytest.raises(botocore.exceptions.EndpointConnectionError):
+        client.put_object(Bucket='bucket', Key='a/index.html', Body=b'hi')
+    span, = _spans(tracer, 'request')
+    assert span['name'] == 'PutObject a/index.html'
+    assert span['args']['status'] is None
+    assert span['args']['error'].startswith('EndpointConnectionError')
@@ -1,6 +1,8 @@
 """Tests for the ltdmason/uploader module."""
 
 import os
+import threading
+import time
 from base64 import b64encode
 try:
     from unittest import mock
@@ -12,10 +14,13 @@ import responses
 import pytest
 
 from ltdmason.manifest import Manifest
-from ltdmason.uploader import (_register_build, _confirm_upload, KeeperError,
+from ltdmason.uploader import (_register_build, _confirm_upload,
+                               _deregister_build, _previous_build,
+                               KeeperError,
                                upload_via_keeper, get_keeper_token,
                                read_keeper_credentials,
-                               read_aws_credentials)
+                               read_aws_credentials, add_upload_phases,
+                               KeeperClient)
 
 
 @responses.activate
@@ -316,6 +321,261 @@ def test_upload_via_keeper(demo_manifest, mocker):
         mock_product.html_dir,
         surrogate_key=build_resource['surrogate_key'],
         acl=None,
-        cache_control_max_age=31536000)
+        cache_control_max_age=31536000,
+        already_uploaded=None,
+        skip_unchanged=False,
+        cache_control_rules=None,
+        header_policy=None, call_stats=None, report=None, tracer=None,
+        progress=None, max_workers=1, tuner=None,
+        bandwidth=None, changed_dirs=None, previous_prefix=None)
 
     mock_confirm.assert_called_once_with(build_resource['self_url'], 'token')
+
+
+def test_add_upload_phases(demo_manifest, mocker, monkeypatch):
+    """Test that the upload phases run in order and that the S3 upload waits
+    for the build phase.
+    """
+    from ltdmason.pipeline import Pipeline
+
+    build_resource = {
+        "bucket_name": "an-s3-bucket",
+        "bucket_root_dir": "lsst_apps/builds/b1",
+        "self_url": "http://localhost:5000/builds/1",
+        "surrogate_key": "35d7a50a1d1b40ab9e7a56cd169f356e"}
+    monkeypatch.setenv('LTD_KEEPER_URL', 'http://localhost:5000')
+    monkeypatch.setenv('LTD_KEEPER_USER', 'user')
+    monkeypatch.setenv('LTD_KEEPER_PASSWORD', 'pass')
+    mock_token = mocker.patch('ltdmason.uploader.get_keeper_token')
+    mock_token.return_value = 'token'
+    mock_register = mocker.patch('ltdmason.uploader._register_build')
+    mock_register.return_value = build_resource
+    mock_upload = mocker.patch('ltdmason.uploader.s3upload_upload')
+    mock_confirm = mocker.patch('ltdmason.uploader._confirm_upload')
+
+    mock_product = mock.MagicMock()
+    mock_product.html_dir = '_build/html'
+
+    pipeline = Pipeline()
+    pipeline.add('sphinx', lambda: None)
+    last_phase = add_upload_phases(pipeline, demo_manifest, mock_product,
+                                   requires=['sphinx'])
+    pipeline.run()
+
+    assert last_phase == 'keeper-confirm'
+    assert 'sphinx' in pipeline['keeper-register'].requires
+    assert 'sphinx' in pipeline['upload'].requires
+    mock_register.assert_called_once_with(
+        demo_manifest, 'http://localhost:5000', 'token', session=mock.ANY)
+    assert mock_upload.call_count == 1
+    assert pipeline['upload'].start_time >= pipeline['sphinx'].end_time
+    mock_confirm.assert_called_once_with(build_resource['self_url'], 'token',
+                                         session=mock.ANY)
+
+
+def test_add_upload_phases_stream(demo_manifest, mocker):
+    """Test that the streaming upload overlaps the build and its results
+    are reconciled by the upload phase.
+    """
+    from ltdmason.pipeline import Pipeline
+
+    build_resource = {
+        "bucket_name": "an-s3-bucket",
+        "bucket_root_dir": "lsst_apps/builds/b1",
+        "self_url": "http://localhost:5000/builds/1",
+        "surrogate_key": "35d7a50a1d1b40ab9e7a56cd169f356e"}
+    mock_register = mocker.patch('ltdmason.uploader._register_build')
+    mock_register.return_value = build_resource
+    mock_stream = mocker.patch('ltdmason.uploader.s3upload_stream_upload')
+    mock_stream.return_value = {'_build/html/index.html': (10, 1)}
+    mock_upload = mocker.patch('ltdmason.uploader.s3upload_upload')
+    mocker.patch('ltdmason.uploader._confirm_upload')
+    keeper = mock.MagicMock()
+
+    mock_product = mock.MagicMock()
+    mock_product.html_dir = '_build/html'
+
+    pipeline = Pipeline()
+    pipeline.add('sphinx', lambda: None)
+    add_upload_phases(pipeline, demo_manifest, mock_product,
+                      requires=['sphinx'], keeper=keeper,
+                      s3_session=mock.sentinel.session, stream=True,
+                      report=mock.sentinel.report,
+                      progress=mock.sentinel.progress, max_workers=16)
+    pipeline.run()
+
+    assert 'sphinx' not in pipeline['upload-stream'].requires
+    assert 'upload-stream' in pipeline['upload'].requires
+    assert mock_stream.call_args[1]['session'] is mock.sentinel.session
+    assert mock_stream.call_args[1]['max_workers'] == 16
+    assert mock_stream.call_args[1]['report'] is mock.sentinel.report
+    assert mock_stream.call_args[1]['progress'] is mock.sentinel.progress
+    assert mock_stream.call_args[1]['since'] <= time.time()
+    assert mock_upload.call_args[1]['already_uploaded'] \
+        == {'_build/html/index.html': (10, 1)}
+
+
+def test_add_upload_phases_skip_unchanged(demo_manifest, mocker):
+    """With skip_unchanged, the upload compares files with the previous
+    build of the edition, looked up while the documentation builds.
+    """
+    from ltdmason.pipeline import Pipeline
+
+    build_resource = {
+        "bucket_name": "an-s3-bucket",
+        "bucket_root_dir": "lsst_apps/builds/b2",
+        "self_url": "http://localhost:5000/builds/2",
+        "surrogate_key": "35d7a50a1d1b40ab9e7a56cd169f356e"}
+    previous = dict(build_resource, bucket_root_dir='lsst_apps/builds/b1')
+    mocker.patch('ltdmason.uploader._register_build',
+                 return_value=build_resource)
+    mock_previous = mocker.patch('ltdmason.uploader._previous_build',
+                                 return_value=previous)
+    mock_upload = mocker.patch('ltdmason.uploader.s3upload_upload')
+    mocker.patch('ltdmason.uploader._confirm_upload')
+    keeper = mock.MagicMock()
+
+    pipeline = Pipeline()
+    pipeline.add('sphinx', lambda: None)
+    add_upload_phases(pipeline, demo_manifest, mock.MagicMock(),
+                      requires=['sphinx'], keeper=keeper,
+                      s3_session=mock.sentinel.session, skip_unchanged=True)
+    pipeline.run()
+
+    assert 'sphinx' not in pipeline['keeper-previous'].requires
+    mock_previous.assert_called_once_with(
+        demo_manifest, keeper.url, keeper.token, session=keeper.session)
+    assert mock_upload.call_args[1]['skip_unchanged'] is True
+    assert mock_upload.call_args[1]['previous_prefix'] == \
+        'lsst_apps/builds/b1'
+
+    # Without a previous build, every file is uploaded
+    mock_previous.side_effect = KeeperError('no editions')
+    pipeline = Pipeline()
+    add_upload_phases(pipeline, demo_manifest, mock.MagicMock(),
+                      keeper=keeper, s3_session=mock.sentinel.session,
+                      skip_unchanged=True)
+    pipeline.run()
+    assert mock_upload.call_args[1]['previous_prefix'] is None
+
+
+@pytest.mark.parametrize('stream', [False, True])
+def test_add_upload_phases_failed_build(demo_manifest, mocker, stream):
+    """A failed build leaves no registered build on LTD Keeper."""
+    from ltdmason.pipeline import Pipeline
+
+    build_resource = {
+        "bucket_name": "an-s3-bucket",
+        "bucket_root_dir": "lsst_apps/builds/b1",
+        "self_url": "http://localhost:5000/builds/1",
+        "surrogate_key": "35d7a50a1d1b40ab9e7a56cd169f356e"}
+    registered = threading.Event()
+
+    def register(*args, **kwargs):
+        registered.set()
+        return build_resource
+
+    mock_register = mocker.patch('ltdmason.uploader._register_build',
+                                 side_effect=register)
+
+    def stream_upload(bucket_name, path_prefix, source_dir, until,
+                      **kwargs):
+        while not until():
+            time.sleep(0.01)
+        return {}
+
+    mocker.patch('ltdmason.uploader.s3upload_stream_upload',
+                 side_effect=stream_upload)
+    mock_deregister = mocker.patch('ltdmason.uploader._deregister_build')
+    keeper = mock.MagicMock()
+
+    def fail():
+        # Fail after the build is registered, if it's registered early
+        registered.wait(timeout=0.5 if stream else 0.1)
+        raise RuntimeError('boom')
+
+    pipeline = Pipeline()
+    pipeline.add('sphinx', fail)
+    add_upload_phases(pipeline, demo_manifest, mock.MagicMock(),
+                      requires=['sphinx'], keeper=keeper,
+                      s3_session=mock.sentinel.session, stream=stream)
+    with pytest.raises(RuntimeError):
+        pipeline.run()
+
+    if stream:
+        assert mock_register.call_count == 1
+        mock_deregister.assert_called_once_with(
+            build_resource['self_url'], keeper.token, session=keeper.session)
+    else:
+        assert mock_register.call_count == 0
+        assert mock_deregister.call_count == 0
+
+
+@responses.activate
+def test_previous_build(demo_manifest):
+    """The previous build is that of the edition tracking the manifest's
+    refs, or of the main edition.
+    """
+    editions = {
+        'main': {'slug': 'main', 'tracked_refs': ['main'],
+                 'build_url': 'http://localhost:5000/builds/1'},
+        'master': {'slug': 'master', 'tracked_refs': ['master'],
+                   'build_url': 'http://localhost:5000/builds/2'},
+    }
+    responses.add(
+        responses.GET,
+        'http://localhost:5000/products/lsst_apps/editions/',
+        json={'editions': ['http://localhost:5000/editions/' + slug
+                           for slug in editions]})
+    for slug, edition in editions.items():
+        responses.add(responses.GET,
+                      'http://localhost:5000/editions/' + slug,
+                      json=edition)
+    for build in ('1', '2'):
+        responses.add(responses.GET,
+                      'http://localhost:5000/builds/' + build,
+                      json={'bucket_name': 'an-s3-bucket',
+                            'bucket_root_dir': 'lsst_apps/builds/' + build})
+
+    build_info = _previous_build(demo_manifest, 'http://localhost:5000',
+                                 'token')
+    assert build_info['bucket_root_dir'] == 'lsst_apps/builds/2'
+
+    editions['master']['tracked_refs'] = ['tickets/DM-1']
+    responses.replace(responses.GET, 'http://localhost:5000/editions/master',
+                      json=editions['master'])
+    build_info = _previous_build(demo_manifest, 'http://localhost:5000',
+                                 'token')
+    assert build_info['bucket_root_dir'] == 'lsst_apps/builds/1'
+
+
+@responses.activate
+def test_deregister_build():
+    url = 'http://localhost:5000/builds/1'
+    responses.add(responses.DELETE, url, status=200)
+    _deregister_build(url, 'token')
+    assert responses.calls[0].request.method == 'DELETE'
+
+    responses.replace(responses.DELETE, url, status=404)
+    with pytest.raises(KeeperError):
+        _deregister_build(url, 'token')
+
+
+@responses.activate
+def test_keeper_client_caches_token():
+    responses.add(
+        responses.GET,
+        'http://localhost:5000/token',
+        json={'token': 'token-1'},
+        status=200)
+
+    client = KeeperClient('http://localhost:5000', 'user', 'pass')
+    assert client.token == 'token-1'
+    assert client.token == 'token-1'
+    assert len(responses.calls) == 1
+
+    client = KeeperClient('http://localhost:5000', 'user', 'pass',
+                          token_max_age=-1)
+    client.token
+    client.token
+    assert len(responses.calls) == 3
@@ -0,0 +1,203 @@
+"""Tests for ltdmason.worker."""
+
+import os
+from pathlib import Path
+
+import pytest
+import responses
+
+from ltdmason.openmetrics import BuildMetrics
+from ltdmason.worker import (DirectorySpool, HTTPQueue, Job, Worker,
+                             QueueError)
+
+
+@pytest.fixture
+def demo_manifest_data():
+    path = Path(__file__).parent / "demo_manifest.yaml"
+    return path.read_text()
+
+
+def _spool_manifest(spool_dir, name, data):
+    with open(os.path.join(spool_dir, name), 'w') as f:
+        f.write(data)
+
+
+def test_directory_spool(tmpdir, demo_manifest_data):
+    spool = DirectorySpool(str(tmpdir))
+    assert spool.claim() is None
+
+    _spool_manifest(str(tmpdir), 'a.yaml', demo_manifest_data)
+    _spool_manifest(str(tmpdir), 'b.yaml', demo_manifest_data)
+    _spool_manifest(str(tmpdir), 'notes.txt', 'ignored')
+
+    job_a = spool.claim()
+    job_b = spool.claim()
+    assert {job_a.job_id, job_b.job_id} == {'a.yaml', 'b.yaml'}
+    assert job_a.manifest_data == demo_manifest_data
+    assert spool.claim() is None
+
+    spool.complete(job_a)
+    spool.complete(job_b, error='boom')
+    assert os.path.exists(str(tmpdir.join('done', job_a.job_id)))
+    assert os.path.exists(str(tmpdir.join('failed', job_b.job_id)))
+    assert tmpdir.join('failed', job_b.job_id + '.error').read() == 'boom'
+
+
+@responses.activate
+def test_http_queue(demo_manifest_data):
+    responses.add(responses.POST, 'http://queue.test/claim',
+                  json={'id': '42', 'manifest': demo_manifest_data},
+                  status=200)
+    responses.add(responses.POST, 'http://queue.test/claim', status=204)
+    responses.add(responses.POST, 'http://queue.test/jobs/42/complete',
+                  status=204)
+
+    queue = HTTPQueue('http://queue.test/')
+    job = queue.claim()
+    assert job.job_id == '42'
+    assert job.manifest_data == demo_manifest_data
+    assert queue.claim() is None
+    queue.complete(job, error='boom')
+    assert responses.calls[-1].request.body \
+        == b'{"status": "failed", "message": "boom"}'
+
+
+@responses.activate
+def test_http_queue_error():
+    responses.add(responses.POST, 'http://queue.test/claim', status=500)
+    with pytest.raises(QueueError):
+        HTTPQueue('http://queue.test').claim()
+
+
+def test_worker_run_once(tmpdir, demo_manifest_data, mocker):
+    spool_dir = str(tmpdir.join('spool'))
+    spool = DirectorySpool(spool_dir)
+    for name in ('a.yaml', 'b.yaml', 'c.yaml'):
+        _spool_manifest(spool_dir, name, demo_manifest_data)
+
+    built = []
+
+    def add_build_phases(pipeline, product, cache=None, postprocessors=None):
+        # The second build fails
+        if len(built) == 1:
+            def fail():
+                built.append('failed')
+                raise RuntimeError('boom')
+            pipeline.add('sphinx', fail)
+        else:
+            pipeline.add('sphinx', lambda: built.append(product.build_dir))
+        return 'sphinx'
+
+    mocker.patch('ltdmason.worker.add_build_phases', add_build_phases)
+
+    metrics_path = str(tmpdir.join('worker.prom'))
+    worker = Worker(spool, concurrency=1, build_root=str(tmpdir),
+                    upload=False, poll_interval=0.01,
+                    metrics=BuildMetrics(metrics_path,
+                                         command='ltd-mason-worker'))
+    worker.run(once=True)
+
+    assert len(built) == 3
+    assert len(os.listdir(os.path.join(spool_dir, 'done'))) == 2
+    assert len(os.listdir(os.path.join(spool_dir, 'processing'))) == 0
+    failed = os.listdir(os.path.join(spool_dir, 'failed'))
+    assert len(failed) == 2  # manifest and its .error file
+    # build directories are removed
+    for path in built:
+        if path != 'failed':
+            assert not os.path.exists(path)
+    with open(metrics_path) as f:
+        metrics = f.read()
+    assert 'ltd_mason_runs_total{command="ltd-mason-worker",' \
+        'status="succeeded"} 2\n' in metrics
+    assert 'ltd_mason_runs_total{command="ltd-mason-worker",' \
+        'status="failed"} 1\n' in metrics
+    assert 'ltd_mason_runs_in_progress{command="ltd-mason-worker"} 0\n' \
+        in metrics
+
+
+def test_worker_session_per_job(tmpdir, demo_manifest_data, mocker):
+    """Each job uploads with its own boto3 session, even when jobs run on
+    the same thread.
+    """
+    from unittest import mock
+
+    spool_dir = str(tmpdir.join('spool'))
+    spool = DirectorySpool(spool_dir)
+    for name in ('a.yaml', 'b.yaml'):
+        _spool_manifest(spool_dir, name, demo_manifest_data)
+
+    sessions = []
+
+    def add_upload_phases(pipeline, manifest, product, s3_session=None,
+                          **kwargs):
+        sessions.append(s3_session)
+
+    mocker.patch('ltdmason.worker.add_build_phases',
+                 lambda pipeline, product, **kwargs: 'sphinx')
+    mocker.patch('ltdmason.worker.add_upload_phases', add_upload_phases)
+
+    worker = Worker(spool, concurrency=1, build_root=str(tmpdir),
+                    keeper=mock.MagicMock(), poll_interval=0.01)
+    worker.run(once=True)
+
+    assert len(sessions) == 2
+    assert sessions[0] is not sessions[1]
+
+
+def test_directory_spool_claimed_while_listing(tmpdir, mocker,
+                                               demo_manifest_data):
+    """Manifests that another worker claims while the spool is listed are
+    skipped.
+    """
+    spool = DirectorySpool(str(tmpdir))
+    _spool_manifest(str(tmpdir), 'a.yaml', demo_manifest_data)
+    _spool_manifest(str(tmpdir), 'b.yaml', demo_manifest_data)
+    scandir = os.scandir
+
+    def racing_scandir(path):
+        entries = list(scandir(path))
+        os.remove(str(tmpdir.join('a.yaml')))
+        return iter(entries)
+
+    mocker.patch('os.scandir', racing_scandir)
+    assert spool.claim().job_id == 'b.yaml'
+
+
+class FlakyQueue(object):
+    """Queue whose first claim and first completion fail."""
+
+    def __init__(self, jobs):
+        self.jobs = list(jobs)
+        self.completed = []
+        self.claims = 0
+
+    def claim(self):
+        self.claims += 1
+        if self.claims == 1:
+            raise QueueError('claim failed')
+        return self.jobs.pop(0) if self.jobs else None
+
+    def complete(self, job, error=None):
+        self.completed.append(job)
+        if len(self.completed) == 1:
+            raise QueueError('complete failed')
+
+
+def test_worker_queue_errors(tmpdir, demo_manifest_data, mocker):
+    """Queue errors are logged, and the worker keeps going."""
+    def add_build_phases(pipeline, product, cache=None, postprocessors=None):
+        pipeline.add('sphinx', lambda: None)
+        return 'sphinx'
+
+    mocker.patch('ltdmason.worker.add_build_phases', add_build_phases)
+    queue = FlakyQueue([Job('a', demo_manifest_data),
+                        Job('b', demo_manifest_data)])
+    worker = Worker(queue, concurrency=1, build_root=str(tmpdir),
+                    upload=False, poll_interval=0.01)
+
+    # The failed claim looks like an empty queue to a single pass
+    worker.run(once=True)
+    assert queue.completed == []
+    worker.run(once=True)
+    assert [job.job_id for job in queue.completed] == ['a', 'b']